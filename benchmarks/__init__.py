@@ -0,0 +1,21 @@
+"""
+Benchmarks for UnionLLM's own overhead, run against the local mock upstream
+(unionllm.mock_server) so numbers do not depend on network or provider load.
+
+    python -m benchmarks run -o results.json              # every suite
+    python -m benchmarks run --quick --suite overhead,streaming
+    python -m benchmarks compare baseline.json results.json --threshold 0.1
+
+Suites:
+
+- import       cold `import unionllm.main` in a fresh interpreter
+- overhead     completion() latency minus a raw HTTP post of the same request, per provider
+- streaming    chunks per second through each provider's stream wrapper
+- prompt       check_prompt / reformat_object_content cost vs history length and attachment count
+- memory       traced Python memory held per open stream
+- throughput   completions per second at 1/10/100/1000 concurrency, sync and async
+
+`run` writes JSON ({"meta": ..., "results": {name: {value, unit, ...}}});
+`compare` prints the change of every result between two runs and exits 1
+when any result got worse by more than the threshold.
+"""
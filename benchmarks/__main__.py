@@ -0,0 +1,109 @@
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+
+from . import bench_import, bench_memory, bench_overhead, bench_prompt, bench_streaming, bench_throughput
+from .compare import compare, format_rows, load, regressions
+from .harness import Options
+
+SUITES = {
+    "import": bench_import.run,
+    "overhead": bench_overhead.run,
+    "streaming": bench_streaming.run,
+    "prompt": bench_prompt.run,
+    "memory": bench_memory.run,
+    "throughput": bench_throughput.run,
+}
+
+
+def _split(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else None
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    suites = _split(args.suite) or list(SUITES)
+    unknown = [name for name in suites if name not in SUITES]
+    if unknown:
+        raise SystemExit(f"unknown suite(s): {', '.join(unknown)}; choose from {', '.join(SUITES)}")
+    concurrency = tuple(int(c) for c in _split(args.concurrency)) if args.concurrency else (1, 10, 100, 1000)
+    options = Options(quick=args.quick, repeat=args.repeat, providers=_split(args.providers),
+                      load_providers=_split(args.load_providers) or ("zhipuai", "dify"),
+                      concurrency=concurrency, latency=args.latency)
+
+    results = {}
+    for name in suites:
+        print(f"running {name} ...", file=sys.stderr, flush=True)
+        results.update(SUITES[name](options))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": _git_commit(),
+            "suites": suites,
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        for name, entry in results.items():
+            print(f"{name}: {entry['value']:.4g} {entry['unit']}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+def compare_command(args):
+    baseline, current = load(args.baseline), load(args.current)
+    rows = compare(baseline, current, threshold=args.threshold)
+    units = {name: " " + entry["unit"] for name, entry in current.get("results", {}).items()}
+    print(format_rows(rows, units))
+    failed = regressions(rows)
+    if failed:
+        print(f"\n{len(failed)} regression(s) beyond {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="UnionLLM overhead benchmarks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run suites and write JSON results")
+    run_parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    run_parser.add_argument("--suite", help=f"comma-separated subset of: {', '.join(SUITES)}")
+    run_parser.add_argument("--quick", action="store_true", help="fewer repeats and concurrency up to 100")
+    run_parser.add_argument("--repeat", type=int, help="override the repeat count of every suite")
+    run_parser.add_argument("--providers", help="providers for the overhead and streaming suites")
+    run_parser.add_argument("--load-providers", help="providers for the memory and throughput suites (default zhipuai,dify)")
+    run_parser.add_argument("--concurrency", help="throughput concurrency levels (default 1,10,100,1000)")
+    run_parser.add_argument("--latency", type=float, default=0.05, help="mock upstream latency in the throughput suite")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change treated as a regression (default 0.1)")
+    compare_parser.set_defaults(func=compare_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,35 @@
+"""Cold import time of unionllm.main, each sample in a fresh interpreter."""
+import json
+import os
+import subprocess
+import sys
+
+from .harness import result, summarize
+
+SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import unionllm.main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "modules": len(sys.modules)}))
+"""
+
+
+def import_once():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    output = subprocess.run([sys.executable, "-c", SCRIPT], env=env, cwd=root, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(options):
+    # 第一次导入负责写好字节码缓存，之后测到的是常规的"冷进程、热磁盘"启动
+    import_once()
+    runs = [import_once() for _ in range(options.repeats(7, 3))]
+    stats = summarize([r["seconds"] for r in runs])
+    return {
+        "import/unionllm.main": result(stats["median"], "s", tolerance=0.05, stats=stats,
+                                       modules=runs[-1]["modules"]),
+    }
@@ -0,0 +1,61 @@
+"""
+Memory per concurrent stream: open N streams at once, stop every consumer
+after its first chunk, and divide the traced Python memory they hold (above
+the idle baseline) by N. Only Python allocations are counted (tracemalloc),
+not thread stacks or kernel socket buffers.
+"""
+import threading
+import tracemalloc
+
+from .harness import MESSAGES, mock_server, result
+
+
+def held_per_stream(client, model, streams):
+    opened = threading.Barrier(streams + 1)
+    release = threading.Event()
+    errors = []
+
+    def consume():
+        response = None
+        try:
+            response = client.completion(model=model, messages=MESSAGES, stream=True)
+            next(iter(response))
+        except Exception as e:
+            errors.append(e)
+        opened.wait()
+        release.wait()
+        if response is not None:
+            for _ in response:
+                pass
+
+    threads = [threading.Thread(target=consume, daemon=True) for _ in range(streams)]
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for thread in threads:
+            thread.start()
+        opened.wait()
+        held = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+        tracemalloc.stop()
+    if errors:
+        raise errors[0]
+    return held / streams
+
+
+def run(options):
+    results = {}
+    streams = 20 if options.quick else 100
+    # 上游慢速输出，保证测量时每个流都还在进行中
+    with mock_server(tokens_per_second=20, completion_tokens=20) as server:
+        for provider, model in options.load_providers:
+            client = server.client(provider, model=model)
+            for _ in client.completion(model=model, messages=MESSAGES, stream=True):
+                pass
+            per_stream = held_per_stream(client, model, streams)
+            results[f"memory/{provider}/per_stream"] = result(
+                per_stream / 1024, "KiB", tolerance=4.0, streams=streams)
+    return results
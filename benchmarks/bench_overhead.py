@@ -0,0 +1,50 @@
+"""
+Per-provider completion() overhead: the latency of a non-streaming call
+through UnionLLM minus a raw HTTP post of the exact request it sent (same
+path, body and headers, replayed from the mock server's request log over a
+keep-alive session). xunfei speaks a websocket and has no raw baseline; its
+absolute latency is still reported.
+"""
+import json
+
+import requests
+
+from .harness import MESSAGES, measure, mock_server, result, scaled, summarize
+
+# 这些头由 requests 自己生成，重放时不能照抄
+HOP_HEADERS = {"host", "content-length", "connection", "accept-encoding", "transfer-encoding"}
+
+
+def raw_post(session, url, body, headers):
+    data = json.dumps(body).encode("utf-8")
+    headers = {k: v for k, v in headers.items() if k.lower() not in HOP_HEADERS}
+
+    def post():
+        response = session.post(url, data=data, headers=headers)
+        response.raise_for_status()
+        return response.content
+
+    return post
+
+
+def run(options):
+    results = {}
+    repeat = options.repeats(200, 30)
+    with mock_server() as server, requests.Session() as session:
+        for provider, model in options.providers:
+            client = server.client(provider, model=model)
+            call = lambda: client.completion(model=model, messages=MESSAGES)
+            call()
+            completion = summarize(measure(call, repeat))
+            results[f"overhead/{provider}/completion"] = result(
+                completion["median"] * 1e3, "ms", tolerance=0.2, stats=scaled(completion, 1e3))
+
+            if provider == "xunfei":
+                continue
+            protocol, path, body, headers = server.requests[-1]
+            raw = summarize(measure(raw_post(session, server.url + path, body, headers), repeat))
+            results[f"overhead/{provider}/raw_http"] = result(
+                raw["median"] * 1e3, "ms", tolerance=0.2, stats=scaled(raw, 1e3), protocol=protocol)
+            results[f"overhead/{provider}"] = result(
+                (completion["median"] - raw["median"]) * 1e3, "ms", tolerance=0.2)
+    return results
@@ -0,0 +1,89 @@
+"""
+Message normalization cost: check_prompt against history length, Gemini
+types.Content building with and without a warm prefix cache, and
+reformat_object_content against the number of attachments in a message.
+No network is involved; attachments are small data: URLs.
+"""
+import contextlib
+import io
+
+from .harness import measure, result, scaled, summarize
+
+HISTORY_LENGTHS = (10, 100, 200, 1000)
+ATTACHMENT_COUNTS = (0, 1, 10, 50)
+# zhipuai 原样透传 object content，coze 只部分支持，会走 reformat_object_content
+CHECK_PROMPT_PROVIDERS = (("zhipuai", "glm-4v"), ("coze", "coze-bot"))
+
+IMAGE = "data:image/png;base64," + "iVBORw0KGgo" * 8
+
+
+def history(length, multimodal=True):
+    """Alternating turns; with multimodal=True every other user turn carries an image."""
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for i in range(length - 1):
+        if i % 2:
+            messages.append({"role": "assistant", "content": f"Answer number {i}, with a few words of text."})
+        elif multimodal and i % 4 == 0:
+            messages.append({"role": "user", "content": [
+                {"type": "text", "text": f"Question number {i}?"},
+                {"type": "image_url", "image_url": {"url": IMAGE}},
+            ]})
+        else:
+            messages.append({"role": "user", "content": f"Question number {i}?"})
+    return messages
+
+
+def with_attachments(count, length=20):
+    messages = history(length)
+    content = [{"type": "text", "text": "Describe these images."}]
+    content.extend({"type": "image_url", "image_url": {"url": IMAGE}} for _ in range(count))
+    messages.append({"role": "user", "content": content})
+    return messages
+
+
+def provider_instance(provider):
+    from unionllm.main import UnionLLM
+
+    kwargs = {"bot_id": "bench"} if provider == "coze" else {}
+    return UnionLLM(provider=provider, api_key="bench", **kwargs).provider_instance
+
+
+def run(options):
+    from unionllm.utils import reformat_object_content
+
+    results = {}
+    repeat = options.repeats(50, 10)
+    for provider, model in CHECK_PROMPT_PROVIDERS:
+        instance = provider_instance(provider)
+        for kind in ("text", "multimodal"):
+            for length in HISTORY_LENGTHS:
+                messages = history(length, multimodal=kind == "multimodal")
+                stats = summarize(measure(lambda: instance.check_prompt(provider, model, messages), repeat))
+                results[f"prompt/check_prompt/{provider}/{kind}_history_{length}"] = result(
+                    stats["median"] * 1e6, "us", tolerance=5.0, stats=scaled(stats, 1e6), messages=length)
+
+    from unionllm import prefix_cache
+
+    # 前缀已缓存时只剩指纹计算和查表；gemini 转换会逐条 print，这里丢弃输出
+    gemini = provider_instance("gemini")
+    convert = lambda message: gemini._convert_stream_message("gemini-2.0-flash", message, None)
+    for cached in (False, True):
+        for length in HISTORY_LENGTHS:
+            messages = history(length, multimodal=False)
+            if cached:
+                prefix_cache.enable()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats = summarize(measure(lambda: prefix_cache.convert_messages(("gemini",), messages, convert), repeat))
+            finally:
+                prefix_cache.disable()
+            kind = "cached" if cached else "uncached"
+            results[f"prompt/gemini_contents/{kind}_history_{length}"] = result(
+                stats["median"] * 1e6, "us", tolerance=5.0, stats=scaled(stats, 1e6), messages=length)
+
+    for count in ATTACHMENT_COUNTS:
+        messages = with_attachments(count)
+        stats = summarize(measure(lambda: reformat_object_content(messages, True, reformat_image=1), repeat))
+        results[f"prompt/reformat_object_content/attachments_{count}"] = result(
+            stats["median"] * 1e6, "us", tolerance=5.0, stats=scaled(stats, 1e6), attachments=count)
+    return results
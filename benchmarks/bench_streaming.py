@@ -0,0 +1,34 @@
+"""
+Streaming throughput: chunks per second through each provider's stream
+wrapper (post_stream_processing_wrapper or the SDK equivalent) while the
+mock upstream sends a long reply as fast as it can.
+"""
+import time
+
+from .harness import MESSAGES, mock_server, result, summarize
+
+
+def consume(client, model):
+    chunks = 0
+    started = time.perf_counter()
+    for chunk in client.completion(model=model, messages=MESSAGES, stream=True):
+        chunks += 1
+    return chunks, time.perf_counter() - started
+
+
+def run(options):
+    results = {}
+    tokens = 500 if options.quick else 2000
+    repeat = options.repeats(10, 3)
+    with mock_server(completion_tokens=tokens) as server:
+        for provider, model in options.providers:
+            client = server.client(provider, model=model)
+            consume(client, model)
+            runs = [consume(client, model) for _ in range(repeat)]
+            rates = summarize([chunks / elapsed for chunks, elapsed in runs])
+            per_chunk = summarize([elapsed / chunks * 1e6 for chunks, elapsed in runs])
+            results[f"streaming/{provider}/chunks_per_second"] = result(
+                rates["median"], "chunks/s", higher_is_better=True, stats=rates, chunks=runs[-1][0])
+            results[f"streaming/{provider}/per_chunk"] = result(
+                per_chunk["median"], "us", tolerance=2.0, stats=per_chunk)
+    return results
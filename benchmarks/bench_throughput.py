@@ -0,0 +1,35 @@
+"""
+Throughput at increasing concurrency: completions per second through
+batch_completion (threads) and abatch_completion (asyncio) while the mock
+upstream takes `latency` seconds per request.
+"""
+import asyncio
+import time
+
+from .harness import MESSAGES, mock_server, result
+
+
+def requests_for(concurrency, quick):
+    return max(concurrency * 2, 20 if quick else 50)
+
+
+def run(options):
+    results = {}
+    with mock_server(latency=options.latency) as server:
+        for provider, model in options.load_providers:
+            client = server.client(provider, model=model)
+            client.completion(model=model, messages=MESSAGES)
+            for concurrency in options.concurrency:
+                batch = [MESSAGES] * requests_for(concurrency, options.quick)
+                for mode in ("sync", "async"):
+                    started = time.perf_counter()
+                    if mode == "sync":
+                        outcomes = client.batch_completion(model, batch, max_concurrency=concurrency)
+                    else:
+                        outcomes = asyncio.run(client.abatch_completion(model, batch, max_concurrency=concurrency))
+                    elapsed = time.perf_counter() - started
+                    errors = sum(isinstance(outcome, Exception) for outcome in outcomes)
+                    results[f"throughput/{provider}/{mode}/c{concurrency}"] = result(
+                        (len(batch) - errors) / elapsed, "req/s", higher_is_better=True,
+                        requests=len(batch), errors=errors, seconds=elapsed)
+    return results
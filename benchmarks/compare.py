@@ -0,0 +1,62 @@
+"""Compare two benchmark runs and flag regressions."""
+import json
+
+REGRESSION = "regression"
+IMPROVEMENT = "improvement"
+UNCHANGED = "ok"
+ADDED = "new"
+REMOVED = "missing"
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Rows of (name, old, new, relative change, status) for every result in
+    either run. A result regresses when it moved in its bad direction by more
+    than `threshold` (relative) and by more than its own absolute tolerance.
+    """
+    old_results = baseline.get("results", {})
+    new_results = current.get("results", {})
+    rows = []
+    for name in sorted(set(old_results) | set(new_results)):
+        old, new = old_results.get(name), new_results.get(name)
+        if old is None:
+            rows.append((name, None, new["value"], None, ADDED))
+            continue
+        if new is None:
+            rows.append((name, old["value"], None, None, REMOVED))
+            continue
+        delta = new["value"] - old["value"]
+        change = delta / abs(old["value"]) if old["value"] else None
+        tolerance = max(old.get("tolerance", 0.0), new.get("tolerance", 0.0))
+        worse = -delta if new.get("higher_is_better", old.get("higher_is_better")) else delta
+        status = UNCHANGED
+        if abs(delta) > tolerance and (change is None or abs(change) > threshold):
+            status = REGRESSION if worse > 0 else IMPROVEMENT
+        rows.append((name, old["value"], new["value"], change, status))
+    return rows
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    return f"{value:.4g}"
+
+
+def format_rows(rows, units=None):
+    units = units or {}
+    header = ("benchmark", "baseline", "current", "change", "status")
+    lines = [(name, _format_value(old) + units.get(name, ""), _format_value(new) + units.get(name, ""),
+              "-" if change is None else f"{change:+.1%}", status)
+             for name, old, new, change, status in rows]
+    widths = [max(len(line[i]) for line in [header] + lines) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+                     for line in [header] + lines)
+
+
+def regressions(rows):
+    return [row for row in rows if row[4] == REGRESSION]
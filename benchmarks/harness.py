@@ -0,0 +1,100 @@
+import contextlib
+import gc
+import statistics
+import time
+
+PROVIDERS = [
+    ("zhipuai", "glm-4"),
+    ("moonshot", "moonshot-v1-8k"),
+    ("deepseek", "deepseek-chat"),
+    ("baichuan", "Baichuan4"),
+    ("minimax", "abab6.5s-chat"),
+    ("xunfei_http", "generalv3.5"),
+    ("xunfei", "generalv3.5"),
+    ("dify", "dify-app"),
+    ("coze", "coze-bot"),
+    ("tiangong", "SkyChat-MegaVerse"),
+    ("wenxin", "ERNIE-4.0"),
+    ("qwen", "qwen-plus"),
+]
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Say hello."},
+]
+
+
+class Options:
+    """Settings shared by all suites."""
+
+    def __init__(self, quick=False, repeat=None, providers=None, load_providers=("zhipuai", "dify"),
+                 concurrency=(1, 10, 100, 1000), latency=0.05):
+        self.quick = quick
+        self.repeat = repeat
+        self.providers = [(p, m) for p, m in PROVIDERS if providers is None or p in providers]
+        self.load_providers = [(p, m) for p, m in PROVIDERS if p in load_providers]
+        self.concurrency = tuple(c for c in concurrency if not quick or c <= 100)
+        # throughput 套件中模拟的上游响应时间
+        self.latency = latency
+
+    def repeats(self, full, quick):
+        if self.repeat:
+            return self.repeat
+        return quick if self.quick else full
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "p95": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "max": samples[-1],
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    """Seconds per call of fn() over `repeat` runs, with GC paused while timing."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return samples
+
+
+def result(value, unit, higher_is_better=False, tolerance=0.0, stats=None, **extra):
+    """
+    One benchmark result. tolerance is the absolute change (in `unit`) that
+    compare treats as noise even when it exceeds the relative threshold.
+    """
+    entry = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+    if tolerance:
+        entry["tolerance"] = tolerance
+    if stats is not None:
+        entry["stats"] = stats
+    entry.update(extra)
+    return entry
+
+
+def scaled(stats, factor):
+    return {key: value if key == "n" else value * factor for key, value in stats.items()}
+
+
+@contextlib.contextmanager
+def mock_server(**config):
+    from unionllm.mock_server import MockConfig, MockProviderServer
+
+    with MockProviderServer(MockConfig(**config)) as server:
+        yield server
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+
+from unionllm.providers.zhipu import ZhiPuOpenAIError
+from unionllm.scheduler import AdaptiveLimit, RequestScheduler, error_status_code
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def test_additive_increase_and_multiplicative_decrease():
+    limit = AdaptiveLimit(initial_limit=4, max_limit=10, cooldown=0)
+    for _ in range(4):
+        limit.acquire(0)
+        limit.release(latency=0.1)
+    assert 4.9 < limit.limit < 5.0
+
+    limit.acquire(0)
+    limit.release(error=RateLimited())
+    assert limit.max_concurrency == 2
+    assert limit.in_flight == 0
+
+
+def test_burst_of_429s_cuts_once_per_cooldown():
+    limit = AdaptiveLimit(initial_limit=16, cooldown=10)
+    for _ in range(5):
+        limit.acquire(0)
+    for _ in range(5):
+        limit.release(error=ZhiPuOpenAIError(status_code=429, message="too many requests"))
+    assert limit.limit == 8
+    assert limit.decreases == 1
+
+
+def test_client_errors_do_not_change_the_limit():
+    limit = AdaptiveLimit(initial_limit=4, cooldown=0)
+    limit.acquire(0)
+    limit.release(error=ZhiPuOpenAIError(status_code=400, message="bad request"))
+    assert limit.limit == 4
+
+
+def test_timeouts_and_503_shrink_limit():
+    limit = AdaptiveLimit(initial_limit=8, cooldown=0)
+    limit.acquire(0)
+    limit.release(error=ZhiPuOpenAIError(status_code=503, message="overloaded"))
+    limit.acquire(0)
+    limit.release(error=ZhiPuOpenAIError(status_code=408, message="timeout"))
+    assert limit.limit == 2
+
+
+def test_latency_spike_against_baseline():
+    limit = AdaptiveLimit(initial_limit=8, max_limit=8, cooldown=0, min_samples=5)
+    for _ in range(5):
+        limit.acquire(0)
+        limit.release(latency=0.2)
+    limit.acquire(0)
+    limit.release(latency=1.0)
+    assert limit.limit == 4
+
+
+def test_limit_stays_within_bounds():
+    limit = AdaptiveLimit(initial_limit=2, min_limit=1, max_limit=3, cooldown=0)
+    for _ in range(5):
+        limit.acquire(0)
+        limit.release(error=RateLimited())
+    assert limit.max_concurrency == 1
+    for _ in range(50):
+        limit.acquire(0)
+        limit.release(latency=0.01)
+    assert limit.max_concurrency == 3
+
+
+def test_status_code_found_through_wrapped_errors():
+    try:
+        try:
+            raise RateLimited()
+        except RateLimited as e:
+            raise RuntimeError("wrapped") from e
+    except RuntimeError as e:
+        assert error_status_code(e) == 429
+
+
+class FlakyClient:
+    """Upstream that answers 429 whenever more than `capacity` calls are in flight."""
+
+    provider = "moonshot"
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def completion(self, model, messages, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            over = self.active > self.capacity
+        try:
+            time.sleep(0.01)
+            if over:
+                raise ZhiPuOpenAIError(status_code=429, message="rate limited")
+            return "ok"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    async def acompletion(self, model, messages, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.completion(model, messages, **kwargs))
+
+
+def test_scheduler_converges_below_upstream_capacity_in_threads():
+    scheduler = RequestScheduler(limit_factory=AdaptiveLimit.factory(initial_limit=16, cooldown=0.02))
+    client = FlakyClient(capacity=4)
+    errors = []
+
+    def worker():
+        for _ in range(15):
+            try:
+                scheduler.completion(client, "m", [{"role": "user", "content": "hi"}])
+            except ZhiPuOpenAIError:
+                errors.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+
+    limit = scheduler.limits["moonshot"]
+    assert limit.decreases >= 1
+    assert limit.max_concurrency <= 8
+    assert scheduler.metrics()["adaptive_limit"]["moonshot"] == limit.limit
+
+
+def test_scheduler_adapts_on_asyncio_path():
+    scheduler = RequestScheduler(limit_factory=AdaptiveLimit.factory(initial_limit=16, cooldown=0))
+    client = FlakyClient(capacity=2)
+
+    async def call():
+        try:
+            return await scheduler.acompletion(client, "m", [{"role": "user", "content": "hi"}])
+        except ZhiPuOpenAIError as e:
+            return e.status_code
+
+    async def run():
+        return await asyncio.gather(*(call() for _ in range(40)))
+
+    results = asyncio.run(run())
+
+    assert 429 in results
+    assert scheduler.limits["moonshot"].limit < 16
+    assert scheduler.limits["moonshot"].in_flight == 0
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import pytest
+
+from unionllm.cost import normalize_usage
+from unionllm.main import UnionLLM
+
+pytest.importorskip("anthropic")
+pytest.importorskip("azure.identity")
+
+EPHEMERAL = {"type": "ephemeral"}
+TOOLS = [
+    {"type": "function", "function": {"name": "search", "description": "d", "parameters": {}}},
+    {"type": "function", "function": {"name": "fetch", "description": "d", "parameters": {}}},
+]
+
+
+class DummyMessages:
+    def __init__(self, response):
+        self.response = response
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.response
+
+
+def make_client(monkeypatch, response):
+    client = UnionLLM(provider="azure", model="claude-sonnet-4-5", api_key="k",
+                      api_base="https://example.services.ai.azure.com/anthropic")
+    messages = DummyMessages(response)
+    monkeypatch.setattr(client.provider_instance, "client", SimpleNamespace(messages=messages))
+    return client, messages
+
+
+def message_response(**usage):
+    return SimpleNamespace(id="msg_1", content=[SimpleNamespace(type="text", text="ok")], stop_reason="end_turn",
+                           usage=SimpleNamespace(input_tokens=5, output_tokens=3, **usage))
+
+
+def history():
+    return [
+        {"role": "system", "content": "long system prompt"},
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "q2"},
+        {"role": "assistant", "content": "a2"},
+        {"role": "user", "content": [{"type": "text", "text": "q3"}]},
+    ]
+
+
+def breakpoints(request):
+    found = [tool["name"] for tool in request.get("tools", []) if tool.get("cache_control")]
+    system = request.get("system")
+    if isinstance(system, list) and system[-1].get("cache_control"):
+        found.append("system")
+    for message in request["messages"]:
+        if isinstance(message["content"], list):
+            found += [block.get("text") for block in message["content"] if block.get("cache_control")]
+    return found
+
+
+def test_explicit_hints_are_passed_through(monkeypatch):
+    client, upstream = make_client(monkeypatch, message_response())
+    messages = [
+        {"role": "system", "content": [{"type": "text", "text": "rules", "cache_control": EPHEMERAL}]},
+        {"role": "user", "content": "doc", "cache_control": EPHEMERAL},
+        {"role": "user", "content": [{"type": "text", "text": "part", "cache_control": EPHEMERAL}, {"type": "text", "text": "tail"}]},
+    ]
+    tools = [dict(TOOLS[0], cache_control=EPHEMERAL)]
+
+    client.completion(model="claude-sonnet-4-5", messages=messages, tools=tools, max_tokens=64)
+
+    request = upstream.calls[0]
+    assert request["system"] == [{"type": "text", "text": "rules", "cache_control": EPHEMERAL}]
+    assert request["messages"][0] == {"role": "user", "content": [{"type": "text", "text": "doc", "cache_control": EPHEMERAL}]}
+    assert breakpoints(request) == ["search", "system", "doc", "part"]
+    assert "cache_control" not in messages[1]["content"]
+
+
+def test_auto_mode_marks_tools_system_and_recent_user_turns(monkeypatch):
+    client, upstream = make_client(monkeypatch, message_response())
+    messages = history()
+
+    client.completion(model="claude-sonnet-4-5", messages=messages, tools=TOOLS, max_tokens=64, prompt_caching="auto")
+    client.completion(model="claude-sonnet-4-5", messages=messages, max_tokens=64)
+
+    assert breakpoints(upstream.calls[0]) == ["fetch", "system", "q2", "q3"]
+    assert "prompt_caching" not in upstream.calls[0]
+    assert breakpoints(upstream.calls[1]) == []
+    assert messages == history()
+
+
+def test_auto_mode_respects_the_breakpoint_limit(monkeypatch):
+    client, upstream = make_client(monkeypatch, message_response())
+    messages = history()
+    messages[1] = dict(messages[1], cache_control=EPHEMERAL)
+    messages[3] = dict(messages[3], cache_control=EPHEMERAL)
+
+    client.completion(model="claude-sonnet-4-5", messages=messages, tools=TOOLS, max_tokens=64, prompt_caching=True)
+
+    assert breakpoints(upstream.calls[0]) == ["fetch", "system", "q1", "q2"]
+
+
+def test_cache_tokens_are_reported_in_usage(monkeypatch):
+    client, _ = make_client(monkeypatch, message_response(cache_creation_input_tokens=100, cache_read_input_tokens=2000))
+
+    usage = client.completion(model="claude-sonnet-4-5", messages=history(), max_tokens=64).usage
+
+    assert (usage.cache_creation_input_tokens, usage.cache_read_input_tokens) == (100, 2000)
+    assert normalize_usage(usage)["prompt_tokens"] == 2105
+
+
+def test_stream_reports_cache_tokens_from_message_start(monkeypatch):
+    start_usage = SimpleNamespace(input_tokens=5, output_tokens=1, cache_creation_input_tokens=100, cache_read_input_tokens=2000)
+    events = [
+        SimpleNamespace(type="message_start", message=SimpleNamespace(id="msg_1", usage=start_usage)),
+        SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason="end_turn"),
+                        usage=SimpleNamespace(output_tokens=3, input_tokens=None, cache_creation_input_tokens=None, cache_read_input_tokens=None)),
+        SimpleNamespace(type="message_stop"),
+    ]
+    client, upstream = make_client(monkeypatch, events)
+
+    chunks = list(client.completion(model="claude-sonnet-4-5", messages=history(), max_tokens=64, stream=True, prompt_caching="auto"))
+
+    usage = next(chunk.usage for chunk in chunks if getattr(chunk.usage, "prompt_tokens", None))
+    assert (usage.prompt_tokens, usage.cache_creation_input_tokens, usage.cache_read_input_tokens) == (5, 100, 2000)
+    assert upstream.calls[0]["system"] == [{"type": "text", "text": "long system prompt", "cache_control": EPHEMERAL}]
@@ -0,0 +1,247 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import urlparse
+
+import pytest
+
+from unionllm import UnionLLM
+from unionllm.exceptions import BatchJobError
+
+
+def chat_body(content, prompt_tokens=4, completion_tokens=2):
+    return {
+        "id": "chatcmpl-x",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "m",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+class StubServer:
+    """Local HTTP stub for the OpenAI and Gemini batch wire protocols."""
+
+    def __init__(self, polls_before_done=2, fail_ids=()):
+        self.polls_before_done = polls_before_done
+        self.fail_ids = set(fail_ids)
+        self.requests = []
+        self.files = {}
+        self.batches = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, payload, status=200, raw=False):
+                data = payload.encode("utf-8") if raw else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                stub.requests.append(("GET", self.path, dict(self.headers)))
+                self._send(*stub.handle_get(urlparse(self.path).path))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                stub.requests.append(("POST", self.path, dict(self.headers)))
+                self._send(*stub.handle_post(urlparse(self.path), self.headers, body))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # OpenAI / DashScope / Azure
+    def handle_post(self, url, headers, body):
+        path = url.path
+        if path.endswith("/files"):
+            message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+            fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True) for part in message.iter_parts()}
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = fields["file"].decode("utf-8")
+            return ({"id": file_id, "purpose": fields["purpose"].decode("utf-8")},)
+        if path.endswith("/batches"):
+            request = json.loads(body)
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {"request": request, "polls": 0}
+            return ({"id": batch_id, "status": "validating"},)
+        if ":batchGenerateContent" in path:
+            request = json.loads(body)
+            self.batches["batches/g1"] = {"request": request, "polls": 0}
+            return ({"name": "batches/g1", "metadata": {"state": "BATCH_STATE_PENDING"}},)
+        return ({"error": "not found"}, 404)
+
+    def handle_get(self, path):
+        if path.startswith("/v1beta/batches/"):
+            return (self.gemini_status(),)
+        if "/batches/" in path:
+            batch_id = path.rsplit("/", 1)[1]
+            return (self.openai_status(batch_id),)
+        if path.endswith("/content"):
+            file_id = path.split("/")[-2]
+            return (self.files[file_id], 200, True)
+        return ({"error": "not found"}, 404)
+
+    def openai_status(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        if batch["polls"] <= self.polls_before_done:
+            return {"id": batch_id, "status": "in_progress"}
+        lines = [json.loads(l) for l in self.files[batch["request"]["input_file_id"]].splitlines()]
+        output, errors = [], []
+        # 结果文件故意倒序，验证按 custom_id 回填
+        for line in reversed(lines):
+            text = line["body"]["messages"][-1]["content"]
+            if line["custom_id"] in self.fail_ids:
+                errors.append({"custom_id": line["custom_id"], "response": {"status_code": 400, "body": {"error": {"message": "bad input"}}}, "error": None})
+            else:
+                output.append({"custom_id": line["custom_id"], "response": {"status_code": 200, "body": chat_body(f"echo {text}")}, "error": None})
+        self.files["out-" + batch_id] = "\n".join(json.dumps(o) for o in output)
+        self.files["err-" + batch_id] = "\n".join(json.dumps(e) for e in errors)
+        return {"id": batch_id, "status": "completed", "output_file_id": "out-" + batch_id, "error_file_id": "err-" + batch_id if errors else None}
+
+    def gemini_status(self):
+        batch = self.batches["batches/g1"]
+        batch["polls"] += 1
+        if batch["polls"] <= self.polls_before_done:
+            return {"name": "batches/g1", "metadata": {"state": "BATCH_STATE_RUNNING"}, "done": False}
+        responses = []
+        for item in batch["request"]["batch"]["input_config"]["requests"]["requests"]:
+            key = item["metadata"]["key"]
+            text = item["request"]["contents"][-1]["parts"][0]["text"]
+            if key in self.fail_ids:
+                responses.append({"error": {"code": 400, "message": "blocked"}, "metadata": {"key": key}})
+            else:
+                responses.append({
+                    "response": {
+                        "candidates": [{"content": {"role": "model", "parts": [{"text": f"echo {text}"}]}, "finishReason": "STOP"}],
+                        "usageMetadata": {"promptTokenCount": 5, "candidatesTokenCount": 3, "totalTokenCount": 8},
+                    },
+                    "metadata": {"key": key},
+                })
+        return {
+            "name": "batches/g1",
+            "metadata": {"state": "BATCH_STATE_SUCCEEDED"},
+            "done": True,
+            "response": {"inlinedResponses": {"inlinedResponses": responses}},
+        }
+
+
+@pytest.fixture
+def stub():
+    server = StubServer(fail_ids={"request-1"})
+    yield server
+    server.close()
+
+
+def prompts(n):
+    return [[{"role": "system", "content": "be brief"}, {"role": "user", "content": f"q{i}"}] for i in range(n)]
+
+
+def test_openai_batch_roundtrip_maps_results_in_input_order(stub):
+    client = UnionLLM(provider="openai")
+    results = client.run_batch_job("gpt-4o-mini", prompts(3), poll_interval=0.01, api_key="sk-test", api_base=stub.base + "/v1", temperature=0.3, stream=True)
+
+    assert results[0].choices[0].message.content == "echo q0"
+    assert results[2].choices[0].message.content == "echo q2"
+    assert results[0].usage.total_tokens == 6
+    assert isinstance(results[1], BatchJobError) and results[1].status_code == 400
+
+    uploaded = [json.loads(l) for l in stub.files["file-0"].splitlines()]
+    assert uploaded[0]["url"] == "/v1/chat/completions"
+    assert uploaded[0]["body"]["model"] == "gpt-4o-mini"
+    assert uploaded[0]["body"]["temperature"] == 0.3
+    assert "stream" not in uploaded[0]["body"]
+    assert stub.requests[0][2]["Authorization"] == "Bearer sk-test"
+    # 轮询直到完成
+    assert sum(1 for method, path, _ in stub.requests if method == "GET" and "/batches/" in path) == 3
+
+
+def test_azure_batch_uses_api_key_header_and_version(stub):
+    client = UnionLLM(provider="openai")
+    backend = client.provider_instance.batch_backend("azure", api_key="az-key", api_base=stub.base, api_version="2024-10-21")
+    job = backend.submit("gpt-4o-batch", prompts(1))
+    results = job.wait(poll_interval=0.01).results()
+
+    assert results[0].choices[0].message.content == "echo q0"
+    method, path, headers = stub.requests[0]
+    assert path.startswith("/openai/files?api-version=2024-10-21")
+    assert headers["api-key"] == "az-key"
+    assert json.loads(stub.files["file-0"].splitlines()[0])["url"] == "/chat/completions"
+
+
+def test_qwen_provider_batch_goes_to_dashscope_compatible_endpoint(stub):
+    client = UnionLLM(provider="qwen", model="qwen-plus", api_key="ds-key")
+    job = client.create_batch_job("qwen-plus", prompts(2), api_base=stub.base + "/compatible-mode/v1")
+    results = job.wait(poll_interval=0.01).results()
+
+    assert stub.requests[0][1] == "/compatible-mode/v1/files"
+    assert results[0].choices[0].message.content == "echo q0"
+    assert isinstance(results[1], BatchJobError)
+
+
+def test_gemini_batch_roundtrip(stub, monkeypatch):
+    client = UnionLLM(provider="gemini", api_key="g-key")
+    job = client.create_batch_job("gemini-2.5-flash", prompts(3), api_base=stub.base + "/v1beta", max_tokens=64)
+    assert job.id == "batches/g1"
+    results = job.wait(poll_interval=0.01).results()
+
+    submitted = stub.batches["batches/g1"]["request"]["batch"]["input_config"]["requests"]["requests"]
+    assert submitted[0]["request"]["systemInstruction"] == {"parts": [{"text": "be brief"}]}
+    assert submitted[0]["request"]["generationConfig"] == {"maxOutputTokens": 64}
+    assert stub.requests[0][2]["x-goog-api-key"] == "g-key"
+    assert results[0].choices[0].message.content == "echo q0"
+    assert results[2].usage.total_tokens == 8
+    assert isinstance(results[1], BatchJobError) and results[1].message == "blocked"
+
+
+def test_wait_backs_off_and_honours_timeout(stub):
+    stub.polls_before_done = 100
+    client = UnionLLM(provider="openai")
+    job = client.create_batch_job("gpt-4o-mini", prompts(1), api_key="sk-test", api_base=stub.base + "/v1")
+    sleeps = []
+
+    with pytest.raises(Exception) as excinfo:
+        job.wait(poll_interval=0.01, backoff=2, max_poll_interval=0.04, timeout=0.2, sleep=lambda s: (sleeps.append(s), __import__("time").sleep(s)))
+
+    assert getattr(excinfo.value, "status_code", None) == 408
+    assert sleeps[:4] == [0.01, 0.02, 0.04, 0.04]
+
+
+def test_unsupported_provider_is_rejected():
+    client = UnionLLM(provider="moonshot", api_key="test-moonshot-key")
+    with pytest.raises(Exception, match="does not support batch jobs"):
+        client.create_batch_job("moonshot-v1-8k", prompts(1))
+
+
+def test_gemini_batch_request_keeps_tools_and_tool_history():
+    backend = UnionLLM(provider="gemini", api_key="g-key").provider_instance.batch_backend()
+    weather = {"type": "function", "function": {"name": "weather", "description": "d", "parameters": {"type": "object"}}}
+    messages = [
+        {"role": "user", "content": "weather?"},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "weather", "arguments": "{\"city\": \"SH\"}"}}]},
+        {"role": "tool", "tool_call_id": "c1", "content": "sunny"},
+    ]
+
+    request = backend.build_request(messages, {"tools": [weather], "tool_choice": "auto"})
+
+    assert request["contents"][1] == {"role": "model", "parts": [{"functionCall": {"name": "weather", "args": {"city": "SH"}}}]}
+    assert request["contents"][2]["parts"][0]["functionResponse"] == {"name": "weather", "response": {"result": "sunny"}}
+    assert request["tools"] == [{"functionDeclarations": [{"name": "weather", "description": "d", "parameters": {"type": "object"}}]}]
+    assert request["toolConfig"] == {"functionCallingConfig": {"mode": "AUTO"}}
+    with pytest.raises(BatchJobError):
+        backend.build_request(messages[2:], {})
+    with pytest.raises(BatchJobError):
+        backend.build_request(messages[:1], {"tools": [{"type": "code_interpreter"}]})
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from unionllm import UnionLLM
+
+
+class FakeProvider:
+    """Provider stand-in that records peak concurrency and fails on request."""
+
+    def __init__(self, delays=None, fail=()):
+        self.delays = delays or {}
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.calls = []
+
+    def completion(self, model, messages, **kwargs):
+        text = messages[0]["content"]
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.calls.append((text, kwargs))
+        try:
+            time.sleep(self.delays.get(text, 0.01))
+            if text in self.fail:
+                raise RuntimeError(f"failed: {text}")
+            return f"reply to {text}"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def make_client(provider):
+    client = UnionLLM(provider="moonshot", api_key="test-moonshot-key")
+    client.provider_instance = provider
+    return client
+
+
+def prompts(n):
+    return [[{"role": "user", "content": f"q{i}"}] for i in range(n)]
+
+
+def test_results_keep_input_order_and_errors_stay_per_item():
+    provider = FakeProvider(delays={"q0": 0.1}, fail={"q2"})
+    client = make_client(provider)
+
+    results = client.batch_completion("moonshot-v1-8k", prompts(5), max_concurrency=3, temperature=0.2)
+
+    assert results[0] == "reply to q0"
+    assert isinstance(results[2], RuntimeError)
+    assert results[1] == "reply to q1" and results[4] == "reply to q4"
+    assert provider.peak <= 3
+    assert all(kwargs["temperature"] == 0.2 for _, kwargs in provider.calls)
+
+
+def test_each_item_gets_its_own_deadline():
+    provider = FakeProvider()
+    client = make_client(provider)
+
+    client.batch_completion("moonshot-v1-8k", prompts(3), max_concurrency=3, timeout=5)
+
+    deadlines = [kwargs["deadline"] for _, kwargs in provider.calls]
+    assert len({id(d) for d in deadlines}) == 3
+
+
+def test_as_completed_yields_fast_items_first_and_reads_input_lazily():
+    provider = FakeProvider(delays={"q0": 0.2})
+    client = make_client(provider)
+    pulled = []
+
+    def lazy():
+        for i, messages in enumerate(prompts(4)):
+            pulled.append(i)
+            yield messages
+
+    stream = client.batch_completion("moonshot-v1-8k", lazy(), max_concurrency=2, as_completed=True)
+    first_index, first = next(stream)
+    # 同时只从输入中取出 max_concurrency 个请求
+    assert len(pulled) == 2
+    rest = list(stream)
+
+    assert first_index == 1 and first == "reply to q1"
+    assert sorted(i for i, _ in rest) == [0, 2, 3]
+    assert provider.peak <= 2
+
+
+def test_async_batch_keeps_order_and_bounds_concurrency():
+    provider = FakeProvider(delays={"q1": 0.1}, fail={"q3"})
+    client = make_client(provider)
+
+    results = asyncio.run(client.abatch_completion("moonshot-v1-8k", prompts(6), max_concurrency=2))
+
+    assert [r if isinstance(r, str) else type(r) for r in results] == [
+        "reply to q0", "reply to q1", "reply to q2", RuntimeError, "reply to q4", "reply to q5",
+    ]
+    assert provider.peak <= 2
+
+
+def test_async_as_completed_stops_pending_work_when_consumer_leaves():
+    provider = FakeProvider(delays={"q0": 0.3, "q1": 0.01})
+    client = make_client(provider)
+
+    async def run():
+        got = []
+        async for index, result in client.abatch_completion("moonshot-v1-8k", prompts(10), max_concurrency=2, as_completed=True):
+            got.append(index)
+            break
+        return got
+
+    assert asyncio.run(run()) == [1]
+    # 未提交的请求不会再被执行
+    assert len(provider.calls) <= 3
+
+
+def test_invalid_concurrency_is_rejected():
+    client = make_client(FakeProvider())
+    with pytest.raises(ValueError):
+        client.batch_completion("moonshot-v1-8k", prompts(1), max_concurrency=0)
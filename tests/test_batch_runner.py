@@ -0,0 +1,148 @@
+import io
+import json
+
+import pytest
+
+from unionllm import batch as batch_module
+from unionllm.utils import Choices, Message, ModelResponse, Usage
+
+
+class FakeUnionLLM:
+    created = []
+    calls = []
+    fail = set()
+
+    def __init__(self, provider=None, **kwargs):
+        self.provider = provider
+        self.kwargs = kwargs
+        FakeUnionLLM.created.append((provider, kwargs))
+
+    def completion(self, model, messages, **kwargs):
+        text = messages[-1]["content"]
+        FakeUnionLLM.calls.append((self.provider, model, text, kwargs))
+        if text in FakeUnionLLM.fail:
+            raise RuntimeError(f"boom: {text}")
+        return ModelResponse(
+            choices=[Choices(index=0, message=Message(content=f"echo {text}"), finish_reason="stop")],
+            model=model,
+            usage=Usage(prompt_tokens=3, completion_tokens=2, total_tokens=5),
+        )
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+    FakeUnionLLM.created = []
+    FakeUnionLLM.calls = []
+    FakeUnionLLM.fail = set()
+    monkeypatch.setattr(batch_module, "UnionLLM", FakeUnionLLM)
+
+
+def write_requests(path, n, **extra):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            line = {"id": f"r{i}", "messages": [{"role": "user", "content": f"q{i}"}], **extra}
+            f.write(json.dumps(line) + "\n")
+
+
+def read_output(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_runs_every_line_and_reports_stats(tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_requests(src, 20, provider="zhipuai", model="glm-4", kwargs={"temperature": 0.1})
+    FakeUnionLLM.fail = {"q7"}
+    log = io.StringIO()
+
+    stats = batch_module.run_batch(str(src), str(out), max_concurrency=4, log=log)
+
+    records = {r["id"]: r for r in read_output(out)}
+    assert len(records) == 20
+    assert records["r0"]["response"]["choices"][0]["message"]["content"] == "echo q0"
+    assert records["r7"]["error"]["type"] == "RuntimeError"
+    assert stats.succeeded == 19 and stats.failed == 1
+    assert stats.total_tokens == 19 * 5
+    assert "errors=1" in log.getvalue()
+    # 同一 provider 只创建一个客户端
+    assert len(FakeUnionLLM.created) == 1
+    assert all(kwargs == {"temperature": 0.1} for *_, kwargs in FakeUnionLLM.calls)
+
+
+def test_resume_skips_checkpointed_ids_and_retries_errors(tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_requests(src, 10)
+    FakeUnionLLM.fail = {"q3"}
+    batch_module.run_batch(str(src), str(out), provider="moonshot", model="moonshot-v1-8k", log=io.StringIO())
+
+    FakeUnionLLM.calls = []
+    FakeUnionLLM.fail = set()
+    stats = batch_module.run_batch(str(src), str(out), provider="moonshot", model="moonshot-v1-8k", log=io.StringIO())
+
+    assert [text for _, _, text, _ in FakeUnionLLM.calls] == ["q3"]
+    assert stats.skipped == 9 and stats.succeeded == 1
+    checkpoint = (tmp_path / "out.jsonl.checkpoint").read_text().split()
+    assert sorted(checkpoint) == sorted(f"r{i}" for i in range(10))
+
+
+def test_invalid_lines_are_counted_and_skipped(tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    src.write_text('not json\n\n{"provider": "zhipuai", "model": "glm-4", "messages": [{"role": "user", "content": "hi"}]}\n{"id": "x"}\n')
+
+    stats = batch_module.run_batch(str(src), str(out), log=io.StringIO())
+
+    assert stats.invalid == 2
+    # 没有 id 时使用行号
+    assert [r["id"] for r in read_output(out)] == ["3"]
+
+
+def test_input_is_read_lazily(tmp_path, monkeypatch):
+    runner = batch_module.BatchRunner(max_concurrency=2, provider="zhipuai", model="glm-4", log=io.StringIO())
+    pulled = []
+    finished = []
+    original = runner.iter_requests
+    run_one = runner._run_one
+
+    def tracking(lines, done_ids, stats):
+        for item in original(lines, done_ids, stats):
+            pulled.append(item[0])
+            # 在途请求数不超过并发上限
+            assert len(pulled) - len(finished) <= 2
+            yield item
+
+    def tracking_run(request):
+        result = run_one(request)
+        finished.append(request)
+        return result
+
+    monkeypatch.setattr(runner, "iter_requests", tracking)
+    monkeypatch.setattr(runner, "_run_one", tracking_run)
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_requests(src, 12)
+
+    stats = runner.run(str(src), str(out))
+
+    assert stats.succeeded == 12
+
+
+def test_cli_entry_point(tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_requests(src, 3)
+
+    code = batch_module.main([str(src), "-o", str(out), "--provider", "zhipuai", "--model", "glm-4", "--progress-interval", "0"])
+
+    assert code == 0
+    assert len(read_output(out)) == 3
+
+
+def test_clients_are_built_per_model_for_model_scoped_providers():
+    runner = batch_module.BatchRunner(max_concurrency=4)
+
+    claude = runner.get_client("azure", "claude-sonnet-4-5")
+    gpt = runner.get_client("azure", "gpt-4o")
+
+    assert claude is not gpt and runner.get_client("azure", "claude-sonnet-4-5") is claude
+    assert ("azure", {"model": "claude-sonnet-4-5"}) in FakeUnionLLM.created
+    assert ("azure", {"model": "gpt-4o"}) in FakeUnionLLM.created
+    runner.get_client("zhipuai", "glm-4")
+    assert ("zhipuai", {}) in FakeUnionLLM.created
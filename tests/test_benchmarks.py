@@ -0,0 +1,45 @@
+import json
+
+from benchmarks.__main__ import main
+from benchmarks.compare import IMPROVEMENT, REGRESSION, UNCHANGED, compare
+from benchmarks.harness import result, summarize
+
+
+def report(**results):
+    return {"meta": {}, "results": results}
+
+
+def test_compare_respects_direction_threshold_and_tolerance():
+    baseline = report(
+        latency=result(10.0, "ms"),
+        rate=result(1000.0, "chunks/s", higher_is_better=True),
+        tiny=result(0.1, "ms", tolerance=0.2),
+        gone=result(1.0, "ms"),
+    )
+    current = report(
+        latency=result(12.0, "ms"),
+        rate=result(1200.0, "chunks/s", higher_is_better=True),
+        tiny=result(0.25, "ms", tolerance=0.2),
+        added=result(1.0, "ms"),
+    )
+
+    rows = {name: status for name, _, _, _, status in compare(baseline, current, threshold=0.1)}
+
+    assert rows == {"latency": REGRESSION, "rate": IMPROVEMENT, "tiny": UNCHANGED, "gone": "missing", "added": "new"}
+    assert compare(baseline, current, threshold=0.25)[3][4] == UNCHANGED
+
+
+def test_compare_command_exits_nonzero_on_regression(tmp_path, capsys):
+    old, new = tmp_path / "old.json", tmp_path / "new.json"
+    old.write_text(json.dumps(report(rate=result(100.0, "req/s", higher_is_better=True))))
+    new.write_text(json.dumps(report(rate=result(80.0, "req/s", higher_is_better=True))))
+
+    assert main(["compare", str(old), str(new)]) == 1
+    assert "regression" in capsys.readouterr().out
+    assert main(["compare", str(old), str(old)]) == 0
+
+
+def test_summarize():
+    stats = summarize([3.0, 1.0, 2.0, 4.0])
+    assert stats["n"] == 4 and stats["min"] == 1.0 and stats["max"] == 4.0
+    assert stats["median"] == 2.5 and stats["p95"] == 4.0
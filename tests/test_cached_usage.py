@@ -0,0 +1,74 @@
+from openai.types.chat import ChatCompletion
+
+from unionllm.cost import normalize_usage
+from unionllm.providers.deepseek import DeepSeekAIProvider
+from unionllm.providers.moonshot import MoonshotAIProvider
+from unionllm.providers.qwen import dashscope_usage
+from unionllm.providers.zhipu import ZhipuAIProvider
+from unionllm.utils import Usage, cached_prompt_tokens
+
+
+def test_cached_prompt_tokens_reads_every_provider_convention():
+    assert cached_prompt_tokens({"prompt_tokens": 100, "prompt_cache_hit_tokens": 64, "prompt_cache_miss_tokens": 36}) == 64
+    assert cached_prompt_tokens({"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 80}}) == 80
+    assert cached_prompt_tokens({"prompt_tokens": 100, "cached_tokens": 50}) == 50
+    assert cached_prompt_tokens(Usage(prompt_tokens=5, cache_read_input_tokens=2000)) == 2000
+    assert cached_prompt_tokens({"prompt_tokens": 100}) == 0
+
+
+def completion(usage):
+    return ChatCompletion.model_validate({
+        "id": "c1", "object": "chat.completion", "created": 1, "model": "m",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+        "usage": usage,
+    })
+
+
+def test_non_stream_responses_report_normalized_and_raw_cache_fields():
+    deepseek = DeepSeekAIProvider(api_key="k").create_model_response(completion(
+        {"prompt_tokens": 100, "completion_tokens": 2, "total_tokens": 102, "prompt_cache_hit_tokens": 64, "prompt_cache_miss_tokens": 36}
+    ), model="deepseek-chat")
+    zhipu = ZhipuAIProvider(api_key="k").create_model_response(completion(
+        {"prompt_tokens": 100, "completion_tokens": 2, "total_tokens": 102, "prompt_tokens_details": {"cached_tokens": 80}}
+    ), model="glm-4.5")
+
+    assert deepseek.usage.cached_prompt_tokens == 64 and deepseek.usage.prompt_cache_miss_tokens == 36
+    assert zhipu.usage.cached_prompt_tokens == 80 and zhipu.usage.prompt_tokens_details["cached_tokens"] == 80
+    assert normalize_usage(deepseek.usage)["cached_prompt_tokens"] == 64
+
+
+class Chunk:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def stream_usages(provider, chunks):
+    return [chunk.usage for chunk in provider.post_stream_processing(iter([Chunk(c) for c in chunks]), model="m")]
+
+
+def test_stream_usage_is_normalized_including_choice_level_usage():
+    moonshot = stream_usages(MoonshotAIProvider(api_key="k"), [
+        {"id": "c1", "created": 1, "choices": [{"index": 0, "delta": {"content": "ok"}}]},
+        {"id": "c1", "created": 1, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop",
+                                                "usage": {"prompt_tokens": 100, "completion_tokens": 2, "total_tokens": 102, "cached_tokens": 90}}]},
+    ])
+    deepseek = stream_usages(DeepSeekAIProvider(api_key="k"), [
+        {"id": "c2", "created": 1, "choices": [], "usage": {"prompt_tokens": 100, "completion_tokens": 2, "prompt_cache_hit_tokens": 64}},
+    ])
+
+    assert "prompt_tokens" not in moonshot[0]
+    assert (moonshot[1].prompt_tokens, moonshot[1].cached_tokens, moonshot[1].cached_prompt_tokens) == (100, 90, 90)
+    assert (deepseek[0].prompt_cache_hit_tokens, deepseek[0].cached_prompt_tokens) == (64, 64)
+
+
+def test_dashscope_usage_keeps_prompt_tokens_details():
+    from dashscope.api_entities.dashscope_response import GenerationUsage
+
+    cached = dashscope_usage(GenerationUsage(input_tokens=100, output_tokens=2, total_tokens=102, prompt_tokens_details={"cached_tokens": 80}))
+    plain = dashscope_usage(GenerationUsage(input_tokens=100, output_tokens=2, total_tokens=102))
+
+    assert (cached.prompt_tokens, cached.cached_prompt_tokens, cached.prompt_tokens_details) == (100, 80, {"cached_tokens": 80})
+    assert plain.cached_prompt_tokens == 0 and "prompt_tokens_details" not in plain
@@ -0,0 +1,167 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+from openai.types.chat import ChatCompletion
+
+from unionllm import UnionLLM
+from unionllm.callbacks import CallbackHandler, clear_callbacks, register_callback
+from unionllm.scheduler import ProviderLimit, RequestScheduler
+from unionllm.utils import CallContext, Deadline, media_get
+
+
+class FakeChunk:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class Recorder(CallbackHandler):
+    def __init__(self):
+        self.events = []
+        self.contexts = []
+
+    def on_request_start(self, context):
+        self.events.append("start")
+
+    def on_first_token(self, context, chunk):
+        self.events.append("first_token")
+
+    def on_chunk(self, context, chunk):
+        self.events.append("chunk")
+
+    def on_success(self, context, response):
+        self.events.append("success")
+        self.contexts.append(context)
+
+    def on_error(self, context, error):
+        self.events.append(("error", type(error).__name__))
+        self.contexts.append(context)
+
+
+class Broken(CallbackHandler):
+    def on_request_start(self, context):
+        raise RuntimeError("handler bug")
+
+
+@pytest.fixture(autouse=True)
+def reset_callbacks():
+    clear_callbacks()
+    yield
+    clear_callbacks()
+
+
+def zhipu_client(create):
+    client = UnionLLM(provider="zhipuai", api_key="test-zhipu-key")
+    client.provider_instance.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return client
+
+
+def completion_body():
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "glm-4",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "hello"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 20, "total_tokens": 25},
+    })
+
+
+def stream_chunks():
+    chunks = []
+    for text in ["", "Hel", "lo"]:
+        chunks.append(FakeChunk({"id": "c1", "created": 1, "choices": [{"index": 0, "delta": {"role": "assistant", "content": text}}]}))
+    chunks.append(FakeChunk({"id": "c1", "created": 1, "choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}}))
+    return chunks
+
+
+def slow_iter(items, delay=0.005):
+    for item in items:
+        time.sleep(delay)
+        yield item
+
+
+def test_non_stream_timings_attached_without_callbacks():
+    def create(**kwargs):
+        time.sleep(0.02)
+        return completion_body()
+
+    response = zhipu_client(create).completion(model="glm-4", messages=[{"role": "user", "content": "hi"}])
+
+    timings = response._hidden_params["timings"]
+    assert timings["provider"] == "zhipuai" and timings["model"] == "glm-4"
+    assert timings["upstream"] >= 0.02
+    assert timings["total"] >= timings["ttfb"] >= timings["upstream"]
+    assert "preprocessing" in timings
+    assert timings["completion_tokens"] == 20
+    assert timings["tokens_per_second"] > 0
+
+
+def test_stream_hooks_fire_in_order_with_ttft_and_inter_token_latency():
+    recorder = Recorder()
+    register_callback(recorder)
+    client = zhipu_client(lambda **kwargs: slow_iter(stream_chunks()))
+
+    chunks = list(client.completion(model="glm-4", messages=[{"role": "user", "content": "hi"}], stream=True))
+
+    assert len(chunks) == 4
+    # 空内容的首个 chunk 不算首 token
+    assert recorder.events == ["start", "chunk", "first_token", "chunk", "chunk", "chunk", "success"]
+    timings = recorder.contexts[0].to_dict()
+    assert timings["ttft"] >= timings["ttfb"]
+    assert timings["inter_token_avg"] > 0
+    assert timings["total_tokens"] == 7
+    assert timings["chunks"] == 4
+
+
+def test_errors_reach_on_error_and_handler_bugs_are_swallowed():
+    recorder = Recorder()
+
+    def create(**kwargs):
+        raise RuntimeError("upstream down")
+
+    client = zhipu_client(create)
+    with pytest.raises(Exception):
+        client.completion(model="glm-4", messages=[{"role": "user", "content": "hi"}], callbacks=[Broken(), recorder])
+
+    assert recorder.events == ["start", ("error", "ZhiPuOpenAIError")]
+    assert "total" in recorder.contexts[0].timings
+
+
+def test_streams_are_not_wrapped_without_callbacks():
+    client = UnionLLM(provider="zhipuai", api_key="test-zhipu-key")
+    stream = iter([])
+    client.provider_instance = SimpleNamespace(completion=lambda model, messages, **kwargs: stream)
+
+    assert client.completion(model="glm-4", messages=[], stream=True) is stream
+
+
+def test_media_fetch_is_timed_into_the_call_context(monkeypatch):
+    def slow_get(url, **kwargs):
+        time.sleep(0.01)
+        return SimpleNamespace(content=b"img")
+
+    monkeypatch.setattr(requests, "get", slow_get)
+    deadline = Deadline()
+    deadline.context = CallContext()
+
+    media_get(deadline, "https://example.com/a.png", timeout=5)
+    media_get(deadline, "https://example.com/b.png", timeout=5)
+
+    assert deadline.context.timings["media_fetch"] >= 0.02
+
+
+def test_scheduler_queue_time_is_reported():
+    recorder = Recorder()
+    client = zhipu_client(lambda **kwargs: completion_body())
+    scheduler = RequestScheduler(provider_limits={"zhipuai": ProviderLimit(rate=20, burst=1)}, poll_interval=0.01)
+
+    scheduler.completion(client, "glm-4", [{"role": "user", "content": "a"}])
+    response = scheduler.completion(client, "glm-4", [{"role": "user", "content": "b"}], callbacks=[recorder])
+
+    assert response._hidden_params["timings"]["queue"] >= 0.03
+    assert recorder.contexts[0].timings["queue"] >= 0.03
@@ -0,0 +1,175 @@
+import json
+import time
+
+import pytest
+import requests
+
+from unionllm import cassette
+from unionllm.cassette import CassetteError, Interaction
+from unionllm.main import UnionLLM
+from unionllm.mock_server import DEFAULT_REPLY, MockConfig, MockProviderServer
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def stream_text(response):
+    text = ""
+    for chunk in response:
+        if chunk.choices:
+            text += getattr(chunk.choices[0].delta, "content", None) or ""
+    return text
+
+
+def run_calls(clients):
+    results = {}
+    for provider, (client, model) in clients.items():
+        response = client.completion(model=model, messages=MESSAGES)
+        streamed = None if provider == "xunfei" else stream_text(client.completion(model=model, messages=MESSAGES, stream=True))
+        results[provider] = (response.choices[0].message.content, response.usage.total_tokens, streamed)
+    return results
+
+
+def write_cassette(path, interactions):
+    recorder = cassette.Cassette(str(path), mode="record")
+    recorder.interactions = interactions
+    recorder.save()
+
+
+def test_record_then_replay_every_transport_without_network(tmp_path):
+    path = str(tmp_path / "session.json.gz")
+    server = MockProviderServer().start()
+    clients = {
+        "zhipuai": (server.client("zhipuai"), "glm-4"),                 # httpx (openai SDK)
+        "dify": (server.client("dify"), "dify-app"),                     # requests
+        "qwen": (server.client("qwen", model="qwen-plus"), "qwen-plus"),  # dashscope SDK over requests
+        "xunfei": (server.client("xunfei"), "generalv3.5"),              # websocket
+    }
+    try:
+        with cassette.use(path) as recorder:
+            recorded = run_calls(clients)
+        assert recorder.mode == "record" and len(recorder.interactions) == 7
+    finally:
+        server.stop()
+    requests_seen = sum(server.stats.values())
+
+    with cassette.use(path) as player:
+        replayed = run_calls(clients)
+
+    assert player.mode == "replay" and player.play_count == 7
+    assert replayed == recorded
+    assert recorded["zhipuai"] == (DEFAULT_REPLY, 25, DEFAULT_REPLY)
+    assert sum(server.stats.values()) == requests_seen
+
+
+def test_replay_with_original_or_compressed_timing(tmp_path):
+    path = str(tmp_path / "slow.json")
+    with MockProviderServer(MockConfig(ttft=0.3)) as server:
+        client = server.client("zhipuai")
+        with cassette.use(path, mode="record"):
+            stream_text(client.completion(model="glm-4", messages=MESSAGES, stream=True))
+
+    def replay(speed):
+        started = time.perf_counter()
+        with cassette.use(path, mode="replay", speed=speed):
+            assert stream_text(client.completion(model="glm-4", messages=MESSAGES, stream=True)) == DEFAULT_REPLY
+        return time.perf_counter() - started
+
+    assert replay(1.0) >= 0.25
+    assert replay(10) < 0.25
+    assert replay(None) < 0.25
+
+
+def test_replay_mode_never_reaches_the_network(tmp_path):
+    path = str(tmp_path / "empty.json")
+    write_cassette(path, [])
+
+    with cassette.use(path, mode="replay"):
+        with pytest.raises(CassetteError):
+            requests.get("http://127.0.0.1:9/never")
+
+    with pytest.raises(CassetteError):
+        cassette.use(str(tmp_path / "missing.json"), mode="replay")
+
+
+def test_credentials_are_redacted_and_repeats_are_opt_in(tmp_path):
+    path = str(tmp_path / "dify.json")
+    with MockProviderServer() as server:
+        client = server.client("dify")
+        with cassette.use(path):
+            client.completion(model="dify-app", messages=MESSAGES)
+
+    text = open(path, encoding="utf-8").read()
+    assert "mock-key" not in text and cassette.REDACTED in text
+
+    with cassette.use(path):
+        client.completion(model="dify-app", messages=MESSAGES)
+        with pytest.raises(Exception):
+            client.completion(model="dify-app", messages=MESSAGES)
+    with cassette.use(path, allow_repeats=True) as player:
+        for _ in range(3):
+            assert client.completion(model="dify-app", messages=MESSAGES).choices[0].message.content == DEFAULT_REPLY
+    assert player.play_count == 3
+
+
+def test_gemini_sdk_path_replays_a_cassette(tmp_path):
+    path = str(tmp_path / "gemini.json")
+    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash"
+    usage = {"promptTokenCount": 3, "candidatesTokenCount": 3, "totalTokenCount": 6}
+    full = {"candidates": [{"content": {"parts": [{"text": "Hello from Gemini"}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": usage}
+    events = [{"candidates": [{"content": {"parts": [{"text": word}], "role": "model"}, "index": 0}]} for word in ("Hello ", "from ", "Gemini")]
+    events[-1]["candidates"][0]["finishReason"] = "STOP"
+    events[-1]["usageMetadata"] = usage
+    write_cassette(path, [
+        Interaction("httpx", "POST", url + ":generateContent", status=200,
+                    response_headers=[["content-type", "application/json"]], chunks=[[0.0, json.dumps(full)]]),
+        Interaction("httpx", "POST", url + ":streamGenerateContent?alt=sse", status=200,
+                    response_headers=[["content-type", "text/event-stream"]],
+                    chunks=[[0.0, "data: " + json.dumps(event) + "\r\n\r\n"] for event in events]),
+    ])
+    client = UnionLLM(provider="gemini", api_key="test-key")
+
+    with cassette.use(path, mode="replay"):
+        response = client.completion(model="gemini-2.0-flash", messages=MESSAGES)
+        streamed = stream_text(client.completion(model="gemini-2.0-flash", messages=MESSAGES, stream=True))
+
+    assert response.choices[0].message.content == "Hello from Gemini"
+    assert response.usage.total_tokens == 6
+    assert streamed == "Hello from Gemini"
+
+
+def test_azure_anthropic_sdk_path_replays_a_cassette(tmp_path):
+    pytest.importorskip("anthropic")
+    pytest.importorskip("azure.identity")
+    path = str(tmp_path / "azure.json")
+    base = "https://example.services.ai.azure.com/anthropic"
+    message = {"id": "msg_1", "type": "message", "role": "assistant", "model": "claude-sonnet-4-5",
+               "content": [{"type": "text", "text": "Hello from Claude"}], "stop_reason": "end_turn",
+               "stop_sequence": None, "usage": {"input_tokens": 5, "output_tokens": 3}}
+
+    def event(data):
+        return [0.0, f"event: {data['type']}\ndata: {json.dumps(data)}\n\n"]
+
+    events = [event({"type": "message_start", "message": dict(message, content=[], stop_reason=None, usage={"input_tokens": 5, "output_tokens": 1})}),
+              event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})]
+    events += [event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word}})
+               for word in ("Hello ", "from ", "Claude")]
+    events += [event({"type": "content_block_stop", "index": 0}),
+               event({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 3}}),
+               event({"type": "message_stop"})]
+    write_cassette(path, [
+        Interaction("httpx", "POST", base + "/v1/messages", status=200,
+                    response_headers=[["content-type", "application/json"]], chunks=[[0.0, json.dumps(message)]]),
+        Interaction("httpx", "POST", base + "/v1/messages", status=200,
+                    response_headers=[["content-type", "text/event-stream"]], chunks=events),
+    ])
+    client = UnionLLM(provider="azure", model="claude-sonnet-4-5", api_key="test-key", api_base=base)
+
+    with cassette.use(path, mode="replay"):
+        response = client.completion(model="claude-sonnet-4-5", messages=MESSAGES, max_tokens=256)
+        chunks = list(client.completion(model="claude-sonnet-4-5", messages=MESSAGES, max_tokens=256, stream=True))
+
+    assert response.choices[0].message.content == "Hello from Claude"
+    assert (response.usage.prompt_tokens, response.usage.completion_tokens) == (5, 3)
+    assert stream_text(chunks) == "Hello from Claude"
+    assert any(chunk.usage.get("prompt_tokens") == 5 and chunk.usage.get("completion_tokens") == 3 for chunk in chunks)
@@ -0,0 +1,129 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from unionllm import UnionLLM, cost
+from unionllm.callbacks import clear_callbacks
+from unionllm.exceptions import BudgetExceededError
+from unionllm.scheduler import RequestScheduler
+from unionllm.utils import Usage
+
+
+@pytest.fixture(autouse=True)
+def reset_callbacks():
+    clear_callbacks()
+    yield
+    clear_callbacks()
+
+
+def zhipu_client(create):
+    client = UnionLLM(provider="zhipuai", api_key="test-zhipu-key")
+    client.provider_instance.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return client
+
+
+def completion_body():
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "glm-4-0520",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "hello"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500,
+                  "prompt_tokens_details": {"cached_tokens": 400}},
+    })
+
+
+def test_normalize_usage_across_provider_conventions():
+    anthropic = Usage(prompt_tokens=100, completion_tokens=10)
+    anthropic.cache_read_input_tokens = 900
+    anthropic.cache_creation_input_tokens = 50
+    assert cost.normalize_usage(anthropic) == {
+        "prompt_tokens": 1050, "completion_tokens": 10, "total_tokens": 1060, "cached_prompt_tokens": 900,
+        "cache_creation_tokens": 50, "reasoning_tokens": 0, "image_prompt_tokens": 0,
+    }
+
+    gemini = Usage(prompt_tokens=300, completion_tokens=80, total_tokens=380)
+    gemini.thought_tokens = 60
+    gemini.image_prompt_tokens = 258
+    normalized = cost.normalize_usage(gemini)
+    assert normalized["reasoning_tokens"] == 60 and normalized["image_prompt_tokens"] == 258
+
+    dify = {"prompt_tokens": 5, "completion_tokens": 5, "total_tokens": 10, "total_cost": "0.0003", "cost_unit": "USD"}
+    assert cost.normalize_usage(dify)["provider_cost"] == pytest.approx(0.0003)
+
+
+def test_price_applies_cached_and_reasoning_rates():
+    price = cost.ModelPrice(input=2.0, cached_input=0.5, output=8.0, reasoning=16.0)
+    usage = {"prompt_tokens": 1_000_000, "completion_tokens": 300_000,
+             "prompt_tokens_details": {"cached_tokens": 600_000}, "completion_tokens_details": {"reasoning_tokens": 100_000}}
+
+    result = price.cost(cost.normalize_usage(usage))
+
+    assert result["input_cost"] == pytest.approx(0.8)
+    assert result["cached_input_cost"] == pytest.approx(0.3)
+    assert result["output_cost"] == pytest.approx(1.6)
+    assert result["reasoning_cost"] == pytest.approx(1.6)
+    assert result["cost"] == pytest.approx(4.3)
+
+
+def test_price_table_lookup_order_and_provider_cost_fallback(tmp_path):
+    path = tmp_path / "prices.json"
+    path.write_text(json.dumps({
+        "zhipuai/glm-4*": {"input": 1, "output": 1, "currency": "CNY"},
+        "zhipuai/glm-4-plus*": {"input": 5, "output": 5, "currency": "CNY"},
+        "glm-4-air": {"input": 0.5, "output": 0.5},
+    }))
+    table = cost.PriceTable.load(str(path), litellm_fallback=False)
+
+    assert table.lookup("zhipuai", "glm-4-plus-0111").input == 5
+    assert table.lookup("zhipuai", "glm-4-flash").input == 1
+    assert table.lookup("zhipuai", "glm-4-air").input == 0.5
+    assert table.lookup("dify", "app") is None
+
+    usage = {"prompt_tokens": 5, "completion_tokens": 5, "total_cost": 0.02, "cost_unit": "RMB"}
+    assert cost.compute_cost(usage, "dify", "app", table) == {"cost": 0.02, "currency": "RMB", "source": "provider"}
+
+
+def test_responses_get_cost_and_aggregator_rolls_up_by_tenant():
+    table = cost.PriceTable({"zhipuai/glm-4": {"input": 1.0, "cached_input": 0.25, "output": 2.0}}, litellm_fallback=False)
+    flushed = []
+    aggregator = cost.UsageAggregator(group_by=("tenant",), sink=flushed.extend, budgets={("acme",): 0.004})
+    handler = cost.enable(table, aggregator)
+    client = zhipu_client(lambda **kwargs: completion_body())
+    messages = [{"role": "user", "content": "hi"}]
+
+    response = client.completion(model="glm-4", messages=messages, tags={"tenant": "acme"})
+    RequestScheduler().completion(client, "glm-4", messages, tenant="acme")
+    client.completion(model="glm-4", messages=messages, tags={"tenant": "other"})
+    cost.disable(handler)
+
+    # (600 * 1.0 + 400 * 0.25 + 500 * 2.0) / 1e6
+    assert response._hidden_params["cost"]["cost"] == pytest.approx(0.0017)
+    assert aggregator.spent({"tenant": "acme"}) == pytest.approx(0.0034)
+    assert aggregator.remaining({"tenant": "acme"}) == pytest.approx(0.0006)
+    aggregator.check_budget({"tenant": "acme"})
+
+    rows = {row["tenant"]: row for row in aggregator.flush()}
+    assert rows["acme"]["requests"] == 2
+    assert rows["acme"]["cached_prompt_tokens"] == 800
+    assert rows["other"]["completion_tokens"] == 500
+    assert flushed and aggregator.flush() == []
+
+    aggregator.record({"tenant": "acme"}, cost={"cost": 0.001})
+    with pytest.raises(BudgetExceededError):
+        aggregator.check_budget({"tenant": "acme"})
+
+
+def test_periodic_flush_and_litellm_fallback():
+    flushed = []
+    aggregator = cost.UsageAggregator(sink=flushed.extend, flush_interval=0.01).start()
+    aggregator.record({"tenant": "a"}, {"prompt_tokens": 1, "completion_tokens": 1}, {"cost": 0.5})
+    aggregator.close()
+    assert flushed == [{"tenant": "a", "requests": 1, "errors": 0, "prompt_tokens": 1, "completion_tokens": 1,
+                        "cached_prompt_tokens": 0, "reasoning_tokens": 0, "cost": 0.5}]
+
+    price = cost.PriceTable().lookup("openai", "gpt-4o")
+    assert price is not None and price.output > price.input > 0
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+import requests
+
+from unionllm.exceptions import Timeout
+from unionllm.providers.minimax import MinimaxAIProvider
+from unionllm.providers.zhipu import ZhipuAIProvider
+from unionllm.utils import Deadline, raise_if_timeout
+
+
+class DummyCompletions:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"ok": True}
+
+
+class DummyChat:
+    def __init__(self):
+        self.completions = DummyCompletions()
+
+
+class DummyClient:
+    def __init__(self):
+        self.chat = DummyChat()
+
+
+def test_unbounded_deadline_keeps_transport_defaults():
+    deadline = Deadline()
+
+    assert deadline.remaining() is None
+    assert deadline.requests_timeout(default=30) == 30
+    assert deadline.sdk_kwargs() == {}
+
+
+def test_requests_timeout_is_clipped_to_remaining_budget():
+    deadline = Deadline(timeout=5)
+
+    connect, read = deadline.requests_timeout(default=30)
+    assert 4 < read <= 5
+    assert connect == read
+    assert deadline.requests_timeout(default=2) == (2, 2)
+
+
+def test_tuple_timeout_sets_connect_timeout():
+    deadline = Deadline(timeout=(1, 10))
+
+    connect, read = deadline.requests_timeout()
+    assert connect == 1
+    assert 9 < read <= 10
+
+
+def test_absolute_deadline_wins_when_earlier():
+    deadline = Deadline(timeout=60, deadline=time.time() + 2)
+
+    assert deadline.remaining() <= 2
+
+
+def test_expired_deadline_raises_timeout():
+    deadline = Deadline(deadline=time.time() - 1)
+
+    assert deadline.expired()
+    with pytest.raises(Timeout) as excinfo:
+        deadline.requests_timeout(model="abab6.5", llm_provider="minimax")
+    assert excinfo.value.llm_provider == "minimax"
+    assert "Deadline exceeded" in excinfo.value.message
+
+
+def test_from_kwargs_pops_timeout_and_deadline():
+    kwargs = {"timeout": 3, "deadline": time.time() + 10, "temperature": 0.1}
+
+    deadline = Deadline.from_kwargs(kwargs)
+
+    assert kwargs == {"temperature": 0.1}
+    assert deadline.remaining() <= 3
+    assert Deadline.from_kwargs({"deadline": deadline}) is deadline
+
+
+def test_raise_if_timeout_unwraps_provider_errors():
+    class WrappedError(Exception):
+        pass
+
+    def call():
+        try:
+            raise requests.exceptions.ReadTimeout("read timed out")
+        except Exception as e:
+            raise WrappedError(str(e))
+
+    with pytest.raises(WrappedError) as excinfo:
+        call()
+    with pytest.raises(Timeout):
+        raise_if_timeout(excinfo.value, llm_provider="dify")
+
+    raise_if_timeout(ValueError("not a timeout"))
+
+
+def test_zhipu_passes_remaining_budget_to_sdk():
+    provider = ZhipuAIProvider(api_key="test-zhipu-key")
+    provider.client = DummyClient()
+    provider.create_model_response_wrapper = lambda result, model: result
+
+    provider.completion(
+        model="glm-5.1",
+        messages=[{"role": "user", "content": "你好"}],
+        timeout=10,
+    )
+
+    call = provider.client.chat.completions.calls[0]
+    assert 9 < call["timeout"] <= 10
+
+
+def test_minimax_request_gets_timeout_and_read_timeout_is_converted(monkeypatch):
+    provider = MinimaxAIProvider(api_key="test-minimax-key")
+    seen = {}
+
+    def fake_post(url, headers=None, data=None, timeout=None, **kwargs):
+        seen["timeout"] = timeout
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    monkeypatch.setattr(requests, "post", fake_post)
+
+    with pytest.raises(Timeout) as excinfo:
+        provider.completion(
+            model="abab6.5-chat",
+            messages=[{"role": "user", "content": "hi"}],
+            timeout=(1, 8),
+        )
+
+    connect, read = seen["timeout"]
+    assert connect == 1
+    assert 7 < read <= 8
+    assert excinfo.value.llm_provider == "minimax"
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from unionllm import UnionLLM
+from unionllm.utils import (
+    Choices,
+    Delta,
+    Message,
+    ModelResponse,
+    StreamAccumulator,
+    StreamingChoices,
+    Usage,
+    call_context,
+)
+
+
+class FakeProvider:
+    supports_n = False
+
+    def __init__(self, fail_on=None):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.fail_on = fail_on
+
+    def completion(self, model, messages, **kwargs):
+        with self.lock:
+            call = len(self.calls)
+            self.calls.append(kwargs)
+        # 模拟 check_prompt 计入预处理耗时
+        call_context(kwargs["deadline"]).add("preprocessing", 0.5)
+        if call == self.fail_on:
+            raise RuntimeError("branch failed")
+        if kwargs.get("stream"):
+            return self.stream(call)
+        usage = Usage(prompt_tokens=10, completion_tokens=call + 1, total_tokens=11 + call)
+        usage.prompt_tokens_details = {"cached_tokens": 4}
+        return ModelResponse(
+            id=f"resp-{call}",
+            choices=[Choices(index=0, message=Message(content=f"sample {call}"), finish_reason="stop")],
+            usage=usage,
+        )
+
+    def stream(self, call):
+        # 与 dify/coze 一样用 chunk 序号作为 index
+        for i, text in enumerate(["a", "b", "c"]):
+            time.sleep(0.001)
+            yield ModelResponse(id="s", choices=[StreamingChoices(index=str(i), delta=Delta(content=f"{text}{call}"))], stream=True)
+        yield ModelResponse(
+            id="s",
+            choices=[StreamingChoices(index="3", delta=Delta(), finish_reason="stop")],
+            stream=True,
+            usage=Usage(prompt_tokens=5, completion_tokens=3, total_tokens=8),
+        )
+
+
+def make_client(provider):
+    client = UnionLLM(provider="moonshot", api_key="test-moonshot-key")
+    client.provider_instance = provider
+    return client
+
+
+def test_non_stream_fan_out_merges_choices_and_sums_usage():
+    provider = FakeProvider()
+    client = make_client(provider)
+
+    response = client.completion("m", [{"role": "user", "content": "hi"}], n=3, timeout=30)
+
+    assert len(provider.calls) == 3
+    assert all("n" not in kwargs for kwargs in provider.calls)
+    # 各分支共享同一预算，但预处理耗时只计一次
+    assert len({kwargs["deadline"].expires_at for kwargs in provider.calls}) == 1
+    assert response._hidden_params["timings"]["preprocessing"] == 0.5
+    assert [c.index for c in response.choices] == [0, 1, 2]
+    assert sorted(c.message.content for c in response.choices) == ["sample 0", "sample 1", "sample 2"]
+    assert response.usage.prompt_tokens == 30
+    assert response.usage.completion_tokens == 6
+    assert response.usage.total_tokens == 36
+    assert response.usage.prompt_tokens_details == {"cached_tokens": 12}
+
+
+def test_stream_fan_out_multiplexes_by_choice_index():
+    client = make_client(FakeProvider())
+
+    chunks = list(client.completion("m", [{"role": "user", "content": "hi"}], n=3, stream=True))
+
+    content_chunks = [c for c in chunks if c.choices]
+    assert sorted({c.choices[0].index for c in content_chunks}) == [0, 1, 2]
+    assert all(not c.usage.model_dump() for c in content_chunks)
+    final = chunks[-1]
+    assert final.choices == [] and final.usage.total_tokens == 24
+
+    acc = StreamAccumulator(n=3)
+    for chunk in chunks:
+        acc.add(chunk)
+    response = acc.build()
+    assert len(response.choices) == 3
+    assert all(len(c.message.content) == 6 for c in response.choices)
+    for choice in response.choices:
+        call = choice.message.content[1]
+        assert choice.message.content == f"a{call}b{call}c{call}"
+
+
+def test_branch_error_fails_the_whole_call():
+    client = make_client(FakeProvider(fail_on=1))
+
+    with pytest.raises(RuntimeError, match="branch failed"):
+        client.completion("m", [{"role": "user", "content": "hi"}], n=2)
+
+    client = make_client(FakeProvider(fail_on=1))
+    with pytest.raises(RuntimeError, match="branch failed"):
+        list(client.completion("m", [{"role": "user", "content": "hi"}], n=2, stream=True))
+
+
+def test_providers_with_native_n_get_a_single_request():
+    provider = FakeProvider()
+    provider.supports_n = True
+    client = make_client(provider)
+
+    client.completion("m", [{"role": "user", "content": "hi"}], n=3)
+
+    assert len(provider.calls) == 1
+    assert provider.calls[0]["n"] == 3
+
+
+def test_closing_multiplexed_stream_cancels_branches():
+    client = make_client(FakeProvider())
+
+    provider = FakeProvider()
+    client = make_client(provider)
+
+    stream = client.completion("m", [{"role": "user", "content": "hi"}], n=2, stream=True, timeout=30)
+    next(stream)
+    stream.close()
+
+    with pytest.raises(StopIteration):
+        next(stream)
+    assert all(kwargs["deadline"].cancelled for kwargs in provider.calls)
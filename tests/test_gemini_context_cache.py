@@ -0,0 +1,153 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from unionllm.main import UnionLLM
+from unionllm.providers import gemini
+
+SYSTEM = "Answer strictly from the attached handbook. " * 200
+DOCUMENT = "Handbook section. " * 400
+
+
+class DummyCaches:
+    def __init__(self, fail=False, delay=0):
+        self.fail = fail
+        self.delay = delay
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    def create(self, model, config):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("content too small")
+        self.created.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+    def update(self, name, config):
+        self.updated.append((name, config.ttl))
+
+
+class DummyModels:
+    def __init__(self):
+        self.calls = []
+
+    def generate_content_stream(self, model, contents, config):
+        self.calls.append((contents, config))
+        return iter([])
+
+    def generate_content(self, model, contents, config):
+        self.calls.append((contents, config))
+        return response()
+
+
+def response(cached=0):
+    part = SimpleNamespace(text="ok", inline_data=None, thought_signature=None)
+    usage = SimpleNamespace(prompt_token_count=2000, candidates_token_count=5, total_token_count=2005,
+                            thoughts_token_count=0, cached_content_token_count=cached)
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))], usage_metadata=usage)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    gemini.context_cache_registry.clear()
+    provider = UnionLLM(provider="gemini", api_key="k").provider_instance
+    monkeypatch.setattr(provider, "client", SimpleNamespace(models=DummyModels(), caches=DummyCaches()))
+    yield provider
+    gemini.context_cache_registry.clear()
+
+
+def conversation(turns):
+    messages = [{"role": "system", "content": SYSTEM}, {"role": "user", "content": DOCUMENT}]
+    for i in range(turns):
+        messages += [{"role": "assistant", "content": f"a{i}"}, {"role": "user", "content": f"q{i}"}]
+    return messages
+
+
+def stream(provider, messages, **kwargs):
+    list(provider.post_stream_processing_wrapper("gemini-2.5-flash", messages, **kwargs))
+    return provider.client.models.calls[-1]
+
+
+def test_stable_prefix_is_cached_once_and_referenced(provider):
+    stream(provider, conversation(1), context_cache=True)
+    contents, config = stream(provider, conversation(2), context_cache=True)
+
+    caches = provider.client.caches
+    assert len(caches.created) == 1
+    created = caches.created[0]
+    assert created.system_instruction == SYSTEM and created.ttl == "3600s"
+    assert [c.parts[0].text for c in created.contents] == [DOCUMENT]
+    assert config.cached_content == "cachedContents/1" and config.system_instruction is None
+    assert [c.parts[0].text for c in contents] == ["a0", "q0", "a1", "q1"]
+
+
+def test_cache_is_refreshed_before_expiry_and_recreated_after(provider, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(gemini.time, "time", lambda: now[0])
+    messages = conversation(1)
+
+    stream(provider, messages, context_cache=True, context_cache_ttl=600)
+    now[0] += 400
+    stream(provider, messages, context_cache=True, context_cache_ttl=600)
+    assert provider.client.caches.updated == [("cachedContents/1", "600s")]
+    now[0] += 2000
+    stream(provider, messages, context_cache=True, context_cache_ttl=600)
+
+    assert len(provider.client.caches.created) == 2
+    assert provider.client.models.calls[-1][1].cached_content == "cachedContents/2"
+
+
+def test_small_prefixes_and_failures_fall_back_to_plain_requests(provider):
+    contents, config = stream(provider, [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}], context_cache=True)
+    assert not provider.client.caches.created and config.system_instruction == "be brief"
+
+    provider.client.caches.fail = True
+    stream(provider, conversation(1), context_cache=True)
+    contents, config = stream(provider, conversation(1), context_cache=True)
+    assert config.cached_content is None and config.system_instruction == SYSTEM and len(contents) == 3
+    assert gemini.context_cache_registry.stats["failures"] == 1
+
+    stream(provider, conversation(1))
+    assert gemini.context_cache_registry.stats["failures"] == 1
+
+
+def test_concurrent_first_requests_create_the_cache_once(provider):
+    provider.client.caches.delay = 0.1
+    hits = gemini.context_cache_registry.stats["hits"]
+    threads = [threading.Thread(target=stream, args=(provider, conversation(1)), kwargs={"context_cache": True}) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(provider.client.caches.created) == 1
+    assert all(config.cached_content == "cachedContents/1" for _, config in provider.client.models.calls)
+    assert gemini.context_cache_registry.stats["hits"] - hits == 4
+
+
+def test_evicted_caches_are_deleted_on_the_server(provider, monkeypatch):
+    monkeypatch.setattr(gemini.context_cache_registry, "maxsize", 1)
+
+    stream(provider, conversation(1), context_cache=True)
+    stream(provider, [{"role": "system", "content": SYSTEM + "v2"}, {"role": "user", "content": DOCUMENT}, {"role": "user", "content": "q"}], context_cache=True)
+
+    assert provider.client.caches.deleted == ["cachedContents/1"]
+    assert len(gemini.context_cache_registry) == 1
+
+
+def test_non_stream_caches_system_instruction_and_reports_cached_tokens(provider):
+    provider.client.models.generate_content = lambda model, contents, config: (
+        provider.client.models.calls.append((contents, config)) or response(cached=1800))
+
+    result = provider.completion(model="gemini-2.5-flash", messages=[{"role": "user", "content": "hi"}],
+                                 system_instruction=SYSTEM, context_cache=True)
+
+    contents, config = provider.client.models.calls[-1]
+    assert contents == "hi" and config.cached_content == "cachedContents/1"
+    assert result.usage.cached_tokens == 1800
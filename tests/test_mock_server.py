@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+from unionllm.mock_server import DEFAULT_REPLY, MockConfig, MockProviderServer
+
+PROVIDERS = [
+    ("zhipuai", "glm-4"),
+    ("moonshot", "moonshot-v1-8k"),
+    ("deepseek", "deepseek-chat"),
+    ("baichuan", "Baichuan4"),
+    ("minimax", "abab6.5s-chat"),
+    ("xunfei_http", "generalv3.5"),
+    ("dify", "dify-app"),
+    ("coze", "coze-bot"),
+    ("tiangong", "SkyChat-MegaVerse"),
+    ("wenxin", "ERNIE-4.0"),
+    ("qwen", "qwen-plus"),
+]
+
+
+@pytest.fixture(scope="module")
+def server():
+    with MockProviderServer() as server:
+        yield server
+
+
+@pytest.fixture(autouse=True)
+def reset(server):
+    server.reset()
+    yield
+
+
+def messages():
+    return [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}]
+
+
+def stream_text(response):
+    text = ""
+    for chunk in response:
+        for choice in chunk.choices:
+            text += getattr(choice.delta, "content", None) or ""
+    return text
+
+
+@pytest.mark.parametrize("provider,model", PROVIDERS)
+def test_every_provider_round_trips_through_its_wire_protocol(server, provider, model):
+    client = server.client(provider, model=model)
+
+    response = client.completion(model=model, messages=messages())
+    assert response.choices[0].message.content == DEFAULT_REPLY
+    assert response.usage.total_tokens > 0
+
+    assert stream_text(client.completion(model=model, messages=messages(), stream=True)) == DEFAULT_REPLY
+
+
+def test_xunfei_websocket_with_signed_url(server):
+    response = server.client("xunfei").completion(model="generalv3.5", messages=messages())
+
+    assert response.choices[0].message.content == DEFAULT_REPLY
+    assert response.usage.completion_tokens == len(MockConfig().tokens())
+    assert server.stats["xunfei"] == 1
+
+
+def test_signatures_are_verified(server):
+    with pytest.raises(Exception) as tiangong_error:
+        server.client("tiangong", app_secret="wrong").completion(model="SkyChat", messages=messages())
+    assert getattr(tiangong_error.value, "status_code", None) == 401
+
+    with pytest.raises(Exception):
+        server.client("xunfei", api_secret="wrong").completion(model="generalv3.5", messages=messages())
+    assert server.stats["xunfei"] == 1 and server.stats["tiangong"] == 1
+
+
+def test_ttft_and_token_rate_shape_the_stream(server):
+    server.configure(ttft=0.1, tokens_per_second=100, completion_tokens=10)
+    started = time.perf_counter()
+    arrivals = []
+    for chunk in server.client("zhipuai").completion(model="glm-4", messages=messages(), stream=True):
+        if chunk.choices and getattr(chunk.choices[0].delta, "content", None):
+            arrivals.append(time.perf_counter() - started)
+
+    assert len(arrivals) == 10
+    assert arrivals[0] >= 0.1
+    assert arrivals[-1] - arrivals[0] >= 0.08
+
+
+def test_error_injection_per_protocol(server):
+    server.configure("dashscope", error_rate=1.0, error_status=429)
+
+    with pytest.raises(Exception) as error:
+        server.client("qwen", model="qwen-plus").completion(model="qwen-plus", messages=messages())
+    assert getattr(error.value, "status_code", None) == 429
+    # 其它协议不受影响
+    assert server.client("dify").completion(model="app", messages=messages()).choices[0].message.content == DEFAULT_REPLY
+
+
+def test_disconnect_mid_stream_surfaces_an_error(server):
+    server.configure("openai", disconnect_after=3)
+
+    chunks = []
+    with pytest.raises(Exception):
+        for chunk in server.client("moonshot").completion(model="moonshot-v1-8k", messages=messages(), stream=True):
+            chunks.append(chunk)
+    assert 1 <= len(chunks) <= 5
@@ -0,0 +1,106 @@
+import copy
+
+from unionllm.providers.base_provider import BaseProvider
+from unionllm.providers.coze import CozeAIProvider
+from unionllm.providers.tiangong import TianGongAIProvider
+from unionllm.utils import normalize_messages, reformat_object_content
+
+IMAGE = {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}}
+
+
+class DummyProvider(BaseProvider):
+    def __init__(self):
+        pass
+
+    def completion(self, model, messages):
+        pass
+
+
+def history():
+    return [
+        {"role": "system", "content": "be brief"},
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+        {"role": "user", "content": [{"type": "text", "text": "plain parts"}]},
+        {"role": "user", "content": [{"type": "text", "text": "look"}, IMAGE]},
+    ]
+
+
+def test_text_only_history_is_passed_through_untouched():
+    messages = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+
+    result = DummyProvider().check_prompt("coze", "bot", messages)
+
+    assert result["pass_check"] and result["reformatted"] == 0
+    assert result["messages"] is messages
+
+
+def test_only_messages_that_change_are_copied():
+    messages = history()
+    original = copy.deepcopy(messages)
+
+    result = normalize_messages("coze", "bot", messages)
+
+    assert result["pass_check"] and result["reformatted"] == 1
+    assert result["multimodal_info"]["has_vision_input"]
+    normalized = result["messages"]
+    assert normalized is not messages
+    assert all(normalized[i] is messages[i] for i in range(4))
+    assert normalized[4]["content"] == [{"type": "text", "text": "look![image](data:image/png;base64,AAAA)"}]
+    assert messages == original
+
+
+def test_full_support_keeps_the_list_and_every_message():
+    messages = history()
+
+    result = normalize_messages("zhipuai", "glm-4v", messages)
+
+    assert result["messages"] is messages
+
+
+def test_image_only_message_keeps_its_link_when_converted_to_text():
+    messages = [{"role": "user", "content": [IMAGE]}]
+
+    result = normalize_messages("coze", "bot", messages)
+
+    assert result["messages"][0]["content"] == [{"type": "text", "text": "![image](data:image/png;base64,AAAA)"}]
+
+
+def test_invalid_parts_fail_the_check():
+    assert normalize_messages("zhipuai", "glm-4", [{"role": "user", "content": ["bare"]}])["reason"] == "Invalid message format"
+    missing_url = [{"role": "user", "content": [{"type": "text", "text": "x"}, {"type": "image_url", "image_url": {}}]}]
+    assert normalize_messages("coze", "bot", missing_url)["pass_check"] is False
+    assert normalize_messages("minimax", "abab", [{"role": "user", "content": [IMAGE]}])["reason"] == "Object content is not supported"
+
+
+def test_reformat_object_content_reuses_unchanged_messages():
+    messages = history()
+
+    formatted = reformat_object_content(messages, True)
+
+    assert all(a is b for a, b in zip(formatted, messages))
+
+
+def test_provider_conversions_do_not_mutate_caller_messages():
+    messages = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}, {"role": "user", "content": "q2"}]
+    original = copy.deepcopy(messages)
+
+    formatted = TianGongAIProvider.to_formatted_prompt(None, messages)
+    history_messages, query = CozeAIProvider.to_formatted_prompt(None, messages)
+
+    assert formatted[1]["role"] == "bot"
+    assert history_messages[1]["type"] == "answer" and query == "q2"
+    assert messages == original
+
+
+def test_coze_completion_does_not_mutate_caller_messages(monkeypatch):
+    provider = CozeAIProvider(api_key="k", bot_id="b")
+    sent = []
+    monkeypatch.setattr(provider, "post_stream_processing_wrapper", lambda model, messages, **kwargs: sent.append(messages))
+    messages = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}, {"role": "user", "content": "q2"}]
+    original = copy.deepcopy(messages)
+
+    provider.completion("bot", messages, stream=True)
+
+    assert all(message["content_type"] == "text" for message in sent[0])
+    assert messages == original
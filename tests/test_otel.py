@@ -0,0 +1,123 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("opentelemetry.sdk")
+
+from openai.types.chat import ChatCompletion
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import StatusCode
+
+from unionllm import UnionLLM, otel
+from unionllm.callbacks import clear_callbacks
+
+
+class FakeChunk:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def telemetry():
+    clear_callbacks()
+    exporter = InMemorySpanExporter()
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(SimpleSpanProcessor(exporter))
+    reader = InMemoryMetricReader()
+    meter_provider = MeterProvider(metric_readers=[reader])
+    handler = otel.instrument(tracer_provider=tracer_provider, meter_provider=meter_provider)
+    yield exporter, reader
+    otel.uninstrument(handler)
+    clear_callbacks()
+
+
+def zhipu_client(create):
+    client = UnionLLM(provider="zhipuai", api_key="test-zhipu-key")
+    client.provider_instance.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return client
+
+
+def completion_body():
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "glm-4",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "hello"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 20, "total_tokens": 25},
+    })
+
+
+def metric_points(reader):
+    points = {}
+    for resource_metrics in reader.get_metrics_data().resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                points[metric.name] = list(metric.data.data_points)
+    return points
+
+
+def test_completion_span_has_phase_children_and_metrics(telemetry):
+    exporter, reader = telemetry
+
+    def create(**kwargs):
+        time.sleep(0.01)
+        return completion_body()
+
+    zhipu_client(create).completion(model="glm-4", messages=[{"role": "user", "content": "hi"}])
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    root = spans["unionllm.completion"]
+    assert root.attributes["gen_ai.system"] == "zhipuai"
+    assert root.attributes["gen_ai.request.model"] == "glm-4"
+    assert root.attributes["gen_ai.usage.output_tokens"] == 20
+    for name in ("unionllm.normalize_messages", "unionllm.upstream"):
+        child = spans[name]
+        assert child.parent.span_id == root.context.span_id
+        assert root.start_time <= child.start_time <= child.end_time <= root.end_time
+    assert spans["unionllm.upstream"].end_time - spans["unionllm.upstream"].start_time >= 10_000_000
+
+    points = metric_points(reader)
+    (duration,) = points["unionllm.request.duration"]
+    assert duration.count == 1
+    assert dict(duration.attributes) == {"provider": "zhipuai", "model": "glm-4"}
+    tokens = {p.attributes["token_type"]: p.value for p in points["unionllm.tokens"]}
+    assert tokens == {"prompt": 5, "completion": 20}
+    assert "unionllm.errors" not in points
+
+
+def test_stream_records_ttft_and_stream_span(telemetry):
+    exporter, reader = telemetry
+    chunks = [FakeChunk({"id": "c1", "created": 1, "choices": [{"index": 0, "delta": {"content": t}}]}) for t in ["Hel", "lo"]]
+
+    list(zhipu_client(lambda **kwargs: iter(chunks)).completion(model="glm-4", messages=[{"role": "user", "content": "hi"}], stream=True))
+
+    names = [span.name for span in exporter.get_finished_spans()]
+    assert "unionllm.stream" in names and names[-1] == "unionllm.completion"
+    (ttft,) = metric_points(reader)["unionllm.request.time_to_first_token"]
+    assert ttft.count == 1
+
+
+def test_errors_mark_span_and_count(telemetry):
+    exporter, reader = telemetry
+
+    def create(**kwargs):
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(Exception):
+        zhipu_client(create).completion(model="glm-4", messages=[{"role": "user", "content": "hi"}])
+
+    (root,) = [span for span in exporter.get_finished_spans() if span.name == "unionllm.completion"]
+    assert root.status.status_code == StatusCode.ERROR
+    assert root.attributes["error.type"] == "ZhiPuOpenAIError"
+    (error,) = metric_points(reader)["unionllm.errors"]
+    assert error.value == 1
+    assert error.attributes["error_type"] == "ZhiPuOpenAIError"
@@ -0,0 +1,181 @@
+import copy
+
+import pytest
+
+from unionllm import prefix_cache, utils
+from unionllm.main import UnionLLM
+from unionllm.prefix_cache import PrefixCache
+from unionllm.providers import gemini
+from unionllm.utils import normalize_messages
+
+IMAGE = {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}}
+
+
+@pytest.fixture
+def cache():
+    yield prefix_cache.enable()
+    prefix_cache.disable()
+
+
+def pdf_turn(i):
+    return {"role": "user", "content": [{"type": "text", "text": f"q{i}"},
+                                        {"type": "file_url", "file_url": {"url": f"https://example.com/{i}.pdf"}}]}
+
+
+def turns(n):
+    messages = [{"role": "system", "content": "be brief"}]
+    for i in range(n):
+        messages.append(pdf_turn(i))
+        messages.append({"role": "assistant", "content": f"a{i}"})
+    return messages
+
+
+class Counter:
+    def __init__(self):
+        self.seen = []
+
+    def __call__(self, message):
+        self.seen.append(message["content"])
+        return {"converted": message["content"]}
+
+
+def test_only_appended_messages_are_converted():
+    cache, convert = PrefixCache(), Counter()
+    first = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}]
+
+    assert cache.convert("ns", first, convert) == [{"converted": "q1"}, {"converted": "a1"}]
+    second = copy.deepcopy(first) + [{"role": "user", "content": "q2"}]
+    assert [item["converted"] for item in cache.convert("ns", second, convert)] == ["q1", "a1", "q2"]
+
+    assert convert.seen == ["q1", "a1", "q2"]
+    assert cache.stats["reused"] == 2 and cache.stats["converted"] == 3
+
+
+def test_edited_history_and_namespaces_do_not_share_results():
+    cache, convert = PrefixCache(), Counter()
+    question = {"role": "user", "content": "q1"}
+    cache.convert("ns", [question], convert)
+    cache.convert("ns", [question, {"role": "assistant", "content": "a1"}, {"role": "user", "content": "q2"}], convert)
+
+    # 改写历史后从最近一次缓存的前缀之后重新转换
+    edited = [question, {"role": "assistant", "content": "a1 edited"}, {"role": "user", "content": "q2"}]
+    cache.convert("ns", edited, convert)
+    cache.convert("other", [question], convert)
+    # 类型不同的值不视为同一条消息
+    cache.convert("ns", [{"role": "user", "content": "q1", "n": True}], convert)
+    cache.convert("ns", [{"role": "user", "content": "q1", "n": 1}], convert)
+
+    assert convert.seen == ["q1", "a1", "q2", "a1 edited", "q2", "q1", "q1", "q1"]
+
+
+def test_failed_conversion_is_not_cached_and_lru_is_bounded():
+    cache = PrefixCache(maxsize=2)
+
+    def failing(message):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        cache.convert("ns", [{"role": "user", "content": "q"}], failing)
+    assert len(cache) == 0
+
+    for i in range(5):
+        cache.convert("ns", [{"role": "user", "content": f"q{i}"}], Counter())
+    assert len(cache) == 2
+
+
+class DummyMedia:
+    content = b"%PDF"
+    headers = {"Content-Type": "application/pdf"}
+
+
+def test_check_prompt_inlines_media_of_new_turns_only(cache, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(utils, "media_get", lambda deadline, url, **kwargs: fetched.append(url) or DummyMedia())
+
+    history = turns(3)
+    first = normalize_messages("anthropic", "claude", history)
+    history = history + [pdf_turn(3)]
+    second = normalize_messages("anthropic", "claude", history)
+    assert len(fetched) == 4
+    assert second["messages"][:len(history) - 1] == first["messages"]
+    assert second["messages"][-1]["content"][1] == {"type": "file", "file": {"file_data": "data:application/pdf;base64,JVBERg=="}}
+
+    prefix_cache.disable()
+    assert second == normalize_messages("anthropic", "claude", history)
+    # 只改写为链接时不走缓存
+    prefix_cache.enable()
+    assert normalize_messages("coze", "bot", [{"role": "user", "content": [IMAGE]}])["reformatted"]
+    assert len(prefix_cache.active()) == 0
+
+
+def test_media_that_fell_back_to_a_link_is_fetched_again(cache, monkeypatch):
+    fetched = []
+
+    def media_get(deadline, url, **kwargs):
+        fetched.append(url)
+        if len(fetched) == 1:
+            raise ConnectionError("reset")
+        return DummyMedia()
+
+    monkeypatch.setattr(utils, "media_get", media_get)
+    history = turns(1)
+
+    first = normalize_messages("anthropic", "claude", history)
+    second = normalize_messages("anthropic", "claude", history)
+
+    assert first["messages"][1]["content"][0]["text"] == "q0[file](https://example.com/0.pdf)"
+    assert second["messages"][1]["content"][1]["type"] == "file"
+    assert len(fetched) == 2 and len(cache) == 1
+    normalize_messages("anthropic", "claude", history)
+    assert len(fetched) == 2
+
+
+def test_anthropic_conversion_reuses_prefix_and_keeps_system(cache, monkeypatch):
+    pytest.importorskip("anthropic")
+    pytest.importorskip("azure.identity")
+    provider = UnionLLM(provider="azure", model="claude-sonnet-4-5", api_key="k",
+                        api_base="https://example.services.ai.azure.com/anthropic").provider_instance
+    calls = []
+    original = provider._convert_openai_message
+    monkeypatch.setattr(provider, "_convert_openai_message", lambda message, deadline=None: calls.append(message) or original(message, deadline=deadline))
+
+    messages = [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}]
+    provider._convert_openai_to_anthropic_messages(messages)
+    messages += [{"role": "assistant", "content": "hello"}, {"role": "user", "content": "again"}]
+    system, converted = provider._convert_openai_to_anthropic_messages(messages)
+
+    assert system == "be brief"
+    assert [m["content"] for m in converted] == ["hi", "hello", "again"]
+    assert len(calls) == 4
+
+
+class DummyModels:
+    def __init__(self):
+        self.calls = []
+
+    def generate_content_stream(self, model, contents, config):
+        self.calls.append((contents, config))
+        return iter([])
+
+
+def test_gemini_stream_contents_reuse_prefix(cache, monkeypatch):
+    provider = UnionLLM(provider="gemini", api_key="k").provider_instance
+    monkeypatch.setattr(gemini, "media_get", lambda *args, **kwargs: DummyMedia())
+    models = DummyModels()
+    monkeypatch.setattr(provider, "client", type("Client", (), {"models": models})())
+    calls = []
+    original = provider._convert_stream_message
+    monkeypatch.setattr(provider, "_convert_stream_message", lambda model, msg, deadline: calls.append(msg) or original(model, msg, deadline))
+
+    messages = [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}]
+    list(provider.post_stream_processing_wrapper("gemini-2.0-flash", messages))
+    messages += [{"role": "assistant", "content": "hello"}, {"role": "user", "content": "again"}]
+    list(provider.post_stream_processing_wrapper("gemini-2.0-flash", messages, image_url="https://example.com/cat.png"))
+    list(provider.post_stream_processing_wrapper("gemini-2.0-flash", messages))
+
+    assert len(calls) == 4
+    first, second, third = (contents for contents, _ in models.calls)
+    assert [c.role for c in second] == ["user", "model", "user"]
+    assert second[0] is first[0] and models.calls[1][1].system_instruction == "be brief"
+    # image_url 追加在最后一条消息的副本上，缓存中的 Content 不受影响
+    assert len(second[-1].parts) == 2 and len(third[-1].parts) == 1
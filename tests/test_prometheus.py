@@ -0,0 +1,144 @@
+import asyncio
+import gc
+import threading
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from unionllm import UnionLLM, prometheus
+from unionllm.callbacks import clear_callbacks
+from unionllm.prometheus import MetricsRegistry
+
+
+@pytest.fixture
+def registry():
+    clear_callbacks()
+    registry = MetricsRegistry()
+    prometheus.enable(registry)
+    yield registry
+    clear_callbacks()
+
+
+def zhipu_client(create):
+    client = UnionLLM(provider="zhipuai", api_key="test-zhipu-key")
+    client.provider_instance.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return client
+
+
+def completion_body(cached=0):
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "glm-4",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "hello"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 20, "total_tokens": 25, "prompt_tokens_details": {"cached_tokens": cached}},
+    })
+
+
+def sample_lines(text):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if not line.startswith("#")}
+
+
+def test_completions_are_recorded_in_text_format(registry):
+    bodies = iter([completion_body(), completion_body(cached=4)])
+    client = zhipu_client(lambda **kwargs: next(bodies))
+    messages = [{"role": "user", "content": "hi"}]
+    client.completion(model="glm-4", messages=messages)
+    client.completion(model="glm-4", messages=messages)
+
+    def fail(**kwargs):
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(Exception):
+        zhipu_client(fail).completion(model="glm-4", messages=messages)
+
+    text = registry.render()
+    assert "# TYPE unionllm_request_duration_seconds histogram" in text
+    samples = sample_lines(text)
+    labels = 'provider="zhipuai",model="glm-4"'
+    assert samples[f"unionllm_requests_total{{{labels}}}"] == 3
+    assert samples[f"unionllm_in_flight{{{labels}}}"] == 0
+    assert samples[f"unionllm_prompt_tokens_total{{{labels}}}"] == 10
+    assert samples[f"unionllm_completion_tokens_total{{{labels}}}"] == 40
+    assert samples[f"unionllm_cache_hits_total{{{labels}}}"] == 1
+    assert samples[f"unionllm_request_duration_seconds_count{{{labels}}}"] == 3
+    assert samples[f'unionllm_request_duration_seconds_bucket{{{labels},le="+Inf"}}'] == 3
+    errors = [key for key in samples if key.startswith("unionllm_errors_total")]
+    assert len(errors) == 1 and samples[errors[0]] == 1
+
+
+def test_counters_sum_shards_across_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Jobs.", ("kind",))
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(("a",))
+            histogram.observe(0.5)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value(("a",)) == 8000
+    samples = sample_lines(registry.render())
+    assert samples['latency_seconds_bucket{le="0.1"}'] == 0
+    assert samples['latency_seconds_bucket{le="1"}'] == 8000
+    assert samples["latency_seconds_sum"] == 4000
+
+
+def test_exited_threads_fold_their_shards_into_the_base():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Jobs.")
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(1.0,))
+
+    def work():
+        counter.inc()
+        histogram.observe(0.5)
+
+    for _ in range(50):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    assert counter._shards == [] and histogram._shards == []
+    assert counter.value() == 50
+    assert sample_lines(registry.render())['latency_seconds_bucket{le="1"}'] == 50
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter("x_total", "X.", ("model",)).inc(('a"b\\c',))
+
+    assert 'x_total{model="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_http_server_and_asgi_app_serve_the_registry():
+    registry = MetricsRegistry()
+    prometheus.record_retry("moonshot", "moonshot-v1-8k", registry=registry)
+
+    server = prometheus.start_http_server(0, addr="127.0.0.1", registry=registry)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            assert response.headers["Content-Type"] == prometheus.CONTENT_TYPE
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'unionllm_retries_total{provider="moonshot",model="moonshot-v1-8k"} 1' in body
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(prometheus.asgi_app(registry)({"type": "http"}, None, send))
+    assert sent[0]["status"] == 200
+    assert sent[1]["body"].decode() == body
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from unionllm import router as router_module
+from unionllm.exceptions import AdmissionRejected
+from unionllm.router import PrefixAffinityRouter, prefix_key
+from unionllm.scheduler import ProviderLimit, RequestScheduler
+
+
+class FakeClient:
+    """UnionLLM stand-in bound to one API key; replies with its own name."""
+
+    provider = "deepseek"
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = []
+
+    def completion(self, model, messages, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get("stream"):
+            return iter([self.name])
+        return self.name
+
+    async def acompletion(self, model, messages, **kwargs):
+        return self.completion(model, messages, **kwargs)
+
+
+def make_router(names=("a", "b", "c"), **kwargs):
+    return PrefixAffinityRouter({name: FakeClient(name) for name in names}, **kwargs)
+
+
+def conversation(system, turns=0):
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": "document"}]
+    for i in range(turns):
+        messages += [{"role": "assistant", "content": f"a{i}"}, {"role": "user", "content": f"q{i}"}]
+    return messages
+
+
+def test_prefix_key_ignores_later_turns():
+    assert prefix_key("m", conversation("s")) == prefix_key("m", conversation("s", turns=3))
+    assert prefix_key("m", conversation("s")) != prefix_key("m", conversation("t"))
+    assert prefix_key("m", conversation("s")) != prefix_key("other", conversation("s"))
+
+
+def test_conversations_stick_to_one_deployment_and_spread_overall():
+    router = make_router()
+
+    homes = [router.completion("deepseek-chat", conversation(f"system {i}")) for i in range(60)]
+    for i in range(60):
+        assert router.completion("deepseek-chat", conversation(f"system {i}", turns=i % 4)) == homes[i]
+
+    assert set(homes) == {"a", "b", "c"}
+    assert router.metrics()["rebalanced"] == 0 and router.metrics()["routed"] == 120
+
+
+def test_removing_a_deployment_only_moves_its_prefixes():
+    router = make_router()
+    before = {i: router.route("m", conversation(f"s{i}")) for i in range(100)}
+
+    router.remove("b")
+    after = {i: router.route("m", conversation(f"s{i}")) for i in range(100)}
+
+    assert all(after[i] == before[i] for i in before if before[i] != "b")
+    assert "b" not in after.values()
+
+
+def test_saturated_home_spills_to_the_next_deployment_on_the_ring():
+    limits = {name: ProviderLimit(max_concurrency=1) for name in ("a", "b", "c")}
+    router = make_router(limits=limits)
+    messages = conversation("hot prefix")
+    order = router.candidates(prefix_key("m", messages))
+
+    stream = router.completion("m", messages, stream=True)
+    assert list(router.completion("m", messages, stream=True)) == [order[1]]
+    assert router.metrics()["in_flight"][order[0]] == 1 and router.metrics()["rebalanced"] == 1
+
+    stream.close()
+    assert router.completion("m", messages) == order[0]
+    assert router.metrics()["in_flight"] == {"a": 0, "b": 0, "c": 0}
+
+
+def test_removing_a_deployment_mid_request_keeps_the_chosen_client(monkeypatch):
+    limits = {name: ProviderLimit(max_concurrency=1) for name in ("a", "b")}
+    router = make_router(("a", "b"), limits=limits)
+    acquire = router._acquire
+
+    def acquire_then_remove(*args):
+        chosen = acquire(*args)
+        router.remove(chosen[0])
+        return chosen
+
+    monkeypatch.setattr(router, "_acquire", acquire_then_remove)
+    home = router.candidates(prefix_key("m", conversation("x")))[0]
+
+    assert router.completion("m", conversation("x")) == home
+    assert limits[home].in_flight == 0
+
+
+def test_all_saturated_is_rejected_without_oversubscribing_and_affinity_key_overrides_prefix():
+    limits = {name: ProviderLimit(max_concurrency=0, rate=1, burst=1) for name in ("a", "b")}
+    router = make_router(("a", "b"), limits=limits)
+    home = router.candidates(prefix_key("m", conversation("x")))[0]
+
+    with pytest.raises(AdmissionRejected):
+        router.completion("m", conversation("x"))
+    assert router.route("m", conversation("x")) == home
+    assert all(limit.in_flight == 0 and limit.tokens == 1 for limit in limits.values())
+    assert router.metrics()["routed"] == 0
+    assert router.route("m", conversation("y"), affinity_key="conv-1") == router.route("m", conversation("z"), affinity_key="conv-1")
+
+
+def test_stream_slot_reports_time_to_response_as_latency(monkeypatch):
+    latencies = []
+
+    class RecordingLimit(ProviderLimit):
+        def release(self, error=None, latency=None):
+            super().release(error=error, latency=latency)
+            latencies.append(latency)
+
+    now = [100.0]
+    monkeypatch.setattr(router_module.time, "monotonic", lambda: now[0])
+    router = make_router(("a",), limits={"a": RecordingLimit(max_concurrency=4)})
+
+    stream = router.completion("m", conversation("long"), stream=True)
+    now[0] += 30
+    assert list(stream) == ["a"]
+    stream.close()
+
+    assert latencies == [0.0]
+
+
+def test_scheduler_limits_drive_rebalancing():
+    scheduler = RequestScheduler(limit_factory=lambda key: ProviderLimit(max_concurrency=1))
+    router = make_router(("a", "b"), scheduler=scheduler)
+    messages = conversation("scheduled")
+    home, other = router.candidates(prefix_key("m", messages))
+
+    stream = router.completion("m", messages, stream=True)
+    assert router.completion("m", messages) == other
+    assert router.deployments[other].calls[-1]["tags"] == {"tenant": "default"}
+    stream.close()
+    assert scheduler.metrics()["in_flight"] == {home: 0, other: 0}
+
+
+def test_async_path_routes_and_releases():
+    limits = {name: ProviderLimit(max_concurrency=1) for name in ("a", "b")}
+    router = make_router(("a", "b"), limits=limits)
+    messages = conversation("async")
+    home = router.candidates(prefix_key("m", messages))[0]
+
+    async def run():
+        return [await router.acompletion("m", messages) for _ in range(3)]
+
+    assert asyncio.run(run()) == [home] * 3
+    assert router.metrics()["in_flight"] == {"a": 0, "b": 0}
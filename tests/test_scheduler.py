@@ -0,0 +1,264 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from unionllm.exceptions import AdmissionRejected
+from unionllm.scheduler import ProviderLimit, RequestScheduler
+
+
+class FakeClient:
+    """UnionLLM stand-in; the call tagged "hold" blocks until released."""
+
+    provider = "moonshot"
+
+    def __init__(self):
+        self.order = []
+        self.gate = threading.Event()
+        self.lock = threading.Lock()
+
+    def completion(self, model, messages, **kwargs):
+        tag = messages[0]["content"]
+        with self.lock:
+            self.order.append(tag)
+        if tag == "hold":
+            self.gate.wait(5)
+        if kwargs.get("stream"):
+            return iter([f"{tag}-1", f"{tag}-2"])
+        return f"reply {tag}"
+
+    async def acompletion(self, model, messages, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.completion(model, messages, **kwargs))
+
+
+def msg(tag):
+    return [{"role": "user", "content": tag}]
+
+
+def wait_for(predicate, timeout=5):
+    end = time.time() + timeout
+    while not predicate():
+        if time.time() > end:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def start(scheduler, client, tag, results, **kwargs):
+    def run():
+        try:
+            results[tag] = scheduler.completion(client, "m", msg(tag), **kwargs)
+        except Exception as e:
+            results[tag] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_interactive_requests_jump_ahead_of_batch():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)})
+    client = FakeClient()
+    results = {}
+    threads = [start(scheduler, client, "hold", results)]
+    wait_for(lambda: client.order == ["hold"])
+    for i, priority in enumerate(["batch", "batch", "interactive", "default"]):
+        threads.append(start(scheduler, client, f"{priority}-{i}", results, priority=priority))
+        wait_for(lambda: scheduler.queue_depth() == i + 1)
+
+    assert scheduler.metrics()["queue_depth"] == {"interactive": 1, "default": 1, "batch": 2}
+    client.gate.set()
+    for t in threads:
+        t.join(5)
+
+    assert client.order == ["hold", "interactive-2", "default-3", "batch-0", "batch-1"]
+    assert results["batch-1"] == "reply batch-1"
+
+
+def test_tenants_share_capacity_by_weight():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)}, tenant_weights={"chat": 3, "evals": 1})
+    client = FakeClient()
+    results = {}
+    threads = [start(scheduler, client, "hold", results)]
+    wait_for(lambda: client.order == ["hold"])
+    for i in range(8):
+        threads.append(start(scheduler, client, f"evals-{i}", results, tenant="evals"))
+        wait_for(lambda: scheduler.queue_depth() == i + 1)
+    for i in range(6):
+        threads.append(start(scheduler, client, f"chat-{i}", results, tenant="chat"))
+        wait_for(lambda: scheduler.queue_depth() == 9 + i)
+
+    client.gate.set()
+    for t in threads:
+        t.join(5)
+
+    first_eight = [tag.split("-")[0] for tag in client.order[1:9]]
+    assert first_eight.count("chat") == 6
+    assert first_eight.count("evals") == 2
+
+
+def test_queue_timeout_raises_timeout_and_frees_the_queue():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)})
+    client = FakeClient()
+    results = {}
+    holder = start(scheduler, client, "hold", results)
+    wait_for(lambda: client.order == ["hold"])
+
+    with pytest.raises(Exception) as excinfo:
+        scheduler.completion(client, "m", msg("late"), queue_timeout=0.05)
+
+    assert excinfo.value.status_code == 408
+    assert scheduler.queue_depth() == 0
+    assert scheduler.metrics()["expired"] == 1
+    client.gate.set()
+    holder.join(5)
+
+
+def test_tenant_shares_are_returned_and_pruned():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)})
+    client = FakeClient()
+    results = {}
+    holder = start(scheduler, client, "hold", results)
+    wait_for(lambda: client.order == ["hold"])
+
+    for i in range(3):
+        with pytest.raises(Exception):
+            scheduler.completion(client, "m", msg(f"late{i}"), tenant="noisy", queue_timeout=0.01)
+    # 过期的请求不计入租户的公平份额
+    assert ("default", "noisy") not in scheduler._tenant_finish
+    waiter = start(scheduler, client, "next", results, tenant="noisy")
+    wait_for(lambda: scheduler.queue_depth() == 1)
+    assert scheduler._queues["default"][0].start == scheduler._virtual_time["default"]
+
+    client.gate.set()
+    holder.join(5)
+    waiter.join(5)
+    for i in range(50):
+        scheduler.completion(client, "m", msg(f"t{i}"), tenant=f"tenant-{i}")
+    assert scheduler._tenant_finish == {}
+
+
+def test_admission_control_evicts_lower_priority_then_rejects():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)}, max_queue_depth=1)
+    client = FakeClient()
+    results = {}
+    threads = [start(scheduler, client, "hold", results)]
+    wait_for(lambda: client.order == ["hold"])
+    threads.append(start(scheduler, client, "bulk", results, priority="batch"))
+    wait_for(lambda: scheduler.queue_depth() == 1)
+    threads.append(start(scheduler, client, "chat", results, priority="interactive"))
+    wait_for(lambda: "bulk" in results)
+
+    assert isinstance(results["bulk"], AdmissionRejected)
+    with pytest.raises(AdmissionRejected):
+        scheduler.completion(client, "m", msg("other"), priority="default")
+
+    client.gate.set()
+    for t in threads:
+        t.join(5)
+    assert results["chat"] == "reply chat"
+    metrics = scheduler.metrics()
+    assert metrics["evicted"] == 1 and metrics["rejected"] == 1
+
+
+def test_streams_hold_their_slot_until_closed():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)})
+    client = FakeClient()
+
+    stream = scheduler.completion(client, "m", msg("s"), stream=True)
+    assert scheduler.metrics()["in_flight"] == {"moonshot": 1}
+    assert list(stream) == ["s-1", "s-2"]
+    assert scheduler.metrics()["in_flight"] == {"moonshot": 0}
+
+    stream = scheduler.completion(client, "m", msg("t"), stream=True)
+    next(stream)
+    stream.close()
+    assert scheduler.metrics()["in_flight"] == {"moonshot": 0}
+
+
+def test_other_providers_are_not_blocked_by_a_saturated_one():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)})
+    client = FakeClient()
+    results = {}
+    holder = start(scheduler, client, "hold", results)
+    wait_for(lambda: client.order == ["hold"])
+
+    assert scheduler.completion(client, "m", msg("zhipu"), provider_key="zhipuai") == "reply zhipu"
+
+    client.gate.set()
+    holder.join(5)
+
+
+def test_rate_limit_spaces_out_requests():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(rate=20, burst=1)}, poll_interval=0.01)
+    client = FakeClient()
+
+    started = time.monotonic()
+    for i in range(4):
+        scheduler.completion(client, "m", msg(f"r{i}"))
+
+    assert time.monotonic() - started >= 0.14
+
+
+def test_refills_and_expiries_are_dispatched_by_the_timer_not_by_polling():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(rate=20, burst=1)}, poll_interval=10)
+    client = FakeClient()
+
+    started = time.monotonic()
+    for i in range(4):
+        scheduler.completion(client, "m", msg(f"r{i}"))
+    assert 0.14 <= time.monotonic() - started < 1
+
+    scheduler.limits["moonshot"] = ProviderLimit(max_concurrency=1)
+    results = {}
+    holder = start(scheduler, client, "hold", results)
+    wait_for(lambda: "hold" in client.order)
+    with pytest.raises(Exception) as excinfo:
+        scheduler.completion(client, "m", msg("late"), queue_timeout=0.05)
+    assert excinfo.value.status_code == 408 and time.monotonic() - started < 2
+    client.gate.set()
+    holder.join(5)
+
+
+def test_queued_waiters_do_not_dispatch_while_blocked():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)})
+    client = FakeClient()
+    results = {}
+    threads = [start(scheduler, client, "hold", results)]
+    wait_for(lambda: client.order == ["hold"])
+    threads += [start(scheduler, client, f"w{i}", results) for i in range(20)]
+    wait_for(lambda: scheduler.queue_depth() == 20)
+
+    calls = []
+    dispatch = scheduler._dispatch
+    scheduler._dispatch = lambda: calls.append(1) or dispatch()
+    time.sleep(0.2)
+    assert calls == []
+
+    client.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 21 and scheduler.metrics()["in_flight"] == {"moonshot": 0}
+
+
+def test_async_path_respects_priority_and_limits():
+    scheduler = RequestScheduler(provider_limits={"moonshot": ProviderLimit(max_concurrency=1)})
+    client = FakeClient()
+
+    async def run():
+        holder = asyncio.ensure_future(scheduler.acompletion(client, "m", msg("hold")))
+        while client.order != ["hold"]:
+            await asyncio.sleep(0.005)
+        batch = asyncio.ensure_future(scheduler.acompletion(client, "m", msg("bulk"), priority="batch"))
+        await asyncio.sleep(0.02)
+        chat = asyncio.ensure_future(scheduler.acompletion(client, "m", msg("chat"), priority="interactive"))
+        await asyncio.sleep(0.02)
+        cancelled = asyncio.ensure_future(scheduler.acompletion(client, "m", msg("gone"), priority="batch"))
+        await asyncio.sleep(0.02)
+        cancelled.cancel()
+        client.gate.set()
+        return await asyncio.gather(holder, batch, chat)
+
+    assert asyncio.run(run()) == ["reply hold", "reply bulk", "reply chat"]
+    assert client.order == ["hold", "chat", "bulk"]
+    assert scheduler.queue_depth() == 0
+    assert scheduler.metrics()["in_flight"] == {"moonshot": 0}
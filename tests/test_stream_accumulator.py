@@ -0,0 +1,164 @@
+import json
+from types import SimpleNamespace
+
+import requests
+
+from unionllm.providers.minimax import MinimaxAIProvider
+from unionllm.providers.zhipu import ZhipuAIProvider
+from unionllm.utils import Delta, ModelResponse, StreamAccumulator, StreamingChoices, Usage
+
+
+class FakeChunk:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeResponse:
+    def __init__(self, lines):
+        self.lines = lines
+        self.status_code = 200
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+
+def chunk(choices, usage=None, id="resp-1"):
+    return ModelResponse(id=id, choices=choices, created=1, model="m", stream=True, usage=usage)
+
+
+def test_openai_compatible_chunks_rebuild_tool_calls_and_usage():
+    deltas = [
+        {"role": "assistant", "content": "Let me "},
+        {"content": "check."},
+        {"tool_calls": [{"index": 0, "id": "call_a", "type": "function", "function": {"name": "get_weather", "arguments": ""}}]},
+        {"tool_calls": [{"index": 0, "function": {"arguments": "{\"city\": "}}]},
+        {"tool_calls": [{"index": 1, "id": "call_b", "type": "function", "function": {"name": "get_time", "arguments": "{}"}}]},
+        {"tool_calls": [{"index": 0, "function": {"arguments": "\"Paris\"}"}}]},
+    ]
+    chunks = [
+        FakeChunk({"id": "chatcmpl-1", "created": 1, "choices": [{"index": 0, "delta": d}]})
+        for d in deltas
+    ]
+    chunks.append(FakeChunk({"id": "chatcmpl-1", "created": 1, "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]}))
+    chunks.append(FakeChunk({"id": "chatcmpl-1", "created": 1, "choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 7, "total_tokens": 17}}))
+
+    provider = ZhipuAIProvider(api_key="test-zhipu-key")
+    provider.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: chunks)))
+    acc = StreamAccumulator()
+
+    passed = list(acc.wrap(provider.completion(model="glm-5.1", messages=[{"role": "user", "content": "hi"}], stream=True)))
+    response = acc.build()
+
+    assert len(passed) == 8
+    message = response.choices[0].message
+    assert message.content == "Let me check."
+    assert [tc.id for tc in message.tool_calls] == ["call_a", "call_b"]
+    assert message.tool_calls[0].function.name == "get_weather"
+    assert json.loads(message.tool_calls[0].function.arguments) == {"city": "Paris"}
+    assert message.tool_calls[1].function.arguments == "{}"
+    assert response.choices[0].finish_reason == "tool_calls"
+    assert response.usage.total_tokens == 17
+    assert response.id == "chatcmpl-1"
+    assert response.object == "chat.completion"
+
+
+def test_minimax_chunks_with_reasoning(monkeypatch):
+    events = [
+        {"choices": [{"index": 0, "delta": {"role": "assistant", "reasoning_content": "think "}}]},
+        {"choices": [{"index": 0, "delta": {"reasoning_content": "more"}}]},
+        {"choices": [{"index": 0, "delta": {"content": "answer"}, "finish_reason": "stop"}], "usage": {"total_tokens": 42}},
+    ]
+    lines = [("data: " + json.dumps({"id": "mm-1", "created": 1, **e})).encode("utf-8") for e in events]
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: FakeResponse(lines))
+    provider = MinimaxAIProvider(api_key="test-minimax-key")
+
+    acc = StreamAccumulator()
+    for _ in acc.wrap(provider.completion(model="abab6.5-chat", messages=[{"role": "user", "content": "hi"}], stream=True)):
+        pass
+    response = acc.build()
+
+    assert response.choices[0].message.content == "answer"
+    assert response.choices[0].message.reasoning_content == "think more"
+    assert response.choices[0].finish_reason == "stop"
+    assert response.usage.total_tokens == 42
+
+
+def test_chunk_counter_indexes_fold_into_one_choice():
+    # dify / coze / fastgpt 用 str(chunk 序号) 作为 index
+    acc = StreamAccumulator()
+    for i, text in enumerate(["Hel", "lo", "!"]):
+        acc.add(chunk([StreamingChoices(index=str(i), delta=Delta(content=text, role="assistant"))]))
+    acc.add(chunk([StreamingChoices(index="3", delta=Delta(), finish_reason="stop")], usage=Usage(prompt_tokens=3, completion_tokens=2)))
+
+    response = acc.build()
+
+    assert len(response.choices) == 1
+    assert response.choices[0].message.content == "Hello!"
+    assert response.usage.total_tokens == 5
+
+
+def test_gemini_shapes_tool_calls_without_index_and_usage_tail():
+    acc = StreamAccumulator()
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(role="assistant", reasoning_content="plan"))], id="gemini-1"))
+    call_a = Delta(role="assistant")
+    call_a.tool_calls = [{"id": "call_1", "type": "function", "function": {"name": "a", "arguments": "{\"x\": 1}"}}]
+    acc.add(chunk([StreamingChoices(index=1, delta=call_a, finish_reason="tool_calls")], id="gemini-2"))
+    call_b = Delta(role="assistant")
+    call_b.tool_calls = [{"id": "call_2", "type": "function", "function": {"name": "b", "arguments": "{}"}}]
+    acc.add(chunk([StreamingChoices(index=2, delta=call_b, finish_reason="tool_calls")], id="gemini-3"))
+    acc.add(chunk([StreamingChoices(index=3, delta="")], usage=Usage(prompt_tokens=4, completion_tokens=6, total_tokens=10), id="gemini-4"))
+
+    response = acc.build()
+
+    message = response.choices[0].message
+    assert message.reasoning_content == "plan"
+    assert message.content is None
+    assert [(tc.function.name, tc.function.arguments) for tc in message.tool_calls] == [("a", "{\"x\": 1}"), ("b", "{}")]
+    assert response.usage.total_tokens == 10
+
+
+def test_azure_shapes_block_indexes_and_split_usage():
+    acc = StreamAccumulator()
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(content="Sure"))], usage=Usage(prompt_tokens=20, completion_tokens=1)))
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(tool_calls=[{"index": 1, "id": "toolu_1", "type": "function", "function": {"name": "search", "arguments": ""}}]))]))
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(tool_calls=[{"index": 1, "function": {"arguments": "{\"q\""}}]))]))
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(tool_calls=[{"index": 1, "function": {"arguments": ": \"x\"}"}}]))]))
+    final_usage = Usage(completion_tokens=15)
+    final_usage.cache_read_input_tokens = 8
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(), finish_reason="tool_calls")], usage=final_usage))
+
+    response = acc.build()
+
+    assert response.choices[0].message.content == "Sure"
+    assert response.choices[0].message.tool_calls[0].function.arguments == "{\"q\": \"x\"}"
+    assert response.usage.prompt_tokens == 20
+    assert response.usage.completion_tokens == 15
+    assert response.usage.total_tokens == 35
+    assert response.usage.cache_read_input_tokens == 8
+
+
+def test_multiple_choices_are_kept_apart_when_n_is_given():
+    acc = StreamAccumulator(n=2)
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(content="a")), StreamingChoices(index=1, delta=Delta(content="b"))]))
+    acc.add(chunk([StreamingChoices(index=1, delta=Delta(content="B")), StreamingChoices(index=0, delta=Delta(content="A"))]))
+
+    response = acc.build()
+
+    assert [c.message.content for c in response.choices] == ["aA", "bB"]
+    assert [c.index for c in response.choices] == [0, 1]
+
+
+def test_usage_is_merged_per_field_and_later_values_win():
+    acc = StreamAccumulator()
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(content="a"))], usage=Usage(prompt_tokens=5, completion_tokens=1)))
+    acc.add(chunk([StreamingChoices(index=0, delta=Delta(content="b"), finish_reason="stop")], usage=Usage(completion_tokens=3)))
+
+    usage = acc.build().usage
+    # 分散在多个事件里的字段会合并；同一字段以后到的非空值为准，不做累加
+    assert (usage.prompt_tokens, usage.completion_tokens, usage.total_tokens) == (5, 3, 8)
@@ -0,0 +1,240 @@
+import asyncio
+import gc
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from unionllm import UnionLLM
+from unionllm.exceptions import RequestCancelled
+from unionllm.providers import xunfei as xunfei_module
+from unionllm.providers.azure import AzureAnthropicProvider
+from unionllm.providers.minimax import MinimaxAIProvider
+from unionllm.providers.zhipu import ZhipuAIProvider
+from unionllm.utils import Deadline
+
+
+class FakeResponse:
+    """requests.Response stand-in that records whether the connection was released."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.status_code = 200
+        self.closed = False
+
+    def iter_lines(self):
+        for line in self.lines:
+            if self.closed:
+                raise requests.exceptions.ConnectionError("connection closed")
+            yield line
+
+    def close(self):
+        self.closed = True
+
+
+class FakeChunk:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSDKStream:
+    """openai.Stream / AnthropicFoundry stream stand-in."""
+
+    def __init__(self, items):
+        self.items = items
+        self.closed = False
+
+    def __iter__(self):
+        for item in self.items:
+            yield item
+
+    def close(self):
+        self.closed = True
+
+
+class DummyCompletions:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def create(self, **kwargs):
+        return self.stream
+
+
+class DummyClient:
+    def __init__(self, stream):
+        self.chat = SimpleNamespace(completions=DummyCompletions(stream))
+
+
+def minimax_lines(n):
+    lines = []
+    for i in range(n):
+        data = {
+            "id": "resp-1",
+            "created": 1,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": f"tok{i}"}}],
+        }
+        lines.append(("data: " + json.dumps(data)).encode("utf-8"))
+    return lines
+
+
+def openai_chunks(n):
+    return [
+        FakeChunk({
+            "id": "chatcmpl-1",
+            "created": 1,
+            "choices": [{"index": 0, "delta": {"content": f"tok{i}"}}],
+        })
+        for i in range(n)
+    ]
+
+
+def open_minimax_stream(monkeypatch):
+    response = FakeResponse(minimax_lines(5))
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: response)
+    provider = MinimaxAIProvider(api_key="test-minimax-key")
+    stream = provider.completion(
+        model="abab6.5-chat",
+        messages=[{"role": "user", "content": "hi"}],
+        stream=True,
+    )
+    return stream, response
+
+
+def test_requests_stream_released_on_close(monkeypatch):
+    stream, response = open_minimax_stream(monkeypatch)
+
+    first = next(stream)
+    assert first.choices[0].delta.content == "tok0"
+    assert response.closed is False
+
+    stream.close()
+    assert response.closed is True
+
+
+def test_requests_stream_released_on_garbage_collection(monkeypatch):
+    stream, response = open_minimax_stream(monkeypatch)
+
+    next(stream)
+    del stream
+    gc.collect()
+
+    assert response.closed is True
+
+
+def test_requests_stream_released_after_exhaustion(monkeypatch):
+    stream, response = open_minimax_stream(monkeypatch)
+
+    assert len(list(stream)) == 5
+    assert response.closed is True
+
+
+def test_sdk_stream_released_when_dropped_unconsumed():
+    upstream = FakeSDKStream(openai_chunks(3))
+    provider = ZhipuAIProvider(api_key="test-zhipu-key")
+    provider.client = DummyClient(upstream)
+
+    stream = provider.completion(
+        model="glm-5.1",
+        messages=[{"role": "user", "content": "hi"}],
+        stream=True,
+    )
+    assert upstream.closed is False
+
+    del stream
+    gc.collect()
+    assert upstream.closed is True
+
+
+def test_sdk_stream_released_on_early_break():
+    upstream = FakeSDKStream(openai_chunks(3))
+    provider = ZhipuAIProvider(api_key="test-zhipu-key")
+    provider.client = DummyClient(upstream)
+
+    stream = provider.completion(
+        model="glm-5.1",
+        messages=[{"role": "user", "content": "hi"}],
+        stream=True,
+    )
+    for chunk in stream:
+        break
+    stream.close()
+
+    assert upstream.closed is True
+
+
+def test_azure_anthropic_stream_released_on_close():
+    events = [
+        SimpleNamespace(type="message_start", message=SimpleNamespace(id="msg-1")),
+        SimpleNamespace(type="content_block_start", index=0, content_block=SimpleNamespace(type="text")),
+        SimpleNamespace(type="content_block_delta", index=0, delta=SimpleNamespace(type="text_delta", text="hello")),
+        SimpleNamespace(type="content_block_delta", index=0, delta=SimpleNamespace(type="text_delta", text=" world")),
+    ]
+    upstream = FakeSDKStream(events)
+    provider = AzureAnthropicProvider(api_key="test-azure-key", api_base="https://example.com/anthropic")
+    provider.client = SimpleNamespace(messages=SimpleNamespace(create=lambda **kwargs: upstream))
+
+    stream = provider.completion(
+        model="claude-sonnet",
+        messages=[{"role": "user", "content": "hi"}],
+        stream=True,
+    )
+    assert next(stream).choices[0].delta.content == "hello"
+
+    stream.close()
+    assert upstream.closed is True
+
+
+def test_deadline_cancel_releases_registered_connections():
+    deadline = Deadline()
+    response = FakeResponse([])
+    deadline.add_cancel_callback(response.close)
+
+    deadline.cancel()
+    assert response.closed is True
+    with pytest.raises(RequestCancelled):
+        deadline.check()
+
+    # 取消之后才注册的连接立即释放
+    late = FakeResponse([])
+    deadline.add_cancel_callback(late.close)
+    assert late.closed is True
+
+
+def test_acompletion_cancel_closes_xunfei_websocket(monkeypatch):
+    opened = threading.Event()
+    sockets = []
+
+    class FakeWebSocketApp:
+        def __init__(self, url, on_message=None, on_error=None, on_close=None):
+            self.on_close = on_close
+            self.closed = threading.Event()
+            sockets.append(self)
+
+        def run_forever(self, **kwargs):
+            opened.set()
+            self.closed.wait(5)
+            self.on_close(self, None, None)
+
+        def close(self):
+            self.closed.set()
+
+    monkeypatch.setattr(xunfei_module.websocket, "WebSocketApp", FakeWebSocketApp)
+    client = UnionLLM(provider="xunfei", app_id="app", api_key="key", api_secret="secret")
+
+    async def run():
+        task = asyncio.ensure_future(
+            client.acompletion(model="generalv3.5", messages=[{"role": "user", "content": "hi"}])
+        )
+        await asyncio.get_running_loop().run_in_executor(None, opened.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    assert sockets[0].closed.is_set()
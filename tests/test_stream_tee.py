@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from unionllm.exceptions import SlowConsumerDropped
+from unionllm.streaming import atee_stream, tee_stream
+
+
+class CountingSource:
+    """Chunk source that records how far it has been pulled and whether it was closed."""
+
+    def __init__(self, n, fail_at=None):
+        self.n = n
+        self.fail_at = fail_at
+        self.pulled = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pulled == self.fail_at:
+            raise RuntimeError("upstream broke")
+        if self.pulled >= self.n:
+            raise StopIteration
+        self.pulled += 1
+        return f"chunk-{self.pulled - 1}"
+
+    def close(self):
+        self.closed = True
+
+
+def test_every_consumer_sees_the_full_sequence_in_threads():
+    source = CountingSource(50)
+    branches = tee_stream(source, n=3, max_buffer=4)
+    results = [None] * 3
+
+    def consume(i, delay):
+        out = []
+        for chunk in branches[i]:
+            out.append(chunk)
+            time.sleep(delay)
+        results[i] = out
+
+    threads = [threading.Thread(target=consume, args=(i, d)) for i, d in enumerate((0, 0.001, 0.002))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    expected = [f"chunk-{i}" for i in range(50)]
+    assert results == [expected, expected, expected]
+    assert source.pulled == 50
+    assert source.closed is True
+
+
+def test_fast_consumer_is_held_back_by_bounded_buffer():
+    source = CountingSource(20)
+    fast, slow = tee_stream(source, n=2, max_buffer=3)
+    got = []
+
+    def consume_fast():
+        for chunk in fast:
+            got.append(chunk)
+
+    t = threading.Thread(target=consume_fast)
+    t.start()
+    time.sleep(0.1)
+
+    # 慢分支一个都没读，快分支最多领先缓冲区大小
+    assert source.pulled == 3
+    assert len(got) == 3
+
+    assert list(slow) == [f"chunk-{i}" for i in range(20)]
+    t.join(5)
+    assert len(got) == 20
+
+
+def test_drop_policy_drops_slow_consumer_in_single_thread():
+    source = CountingSource(10)
+    fast, slow = tee_stream(source, n=2, max_buffer=2, slow_consumer_policy="drop")
+
+    assert list(fast) == [f"chunk-{i}" for i in range(10)]
+    assert slow.dropped is True
+    with pytest.raises(SlowConsumerDropped):
+        next(slow)
+
+
+def test_drop_policy_waits_for_timeout_before_dropping():
+    source = CountingSource(5)
+    fast, slow = tee_stream(source, n=2, max_buffer=1, slow_consumer_policy="drop", slow_consumer_timeout=0.5)
+
+    def consume_slow():
+        time.sleep(0.1)
+        next(slow)
+
+    t = threading.Thread(target=consume_slow)
+    t.start()
+    assert next(fast) == "chunk-0"
+    # 慢分支在超时前读取了一个，快分支可以继续
+    assert next(fast) == "chunk-1"
+    t.join(5)
+    assert slow.dropped is False
+
+
+def test_upstream_error_reaches_every_consumer():
+    source = CountingSource(10, fail_at=2)
+    a, b = tee_stream(source, n=2, max_buffer=8)
+
+    assert next(a) == "chunk-0"
+    assert next(a) == "chunk-1"
+    with pytest.raises(RuntimeError):
+        next(a)
+    assert next(b) == "chunk-0"
+    assert next(b) == "chunk-1"
+    with pytest.raises(RuntimeError):
+        next(b)
+
+
+def test_closing_all_branches_closes_upstream():
+    source = CountingSource(10)
+    a, b = tee_stream(source, n=2)
+
+    next(a)
+    a.close()
+    assert source.closed is False
+    b.close()
+    assert source.closed is True
+
+
+def test_async_tee_over_sync_generator():
+    source = CountingSource(30)
+
+    async def consume(branch, delay):
+        out = []
+        async for chunk in branch:
+            out.append(chunk)
+            await asyncio.sleep(delay)
+        return out
+
+    async def run():
+        branches = atee_stream(source, n=3, max_buffer=4)
+        return await asyncio.gather(*(consume(b, d) for b, d in zip(branches, (0, 0.001, 0.002))))
+
+    results = asyncio.run(run())
+
+    expected = [f"chunk-{i}" for i in range(30)]
+    assert results == [expected, expected, expected]
+    assert source.closed is True
+
+
+def test_cancelling_a_branch_mid_pull_keeps_the_chunk_for_the_others():
+    release = threading.Event()
+
+    def source():
+        for i in range(3):
+            release.wait()
+            yield f"chunk-{i}"
+
+    async def run():
+        a, b = atee_stream(source(), n=2)
+        pulling = asyncio.ensure_future(a.__anext__())
+        await asyncio.sleep(0.05)
+        pulling.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await pulling
+        reader = asyncio.ensure_future(b.__anext__())
+        await asyncio.sleep(0.05)
+        release.set()
+        first = await reader
+        return [first] + [chunk async for chunk in b], [chunk async for chunk in a]
+
+    expected = [f"chunk-{i}" for i in range(3)]
+    assert asyncio.run(run()) == (expected, expected)
+
+
+def test_async_tee_drops_slow_consumer():
+    async def agen():
+        for i in range(10):
+            yield i
+
+    async def run():
+        fast, slow = atee_stream(agen(), n=2, max_buffer=2, slow_consumer_policy="drop")
+        got = [chunk async for chunk in fast]
+        with pytest.raises(SlowConsumerDropped):
+            await slow.__anext__()
+        return got
+
+    assert asyncio.run(run()) == list(range(10))
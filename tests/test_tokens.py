@@ -0,0 +1,99 @@
+import pytest
+
+from unionllm import tokens
+from unionllm.exceptions import ContextWindowExceededError
+from unionllm.main import UnionLLM
+from unionllm.tokens import HEURISTIC, TokenCounter, context_window, count_messages, fit_messages
+
+
+def test_heuristic_counts_cjk_per_character_and_ascii_per_four():
+    assert HEURISTIC.count("abcdefgh") == 2
+    assert HEURISTIC.count("你好世界") == 4
+    assert HEURISTIC.count("hi 你好") == 3
+
+
+def test_context_window_lookup():
+    assert context_window("moonshot", "moonshot-v1-8k") == 8192
+    assert context_window("moonshot", "kimi-k2-0905-preview") == 256 * 1024
+    assert context_window("zhipuai", "glm-4v-plus") == 8 * 1024
+    assert context_window("wenxin", "ernie-3.5-128k") == 128 * 1024
+    assert context_window(None, "openai/gpt-4o-mini") == 128 * 1024
+    assert context_window("dify", "my-app") is None
+
+
+def test_local_tokenizers_are_used_when_available():
+    assert tokens.estimator_for("deepseek", "deepseek-chat").name in ("cl100k_base", "heuristic")
+    assert tokens.estimator_for("qwen", "qwen-plus").name in ("qwen", "heuristic")
+    assert tokens.estimator_for("zhipuai", "glm-4") is HEURISTIC
+    assert count_messages([{"role": "user", "content": "hello"}], "qwen", "qwen-plus") > 4
+
+
+class CountingEstimator:
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, text):
+        self.calls += 1
+        return len(text)
+
+
+def test_message_counts_are_memoized():
+    estimator = CountingEstimator()
+    counter = TokenCounter(estimator)
+    history = [{"role": "user", "content": "abc"}, {"role": "assistant", "content": "de"}]
+
+    assert counter.count_messages(history) == 3 + 2 + 2 * tokens.TOKENS_PER_MESSAGE + tokens.TOKENS_PER_REPLY
+    counter.count_messages(history + [{"role": "user", "content": "f"}])
+    assert estimator.calls == 3
+    image = {"role": "user", "content": [{"type": "text", "text": "x"}, {"type": "image_url", "image_url": {"url": "u"}}]}
+    assert counter.count_message(image) == tokens.TOKENS_PER_MESSAGE + 1 + tokens.MEDIA_TOKENS["image_url"]
+
+
+def conversation():
+    return [
+        {"role": "system", "content": "s" * 40},
+        {"role": "user", "content": "u" * 400},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "1", "type": "function", "function": {"name": "f", "arguments": "{}"}}]},
+        {"role": "tool", "tool_call_id": "1", "content": "r" * 400},
+        {"role": "assistant", "content": "a" * 400},
+        {"role": "user", "content": "u" * 40},
+        {"role": "assistant", "content": "a" * 40},
+        {"role": "user", "content": "latest"},
+    ]
+
+
+def test_trim_drops_oldest_turns_with_their_tool_calls():
+    messages = conversation()
+
+    fitted = fit_messages(messages, "zhipuai", "glm-4", window=150)
+
+    assert [m["role"] for m in fitted] == ["system", "user", "assistant", "user"]
+    assert fitted[0] is messages[0] and fitted[-1] is messages[-1]
+    assert fit_messages(messages, "zhipuai", "glm-4", window=10_000) is messages
+
+
+def test_validate_and_unfittable_prompts_raise_before_sending():
+    messages = conversation()
+
+    with pytest.raises(ContextWindowExceededError):
+        fit_messages(messages, "zhipuai", "glm-4", window=150, mode="validate")
+    with pytest.raises(ContextWindowExceededError):
+        fit_messages(messages, "zhipuai", "glm-4", window=150, max_tokens=140)
+
+
+def test_completion_trims_before_dispatch(monkeypatch):
+    client = UnionLLM(provider="moonshot", api_key="k")
+    sent = []
+    monkeypatch.setattr(client.provider_instance, "completion", lambda model, messages, **kwargs: sent.append((messages, kwargs)))
+    monkeypatch.setitem(tokens.CONTEXT_WINDOWS["moonshot"], "tiny-model", 150)
+    messages = conversation()
+
+    client.completion(model="tiny-model", messages=messages, context_fit="trim")
+    client.completion(model="tiny-model", messages=messages)
+
+    assert len(sent[0][0]) == 4 and "context_fit" not in sent[0][1]
+    assert sent[1][0] is messages
+    with pytest.raises(ContextWindowExceededError):
+        client.completion(model="tiny-model", messages=messages, max_tokens=1000, context_fit="trim")
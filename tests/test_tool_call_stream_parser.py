@@ -0,0 +1,114 @@
+import json
+
+from unionllm.streaming import (
+    ARGUMENT,
+    TOOL_CALL_COMPLETE,
+    TOOL_NAME,
+    PartialJSONObjectParser,
+    ToolCallStreamParser,
+)
+from unionllm.utils import Delta, ModelResponse, StreamingChoices
+
+
+def tool_chunk(tool_calls, finish_reason=None):
+    delta = Delta()
+    if tool_calls:
+        delta.tool_calls = tool_calls
+    return ModelResponse(
+        id="resp-1",
+        choices=[StreamingChoices(index=0, delta=delta, finish_reason=finish_reason)],
+        stream=True,
+    )
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_partial_parser_emits_each_key_once_its_value_is_complete():
+    arguments = {
+        "city": "Paris, \"FR\"",
+        "days": 3,
+        "units": None,
+        "options": {"hourly": True, "fields": ["temp", "wind}"]},
+        "ratio": -1.5e2,
+        "verbose": False,
+    }
+    parser = PartialJSONObjectParser()
+    completed = []
+    for fragment in split(json.dumps(arguments), 3):
+        completed.extend(parser.feed(fragment))
+
+    assert completed == list(arguments.items())
+    assert parser.done is True
+    assert parser.error is None
+
+
+def test_partial_parser_reports_key_before_object_closes():
+    parser = PartialJSONObjectParser()
+
+    assert parser.feed('{"query": "wea') == []
+    assert parser.feed('ther", "limit"') == [("query", "weather")]
+    assert parser.feed(': 5') == []
+    assert parser.feed('}') == [("limit", 5)]
+    assert parser.done is True
+
+
+def test_partial_parser_flags_non_object_arguments():
+    parser = PartialJSONObjectParser()
+
+    assert parser.feed('[1, 2]') == []
+    assert parser.error is not None
+
+
+def test_stream_parser_events_for_openai_style_deltas():
+    parser = ToolCallStreamParser()
+    chunks = [
+        tool_chunk([{"index": 0, "id": "call_a", "type": "function", "function": {"name": "search", "arguments": ""}}]),
+        tool_chunk([{"index": 0, "function": {"arguments": "{\"q\": \"un"}}]),
+        tool_chunk([{"index": 0, "function": {"arguments": "ion\", \"k\": 3"}}]),
+        tool_chunk([{"index": 1, "id": "call_b", "type": "function", "function": {"name": "clock", "arguments": "{}"}}]),
+        tool_chunk([{"index": 0, "function": {"arguments": "}"}}]),
+        tool_chunk(None, finish_reason="tool_calls"),
+    ]
+
+    events = []
+    seen = list(parser.wrap(iter(chunks), events.append))
+
+    assert seen == chunks
+    assert [(e.type, e.index) for e in events] == [
+        (TOOL_NAME, 0),
+        (ARGUMENT, 0),
+        (TOOL_NAME, 1),
+        (TOOL_CALL_COMPLETE, 1),
+        (ARGUMENT, 0),
+        (TOOL_CALL_COMPLETE, 0),
+    ]
+    assert events[1].key == "q" and events[1].value == "union"
+    assert events[4].key == "k" and events[4].value == 3
+    assert events[5].id == "call_a"
+    assert events[5].name == "search"
+    assert events[5].arguments == {"q": "union", "k": 3}
+
+
+def test_stream_parser_handles_whole_calls_without_index():
+    # gemini 每个 chunk 给出一个完整的调用，没有 index
+    parser = ToolCallStreamParser()
+    events = []
+    events += parser.feed(tool_chunk([{"id": "call_1", "function": {"name": "a", "arguments": "{\"x\": 1}"}}], finish_reason="tool_calls"))
+    events += parser.feed(tool_chunk([{"id": "call_2", "function": {"name": "b", "arguments": "{}"}}], finish_reason="tool_calls"))
+
+    completes = [e for e in events if e.type == TOOL_CALL_COMPLETE]
+    assert [(e.index, e.name, e.arguments) for e in completes] == [(0, "a", {"x": 1}), (1, "b", {})]
+
+
+def test_stream_parser_completes_truncated_call_at_end_with_error():
+    parser = ToolCallStreamParser()
+    parser.feed(tool_chunk([{"index": 0, "id": "call_a", "function": {"name": "f", "arguments": "{\"a\": "}}]))
+
+    (event,) = parser.finish()
+
+    assert event.type == TOOL_CALL_COMPLETE
+    assert event.arguments is None
+    assert event.raw_arguments == "{\"a\": "
+    assert event.error
@@ -0,0 +1,274 @@
+"""
+JSONL batch runner.
+
+    python -m unionllm.batch requests.jsonl -o responses.jsonl --concurrency 16
+
+Each input line is one request:
+
+    {"id": "q-1", "provider": "zhipuai", "model": "glm-4", "messages": [...], "kwargs": {"temperature": 0.2}}
+
+`id` defaults to the line number and `provider`/`model` may be given once on the
+command line instead. Results are appended to the output file as they finish,
+one line per request: {"id", "response"} or {"id", "error"}. Ids of successful
+requests are appended to a checkpoint file, so rerunning the same command after
+a crash skips them; failed requests are retried on the next run.
+
+Input is read lazily and only `--concurrency` requests are in flight at a time,
+so memory stays flat regardless of the file size.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .main import UnionLLM
+from .utils import StreamAccumulator
+
+
+class BatchStats:
+    """Running counters of a batch job."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+
+    @property
+    def completed(self):
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def add_usage(self, usage):
+        if usage is None:
+            return
+        prompt = _field(usage, "prompt_tokens") or 0
+        completion = _field(usage, "completion_tokens") or 0
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.total_tokens += _field(usage, "total_tokens") or (prompt + completion)
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return (
+            f"done={self.completed} ok={self.succeeded} errors={self.failed} "
+            f"skipped={self.skipped} invalid={self.invalid} "
+            f"elapsed={elapsed:.1f}s rate={self.completed / elapsed:.2f} req/s "
+            f"tokens={self.total_tokens} (prompt={self.prompt_tokens} completion={self.completion_tokens}) "
+            f"token_rate={self.total_tokens / elapsed:.1f} tok/s"
+        )
+
+    def to_dict(self):
+        return {
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "invalid": self.invalid,
+            "elapsed": self.elapsed,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+def _field(obj, key, default=None):
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+def _to_jsonable(response):
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    if hasattr(response, "to_dict"):
+        return response.to_dict()
+    return response
+
+
+def _error_record(e):
+    return {
+        "type": type(e).__name__,
+        "message": str(e),
+        "status_code": getattr(e, "status_code", None),
+    }
+
+
+def load_checkpoint(path: Optional[str]) -> set:
+    done = set()
+    if not path:
+        return done
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    done.add(line)
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class BatchRunner:
+    """
+    Runs JSONL requests through UnionLLM with at most `max_concurrency` in flight.
+
+    One UnionLLM client is created per provider/model and shared by all worker
+    threads. Providers in MODEL_SCOPED_PROVIDERS also get the model at
+    construction, since it picks their client type (azure claude-* models use
+    the Anthropic SDK, qwen picks the multimodal client).
+    """
+
+    MODEL_SCOPED_PROVIDERS = ("azure", "qwen")
+
+    def __init__(self, max_concurrency: int = 8, provider: Optional[str] = None, model: Optional[str] = None,
+                 client_kwargs: Optional[Dict[str, Any]] = None, progress_interval: float = 10.0, log=None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.provider = provider
+        self.model = model
+        self.client_kwargs = client_kwargs or {}
+        self.progress_interval = progress_interval
+        self.log = log if log is not None else sys.stderr
+        self.clients = {}
+        self._clients_lock = threading.Lock()
+
+    def get_client(self, provider, model):
+        key = (provider, model)
+        client = self.clients.get(key)
+        if client is None:
+            # 工作线程并发调用，加锁避免同一 key 创建出多个客户端
+            with self._clients_lock:
+                client = self.clients.get(key)
+                if client is None:
+                    init_kwargs = dict(self.client_kwargs)
+                    if provider in self.MODEL_SCOPED_PROVIDERS:
+                        init_kwargs["model"] = model
+                    client = self.clients[key] = UnionLLM(provider=provider, **init_kwargs)
+        return client
+
+    def call(self, request: Dict[str, Any]):
+        provider = request.get("provider") or self.provider
+        model = request.get("model") or self.model
+        if not provider or not model:
+            raise ValueError("request needs both provider and model")
+        kwargs = dict(request.get("kwargs") or {})
+        client = self.get_client(provider, model)
+        response = client.completion(model=model, messages=request["messages"], **kwargs)
+        if kwargs.get("stream"):
+            # 流式请求在这里拼回完整的响应再写出
+            acc = StreamAccumulator(n=kwargs.get("n") or 1)
+            for _ in acc.wrap(response):
+                pass
+            response = acc.build()
+        return response
+
+    def iter_requests(self, lines, done_ids, stats) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for lineno, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict) or "messages" not in request:
+                    raise ValueError("request must be an object with messages")
+            except ValueError as e:
+                stats.invalid += 1
+                print(f"line {lineno}: invalid request: {e}", file=self.log)
+                continue
+            request_id = str(request.get("id", lineno))
+            if request_id in done_ids:
+                stats.skipped += 1
+                continue
+            yield request_id, request
+
+    def _run_one(self, request):
+        try:
+            return self.call(request), None
+        except Exception as e:
+            return None, e
+
+    def run(self, input_path: str, output_path: str, checkpoint_path: Optional[str] = None) -> BatchStats:
+        if checkpoint_path is None:
+            checkpoint_path = output_path + ".checkpoint"
+        done_ids = load_checkpoint(checkpoint_path)
+        stats = BatchStats()
+        last_report = time.time()
+
+        with open(input_path, "r", encoding="utf-8") as source, \
+                open(output_path, "a", encoding="utf-8") as out, \
+                open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+                ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            requests_iter = self.iter_requests(source, done_ids, stats)
+            in_flight = {}
+            while True:
+                for request_id, request in requests_iter:
+                    in_flight[executor.submit(self._run_one, request)] = request_id
+                    if len(in_flight) >= self.max_concurrency:
+                        break
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    request_id = in_flight.pop(future)
+                    response, error = future.result()
+                    if error is None:
+                        record = {"id": request_id, "response": _to_jsonable(response)}
+                        stats.succeeded += 1
+                        stats.add_usage(_field(response, "usage"))
+                    else:
+                        record = {"id": request_id, "error": _error_record(error)}
+                        stats.failed += 1
+                    out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                    out.flush()
+                    if error is None:
+                        # 先落盘结果再记 checkpoint，崩溃时最多重复一条而不会丢失
+                        checkpoint.write(request_id + "\n")
+                        checkpoint.flush()
+                if self.progress_interval and time.time() - last_report >= self.progress_interval:
+                    print(stats.summary(), file=self.log)
+                    last_report = time.time()
+
+        print(stats.summary(), file=self.log)
+        return stats
+
+
+def run_batch(input_path: str, output_path: str, checkpoint_path: Optional[str] = None, **kwargs) -> BatchStats:
+    return BatchRunner(**kwargs).run(input_path, output_path, checkpoint_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m unionllm.batch", description="Run a JSONL file of chat requests through UnionLLM.")
+    parser.add_argument("input", help="input JSONL, one request per line")
+    parser.add_argument("-o", "--output", required=True, help="output JSONL, appended to as requests finish")
+    parser.add_argument("--checkpoint", help="file of completed ids (default: <output>.checkpoint)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="max requests in flight")
+    parser.add_argument("--provider", help="default provider for lines without one")
+    parser.add_argument("--model", help="default model for lines without one")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines, 0 to disable")
+    args = parser.parse_args(argv)
+
+    stats = run_batch(
+        args.input,
+        args.output,
+        args.checkpoint,
+        max_concurrency=args.concurrency,
+        provider=args.provider,
+        model=args.model,
+        progress_interval=args.progress_interval,
+    )
+    return 1 if stats.failed or stats.invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Provider-native offline batch jobs.
+
+A batch job submits a whole list of chat requests to the provider's asynchronous
+batch endpoint in one go, which is cheaper and has far higher throughput limits
+than calling `completion` per request, at the cost of minutes-to-hours latency.
+
+    client = UnionLLM(provider="qwen", model="qwen-plus")
+    job = client.create_batch_job("qwen-plus", list_of_messages, temperature=0.2)
+    results = job.wait().results()      # ModelResponse or BatchJobError, input order
+
+Backends:
+- OpenAIBatchBackend: OpenAI /files + /batches (also Azure OpenAI and any compatible endpoint)
+- DashScopeBatchBackend: DashScope OpenAI-compatible batch (QwenAIProvider)
+- GeminiBatchBackend: Gemini batchGenerateContent with inlined requests (GeminiAIProvider)
+"""
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from .exceptions import BatchJobError
+from .utils import Deadline
+
+# 请求参数中不能进入批处理请求体的字段
+_UNBATCHABLE_KWARGS = {"stream", "stream_options", "deadline", "timeout", "api_key", "api_base", "api_version", "provider"}
+
+
+def _custom_id(index):
+    return f"request-{index}"
+
+
+class BatchJob:
+    """Handle to a submitted provider batch job."""
+
+    def __init__(self, backend, id: str, model: str, custom_ids: List[str], status: Optional[str] = None, raw: Optional[dict] = None):
+        self.backend = backend
+        self.id = id
+        self.model = model
+        self.custom_ids = custom_ids
+        self.status = status
+        self.raw = raw or {}
+
+    @property
+    def done(self) -> bool:
+        return self.backend.is_terminal(self)
+
+    def refresh(self) -> "BatchJob":
+        self.backend.refresh(self)
+        return self
+
+    def cancel(self) -> "BatchJob":
+        self.backend.cancel(self)
+        return self
+
+    def wait(self, poll_interval: float = 5.0, max_poll_interval: float = 60.0, backoff: float = 1.5,
+             timeout: Optional[float] = None, sleep=time.sleep) -> "BatchJob":
+        """Poll until the job reaches a terminal state, backing off between polls."""
+        deadline = Deadline(timeout=timeout)
+        interval = poll_interval
+        while not self.refresh().done:
+            remaining = deadline.remaining()
+            if remaining is not None and remaining <= 0:
+                deadline.check(llm_provider=self.backend.llm_provider)
+            sleep(interval if remaining is None else min(interval, remaining))
+            interval = min(interval * backoff, max_poll_interval)
+        return self
+
+    def results(self) -> List[Any]:
+        """Results in input order; failed or missing requests are BatchJobError instances."""
+        by_id = self.backend.fetch_results(self)
+        return [
+            by_id.get(custom_id, BatchJobError(status_code=500, message=f"No result for {custom_id} (job status: {self.status})"))
+            for custom_id in self.custom_ids
+        ]
+
+
+class OpenAIBatchBackend:
+    """
+    OpenAI Batch API: upload a JSONL file, create a batch, download the output file.
+
+    `provider` is used to turn each response body into a ModelResponse.
+    For Azure OpenAI pass `api_version` (the key is then sent as `api-key`) and
+    api_base ending in /openai.
+    """
+
+    llm_provider = "openai"
+    terminal_statuses = {"completed", "failed", "expired", "cancelled"}
+
+    def __init__(self, provider, api_key: str, api_base: str = "https://api.openai.com/v1", api_version: Optional[str] = None,
+                 endpoint: str = "/v1/chat/completions", completion_window: str = "24h", request_timeout: float = 60):
+        self.provider = provider
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.api_version = api_version
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+        self.request_timeout = request_timeout
+
+    def _headers(self):
+        if self.api_version:
+            return {"api-key": self.api_key}
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _request(self, method, path, **kwargs):
+        params = kwargs.pop("params", {})
+        if self.api_version:
+            params["api-version"] = self.api_version
+        try:
+            response = requests.request(method, self.api_base + path, headers=self._headers(), params=params,
+                                        timeout=self.request_timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise BatchJobError(status_code=500, message=f"{method} {path} failed: {e}")
+        if response.status_code >= 400:
+            raise BatchJobError(status_code=response.status_code, message=response.text)
+        return response
+
+    def build_line(self, custom_id, model, messages, kwargs):
+        body = {"model": model, "messages": messages}
+        body.update({k: v for k, v in kwargs.items() if k not in _UNBATCHABLE_KWARGS})
+        return {"custom_id": custom_id, "method": "POST", "url": self.endpoint, "body": body}
+
+    def submit(self, model: str, list_of_messages: List[list], metadata: Optional[Dict[str, str]] = None, **kwargs) -> BatchJob:
+        custom_ids = []
+        lines = []
+        for index, messages in enumerate(list_of_messages):
+            custom_id = _custom_id(index)
+            custom_ids.append(custom_id)
+            lines.append(json.dumps(self.build_line(custom_id, model, messages, kwargs), ensure_ascii=False))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        uploaded = self._request("POST", "/files", data={"purpose": "batch"},
+                                 files={"file": ("batch.jsonl", payload, "application/jsonl")}).json()
+        body = {"input_file_id": uploaded["id"], "endpoint": self.endpoint, "completion_window": self.completion_window}
+        if metadata:
+            body["metadata"] = metadata
+        created = self._request("POST", "/batches", json=body).json()
+        return BatchJob(self, created["id"], model, custom_ids, status=created.get("status"), raw=created)
+
+    def refresh(self, job: BatchJob):
+        job.raw = self._request("GET", f"/batches/{job.id}").json()
+        job.status = job.raw.get("status")
+        if job.status == "failed" and not job.raw.get("output_file_id"):
+            errors = (job.raw.get("errors") or {}).get("data") or []
+            message = "; ".join(e.get("message", "") for e in errors) or "batch failed"
+            raise BatchJobError(status_code=400, message=f"Batch {job.id} failed: {message}")
+
+    def is_terminal(self, job: BatchJob) -> bool:
+        return job.status in self.terminal_statuses
+
+    def cancel(self, job: BatchJob):
+        job.raw = self._request("POST", f"/batches/{job.id}/cancel").json()
+        job.status = job.raw.get("status")
+
+    def _iter_file(self, file_id):
+        if not file_id:
+            return
+        response = self._request("GET", f"/files/{file_id}/content")
+        for line in response.text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+    def to_model_response(self, body: dict, model: str):
+        from openai.types.chat import ChatCompletion
+        return self.provider.create_model_response(ChatCompletion.model_validate(body), model=model)
+
+    def fetch_results(self, job: BatchJob) -> Dict[str, Any]:
+        results = {}
+        for file_key in ("output_file_id", "error_file_id"):
+            for line in self._iter_file(job.raw.get(file_key)):
+                custom_id = line.get("custom_id")
+                response = line.get("response") or {}
+                body = response.get("body") or {}
+                status_code = response.get("status_code", 500)
+                if line.get("error") or status_code >= 400:
+                    error = line.get("error") or body.get("error") or {}
+                    results[custom_id] = BatchJobError(status_code=status_code if status_code >= 400 else 500,
+                                                       message=error.get("message") or json.dumps(error, ensure_ascii=False))
+                    continue
+                try:
+                    results[custom_id] = self.to_model_response(body, job.model)
+                except Exception as e:
+                    results[custom_id] = BatchJobError(status_code=500, message=f"Invalid response body: {e}")
+        return results
+
+
+class DashScopeBatchBackend(OpenAIBatchBackend):
+    """DashScope batch inference through its OpenAI-compatible endpoint."""
+
+    llm_provider = "qwen"
+
+    def __init__(self, provider, api_key: str, api_base: str = "https://dashscope.aliyuncs.com/compatible-mode/v1", **kwargs):
+        super().__init__(provider, api_key, api_base=api_base, **kwargs)
+
+
+class GeminiBatchBackend:
+    """Gemini Batch API with inlined requests (models/{model}:batchGenerateContent)."""
+
+    llm_provider = "gemini"
+    terminal_states = {"BATCH_STATE_SUCCEEDED", "BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED"}
+
+    def __init__(self, provider, api_key: str, api_base: str = "https://generativelanguage.googleapis.com/v1beta", request_timeout: float = 60):
+        self.provider = provider
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.request_timeout = request_timeout
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = requests.request(method, self.api_base + path, headers={"x-goog-api-key": self.api_key},
+                                        timeout=self.request_timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise BatchJobError(status_code=500, message=f"{method} {path} failed: {e}")
+        if response.status_code >= 400:
+            raise BatchJobError(status_code=response.status_code, message=response.text)
+        return response.json()
+
+    @staticmethod
+    def _parts(content):
+        if isinstance(content, str):
+            return [{"text": content}]
+        parts = []
+        for item in content or []:
+            if item.get("type") == "text":
+                parts.append({"text": item.get("text", "")})
+            elif item.get("type") == "image_url":
+                url = item.get("image_url", {}).get("url", "")
+                if url.startswith("data:"):
+                    header, data = url.split(",", 1)
+                    parts.append({"inlineData": {"mimeType": header[5:].split(";")[0], "data": data}})
+                else:
+                    parts.append({"fileData": {"fileUri": url}})
+        return parts
+
+    @staticmethod
+    def _function_call_parts(tool_calls, names):
+        parts = []
+        for tool_call in tool_calls:
+            if tool_call.get("type", "function") != "function":
+                raise BatchJobError(status_code=422, message=f"Unsupported tool_call type for Gemini batch: {tool_call.get('type')}")
+            function = tool_call.get("function") or {}
+            arguments = function.get("arguments") or "{}"
+            try:
+                args = json.loads(arguments) if isinstance(arguments, str) else arguments
+            except ValueError:
+                raise BatchJobError(status_code=422, message=f"tool_call arguments are not valid JSON: {arguments[:200]}")
+            names[tool_call.get("id")] = function.get("name")
+            part = {"functionCall": {"name": function.get("name"), "args": args}}
+            if tool_call.get("thought_signature"):
+                part["thoughtSignature"] = tool_call["thought_signature"]
+            parts.append(part)
+        return parts
+
+    @staticmethod
+    def _tools(kwargs):
+        """tools / tool_choice as Gemini functionDeclarations and toolConfig (OpenAI tool_choice semantics)."""
+        declarations = []
+        for tool in kwargs["tools"]:
+            if tool.get("type", "function") != "function" or "function" not in tool:
+                raise BatchJobError(status_code=422, message=f"Unsupported tool type for Gemini batch: {tool.get('type')}")
+            function = tool["function"]
+            declaration = {"name": function.get("name"), "description": function.get("description", "")}
+            if function.get("parameters"):
+                declaration["parameters"] = function["parameters"]
+            declarations.append(declaration)
+        config = {"mode": "AUTO"}
+        tool_choice = kwargs.get("tool_choice")
+        if tool_choice == "none":
+            config = {"mode": "NONE"}
+        elif tool_choice == "required":
+            config = {"mode": "ANY"}
+        elif isinstance(tool_choice, dict):
+            config = {"mode": "ANY", "allowedFunctionNames": [(tool_choice.get("function") or {}).get("name")]}
+        return [{"functionDeclarations": declarations}], {"functionCallingConfig": config}
+
+    def build_request(self, messages, kwargs):
+        request = {"contents": []}
+        system_parts = []
+        # tool 消息通常只带 tool_call_id，按之前的 tool_calls 找回函数名
+        call_names = {}
+        for message in messages:
+            role = message.get("role")
+            if role == "system":
+                system_parts.extend(self._parts(message.get("content")))
+                continue
+            if role == "tool":
+                name = message.get("name") or call_names.get(message.get("tool_call_id"))
+                if not name:
+                    raise BatchJobError(status_code=422, message="tool message needs a name or a tool_call_id of an earlier tool_call")
+                response = {"name": name, "response": {"result": message.get("content", "")}}
+                request["contents"].append({"role": "function", "parts": [{"functionResponse": response}]})
+                continue
+            parts = self._parts(message.get("content"))
+            if role == "assistant" and message.get("tool_calls"):
+                parts.extend(self._function_call_parts(message["tool_calls"], call_names))
+            request["contents"].append({"role": "model" if role == "assistant" else "user", "parts": parts or [{"text": ""}]})
+        if system_parts:
+            request["systemInstruction"] = {"parts": system_parts}
+        if kwargs.get("tools"):
+            request["tools"], request["toolConfig"] = self._tools(kwargs)
+        generation_config = {}
+        for key, wire_key in (("temperature", "temperature"), ("top_p", "topP"), ("max_tokens", "maxOutputTokens"),
+                              ("presence_penalty", "presencePenalty"), ("frequency_penalty", "frequencyPenalty")):
+            if kwargs.get(key) is not None:
+                generation_config[wire_key] = kwargs[key]
+        if kwargs.get("stop"):
+            stop = kwargs["stop"]
+            generation_config["stopSequences"] = [stop] if isinstance(stop, str) else list(stop)
+        if generation_config:
+            request["generationConfig"] = generation_config
+        return request
+
+    def submit(self, model: str, list_of_messages: List[list], display_name: Optional[str] = None, **kwargs) -> BatchJob:
+        custom_ids = []
+        inlined = []
+        for index, messages in enumerate(list_of_messages):
+            custom_id = _custom_id(index)
+            custom_ids.append(custom_id)
+            inlined.append({"request": self.build_request(messages, kwargs), "metadata": {"key": custom_id}})
+        body = {"batch": {"display_name": display_name or f"unionllm-{int(time.time())}",
+                          "input_config": {"requests": {"requests": inlined}}}}
+        operation = self._request("POST", f"/models/{model}:batchGenerateContent", json=body)
+        job = BatchJob(self, operation["name"], model, custom_ids, raw=operation)
+        job.status = (operation.get("metadata") or {}).get("state")
+        return job
+
+    def refresh(self, job: BatchJob):
+        job.raw = self._request("GET", f"/{job.id}")
+        job.status = (job.raw.get("metadata") or {}).get("state")
+        if job.status == "BATCH_STATE_FAILED":
+            error = job.raw.get("error") or {}
+            raise BatchJobError(status_code=400, message=f"Batch {job.id} failed: {error.get('message', 'unknown error')}")
+
+    def is_terminal(self, job: BatchJob) -> bool:
+        return job.status in self.terminal_states or bool(job.raw.get("done"))
+
+    def cancel(self, job: BatchJob):
+        self._request("POST", f"/{job.id}:cancel")
+        job.refresh()
+
+    def to_model_response(self, body: dict, model: str):
+        from google.genai import types
+        return self.provider.create_model_response_wrapper(types.GenerateContentResponse.model_validate(body), model=model)
+
+    def fetch_results(self, job: BatchJob) -> Dict[str, Any]:
+        output = job.raw.get("response") or (job.raw.get("metadata") or {}).get("output") or {}
+        inlined = (output.get("inlinedResponses") or {}).get("inlinedResponses") or []
+        results = {}
+        for position, item in enumerate(inlined):
+            # 按 metadata.key 对齐，缺失时退回到提交顺序
+            custom_id = (item.get("metadata") or {}).get("key") or _custom_id(position)
+            if item.get("error"):
+                error = item["error"]
+                results[custom_id] = BatchJobError(status_code=error.get("code", 500), message=error.get("message", ""))
+                continue
+            try:
+                results[custom_id] = self.to_model_response(item.get("response") or {}, job.model)
+            except Exception as e:
+                results[custom_id] = BatchJobError(status_code=500, message=f"Invalid response body: {e}")
+        return results
@@ -0,0 +1,114 @@
+"""
+Callback hooks around every UnionLLM completion.
+
+    class TimingLogger(CallbackHandler):
+        def on_success(self, context, response):
+            print(context.to_dict())
+
+    register_callback(TimingLogger())                       # every call
+    client.completion(model, messages, callbacks=[other])   # this call only
+
+Hooks receive the call's CallContext (provider, model, timings, usage):
+
+- on_request_start(context)
+- on_first_token(context, chunk)   streams, first chunk carrying output
+- on_chunk(context, chunk)         streams, every chunk
+- on_success(context, response)    response is None for streams
+- on_error(context, error)
+
+Exceptions raised by a handler are logged and never reach the caller. When no
+handler is registered, streams are returned unwrapped and non-stream calls
+only pay for a few clock reads; the timing breakdown is still attached to
+ModelResponse._hidden_params["timings"].
+"""
+import logging
+
+from .utils import ClosingStream, close_quietly
+
+logger = logging.getLogger(__name__)
+
+_callbacks = []
+
+
+class CallbackHandler:
+    """Base class for hooks; override the events you need."""
+
+    def on_request_start(self, context):
+        pass
+
+    def on_first_token(self, context, chunk):
+        pass
+
+    def on_chunk(self, context, chunk):
+        pass
+
+    def on_success(self, context, response):
+        pass
+
+    def on_error(self, context, error):
+        pass
+
+
+def register_callback(handler):
+    if handler not in _callbacks:
+        _callbacks.append(handler)
+
+
+def unregister_callback(handler):
+    if handler in _callbacks:
+        _callbacks.remove(handler)
+
+
+def clear_callbacks():
+    del _callbacks[:]
+
+
+def active_callbacks(extra=None):
+    if not extra:
+        return list(_callbacks) if _callbacks else None
+    return list(_callbacks) + list(extra)
+
+
+def fire(handlers, event, *args):
+    for handler in handlers:
+        try:
+            getattr(handler, event)(*args)
+        except Exception:
+            logger.exception("UnionLLM callback %s.%s failed", type(handler).__name__, event)
+
+
+def attach_timings(response, context):
+    try:
+        hidden = dict(getattr(response, "_hidden_params", None) or {})
+        hidden["timings"] = context.to_dict()
+        response._hidden_params = hidden
+    except Exception:
+        pass
+
+
+def _instrumented(stream, context, handlers):
+    error = None
+    try:
+        for chunk in stream:
+            if context.chunk(chunk):
+                fire(handlers, "on_first_token", context, chunk)
+            fire(handlers, "on_chunk", context, chunk)
+            yield chunk
+    except GeneratorExit:
+        context.metadata["closed_early"] = True
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        close_quietly(stream)
+        context.finish()
+        if error is None:
+            fire(handlers, "on_success", context, None)
+        else:
+            fire(handlers, "on_error", context, error)
+
+
+def instrument_stream(stream, context, handlers):
+    """Wrap a chunk stream so that chunk/first-token/success/error hooks fire."""
+    return ClosingStream(_instrumented(stream, context, handlers), stream)
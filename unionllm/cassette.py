@@ -0,0 +1,578 @@
+"""
+Record/replay of upstream traffic at the transport level, so provider code
+paths that go through vendor SDKs (google-genai, anthropic, openai, dashscope)
+can be exercised without network and with deterministic responses.
+
+    from unionllm import cassette
+
+    with cassette.use("tests/cassettes/gemini_stream.json.gz"):    # records once, replays afterwards
+        client.completion(model="gemini-2.0-flash", messages=messages, stream=True)
+
+    with cassette.use(path, mode="replay", speed=1.0):   # original chunk timing
+    with cassette.use(path, mode="replay", speed=10):    # 10x faster
+    with cassette.use(path, mode="replay")               # no delays (default)
+
+Three transports are patched while a cassette is in use:
+
+- requests   HTTPAdapter.send (wenxin, dify, coze, dashscope sync calls ...)
+- httpx      HTTPTransport / AsyncHTTPTransport of httpx and httpx2 (openai, anthropic, google-genai SDKs)
+- websocket  websocket-client WebSocketApp (xunfei)
+
+Modes: "once" replays when the file exists and records otherwise, "record"
+always records (overwriting the file), "replay" never touches the network
+and raises CassetteError for a request with no recorded match.
+
+A cassette is JSON (gzip when the path ends in .gz) with one line per
+interaction: the request (credentials redacted) and the response status,
+headers and body chunks, each chunk with its delay after the previous one.
+Requests are matched in recorded order on method, host and path by default;
+match_on can add "query" and "body". allow_repeats=True cycles through the
+matches instead of failing once they are used up, for benchmarks.
+"""
+import base64
+import gzip
+import http
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from .exceptions import UnionLLMError
+
+MODES = ("once", "record", "replay")
+DEFAULT_MATCH_ON = ("method", "host", "path")
+REDACTED = "REDACTED"
+
+# 录制时不保存凭证；头部只保留对排查有用的几项
+SENSITIVE_HEADERS = {"authorization", "proxy-authorization", "api-key", "x-api-key", "x-goog-api-key", "cookie",
+                     "x-dashscope-api-key", "app_key", "sign"}
+SENSITIVE_PARAMS = {"key", "api_key", "apikey", "access_token", "authorization", "signature", "sign", "client_secret"}
+DROPPED_REQUEST_HEADERS = {"host", "content-length", "connection", "accept-encoding", "user-agent", "cookie"}
+DROPPED_RESPONSE_HEADERS = {"content-length", "transfer-encoding", "connection", "content-encoding", "keep-alive",
+                            "date", "set-cookie"}
+
+
+class CassetteError(UnionLLMError):
+    """A request had no recorded match, or the cassette could not be used."""
+
+
+def redact_url(url):
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, REDACTED if k.lower() in SENSITIVE_PARAMS else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _request_headers(headers):
+    kept = {}
+    for key, value in headers.items():
+        name = key.lower()
+        if name in DROPPED_REQUEST_HEADERS or name.startswith("x-stainless"):
+            continue
+        kept[name] = REDACTED if name in SENSITIVE_HEADERS else value
+    return kept
+
+
+def _response_headers(headers):
+    return [[key.lower(), value] for key, value in headers.items() if key.lower() not in DROPPED_RESPONSE_HEADERS]
+
+
+def _encode(data):
+    if isinstance(data, str):
+        return data
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return {"b64": base64.b64encode(data).decode("ascii")}
+
+
+def _decode(data):
+    if isinstance(data, dict):
+        return base64.b64decode(data["b64"])
+    return data.encode("utf-8")
+
+
+def _body_key(body):
+    if body is None or body == "":
+        return ""
+    if isinstance(body, dict):
+        return json.dumps(body, sort_keys=True)
+    try:
+        return json.dumps(json.loads(body), sort_keys=True)
+    except (TypeError, ValueError):
+        return body
+
+
+class Interaction:
+    """One request and its (possibly streamed) response."""
+
+    def __init__(self, transport, method, url, headers=None, body=None, status=None, response_headers=None,
+                 chunks=None, error=None):
+        self.transport = transport
+        self.method = method.upper()
+        self.url = redact_url(url)
+        self.headers = headers or {}
+        self.body = body
+        self.status = status
+        self.response_headers = response_headers or []
+        # [delay_after_previous, data]；第一块的 delay 从请求发出算起，包含首字节时间
+        self.chunks = chunks if chunks is not None else []
+        self.error = error
+        self._last = None
+
+    def key(self, match_on):
+        parts = urlsplit(self.url)
+        values = {
+            "method": self.method,
+            "host": parts.netloc,
+            "path": parts.path,
+            "query": tuple(sorted(parse_qsl(parts.query, keep_blank_values=True))),
+            # websocket 在发出第一帧之前就要选定录像，只能按 URL 匹配
+            "body": "" if self.transport == "websocket" else _body_key(self.body),
+        }
+        return tuple([self.transport] + [values[name] for name in match_on])
+
+    # ---- 录制 ----
+
+    def started(self):
+        self._last = time.perf_counter()
+
+    def add_chunk(self, data):
+        now = time.perf_counter()
+        self.chunks.append([round(now - self._last, 4), _encode(data)])
+        self._last = now
+
+    def failed(self, error):
+        self.error = f"{type(error).__name__}: {error}"
+
+    # ---- 回放 ----
+
+    def iter_chunks(self, speed):
+        for delay, data in self.chunks:
+            if speed and delay > 0:
+                time.sleep(delay / speed)
+            yield _decode(data)
+
+    async def aiter_chunks(self, speed):
+        import asyncio
+
+        for delay, data in self.chunks:
+            if speed and delay > 0:
+                await asyncio.sleep(delay / speed)
+            yield _decode(data)
+
+    def to_dict(self):
+        entry = {"transport": self.transport, "request": {"method": self.method, "url": self.url}}
+        if self.headers:
+            entry["request"]["headers"] = self.headers
+        if self.body not in (None, ""):
+            entry["request"]["body"] = self.body
+        entry["response"] = {"status": self.status, "headers": self.response_headers, "chunks": self.chunks}
+        if self.error:
+            entry["response"]["error"] = self.error
+        return entry
+
+    @classmethod
+    def from_dict(cls, entry):
+        request, response = entry["request"], entry["response"]
+        return cls(entry["transport"], request["method"], request["url"], request.get("headers"), request.get("body"),
+                   response.get("status"), response.get("headers"), response.get("chunks"), response.get("error"))
+
+
+class Cassette:
+    def __init__(self, path, mode="once", speed=None, match_on=DEFAULT_MATCH_ON, allow_repeats=False):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        self.path = path
+        self.speed = speed
+        self.match_on = tuple(match_on)
+        self.allow_repeats = allow_repeats
+        if mode == "once":
+            mode = "replay" if os.path.exists(path) else "record"
+        self.mode = mode
+        self.interactions = []
+        self.play_count = 0
+        self._queues = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self.load()
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise CassetteError(f"cassette {self.path} does not exist")
+        with self._open("r") as f:
+            data = json.load(f)
+        self.interactions = [Interaction.from_dict(entry) for entry in data.get("interactions", [])]
+        self._queues = {}
+        for index, interaction in enumerate(self.interactions):
+            self._queues.setdefault(interaction.key(self.match_on), []).append(index)
+        self._positions = {key: 0 for key in self._queues}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            entries = [json.dumps(i.to_dict(), ensure_ascii=False, separators=(",", ":")) for i in self.interactions]
+        with self._open("w") as f:
+            f.write('{"version":1,"interactions":[\n' + ",\n".join(entries) + "\n]}\n")
+
+    def add(self, interaction):
+        with self._lock:
+            self.interactions.append(interaction)
+        return interaction
+
+    def match(self, transport, method, url, body=None):
+        probe = Interaction(transport, method, url, body=body)
+        key = probe.key(self.match_on)
+        with self._lock:
+            indexes = self._queues.get(key)
+            if indexes:
+                position = self._positions[key]
+                if position >= len(indexes) and self.allow_repeats:
+                    position = 0
+                if position < len(indexes):
+                    self._positions[key] = position + 1
+                    self.play_count += 1
+                    return self.interactions[indexes[position]]
+        raise CassetteError(f"no recorded {transport} interaction left for {probe.method} {probe.url} in {self.path}")
+
+    def __enter__(self):
+        _install(self)
+        return self
+
+    def __exit__(self, *exc):
+        _uninstall(self)
+        if self.recording:
+            self.save()
+
+
+def use(path, mode="once", speed=None, match_on=DEFAULT_MATCH_ON, allow_repeats=False):
+    """Cassette context manager; speed=None replays without delays, 1.0 with the recorded timing."""
+    return Cassette(path, mode=mode, speed=speed, match_on=match_on, allow_repeats=allow_repeats)
+
+
+# ---- 传输层补丁 ----
+
+_active = None
+_originals = {}
+_install_lock = threading.Lock()
+
+
+def _install(cassette):
+    global _active
+    with _install_lock:
+        if _active is not None:
+            raise CassetteError("another cassette is already in use")
+        _active = cassette
+        _patch_requests()
+        _patch_httpx()
+        _patch_websocket()
+
+
+def _uninstall(cassette):
+    global _active
+    with _install_lock:
+        if _active is not cassette:
+            return
+        for (owner, name), original in _originals.items():
+            setattr(owner, name, original)
+        _originals.clear()
+        _active = None
+
+
+def _patch(owner, name, replacement):
+    _originals[(owner, name)] = owner.__dict__[name]
+    setattr(owner, name, replacement)
+
+
+# requests
+
+class _ReplayRaw:
+    """Stands in for urllib3's response as requests.Response.raw."""
+
+    def __init__(self, interaction, speed):
+        self._chunks = interaction.iter_chunks(speed)
+        self._interaction = interaction
+        self._buffer = b""
+        self.closed = False
+
+    def stream(self, amt=None, decode_content=None):
+        for data in self._chunks:
+            yield data
+        if self._interaction.error:
+            from requests.exceptions import ChunkedEncodingError
+
+            raise ChunkedEncodingError(f"replayed upstream error: {self._interaction.error}")
+
+    def read(self, amt=None, decode_content=None, **kwargs):
+        while amt is None or len(self._buffer) < amt:
+            data = next(self._chunks, None)
+            if data is None:
+                break
+            self._buffer += data
+        if amt is None:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        pass
+
+
+class _RecordingRaw:
+    """Wraps urllib3's response and records the decoded body as it is read."""
+
+    def __init__(self, raw, interaction):
+        self._raw = raw
+        self._interaction = interaction
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        try:
+            for data in self._raw.stream(amt, decode_content=True):
+                self._interaction.add_chunk(data)
+                yield data
+        except Exception as e:
+            self._interaction.failed(e)
+            raise
+
+    def read(self, amt=None, decode_content=None, **kwargs):
+        data = self._raw.read(amt, decode_content=True, **kwargs)
+        if data:
+            self._interaction.add_chunk(data)
+        return data
+
+
+def _patch_requests():
+    from requests.adapters import HTTPAdapter
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    original = HTTPAdapter.__dict__["send"]
+
+    def send(adapter, request, **kwargs):
+        cassette = _active
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", "replace")
+        elif not isinstance(body, str):
+            # 流式上传的请求体无法在不消费的情况下读取
+            body = None
+        if not cassette.recording:
+            interaction = cassette.match("requests", request.method, request.url, body)
+            response = Response()
+            response.status_code = interaction.status
+            response.headers = CaseInsensitiveDict(interaction.response_headers)
+            response.encoding = get_encoding_from_headers(response.headers)
+            response.reason = _reason(interaction.status)
+            response.raw = _ReplayRaw(interaction, cassette.speed)
+            response.url = request.url
+            response.request = request
+            response.connection = adapter
+            return response
+
+        request.headers["Accept-Encoding"] = "identity"
+        interaction = Interaction("requests", request.method, request.url, _request_headers(request.headers), body)
+        interaction.started()
+        response = original(adapter, request, **kwargs)
+        interaction.status = response.status_code
+        interaction.response_headers = _response_headers(response.headers)
+        response.raw = _RecordingRaw(response.raw, interaction)
+        cassette.add(interaction)
+        return response
+
+    _patch(HTTPAdapter, "send", send)
+
+
+def _reason(status):
+    try:
+        return http.HTTPStatus(status).phrase
+    except ValueError:
+        return ""
+
+
+# httpx（新版 anthropic SDK 依赖其分支 httpx2，API 相同）
+
+def _patch_httpx():
+    import importlib
+
+    for name in ("httpx", "httpx2"):
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        _patch_httpx_module(module)
+
+
+def _patch_httpx_module(httpx):
+
+    class ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+        def __init__(self, interaction, speed):
+            self.interaction = interaction
+            self.speed = speed
+
+        def __iter__(self):
+            yield from self.interaction.iter_chunks(self.speed)
+            self._raise_recorded_error()
+
+        async def __aiter__(self):
+            async for data in self.interaction.aiter_chunks(self.speed):
+                yield data
+            self._raise_recorded_error()
+
+        def _raise_recorded_error(self):
+            if self.interaction.error:
+                raise httpx.RemoteProtocolError(f"replayed upstream error: {self.interaction.error}")
+
+    class RecordingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+        def __init__(self, stream, interaction):
+            self.stream = stream
+            self.interaction = interaction
+
+        def __iter__(self):
+            try:
+                for data in self.stream:
+                    self.interaction.add_chunk(data)
+                    yield data
+            except Exception as e:
+                self.interaction.failed(e)
+                raise
+
+        async def __aiter__(self):
+            try:
+                async for data in self.stream:
+                    self.interaction.add_chunk(data)
+                    yield data
+            except Exception as e:
+                self.interaction.failed(e)
+                raise
+
+        def close(self):
+            self.stream.close()
+
+        async def aclose(self):
+            await self.stream.aclose()
+
+    def replay(cassette, request, body):
+        interaction = cassette.match("httpx", request.method, str(request.url), body)
+        return httpx.Response(interaction.status, headers=interaction.response_headers, request=request,
+                              stream=ReplayStream(interaction, cassette.speed),
+                              extensions={"http_version": b"HTTP/1.1", "reason_phrase": _reason(interaction.status).encode()})
+
+    def start_recording(cassette, request, body):
+        request.headers["Accept-Encoding"] = "identity"
+        interaction = Interaction("httpx", request.method, str(request.url), _request_headers(request.headers), body)
+        interaction.started()
+        return interaction
+
+    def finish_recording(cassette, interaction, response):
+        interaction.status = response.status_code
+        interaction.response_headers = _response_headers(response.headers)
+        response.stream = RecordingStream(response.stream, interaction)
+        cassette.add(interaction)
+        return response
+
+    original_sync = httpx.HTTPTransport.__dict__["handle_request"]
+    original_async = httpx.AsyncHTTPTransport.__dict__["handle_async_request"]
+
+    def handle_request(transport, request):
+        cassette = _active
+        body = request.read().decode("utf-8", "replace")
+        if not cassette.recording:
+            return replay(cassette, request, body)
+        interaction = start_recording(cassette, request, body)
+        return finish_recording(cassette, interaction, original_sync(transport, request))
+
+    async def handle_async_request(transport, request):
+        cassette = _active
+        body = (await request.aread()).decode("utf-8", "replace")
+        if not cassette.recording:
+            return replay(cassette, request, body)
+        interaction = start_recording(cassette, request, body)
+        return finish_recording(cassette, interaction, await original_async(transport, request))
+
+    _patch(httpx.HTTPTransport, "handle_request", handle_request)
+    _patch(httpx.AsyncHTTPTransport, "handle_async_request", handle_async_request)
+
+
+# websocket-client
+
+def _patch_websocket():
+    try:
+        import websocket
+    except ImportError:
+        return
+
+    App = websocket.WebSocketApp
+    original_run = App.__dict__["run_forever"]
+    original_send = App.__dict__["send"]
+
+    def run_forever(app, *args, **kwargs):
+        cassette = _active
+        if not cassette.recording:
+            return _replay_websocket(cassette, app)
+
+        interaction = cassette.add(Interaction("websocket", "GET", app.url))
+        interaction.started()
+        app._cassette_interaction = interaction
+        on_message = app.on_message
+
+        def record_message(ws, message):
+            interaction.add_chunk(message)
+            if on_message:
+                on_message(ws, message)
+
+        app.on_message = record_message
+        try:
+            return original_run(app, *args, **kwargs)
+        finally:
+            app.on_message = on_message
+            interaction.status = 101
+
+    def send(app, data, *args, **kwargs):
+        interaction = getattr(app, "_cassette_interaction", None)
+        if interaction is not None and _active is not None:
+            # 回放时没有真实连接，发出的帧直接丢弃
+            if not _active.recording:
+                return
+            if interaction.body is None:
+                interaction.body = data if isinstance(data, str) else _encode(data)
+        return original_send(app, data, *args, **kwargs)
+
+    _patch(App, "run_forever", run_forever)
+    _patch(App, "send", send)
+
+
+def _replay_websocket(cassette, app):
+    interaction = cassette.match("websocket", "GET", app.url)
+    app._cassette_interaction = interaction
+    app.keep_running = True
+    app._callback(app.on_open)
+    for data in interaction.iter_chunks(cassette.speed):
+        if not app.keep_running:
+            break
+        message = data.decode("utf-8") if not isinstance(data, str) else data
+        app._callback(app.on_message, message)
+    app.keep_running = False
+    app._callback(app.on_close, 1000, "")
+    return False
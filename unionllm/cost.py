@@ -0,0 +1,374 @@
+"""
+Usage normalization, cost computation and spend aggregation.
+
+    from unionllm import cost
+
+    table = cost.PriceTable.load("prices.json")
+    aggregator = cost.UsageAggregator(group_by=("tenant",), flush_interval=60, sink=save_rows,
+                                      budgets={("acme",): 50.0})
+    cost.enable(table, aggregator)
+
+    client.completion(model, messages, tags={"tenant": "acme", "feature": "search"})
+    response._hidden_params["cost"]      # {"cost": 0.0021, "currency": "USD", ...}
+    aggregator.check_budget({"tenant": "acme"})   # raises BudgetExceededError once spent
+
+Price files map "provider/model" (or just "model"; a trailing * matches by
+prefix) to prices per million tokens:
+
+    {"zhipuai/glm-4*": {"input": 5, "output": 5, "currency": "CNY"},
+     "openai/gpt-4o": {"input": 2.5, "cached_input": 1.25, "output": 10},
+     "o3-mini": {"input": 1.1, "output": 4.4, "reasoning": 4.4}}
+
+Models missing from the table fall back to litellm's model cost map, and
+responses whose provider reports its own cost (Dify's total_cost/cost_unit)
+use that when no price is known.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .callbacks import CallbackHandler, register_callback, unregister_callback
+from .exceptions import BudgetExceededError
+from .utils import cached_prompt_tokens
+
+logger = logging.getLogger(__name__)
+
+PER_TOKENS = 1_000_000
+
+
+def _as_dict(obj):
+    if obj is None:
+        return {}
+    if isinstance(obj, dict):
+        return obj
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return dict(vars(obj))
+
+
+def normalize_usage(usage) -> Dict[str, Any]:
+    """
+    Provider-independent token counts of a Usage (object or dict).
+
+    prompt_tokens counts every input token, cached ones included, and
+    completion_tokens includes reasoning tokens, whichever convention the
+    provider uses (Anthropic reports cache reads/writes outside input_tokens,
+    Gemini reports thought_tokens, OpenAI-compatible APIs use *_details).
+    """
+    values = _as_dict(usage)
+    completion_details = _as_dict(values.get("completion_tokens_details"))
+
+    prompt = values.get("prompt_tokens") or 0
+    completion = values.get("completion_tokens") or 0
+    cache_read = values.get("cache_read_input_tokens") or 0
+    cache_creation = values.get("cache_creation_input_tokens") or 0
+    if cache_read or cache_creation:
+        # Anthropic 的 input_tokens 不含缓存读写部分
+        prompt += cache_read + cache_creation
+        cached = cache_read
+    else:
+        cached = cached_prompt_tokens(values)
+    reasoning = completion_details.get("reasoning_tokens") or values.get("reasoning_tokens") or values.get("thought_tokens") or 0
+
+    normalized = {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion if cache_read or cache_creation else values.get("total_tokens") or prompt + completion,
+        "cached_prompt_tokens": cached,
+        "cache_creation_tokens": cache_creation,
+        "reasoning_tokens": reasoning,
+        "image_prompt_tokens": values.get("image_prompt_tokens") or 0,
+    }
+    if values.get("total_cost") is not None:
+        normalized["provider_cost"] = float(values["total_cost"])
+        normalized["cost_unit"] = values.get("cost_unit")
+    return normalized
+
+
+class ModelPrice:
+    """Prices per million tokens; the optional rates default to input/output."""
+
+    def __init__(self, input: float, output: float, cached_input: Optional[float] = None,
+                 cache_write: Optional[float] = None, reasoning: Optional[float] = None,
+                 image_input: Optional[float] = None, currency: str = "USD"):
+        self.input = float(input)
+        self.output = float(output)
+        self.cached_input = self.input if cached_input is None else float(cached_input)
+        self.cache_write = self.input if cache_write is None else float(cache_write)
+        self.reasoning = self.output if reasoning is None else float(reasoning)
+        self.image_input = self.input if image_input is None else float(image_input)
+        self.currency = currency
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def cost(self, usage: Dict[str, Any]) -> Dict[str, Any]:
+        """Cost of a normalize_usage() dict."""
+        cached = usage["cached_prompt_tokens"]
+        cache_creation = usage["cache_creation_tokens"]
+        image = usage["image_prompt_tokens"]
+        reasoning = usage["reasoning_tokens"]
+        text_input = max(0, usage["prompt_tokens"] - cached - cache_creation - image)
+        text_output = max(0, usage["completion_tokens"] - reasoning)
+
+        breakdown = {
+            "input_cost": (text_input * self.input + image * self.image_input) / PER_TOKENS,
+            "cached_input_cost": (cached * self.cached_input + cache_creation * self.cache_write) / PER_TOKENS,
+            "output_cost": text_output * self.output / PER_TOKENS,
+            "reasoning_cost": reasoning * self.reasoning / PER_TOKENS,
+        }
+        return dict(cost=sum(breakdown.values()), currency=self.currency, source="price_table", **breakdown)
+
+
+class PriceTable:
+    def __init__(self, prices: Optional[Dict[str, Any]] = None, litellm_fallback: bool = True):
+        self.prices = {}
+        self.prefixes = []
+        self.litellm_fallback = litellm_fallback
+        self._unknown = set()
+        for key, price in (prices or {}).items():
+            self.set(key, price)
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def set(self, key: str, price):
+        if not isinstance(price, ModelPrice):
+            price = ModelPrice.from_dict(price)
+        if key.endswith("*"):
+            self.prefixes = [(p, v) for p, v in self.prefixes if p != key[:-1]]
+            self.prefixes.append((key[:-1], price))
+            # 最长前缀优先
+            self.prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+        else:
+            self.prices[key] = price
+        self._unknown.clear()
+
+    def lookup(self, provider: Optional[str], model: str) -> Optional[ModelPrice]:
+        keys = [f"{provider}/{model}", model] if provider else [model]
+        for key in keys:
+            if key in self.prices:
+                return self.prices[key]
+        for key in keys:
+            for prefix, price in self.prefixes:
+                if key.startswith(prefix):
+                    return price
+        if self.litellm_fallback and keys[0] not in self._unknown:
+            price = _litellm_price(provider, model)
+            if price is None:
+                self._unknown.add(keys[0])
+            else:
+                self.prices[keys[0]] = price
+            return price
+        return None
+
+
+def _litellm_price(provider, model):
+    try:
+        import litellm
+    except ImportError:
+        return None
+    model_cost = getattr(litellm, "model_cost", None) or {}
+    entry = model_cost.get(f"{provider}/{model}") or model_cost.get(model)
+    if not entry or entry.get("input_cost_per_token") is None or entry.get("output_cost_per_token") is None:
+        return None
+
+    def per_million(key):
+        value = entry.get(key)
+        return None if value is None else value * PER_TOKENS
+
+    return ModelPrice(
+        input=per_million("input_cost_per_token"),
+        output=per_million("output_cost_per_token"),
+        cached_input=per_million("cache_read_input_token_cost"),
+        cache_write=per_million("cache_creation_input_token_cost"),
+        reasoning=per_million("output_cost_per_reasoning_token"),
+    )
+
+
+_default_table = None
+
+
+def default_price_table() -> PriceTable:
+    """Table from $UNIONLLM_PRICE_TABLE if set, else litellm's cost map only."""
+    global _default_table
+    if _default_table is None:
+        path = os.environ.get("UNIONLLM_PRICE_TABLE")
+        _default_table = PriceTable.load(path) if path else PriceTable()
+    return _default_table
+
+
+def compute_cost(usage, provider: Optional[str], model: str, table: Optional[PriceTable] = None) -> Optional[Dict[str, Any]]:
+    """Cost of one response's usage, or None when neither a price nor a provider-reported cost is known."""
+    normalized = normalize_usage(usage)
+    table = table if table is not None else default_price_table()
+    price = table.lookup(provider, model) if model else None
+    if price is not None:
+        return price.cost(normalized)
+    if "provider_cost" in normalized:
+        return {"cost": normalized["provider_cost"], "currency": normalized.get("cost_unit"), "source": "provider"}
+    return None
+
+
+def completion_cost(response, provider: Optional[str] = None, model: Optional[str] = None,
+                    table: Optional[PriceTable] = None) -> Optional[Dict[str, Any]]:
+    """compute_cost for a ModelResponse, reading the model from the response when not given."""
+    usage = response.get("usage") if isinstance(response, dict) else getattr(response, "usage", None)
+    if model is None:
+        model = response.get("model") if isinstance(response, dict) else getattr(response, "model", None)
+    return compute_cost(usage, provider, model, table)
+
+
+class UsageAggregator:
+    """
+    Thread-safe in-memory roll-up of tokens and spend by tag values.
+
+    group_by names the tags that form a key (missing tags group as None).
+    flush() hands the rows accumulated since the previous flush to `sink` and
+    is called every `flush_interval` seconds from a daemon thread once
+    start() is called; spend totals used for budgets are kept across flushes.
+    """
+
+    FIELDS = ("requests", "errors", "prompt_tokens", "completion_tokens", "cached_prompt_tokens", "reasoning_tokens", "cost")
+
+    def __init__(self, group_by: Tuple[str, ...] = ("tenant",), sink: Optional[Callable] = None,
+                 flush_interval: Optional[float] = None, budgets: Optional[Dict[tuple, float]] = None):
+        self.group_by = tuple(group_by)
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.budgets = dict(budgets or {})
+        self._pending = {}
+        self._spent = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def key(self, tags: Optional[Dict[str, Any]]) -> tuple:
+        tags = tags or {}
+        return tuple(tags.get(name) for name in self.group_by)
+
+    def record(self, tags, usage=None, cost=None, error=False):
+        key = self.key(tags)
+        normalized = normalize_usage(usage) if usage is not None else {}
+        amount = (cost or {}).get("cost") or 0.0
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = self._pending[key] = dict.fromkeys(self.FIELDS, 0)
+            row["requests"] += 1
+            row["errors"] += 1 if error else 0
+            for field in ("prompt_tokens", "completion_tokens", "cached_prompt_tokens", "reasoning_tokens"):
+                row[field] += normalized.get(field, 0)
+            row["cost"] += amount
+            self._spent[key] = self._spent.get(key, 0.0) + amount
+
+    def spent(self, tags) -> float:
+        with self._lock:
+            return self._spent.get(self.key(tags), 0.0)
+
+    def remaining(self, tags) -> Optional[float]:
+        key = self.key(tags)
+        budget = self.budgets.get(key)
+        if budget is None:
+            return None
+        with self._lock:
+            return budget - self._spent.get(key, 0.0)
+
+    def check_budget(self, tags):
+        """Raise BudgetExceededError when the group of `tags` has used up its budget."""
+        key = self.key(tags)
+        budget = self.budgets.get(key)
+        if budget is None:
+            return
+        with self._lock:
+            spent = self._spent.get(key, 0.0)
+        if spent >= budget:
+            raise BudgetExceededError(current_cost=spent, max_budget=budget)
+
+    def set_budget(self, tags, budget: Optional[float]):
+        key = self.key(tags)
+        if budget is None:
+            self.budgets.pop(key, None)
+        else:
+            self.budgets[key] = budget
+
+    def totals(self) -> Dict[tuple, float]:
+        """Spend per key since the aggregator was created."""
+        with self._lock:
+            return dict(self._spent)
+
+    def flush(self):
+        """Swap out the pending rows and pass them to the sink as a list of dicts."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        rows = [dict(zip(self.group_by, key), **row) for key, row in pending.items()]
+        if rows and self.sink is not None:
+            try:
+                self.sink(rows)
+            except Exception:
+                logger.exception("UnionLLM usage sink failed; %d rows dropped", len(rows))
+        return rows
+
+    def start(self):
+        if self._thread is None and self.flush_interval:
+            self._thread = threading.Thread(target=self._run, name="unionllm-usage-flush", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+class CostCallback(CallbackHandler):
+    """
+    Computes the cost of every call, attaches it to the response
+    (_hidden_params["cost"]; context.metadata["cost"] for streams) and feeds
+    the aggregator with the call's tags.
+    """
+
+    def __init__(self, table: Optional[PriceTable] = None, aggregator: Optional[UsageAggregator] = None):
+        self.table = table
+        self.aggregator = aggregator
+
+    def on_success(self, context, response):
+        usage = getattr(response, "usage", None) if response is not None else None
+        usage = usage if usage else context.usage
+        # 用请求的 model 查价，响应里的 model 常带版本后缀
+        model = context.model or getattr(response, "model", None)
+        result = compute_cost(usage, context.provider, model, self.table)
+        context.metadata["cost"] = result
+        if response is not None and result is not None:
+            hidden = dict(getattr(response, "_hidden_params", None) or {})
+            hidden["cost"] = result
+            response._hidden_params = hidden
+        if self.aggregator is not None:
+            self.aggregator.record(context.metadata.get("tags"), usage, result)
+
+    def on_error(self, context, error):
+        if self.aggregator is not None:
+            self.aggregator.record(context.metadata.get("tags"), context.usage or None, error=True)
+
+
+def enable(table: Optional[PriceTable] = None, aggregator: Optional[UsageAggregator] = None) -> CostCallback:
+    handler = CostCallback(table, aggregator)
+    register_callback(handler)
+    if aggregator is not None:
+        aggregator.start()
+    return handler
+
+
+def disable(handler: CostCallback):
+    unregister_callback(handler)
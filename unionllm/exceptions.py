@@ -55,6 +55,8 @@ class Timeout(APITimeoutError):  # type: ignore
         super().__init__(
             request=request
         )  # Call the base class constructor with the parameters it needs
+        # APITimeoutError overwrites message with a generic text, keep ours
+        self.message = message
 
 class RateLimitError(RateLimitError):  # type: ignore
     def __init__(self, message, llm_provider, model, response: httpx.Response):
@@ -134,6 +136,29 @@ class BudgetExceededError(Exception):
         message = f"Budget has been exceeded! Current cost: {current_cost}, Max budget: {max_budget}"
         super().__init__(message)
 
+class RequestCancelled(UnionLLMError):
+    """Raised inside a provider call after the caller cancelled it (e.g. its asyncio task was cancelled)."""
+    pass
+
+class SlowConsumerDropped(UnionLLMError):
+    """Raised to a stream tee consumer that fell too far behind the others and was dropped."""
+    pass
+
+class BatchJobError(UnionLLMError):
+    """Raised when a provider batch job, or one request inside it, failed."""
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.message = message
+        super().__init__(self.message)
+
+class AdmissionRejected(UnionLLMError):
+    """Raised by the request scheduler when a request is not admitted to (or is evicted from) a full queue,
+    and by the prefix-affinity router when every deployment is saturated."""
+    def __init__(self, message):
+        self.status_code = 429
+        self.message = message
+        super().__init__(self.message)
+
 ## DEPRECATED ## 
 class InvalidRequestError(BadRequestError):  # type: ignore
     def __init__(self, message, model, llm_provider):
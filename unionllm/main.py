@@ -1,11 +1,17 @@
 import logging
 import asyncio
+import copy
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from functools import partial
 
-from typing import Any, List, Optional
+from typing import Any, Iterable, List, Optional
 from .providers import zhipu, moonshot, xai, minimax, qwen, tiangong, baichuan, wenxin, xunfei, xunfei_http, dify, fastgpt, coze, litellm, lingyi, stepfun, doubao, deepseek, gemini, azure
 from .exceptions import ProviderError
+from .utils import Deadline, call_context, merge_model_responses, _chunk_field
+from .callbacks import active_callbacks, attach_timings, fire, instrument_stream
+from .streaming import multiplex_streams
+from .tokens import fit_messages
 # from litellm import completion as litellm_completion
 
 logger = logging.getLogger(__name__)
@@ -92,6 +98,66 @@ class UnionLLM:
     def completion(self, model: str, messages: List[str], **kwargs) -> Any:
         if not self.provider_instance:
             raise ProviderError(f"Provider '{self.provider}' is not initialized.")
+        # timeout/deadline 在入口处统一转换为 Deadline，后续各环节共享同一个总预算
+        deadline = Deadline.from_kwargs(kwargs)
+        kwargs['deadline'] = deadline
+        handlers = active_callbacks(kwargs.pop("callbacks", None))
+        stream = bool(kwargs.get("stream"))
+        # 计时信息挂在 deadline 上，check_prompt / 媒体下载 / 调度器都会写入
+        context = call_context(deadline)
+        tags = kwargs.pop("tags", None)
+        if tags:
+            context.metadata["tags"] = dict(context.metadata.get("tags") or {}, **tags)
+        # context_fit="validate" / "trim"：发送前按本地估算的 token 数检查或裁剪历史消息
+        context_fit = kwargs.pop("context_fit", None)
+        context.begin(self.provider, model, stream)
+        if handlers:
+            fire(handlers, "on_request_start", context)
+        try:
+            if context_fit:
+                max_tokens = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens")
+                messages = fit_messages(messages, self.provider, model, max_tokens=max_tokens,
+                                        tools=kwargs.get("tools"), mode=context_fit)
+            n = kwargs.get("n")
+            if n and n > 1 and not getattr(self.provider_instance, "supports_n", True):
+                result = self._fan_out_completion(model, messages, **kwargs)
+            else:
+                result = self._dispatch_completion(model, messages, **kwargs)
+        except Exception as e:
+            if handlers:
+                context.finish()
+                fire(handlers, "on_error", context, e)
+            raise
+        context.responded()
+        if stream:
+            return instrument_stream(result, context, handlers) if handlers else result
+        context.finish(_chunk_field(result, "usage"))
+        attach_timings(result, context)
+        if handlers:
+            fire(handlers, "on_success", context, result)
+        return result
+
+    def _fan_out_completion(self, model: str, messages: List[dict], **kwargs) -> Any:
+        # 上游不支持 n 时并发发出 n 个单选项请求，共享同一个 deadline
+        n = kwargs.pop("n")
+        deadline = kwargs["deadline"]
+        # 部分 provider 会原地改写 messages，每个分支使用独立副本。
+        # 分支并行执行，预处理/媒体下载只由第一个分支计入本次调用的计时，其余分支用子 deadline
+        branch_kwargs = [kwargs] + [dict(kwargs, deadline=deadline.child()) for _ in range(n - 1)]
+        branches = [partial(self._dispatch_completion, model, copy.deepcopy(messages), **branch) for branch in branch_kwargs]
+        if kwargs.get("stream"):
+            return multiplex_streams(branches, deadline=deadline)
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [executor.submit(branch) for branch in branches]
+            try:
+                responses = [future.result() for future in futures]
+            except BaseException:
+                # 任一分支失败即整体失败，释放其余分支的连接
+                deadline.cancel()
+                raise
+        return merge_model_responses(responses)
+
+    def _dispatch_completion(self, model: str, messages: List[dict], **kwargs) -> Any:
         if self.litellm_call_type:
             if self.litellm_call_type == 1:
                 # Jugde whether the model starts with self.provider, if not, add it
@@ -115,19 +181,137 @@ class UnionLLM:
         loop = asyncio.get_event_loop()
         if not self.provider_instance:
             raise ProviderError(f"Provider '{self.provider}' is not initialized.")
-        
-        if self.litellm_call_type:
-            if self.litellm_call_type == 1:
-                if not model.startswith(self.provider + "/"):
-                    model = f"{self.provider}/{model}"
-                func = partial(self.provider_instance.completion, model, messages, **kwargs)
-                return await loop.run_in_executor(None, func)
-            elif self.litellm_call_type == 2:
-                func = partial(self.provider_instance.completion, model, messages, **kwargs)
-                return await loop.run_in_executor(None, func)
-        else:
-            func = partial(self.provider_instance.completion, model, messages, **kwargs)
+        # 在进入线程池之前开始计时，排队等待的时间也计入总预算
+        deadline = Deadline.from_kwargs(kwargs)
+        kwargs['deadline'] = deadline
+        # 等待线程池的时间计入 queue
+        call_context(deadline).queued()
+        func = partial(self.completion, model, messages, **kwargs)
+        try:
             return await loop.run_in_executor(None, func)
+        except asyncio.CancelledError:
+            # 任务被取消时线程仍在运行，通过 deadline 关闭其上游连接
+            deadline.cancel()
+            raise
+
+    def batch_completion(self, model: str, list_of_messages: Iterable[List[dict]], max_concurrency: int = 8, as_completed: bool = False, **kwargs) -> Any:
+        """
+        并发执行一批请求，同时在途的请求数不超过 max_concurrency。
+
+        默认返回与输入顺序一致的列表，单个请求失败时对应位置为异常对象，不影响其余请求；
+        as_completed=True 时返回生成器，按完成顺序产出 (index, result)。
+        timeout 等参数对每个请求单独生效。
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        results = self._iter_batch_completion(model, list_of_messages, max_concurrency, **kwargs)
+        if as_completed:
+            return results
+        ordered = []
+        for index, result in results:
+            if index >= len(ordered):
+                ordered.extend([None] * (index + 1 - len(ordered)))
+            ordered[index] = result
+        return ordered
+
+    def _run_batch_item(self, model, messages, **kwargs):
+        try:
+            return self.completion(model, messages, **kwargs)
+        except Exception as e:
+            return e
+
+    def _iter_batch_completion(self, model, list_of_messages, max_concurrency, **kwargs):
+        # 只在有空位时才从输入中取下一个请求，输入可以是惰性的迭代器
+        items = enumerate(list_of_messages)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            try:
+                while True:
+                    for index, messages in items:
+                        future = executor.submit(self._run_batch_item, model, messages, **kwargs)
+                        in_flight[future] = index
+                        if len(in_flight) >= max_concurrency:
+                            break
+                    if not in_flight:
+                        return
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in sorted(done, key=in_flight.get):
+                        yield in_flight.pop(future), future.result()
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def abatch_completion(self, model: str, list_of_messages: Iterable[List[dict]], max_concurrency: int = 8, as_completed: bool = False, **kwargs) -> Any:
+        """
+        batch_completion 的异步版本。
+
+        默认返回 coroutine，await 后得到按输入顺序排列的结果列表；
+        as_completed=True 时返回异步生成器，按完成顺序产出 (index, result)。
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        results = self._aiter_batch_completion(model, list_of_messages, max_concurrency, **kwargs)
+        if as_completed:
+            return results
+        return self._collect_batch(results)
+
+    async def _collect_batch(self, results):
+        ordered = []
+        async for index, result in results:
+            if index >= len(ordered):
+                ordered.extend([None] * (index + 1 - len(ordered)))
+            ordered[index] = result
+        return ordered
+
+    async def _arun_batch_item(self, index, model, messages, **kwargs):
+        try:
+            return index, await self.acompletion(model, messages, **kwargs)
+        except Exception as e:
+            return index, e
+
+    async def _aiter_batch_completion(self, model, list_of_messages, max_concurrency, **kwargs):
+        items = enumerate(list_of_messages)
+        in_flight = set()
+        try:
+            while True:
+                for index, messages in items:
+                    in_flight.add(asyncio.ensure_future(self._arun_batch_item(index, model, messages, **kwargs)))
+                    if len(in_flight) >= max_concurrency:
+                        break
+                if not in_flight:
+                    return
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for index, result in sorted(task.result() for task in done):
+                    yield index, result
+        finally:
+            # 提前停止消费或被取消时，取消仍在途的请求并释放其上游连接
+            for task in in_flight:
+                task.cancel()
+
+    def batch_backend(self, api_key: Optional[str] = None, api_base: Optional[str] = None, api_version: Optional[str] = None):
+        if not self.provider_instance:
+            raise ProviderError(f"Provider '{self.provider}' is not initialized.")
+        if not hasattr(self.provider_instance, "batch_backend"):
+            raise ProviderError(f"Provider '{self.provider}' does not support batch jobs.")
+        backend_kwargs = {"api_key": api_key, "api_base": api_base, "api_version": api_version}
+        if isinstance(self.provider_instance, litellm.LiteLLMProvider):
+            return self.provider_instance.batch_backend(self.provider, **backend_kwargs)
+        return self.provider_instance.batch_backend(**backend_kwargs)
+
+    def create_batch_job(self, model: str, list_of_messages: List[List[dict]], **kwargs) -> Any:
+        """
+        提交供应商原生的离线批处理任务（OpenAI/Azure、DashScope、Gemini），返回 BatchJob。
+        通过 job.wait().results() 获取与输入顺序一致的结果。
+        """
+        backend = self.batch_backend(**{key: kwargs.pop(key) for key in ("api_key", "api_base", "api_version") if key in kwargs})
+        # 批处理请求体中直接使用供应商侧的模型名
+        if self.provider and model.startswith(self.provider + "/"):
+            model = model[len(self.provider) + 1:]
+        return backend.submit(model, list(list_of_messages), **kwargs)
+
+    def run_batch_job(self, model: str, list_of_messages: List[List[dict]], poll_interval: float = 5.0, max_poll_interval: float = 60.0, wait_timeout: Optional[float] = None, **kwargs) -> List[Any]:
+        job = self.create_batch_job(model, list_of_messages, **kwargs)
+        return job.wait(poll_interval=poll_interval, max_poll_interval=max_poll_interval, timeout=wait_timeout).results()
 
     def check_litellm_providers(self, provider: str) -> bool:
         # Judge whether the provider is supported by LiteLLM, and if provider name should be added to the model name
@@ -0,0 +1,753 @@
+"""
+Local mock upstream speaking the wire protocols UnionLLM's providers use, for
+offline tests and for measuring UnionLLM's own overhead without network.
+
+    from unionllm.mock_server import MockConfig, MockProviderServer
+
+    with MockProviderServer(MockConfig(ttft=0.2, tokens_per_second=50)) as server:
+        client = server.client("dify")
+        for chunk in client.completion(model="app", messages=messages, stream=True):
+            ...
+
+    python -m unionllm.mock_server --port 8800 --ttft 0.2 --tokens-per-second 50 --error-rate 0.01
+
+Protocols and the providers that reach them through server.client():
+
+- openai     POST .../chat/completions (SSE); zhipuai, moonshot, deepseek, baichuan, xunfei_http, wenxin with api_key
+- minimax    POST /v1/text/chatcompletion_v2 (SSE without [DONE])
+- dify       POST /v1/chat-messages (agent_message/message/message_end events)
+- coze       POST /v3/chat (v3 events), POST /open_api/v2/chat (v2 blocking)
+- tiangong   POST /saas/api/v4/generate (app_key/timestamp/sign headers, NDJSON stream)
+- wenxin     POST /oauth/2.0/token, POST /rpc/2.0/ai_custom/v1/wenxinworkshop/chat/<model> ("result" stream)
+- dashscope  POST /api/v1/services/aigc/{text,multimodal}-generation/generation; qwen
+- xunfei     GET /v3.5/chat etc., Spark websocket with HMAC-signed URL
+
+MockConfig controls the reply, latency before the response starts, extra
+time to first token, token rate, and error injection (error_rate with
+error_status, or dropping the connection after disconnect_after tokens).
+server.configure(protocol, ...) overrides it for one protocol. Signed
+protocols (tiangong, wenxin OAuth, xunfei) verify the signature when
+credentials for them are set; server.stats counts requests per protocol and
+server.requests keeps the last (protocol, path, body, headers) received.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_REPLY = "Hello! This is a mock response from the UnionLLM test server, streamed one token at a time."
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+DEFAULT_CREDENTIALS = {
+    "tiangong": ("mock-app-key", "mock-app-secret"),
+    "wenxin": ("mock-client-id", "mock-client-secret"),
+    "xunfei": ("mock-api-key", "mock-api-secret"),
+}
+
+
+class MockConfig:
+    """Behaviour of the mock upstream. Times are seconds."""
+
+    FIELDS = ("reply", "completion_tokens", "latency", "ttft", "tokens_per_second",
+              "error_rate", "error_status", "error_message", "disconnect_after")
+
+    def __init__(self, reply=DEFAULT_REPLY, completion_tokens=None, latency=0.0, ttft=0.0, tokens_per_second=None,
+                 error_rate=0.0, error_status=500, error_message="mock upstream error", disconnect_after=None):
+        self.reply = reply
+        # 指定时循环 reply 的 token 直到这个长度，用于模拟长输出
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_message = error_message
+        self.disconnect_after = disconnect_after
+
+    def replace(self, **changes):
+        unknown = set(changes) - set(self.FIELDS)
+        if unknown:
+            raise TypeError(f"unknown MockConfig fields: {sorted(unknown)}")
+        values = {name: getattr(self, name) for name in self.FIELDS}
+        values.update(changes)
+        return MockConfig(**values)
+
+    def tokens(self, max_tokens=None):
+        pieces = re.findall(r"\S+\s*", self.reply) or [self.reply]
+        if self.completion_tokens:
+            pieces = list(itertools.islice(itertools.cycle(pieces), self.completion_tokens))
+        if max_tokens:
+            pieces = pieces[:max_tokens]
+        return pieces
+
+    def generation_time(self, count):
+        return self.ttft + (count / self.tokens_per_second if self.tokens_per_second else 0.0)
+
+
+class _Disconnect(Exception):
+    pass
+
+
+def _estimate_prompt_tokens(messages):
+    text = json.dumps(messages, ensure_ascii=False) if messages else ""
+    return max(1, len(text) // 4)
+
+
+class _Call:
+    """One request as seen by a protocol handler."""
+
+    def __init__(self, protocol, body, config, messages, model, max_tokens=None):
+        self.protocol = protocol
+        self.body = body
+        self.config = config
+        self.model = model
+        self.tokens = config.tokens(max_tokens)
+        self.prompt_tokens = _estimate_prompt_tokens(messages)
+        self.completion_tokens = len(self.tokens)
+        self.total_tokens = self.prompt_tokens + self.completion_tokens
+        self.id = uuid.uuid4().hex
+        self.created = int(time.time())
+
+    @property
+    def text(self):
+        return "".join(self.tokens)
+
+    def usage(self):
+        return {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens, "total_tokens": self.total_tokens}
+
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    return f"{prefix}data: {payload}\n\n"
+
+
+# ---- 各协议的响应体 -------------------------------------------------------------
+# stream 函数逐个产出 (frame, is_token)，由 _Handler._pace 控制首 token 延迟与吐字速率
+
+def _openai_chunk(call, delta, finish_reason=None, index=0, usage=None):
+    chunk = {
+        "id": call.id, "object": "chat.completion.chunk", "created": call.created, "model": call.model,
+        "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return chunk
+
+
+def _openai_stream(call, n=1, include_usage=False, done=True):
+    for index in range(n):
+        yield _sse(_openai_chunk(call, {"role": "assistant", "content": ""}, index=index)), False
+    for token in call.tokens:
+        for index in range(n):
+            yield _sse(_openai_chunk(call, {"content": token}, index=index)), True
+    for index in range(n):
+        # 未要求 include_usage 时与多数国内 OpenAI 兼容接口一致，usage 随最后一个 chunk 返回
+        usage = call.usage() if index == n - 1 and not include_usage else None
+        yield _sse(_openai_chunk(call, {}, finish_reason="stop", index=index, usage=usage)), False
+    if include_usage:
+        yield _sse({"id": call.id, "object": "chat.completion.chunk", "created": call.created, "model": call.model,
+                    "choices": [], "usage": call.usage()}), False
+    if done:
+        yield "data: [DONE]\n\n", False
+
+
+def _openai_response(call, n=1):
+    return {
+        "id": call.id, "object": "chat.completion", "created": call.created, "model": call.model,
+        "choices": [{"index": i, "message": {"role": "assistant", "content": call.text}, "finish_reason": "stop"} for i in range(n)],
+        "usage": call.usage(),
+    }
+
+
+def _dify_stream(call, event):
+    common = {"task_id": call.id, "message_id": call.id, "conversation_id": call.body.get("conversation_id") or call.id,
+              "created_at": call.created}
+    for token in call.tokens:
+        yield _sse(dict(common, event=event, id=call.id, answer=token)), True
+    usage = dict(call.usage(), total_price="0", currency="USD")
+    yield _sse(dict(common, event="message_end", id=call.id, metadata={"usage": usage, "retriever_resources": []})), False
+
+
+def _dify_response(call):
+    return {
+        "event": "message", "id": call.id, "task_id": call.id, "message_id": call.id, "mode": "chat",
+        "conversation_id": call.body.get("conversation_id") or call.id, "answer": call.text,
+        "metadata": {"usage": dict(call.usage(), total_price="0", currency="USD"), "retriever_resources": []},
+        "created_at": call.created,
+    }
+
+
+def _coze_stream(call):
+    conversation_id = call.body.get("conversation_id") or call.id
+    chat = {"id": call.id, "conversation_id": conversation_id, "bot_id": call.body.get("bot_id"), "created_at": call.created}
+    yield f"event:conversation.chat.created\ndata:{json.dumps(dict(chat, status='created'))}\n\n", False
+    yield f"event:conversation.chat.in_progress\ndata:{json.dumps(dict(chat, status='in_progress'))}\n\n", False
+    message = {"id": "msg-" + call.id, "conversation_id": conversation_id, "bot_id": call.body.get("bot_id"),
+               "chat_id": call.id, "role": "assistant", "type": "answer", "content_type": "text"}
+    for token in call.tokens:
+        yield f"event:conversation.message.delta\ndata:{json.dumps(dict(message, content=token), ensure_ascii=False)}\n\n", True
+    yield f"event:conversation.message.completed\ndata:{json.dumps(dict(message, content=call.text), ensure_ascii=False)}\n\n", False
+    usage = {"token_count": call.total_tokens, "output_count": call.completion_tokens, "input_count": call.prompt_tokens}
+    yield f"event:conversation.chat.completed\ndata:{json.dumps(dict(chat, status='completed', usage=usage))}\n\n", False
+    yield 'event:done\ndata:"[DONE]"\n\n', False
+
+
+def _coze_v2_response(call):
+    return {
+        "code": 0, "msg": "success", "conversation_id": call.body.get("conversation_id") or call.id,
+        "messages": [{"role": "assistant", "type": "answer", "content": call.text, "content_type": "text"}],
+        "usage": call.usage(),
+    }
+
+
+def _tiangong_stream(call):
+    for token in call.tokens:
+        yield json.dumps({"code": 200, "code_msg": "ok", "trace_id": call.id,
+                          "resp_data": {"reply": token, "finish_reason": None}}, ensure_ascii=False) + "\n", True
+    yield json.dumps({"code": 200, "code_msg": "ok", "trace_id": call.id,
+                      "resp_data": {"reply": "", "finish_reason": "stop", "usage": call.usage()}}) + "\n", False
+
+
+def _tiangong_response(call):
+    return {"code": 200, "code_msg": "ok", "trace_id": call.id,
+            "resp_data": {"reply": call.text, "finish_reason": "stop", "usage": call.usage()}}
+
+
+def _wenxin_stream(call):
+    last = len(call.tokens) - 1
+    for i, token in enumerate(call.tokens):
+        chunk = {"id": "as-" + call.id, "object": "chat.completion", "created": call.created, "sentence_id": i,
+                 "is_end": i == last, "is_truncated": False, "result": token, "need_clear_history": False}
+        if i == last:
+            chunk["usage"] = call.usage()
+        yield _sse(chunk), True
+
+
+def _wenxin_response(call):
+    return {"id": "as-" + call.id, "object": "chat.completion", "created": call.created, "result": call.text,
+            "is_truncated": False, "need_clear_history": False, "usage": call.usage()}
+
+
+def _dashscope_output(call, content, finish_reason, multimodal):
+    if multimodal:
+        content = [{"text": content}]
+    return {
+        "output": {"choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}]},
+        "usage": {"input_tokens": call.prompt_tokens, "output_tokens": call.completion_tokens, "total_tokens": call.total_tokens},
+        "request_id": call.id,
+    }
+
+
+def _dashscope_stream(call, multimodal, incremental):
+    text = ""
+    for i, token in enumerate(call.tokens, 1):
+        text += token
+        body = _dashscope_output(call, token if incremental else text, "null", multimodal)
+        yield f"id:{i}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(body, ensure_ascii=False)}\n\n", True
+    body = _dashscope_output(call, "" if incremental else text, "stop", multimodal)
+    yield f"id:{len(call.tokens) + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(body)}\n\n", False
+
+
+def _xunfei_frames(call, sid):
+    for i, token in enumerate(call.tokens):
+        yield json.dumps({"header": {"code": 0, "message": "Success", "sid": sid, "status": 0 if i == 0 else 1},
+                          "payload": {"choices": {"status": 1, "seq": i, "text": [{"content": token, "role": "assistant", "index": 0}]}}},
+                         ensure_ascii=False), True
+    usage = dict(call.usage(), question_tokens=call.prompt_tokens)
+    yield json.dumps({"header": {"code": 0, "message": "Success", "sid": sid, "status": 2},
+                      "payload": {"choices": {"status": 2, "seq": len(call.tokens), "text": [{"content": "", "role": "assistant", "index": 0}]},
+                                  "usage": {"text": usage}}}), False
+
+
+def _error_body(protocol, status, message, call_id):
+    if protocol == "dify":
+        return {"code": "mock_error", "message": message, "status": status}
+    if protocol == "coze":
+        return {"code": status, "msg": message}
+    if protocol == "tiangong":
+        return {"code": status, "code_msg": message, "trace_id": call_id}
+    if protocol == "wenxin":
+        return {"error_code": status, "error_msg": message}
+    if protocol == "dashscope":
+        return {"code": "Throttling" if status == 429 else "InternalError", "message": message, "request_id": call_id}
+    return {"error": {"message": message, "type": "mock_error", "code": status}}
+
+
+# ---- websocket（讯飞星火）：只实现单帧文本消息，足够星火协议使用 ----------------------
+
+def _ws_read_frame(rfile):
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None, b""
+    opcode = header[0] & 0x0F
+    masked = header[1] & 0x80
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", rfile.read(8))[0]
+    mask = rfile.read(4) if masked else b""
+    data = rfile.read(length)
+    if masked:
+        data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+    return opcode, data
+
+
+def _ws_frame(payload, opcode=0x1):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "UnionLLMMock/1.0"
+    # 响应头和响应体分两次写出，开着 Nagle 时 keep-alive 连接每个请求会多等一个 delayed ACK（约 40ms）
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    # ---- 传输层 ----
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, body, content_type="application/json"):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _pace(self, config, frames, write):
+        first = True
+        sent = 0
+        for frame, is_token in frames:
+            if is_token:
+                if first:
+                    if config.ttft:
+                        time.sleep(config.ttft)
+                    first = False
+                elif config.tokens_per_second:
+                    time.sleep(1.0 / config.tokens_per_second)
+                if config.disconnect_after is not None and sent >= config.disconnect_after:
+                    raise _Disconnect()
+                sent += 1
+            write(frame)
+
+    def _stream(self, call, frames, content_type="text/event-stream"):
+        self._start_stream(content_type)
+        try:
+            self._pace(call.config, frames, self._write_chunk)
+        except _Disconnect:
+            # 不写结束块直接断开，客户端看到的是读到一半的连接中断
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _respond(self, call, body):
+        delay = call.config.generation_time(call.completion_tokens)
+        if delay:
+            time.sleep(delay)
+        self._send_json(200, body)
+
+    def _begin(self, protocol, body, messages, model, max_tokens=None):
+        """Count the request, apply latency and error injection; returns the _Call or None if an error was sent."""
+        config = self.mock.config_for(protocol)
+        call = _Call(protocol, body, config, messages, model, max_tokens)
+        self.mock.record(protocol, self.path, body, self.headers)
+        if config.latency:
+            time.sleep(config.latency)
+        if self.mock.should_fail(config):
+            self._send_json(config.error_status, _error_body(protocol, config.error_status, config.error_message, call.id))
+            return None
+        return call
+
+    # ---- 路由 ----
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path.endswith("/chat/completions"):
+            return self._openai()
+        if path.endswith("/text/chatcompletion_v2"):
+            return self._minimax()
+        if path.endswith("/chat-messages"):
+            return self._dify()
+        if path.endswith("/v3/chat"):
+            return self._coze_v3()
+        if path.endswith("/open_api/v2/chat"):
+            return self._coze_v2()
+        if path.endswith("/saas/api/v4/generate"):
+            return self._tiangong()
+        if path.endswith("/oauth/2.0/token"):
+            return self._wenxin_token()
+        if "/wenxinworkshop/chat/" in path:
+            return self._wenxin()
+        if path.endswith("/text-generation/generation") or path.endswith("/multimodal-generation/generation"):
+            return self._dashscope(multimodal="multimodal" in path)
+        self._read_json()
+        self._send_json(404, {"error": {"message": f"mock server has no route for POST {path}"}})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if self.headers.get("Upgrade", "").lower() == "websocket" and re.fullmatch(r"/v\d+(\.\d+)?/chat", path):
+            return self._xunfei()
+        self._send_json(404, {"error": {"message": f"mock server has no route for GET {path}"}})
+
+    def _openai(self):
+        body = self._read_json()
+        protocol = "openai"
+        n = body.get("n") or 1
+        call = self._begin(protocol, body, body.get("messages"), body.get("model"), body.get("max_tokens"))
+        if call is None:
+            return
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return self._stream(call, _openai_stream(call, n=n, include_usage=include_usage))
+        self._respond(call, _openai_response(call, n=n))
+
+    def _minimax(self):
+        body = self._read_json()
+        call = self._begin("minimax", body, body.get("messages"), body.get("model"), body.get("max_tokens"))
+        if call is None:
+            return
+        if body.get("stream"):
+            # MiniMax 的流不以 [DONE] 结束
+            return self._stream(call, _openai_stream(call, done=False))
+        response = _openai_response(call)
+        response["base_resp"] = {"status_code": 0, "status_msg": ""}
+        self._respond(call, response)
+
+    def _dify(self):
+        body = self._read_json()
+        messages = [{"role": "user", "content": body.get("query", "")}]
+        call = self._begin("dify", body, messages, "dify")
+        if call is None:
+            return
+        if body.get("response_mode") == "streaming":
+            return self._stream(call, _dify_stream(call, self.mock.dify_event))
+        self._respond(call, _dify_response(call))
+
+    def _coze_v3(self):
+        body = self._read_json()
+        call = self._begin("coze", body, body.get("additional_messages"), body.get("bot_id"))
+        if call is None:
+            return
+        if body.get("stream"):
+            return self._stream(call, _coze_stream(call))
+        self._respond(call, {"code": 0, "msg": "", "data": {"id": call.id, "conversation_id": call.id,
+                                                            "bot_id": body.get("bot_id"), "status": "in_progress"}})
+
+    def _coze_v2(self):
+        body = self._read_json()
+        messages = list(body.get("chat_history") or []) + [{"role": "user", "content": body.get("query", "")}]
+        call = self._begin("coze", body, messages, body.get("bot_id"))
+        if call is None:
+            return
+        self._respond(call, _coze_v2_response(call))
+
+    def _tiangong(self):
+        body = self._read_json()
+        credentials = self.mock.credentials.get("tiangong")
+        if credentials:
+            app_key, app_secret = credentials
+            timestamp = self.headers.get("timestamp", "")
+            expected = hashlib.md5((app_key + app_secret + timestamp).encode("utf-8")).hexdigest()
+            if self.headers.get("app_key") != app_key or not hmac.compare_digest(self.headers.get("sign", ""), expected):
+                self.mock.record("tiangong", self.path, body, self.headers)
+                return self._send_json(401, {"code": 401, "code_msg": "invalid sign", "trace_id": ""})
+        call = self._begin("tiangong", body, body.get("messages"), body.get("model"))
+        if call is None:
+            return
+        if self.headers.get("stream") == "true":
+            return self._stream(call, _tiangong_stream(call), content_type="application/x-ndjson")
+        self._respond(call, _tiangong_response(call))
+
+    def _wenxin_token(self):
+        self._read_json()
+        params = parse_qs(urlparse(self.path).query)
+        credentials = self.mock.credentials.get("wenxin")
+        client = (params.get("client_id", [""])[0], params.get("client_secret", [""])[0])
+        self.mock.record("wenxin_oauth", self.path, {}, self.headers)
+        if credentials and client != tuple(credentials):
+            return self._send_json(401, {"error": "invalid_client", "error_description": "unknown client id"})
+        self._send_json(200, {"access_token": self.mock.wenxin_token, "expires_in": 2592000, "scope": "mock"})
+
+    def _wenxin(self):
+        body = self._read_json()
+        token = parse_qs(urlparse(self.path).query).get("access_token", [""])[0]
+        if self.mock.credentials.get("wenxin") and token != self.mock.wenxin_token:
+            self.mock.record("wenxin", self.path, body, self.headers)
+            return self._send_json(200, {"error_code": 110, "error_msg": "Access token invalid or no longer valid"})
+        model = urlparse(self.path).path.rsplit("/", 1)[-1]
+        messages = list(body.get("messages") or [])
+        if body.get("system"):
+            messages.insert(0, {"role": "system", "content": body["system"]})
+        call = self._begin("wenxin", body, messages, model, body.get("max_output_tokens"))
+        if call is None:
+            return
+        if body.get("stream"):
+            return self._stream(call, _wenxin_stream(call))
+        self._respond(call, _wenxin_response(call))
+
+    def _dashscope(self, multimodal):
+        body = self._read_json()
+        parameters = body.get("parameters") or {}
+        call = self._begin("dashscope", body, (body.get("input") or {}).get("messages"), body.get("model"), parameters.get("max_tokens"))
+        if call is None:
+            return
+        stream = self.headers.get("X-DashScope-SSE", "").lower() == "enable" or "text/event-stream" in self.headers.get("Accept", "")
+        if stream:
+            return self._stream(call, _dashscope_stream(call, multimodal, bool(parameters.get("incremental_output"))))
+        self._respond(call, _dashscope_output(call, call.text, "stop", multimodal))
+
+    def _xunfei(self):
+        credentials = self.mock.credentials.get("xunfei")
+        if credentials and not self._xunfei_authorized(*credentials):
+            self.mock.record("xunfei", self.path, {}, self.headers)
+            return self._send_json(401, {"message": "HMAC signature does not match"})
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+
+        opcode, data = _ws_read_frame(self.rfile)
+        if opcode != 0x1:
+            return
+        body = json.loads(data)
+        chat = (body.get("parameter") or {}).get("chat") or {}
+        messages = ((body.get("payload") or {}).get("message") or {}).get("text")
+        call = _Call("xunfei", body, self.mock.config_for("xunfei"), messages, chat.get("domain"), chat.get("max_tokens"))
+        self.mock.record("xunfei", self.path, body, self.headers)
+        config = call.config
+        if config.latency:
+            time.sleep(config.latency)
+        send = lambda frame: (self.wfile.write(_ws_frame(frame.encode("utf-8"))), self.wfile.flush())
+        if self.mock.should_fail(config):
+            send(json.dumps({"header": {"code": 10000 + config.error_status, "message": config.error_message, "sid": call.id, "status": 2}}))
+        else:
+            try:
+                self._pace(config, _xunfei_frames(call, call.id), send)
+            except _Disconnect:
+                return
+        self.wfile.write(_ws_frame(struct.pack(">H", 1000), opcode=0x8))
+        self.wfile.flush()
+        # 等客户端回应关闭帧再断开 TCP，否则客户端会把它当作异常断连
+        self.connection.settimeout(1.0)
+        try:
+            _ws_read_frame(self.rfile)
+        except OSError:
+            pass
+
+    def _xunfei_authorized(self, api_key, api_secret):
+        params = parse_qs(urlparse(self.path).query)
+        try:
+            authorization = base64.b64decode(params["authorization"][0]).decode("utf-8")
+            date, host = params["date"][0], params["host"][0]
+            parsedate_to_datetime(date)
+        except (KeyError, ValueError, TypeError):
+            return False
+        signature_origin = f"host: {host}\ndate: {date}\nGET {urlparse(self.path).path} HTTP/1.1"
+        signature = base64.b64encode(hmac.new(api_secret.encode("utf-8"), signature_origin.encode("utf-8"), hashlib.sha256).digest()).decode()
+        return f'api_key="{api_key}"' in authorization and f'signature="{signature}"' in authorization
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # 压测时会同时建立上千个连接，默认的 5 会让多余的连接等待 SYN 重传
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开（取消、超时、压测结束）不是 mock 自身的错误
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockProviderServer:
+    """Threaded mock upstream; use as a context manager or call start()/stop()."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0, credentials=None, dify_event="agent_message", seed=None):
+        self.config = self._initial_config = config or MockConfig()
+        self.overrides = {}
+        self.credentials = dict(DEFAULT_CREDENTIALS if credentials is None else credentials)
+        self.dify_event = dify_event
+        self.wenxin_token = "mock-access-token"
+        self.stats = Counter()
+        self.requests = deque(maxlen=200)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def configure(self, protocol=None, **changes):
+        """Change the config for every protocol, or only for `protocol`."""
+        if protocol is None:
+            self.config = self.config.replace(**changes)
+        else:
+            self.overrides[protocol] = self.config_for(protocol).replace(**changes)
+
+    def reset(self):
+        """Restore the config given at construction and clear the stats."""
+        self.config = self._initial_config
+        self.overrides.clear()
+        with self._lock:
+            self.stats.clear()
+            self.requests.clear()
+
+    def config_for(self, protocol):
+        return self.overrides.get(protocol, self.config)
+
+    def should_fail(self, config):
+        if not config.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < config.error_rate
+
+    def record(self, protocol, path, body, headers=None):
+        with self._lock:
+            self.stats[protocol] += 1
+            self.requests.append((protocol, path, body, dict(headers or {})))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="unionllm-mock-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def client_kwargs(self, provider, model=None):
+        """UnionLLM(...) keyword arguments that point `provider` at this server."""
+        url = self.url
+        if provider in ("zhipuai", "moonshot", "deepseek", "baichuan", "minimax", "xunfei_http", "dify"):
+            return {"api_key": "mock-key", "api_base": url + "/v1"}
+        if provider == "coze":
+            return {"api_key": "mock-key", "bot_id": "mock-bot", "api_base": url}
+        if provider == "tiangong":
+            app_key, app_secret = self.credentials.get("tiangong") or DEFAULT_CREDENTIALS["tiangong"]
+            return {"app_key": app_key, "app_secret": app_secret, "api_base": url}
+        if provider == "wenxin":
+            client_id, client_secret = self.credentials.get("wenxin") or DEFAULT_CREDENTIALS["wenxin"]
+            return {"client_id": client_id, "client_secret": client_secret, "aip_base": url, "api_base": url + "/v2"}
+        if provider == "qwen":
+            return {"api_key": "mock-key", "api_base": url + "/api/v1", "model": model or "qwen-plus"}
+        if provider == "xunfei":
+            api_key, api_secret = self.credentials.get("xunfei") or DEFAULT_CREDENTIALS["xunfei"]
+            return {"app_id": "mock-app", "api_key": api_key, "api_secret": api_secret, "api_base": f"ws://{self.host}:{self.port}"}
+        raise ValueError(f"mock server has no wire protocol for provider {provider!r}")
+
+    def client(self, provider, model=None, **kwargs):
+        from .main import UnionLLM
+
+        return UnionLLM(provider=provider, **dict(self.client_kwargs(provider, model), **kwargs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m unionllm.mock_server", description="Mock upstream for UnionLLM providers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--completion-tokens", type=int, help="repeat the reply up to this many tokens")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the response starts")
+    parser.add_argument("--ttft", type=float, default=0.0, help="extra seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, help="token rate, unlimited by default")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--disconnect-after", type=int, help="drop streams after this many tokens")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(reply=args.reply, completion_tokens=args.completion_tokens, latency=args.latency, ttft=args.ttft,
+                        tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+                        error_status=args.error_status, disconnect_after=args.disconnect_after)
+    server = MockProviderServer(config, host=args.host, port=args.port, seed=args.seed)
+    print(f"UnionLLM mock server listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,138 @@
+"""
+OpenTelemetry tracing and metrics for UnionLLM (optional).
+
+    pip install opentelemetry-api opentelemetry-sdk
+
+    from unionllm import otel
+    otel.instrument()              # global tracer/meter providers
+    otel.instrument(tracer_provider=tp, meter_provider=mp)
+
+Every completion becomes a "unionllm.completion" CLIENT span with child spans
+for the phases recorded on its CallContext: queue, message normalization
+(check_prompt), media fetch, the upstream call and, for streams, stream
+consumption. The phases are only known once the call ends, so children are
+created then with their original start/end times.
+
+Metrics, all labelled with provider and model:
+
+- unionllm.request.duration (histogram, s)
+- unionllm.request.time_to_first_token (histogram, s; streams only)
+- unionllm.requests (counter)
+- unionllm.tokens (counter, token_type=prompt|completion)
+- unionllm.errors (counter, error_type and status_code)
+
+This module imports opentelemetry at import time; nothing else in UnionLLM
+imports it, so the dependency is only needed by callers of instrument().
+"""
+from opentelemetry import metrics, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode, set_span_in_context
+
+from .callbacks import CallbackHandler, register_callback, unregister_callback
+
+SPAN_NAMES = {
+    "queue": "unionllm.queue",
+    "preprocessing": "unionllm.normalize_messages",
+    "media_fetch": "unionllm.media_fetch",
+    "upstream": "unionllm.upstream",
+    "stream": "unionllm.stream",
+}
+
+_SPAN_KEY = "otel_span"
+
+
+class OpenTelemetryCallback(CallbackHandler):
+    """CallbackHandler that exports each call as spans and metrics."""
+
+    def __init__(self, tracer_provider=None, meter_provider=None):
+        self.tracer = trace.get_tracer("unionllm", tracer_provider=tracer_provider)
+        meter = metrics.get_meter("unionllm", meter_provider=meter_provider)
+        self.duration = meter.create_histogram("unionllm.request.duration", unit="s", description="Completion latency")
+        self.ttft = meter.create_histogram("unionllm.request.time_to_first_token", unit="s", description="Time to first streamed token")
+        self.requests = meter.create_counter("unionllm.requests", unit="{request}", description="Completions started")
+        self.tokens = meter.create_counter("unionllm.tokens", unit="{token}", description="Tokens reported by providers")
+        self.errors = meter.create_counter("unionllm.errors", unit="{error}", description="Failed completions")
+
+    @staticmethod
+    def _labels(context):
+        return {"provider": str(context.provider), "model": str(context.model)}
+
+    def on_request_start(self, context):
+        attributes = {
+            "gen_ai.system": str(context.provider),
+            "gen_ai.request.model": str(context.model),
+            "unionllm.stream": bool(context.stream),
+        }
+        context.metadata[_SPAN_KEY] = self.tracer.start_span(
+            "unionllm.completion",
+            kind=SpanKind.CLIENT,
+            attributes=attributes,
+            start_time=context.started_ns,
+        )
+        self.requests.add(1, self._labels(context))
+
+    def on_success(self, context, response):
+        self._end(context)
+
+    def on_error(self, context, error):
+        self._end(context, error)
+
+    def _end(self, context, error=None):
+        span = context.metadata.pop(_SPAN_KEY, None)
+        labels = self._labels(context)
+        timings = context.timings
+
+        if "total" in timings:
+            self.duration.record(timings["total"], labels)
+        if "ttft" in timings:
+            self.ttft.record(timings["ttft"], labels)
+        for token_type in ("prompt", "completion"):
+            count = context.usage.get(token_type + "_tokens")
+            if count:
+                self.tokens.add(count, dict(labels, token_type=token_type))
+        if error is not None:
+            error_labels = dict(labels, error_type=type(error).__name__)
+            status_code = getattr(error, "status_code", None)
+            if status_code is not None:
+                error_labels["status_code"] = str(status_code)
+            self.errors.add(1, error_labels)
+
+        if span is None:
+            return
+        parent = set_span_in_context(span)
+        for name, start, end in context.intervals:
+            child = self.tracer.start_span(
+                SPAN_NAMES.get(name, "unionllm." + name),
+                context=parent,
+                start_time=context.to_ns(start),
+            )
+            child.end(end_time=context.to_ns(end))
+
+        if context.usage.get("prompt_tokens") is not None:
+            span.set_attribute("gen_ai.usage.input_tokens", context.usage["prompt_tokens"])
+        if context.usage.get("completion_tokens") is not None:
+            span.set_attribute("gen_ai.usage.output_tokens", context.usage["completion_tokens"])
+        for key in ("ttfb", "ttft", "tokens_per_second"):
+            if key in timings:
+                span.set_attribute("unionllm." + key, timings[key])
+        if context.stream:
+            span.set_attribute("unionllm.chunks", context.chunk_count)
+            if context.metadata.get("closed_early"):
+                span.set_attribute("unionllm.closed_early", True)
+        if error is not None:
+            span.record_exception(error)
+            span.set_attribute("error.type", type(error).__name__)
+            span.set_status(Status(StatusCode.ERROR, str(error)))
+
+        end_time = context.to_ns(context.started + timings["total"]) if "total" in timings else None
+        span.end(end_time=end_time)
+
+
+def instrument(tracer_provider=None, meter_provider=None):
+    """Register an OpenTelemetryCallback for every call and return it."""
+    handler = OpenTelemetryCallback(tracer_provider=tracer_provider, meter_provider=meter_provider)
+    register_callback(handler)
+    return handler
+
+
+def uninstrument(handler):
+    unregister_callback(handler)
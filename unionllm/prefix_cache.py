@@ -0,0 +1,165 @@
+"""
+Optional cache of converted message prefixes for multi-turn conversations.
+
+Every chat request re-sends the whole history, so check_prompt and the
+provider conversions (Gemini types.Content, Anthropic messages, Moonshot
+base64 media) would redo every earlier turn on each call. With the cache
+enabled a conversion is memoised per message prefix: each raw message is
+fingerprinted, the fingerprints are chained into a rolling hash, and a call
+only converts the messages after the longest prefix it has converted before.
+
+    from unionllm import prefix_cache
+
+    prefix_cache.enable()            # process-wide LRU, 256 prefixes
+    client.completion(model, messages)
+    prefix_cache.disable()
+
+Conversions are cached per message, so they must not depend on neighbouring
+messages. Remote media referenced by a cached message is fetched once and not
+refreshed; a conversion that could not fetch it raises Uncacheable so the
+degraded result is used once and the fetch is retried on the next call.
+Disabled by default; callers then only pay a None check.
+"""
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 256
+
+_DICT = object()
+_LIST = object()
+_SCALARS = (int, float, bool, type(None))
+
+
+def fingerprint(value):
+    """Hashable, comparable snapshot of a raw message (dicts keep their key order)."""
+    cls = type(value)
+    if cls is str:
+        return value
+    if cls is dict:
+        items = tuple(value.items())
+        for _, item in items:
+            if type(item) is not str:
+                return (_DICT,) + tuple([(key, fingerprint(item)) for key, item in items])
+        # 纯文本消息走快速路径，直接用 (key, value) 元组
+        return items
+    if isinstance(value, dict):
+        return (_DICT,) + tuple([(key, fingerprint(item)) for key, item in value.items()])
+    if isinstance(value, (list, tuple)):
+        return (_LIST,) + tuple([fingerprint(item) for item in value])
+    if isinstance(value, str):
+        return value
+    if isinstance(value, _SCALARS) or isinstance(value, bytes):
+        # True == 1 == 1.0，带上类型避免不同值被当成同一前缀
+        return (type(value), value)
+    # SDK 对象（如 genai types.Part）没有稳定的 hash，用 repr 兜底
+    return (type(value), repr(value))
+
+
+class Uncacheable(Exception):
+    """Raised by a conversion: use value for this call, but do not cache the prefix."""
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+
+def _convert_all(messages, convert):
+    """(converted, cacheable): Uncacheable values are kept and mark the result as not cacheable."""
+    converted = []
+    cacheable = True
+    for message in messages:
+        try:
+            converted.append(convert(message))
+        except Uncacheable as e:
+            converted.append(e.value)
+            cacheable = False
+    return converted, cacheable
+
+
+class PrefixCache:
+    """
+    LRU of converted message prefixes, keyed by (namespace, rolling hash).
+
+    The namespace must capture everything besides the message itself that the
+    conversion depends on (provider, model, reformat flags ...).
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 以消息条数计：reused 为复用的前缀消息，converted 为实际转换的消息
+        self.stats = {"hits": 0, "misses": 0, "reused": 0, "converted": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def convert(self, namespace, messages, convert):
+        """
+        Return [convert(m) for m in messages], converting only the messages after
+        the longest cached prefix. Exceptions from convert propagate and nothing
+        is stored for that call; Uncacheable supplies the value and also skips
+        storing.
+        """
+        fingerprints = [fingerprint(message) for message in messages]
+        hashes = []
+        rolling = hash(namespace)
+        for item in fingerprints:
+            rolling = hash((rolling, item))
+            hashes.append(rolling)
+
+        prefix = ()
+        with self._lock:
+            for length in range(len(hashes), 0, -1):
+                entry = self._entries.get((namespace, hashes[length - 1]))
+                # 校验完整指纹，hash 碰撞时当作未命中
+                if entry is not None and len(entry[0]) == length and entry[0] == tuple(fingerprints[:length]):
+                    self._entries.move_to_end((namespace, hashes[length - 1]))
+                    prefix = entry[1]
+                    break
+            self.stats["hits" if prefix else "misses"] += 1
+            self.stats["reused"] += len(prefix)
+            self.stats["converted"] += len(messages) - len(prefix)
+
+        tail, cacheable = _convert_all(messages[len(prefix):], convert)
+        converted = list(prefix) + tail
+        if not cacheable or not hashes or len(prefix) == len(hashes):
+            return converted
+
+        with self._lock:
+            self._entries[(namespace, hashes[-1])] = (tuple(fingerprints), tuple(converted))
+            self._entries.move_to_end((namespace, hashes[-1]))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return converted
+
+
+_cache = None
+
+
+def enable(maxsize: int = DEFAULT_MAXSIZE) -> PrefixCache:
+    """Turn the process-wide prefix cache on (replacing any previous one) and return it."""
+    global _cache
+    _cache = PrefixCache(maxsize)
+    return _cache
+
+
+def disable():
+    global _cache
+    _cache = None
+
+
+def active():
+    return _cache
+
+
+def convert_messages(namespace, messages, convert):
+    """Per-message conversion that goes through the prefix cache when it is enabled."""
+    cache = _cache
+    if cache is None:
+        return _convert_all(messages, convert)[0]
+    return cache.convert(namespace, messages, convert)
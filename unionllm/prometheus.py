@@ -0,0 +1,368 @@
+"""
+In-process Prometheus metrics for long-running workers.
+
+    from unionllm import prometheus
+    prometheus.enable()                        # record every completion
+    prometheus.start_http_server(9464)         # standalone /metrics server
+
+    # or mount on an existing app
+    app.mount("/metrics", prometheus.asgi_app())          # ASGI (Starlette/FastAPI)
+    DispatcherMiddleware(app, {"/metrics": prometheus.wsgi_app()})  # WSGI
+
+Series, labelled with provider and model:
+
+- unionllm_requests_total
+- unionllm_errors_total{status_code}      "unknown" when the error has none
+- unionllm_retries_total                  via record_retry()
+- unionllm_cache_hits_total               responses whose usage reports cached prompt tokens, or record_cache_hit()
+- unionllm_in_flight                      calls started but not finished (streams until consumed)
+- unionllm_request_duration_seconds       histogram
+- unionllm_time_to_first_token_seconds    histogram, streams only
+- unionllm_prompt_tokens_total / unionllm_completion_tokens_total
+
+The hot path takes no lock: each thread updates its own shard of every metric
+and a scrape sums the shards. A lock is only taken the first time a thread
+touches a metric, when a thread exits (its shard is folded into the metric's
+base values) and when a new metric is registered.
+"""
+import bisect
+import threading
+import weakref
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from socketserver import ThreadingMixIn
+
+from .callbacks import CallbackHandler, register_callback, unregister_callback
+from .scheduler import error_status_code
+from .utils import cached_prompt_tokens
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+LABELS = ("provider", "model")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _ShardHolder:
+    """Thread-local owner of a shard; collected when its thread exits."""
+
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        self.values = {}
+
+
+class _Metric:
+    """Base for metrics whose values are kept in per-thread shards."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        # 已退出线程的分片合并到这里，避免线程池不断换线程时分片无限增长
+        self._base = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ShardHolder()
+            with self._lock:
+                self._shards.append(holder.values)
+            weakref.finalize(holder, self._retire, holder.values)
+        return holder.values
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards = [s for s in self._shards if s is not shard]
+            for key, value in shard.items():
+                base = self._base.get(key)
+                if base is None:
+                    self._base[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    for i, item in enumerate(value):
+                        base[i] += item
+                else:
+                    self._base[key] = base + value
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(value) for value in labels)
+
+    def _snapshot(self):
+        with self._lock:
+            shards = list(self._shards)
+            base = {key: list(value) if isinstance(value, list) else value for key, value in self._base.items()}
+        # dict(shard) 在 GIL 下一次完成，不会和写入线程冲突
+        return [base] + [dict(shard) for shard in shards]
+
+    def samples(self):
+        """(suffix, label values, extra label, value) tuples summed over shards."""
+        raise NotImplementedError
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def value(self, labels=()):
+        key = self._key(labels)
+        return sum(shard.get(key, 0) for shard in self._snapshot())
+
+    def samples(self):
+        totals = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return [("", key, None, value) for key, value in sorted(totals.items())]
+
+
+class Gauge(Counter):
+    """Up/down gauge; each shard holds the thread's net change."""
+
+    type = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        key = self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            # 每个桶的计数（非累计）+ 溢出桶，最后两位是 sum 和 count
+            counts = shard[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self):
+        totals = {}
+        for shard in self._snapshot():
+            for key, counts in shard.items():
+                total = totals.setdefault(key, [0] * len(counts))
+                for i, value in enumerate(list(counts)):
+                    total[i] += value
+        samples = []
+        for key, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", key, f'le="{_format_value(float(bound))}"', cumulative))
+            samples.append(("_sum", key, None, counts[-2]))
+            samples.append(("_count", key, None, counts[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class PrometheusCallback(CallbackHandler):
+    """CallbackHandler that records every completion into a MetricsRegistry."""
+
+    def __init__(self, registry=None):
+        registry = registry if registry is not None else REGISTRY
+        self.registry = registry
+        self.requests = registry.counter("unionllm_requests_total", "Completions started.", LABELS)
+        self.errors = registry.counter("unionllm_errors_total", "Failed completions by status code.", LABELS + ("status_code",))
+        self.retries = registry.counter("unionllm_retries_total", "Retried provider calls.", LABELS)
+        self.cache_hits = registry.counter("unionllm_cache_hits_total", "Completions served partly or fully from a cache.", LABELS)
+        self.in_flight = registry.gauge("unionllm_in_flight", "Completions in progress.", LABELS)
+        self.duration = registry.histogram("unionllm_request_duration_seconds", "Completion latency.", LABELS)
+        self.ttft = registry.histogram("unionllm_time_to_first_token_seconds", "Time to first streamed token.", LABELS, buckets=TTFT_BUCKETS)
+        self.prompt_tokens = registry.counter("unionllm_prompt_tokens_total", "Prompt tokens reported by providers.", LABELS)
+        self.completion_tokens = registry.counter("unionllm_completion_tokens_total", "Completion tokens reported by providers.", LABELS)
+
+    def on_request_start(self, context):
+        labels = (context.provider, context.model)
+        self.requests.inc(labels)
+        self.in_flight.inc(labels)
+
+    def on_success(self, context, response):
+        self._finish(context)
+
+    def on_error(self, context, error):
+        status_code = error_status_code(error)
+        self.errors.inc((context.provider, context.model, status_code if status_code is not None else "unknown"))
+        self._finish(context)
+
+    def _finish(self, context):
+        labels = (context.provider, context.model)
+        self.in_flight.dec(labels)
+        timings = context.timings
+        if "total" in timings:
+            self.duration.observe(timings["total"], labels)
+        if "ttft" in timings:
+            self.ttft.observe(timings["ttft"], labels)
+        usage = context.usage
+        if usage.get("prompt_tokens"):
+            self.prompt_tokens.inc(labels, usage["prompt_tokens"])
+        if usage.get("completion_tokens"):
+            self.completion_tokens.inc(labels, usage["completion_tokens"])
+        if cached_prompt_tokens(usage):
+            self.cache_hits.inc(labels)
+
+    def record_retry(self, provider, model):
+        self.retries.inc((provider, model))
+
+    def record_cache_hit(self, provider, model):
+        self.cache_hits.inc((provider, model))
+
+
+_default_handler = None
+_default_lock = threading.Lock()
+
+
+def enable(registry=None):
+    """Register a PrometheusCallback for every call; idempotent for the default registry."""
+    global _default_handler
+    if registry is not None:
+        handler = PrometheusCallback(registry)
+        register_callback(handler)
+        return handler
+    with _default_lock:
+        if _default_handler is None:
+            _default_handler = PrometheusCallback()
+        register_callback(_default_handler)
+        return _default_handler
+
+
+def disable(handler=None):
+    unregister_callback(handler if handler is not None else _default_handler)
+
+
+def record_retry(provider, model, registry=None):
+    """Count a retry done outside UnionLLM (e.g. by an application retry loop)."""
+    registry = registry if registry is not None else REGISTRY
+    registry.counter("unionllm_retries_total", "Retried provider calls.", LABELS).inc((provider, model))
+
+
+def record_cache_hit(provider, model, registry=None):
+    """Count a response served from an application-level cache."""
+    registry = registry if registry is not None else REGISTRY
+    registry.counter("unionllm_cache_hits_total", "Completions served partly or fully from a cache.", LABELS).inc((provider, model))
+
+
+def wsgi_app(registry=None):
+    """WSGI app serving the registry on any path."""
+    registry = registry if registry is not None else REGISTRY
+
+    def app(environ, start_response):
+        body = registry.render().encode("utf-8")
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE), ("Content-Length", str(len(body)))])
+        return [body]
+
+    return app
+
+
+def asgi_app(registry=None):
+    """ASGI app serving the registry on any path."""
+    registry = registry if registry is not None else REGISTRY
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = registry.render().encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", CONTENT_TYPE.encode()), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr="0.0.0.0", registry=None):
+    """Serve the registry from a daemon thread; returns the server (call shutdown() to stop)."""
+    server = make_server(addr, port, wsgi_app(registry), server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name="unionllm-metrics", daemon=True)
+    thread.start()
+    return server
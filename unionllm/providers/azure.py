@@ -5,7 +5,8 @@ import requests
 from typing import Any, Dict, List, Optional
 
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices
+from unionllm import prefix_cache
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices, Deadline, raise_if_timeout, ClosingStream, media_get, with_cached_prompt_tokens
 
 
 class AzureProviderError(Exception):
@@ -55,6 +56,13 @@ class AzureAnthropicProvider(BaseProvider):
 
     SCOPE = "https://cognitiveservices.azure.com/.default"
 
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
+    # Anthropic 每个请求最多 4 个 cache_control 断点
+    MAX_CACHE_BREAKPOINTS = 4
+    EPHEMERAL = {"type": "ephemeral"}
+
     def __init__(self, **kwargs):
         try:
             from anthropic import AnthropicFoundry
@@ -137,7 +145,7 @@ class AzureAnthropicProvider(BaseProvider):
 
         return clean
 
-    def _convert_openai_to_anthropic_messages(self, messages: List[dict]) -> tuple[Optional[str], List[dict]]:
+    def _convert_openai_to_anthropic_messages(self, messages: List[dict], deadline: Optional[Deadline] = None) -> tuple[Optional[str], List[dict]]:
         """
         Convert OpenAI-style messages to Anthropic-style messages.
         
@@ -162,145 +170,226 @@ class AzureAnthropicProvider(BaseProvider):
                 - converted_messages: list - non-system messages in Anthropic format
         """
         system_message = None
-        system_message = None
         converted_messages = []
-        
-        for message in messages:
-            # Handle system role: Anthropic doesn't support system role in messages array
-            # Extract it and return as separate parameter
-            if message.get("role") == "system":
-                content = message.get("content", "")
-                if isinstance(content, str):
-                    system_message = content
-                elif isinstance(content, list):
-                    # Extract text from content blocks
-                    text_parts = []
-                    for block in content:
-                        if isinstance(block, dict) and block.get("type") == "text":
-                            text_parts.append(block.get("text", ""))
-                    system_message = "\n".join(text_parts)
+        # 开启 prefix_cache 时只转换新追加的消息，前缀复用上一轮的转换结果
+        converted = prefix_cache.convert_messages(
+            ("anthropic",), messages, lambda message: self._convert_openai_message(message, deadline=deadline)
+        )
+        for converted_msg in converted:
+            if converted_msg is None:
                 continue
-            
-            # Handle tool role conversion: OpenAI's role="tool" -> Anthropic's role="user" with tool_result
-            if message.get("role") == "tool":
-                converted_msg = {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": message.get("tool_call_id", ""),
-                            "content": message.get("content", "")
-                        }
-                    ]
-                }
+            if converted_msg.get("role") == "system":
+                system_message = converted_msg["content"]
+            else:
                 converted_messages.append(converted_msg)
-                continue
-            
-            # Handle assistant messages with tool_calls
-            if message.get("role") == "assistant" and "tool_calls" in message:
-                converted_content = []
-                
-                # Add text content if present
-                if message.get("content"):
-                    if isinstance(message["content"], str):
-                        converted_content.append({
-                            "type": "text",
-                            "text": message["content"]
-                        })
-                    elif isinstance(message["content"], list):
-                        # Already in content block format
-                        converted_content.extend(message["content"])
-                
-                # Convert tool_calls to tool_use blocks
-                for tool_call in message.get("tool_calls", []):
-                    tool_use_block = {
-                        "type": "tool_use",
-                        "id": tool_call.get("id", ""),
-                        "name": tool_call.get("function", {}).get("name", ""),
+        
+        return system_message, converted_messages
+
+    def _convert_openai_message(self, message: dict, deadline: Optional[Deadline] = None) -> Optional[dict]:
+        """
+        Convert a single OpenAI-style message, see _convert_openai_to_anthropic_messages.
+        System messages come back as {"role": "system", "content": <text or text blocks>}.
+        A message-level cache_control hint is moved onto the last content block.
+        """
+        cache_control = message.get("cache_control")
+        if cache_control:
+            message = {k: v for k, v in message.items() if k != "cache_control"}
+            return self._mark_cache_breakpoint(self._convert_openai_message(message, deadline=deadline), cache_control)
+
+        # Handle system role: Anthropic doesn't support system role in messages array
+        # Extract it and return as separate parameter
+        if message.get("role") == "system":
+            content = message.get("content", "")
+            if isinstance(content, str):
+                return {"role": "system", "content": content}
+            elif isinstance(content, list):
+                # Extract text from content blocks
+                text_blocks = [block for block in content if isinstance(block, dict) and block.get("type") == "text"]
+                if any(block.get("cache_control") for block in text_blocks):
+                    # 带缓存断点的 system 保留为 text block 列表
+                    return {"role": "system", "content": [
+                        {k: v for k, v in block.items() if k in ("type", "text", "cache_control")} for block in text_blocks
+                    ]}
+                return {"role": "system", "content": "\n".join(block.get("text", "") for block in text_blocks)}
+            return None
+        
+        # Handle tool role conversion: OpenAI's role="tool" -> Anthropic's role="user" with tool_result
+        if message.get("role") == "tool":
+            converted_msg = {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": message.get("tool_call_id", ""),
+                        "content": message.get("content", "")
                     }
-                    
-                    # Parse arguments from string to dict
-                    arguments = tool_call.get("function", {}).get("arguments", "{}")
-                    if isinstance(arguments, str):
-                        try:
-                            import json
-                            tool_use_block["input"] = json.loads(arguments)
-                        except Exception:
-                            # If parsing fails, use empty dict
-                            tool_use_block["input"] = {}
-                    else:
-                        tool_use_block["input"] = arguments
-                    
-                    converted_content.append(tool_use_block)
-                
-                converted_msg = {
-                    "role": "assistant",
-                    "content": converted_content
-                }
-                converted_messages.append(converted_msg)
-                continue
+                ]
+            }
+            return converted_msg
+        
+        # Handle assistant messages with tool_calls
+        if message.get("role") == "assistant" and "tool_calls" in message:
+            converted_content = []
             
-            # Handle regular messages
-            converted_msg = {k: v for k, v in message.items() if k not in ["content", "tool_calls"]}
+            # Add text content if present
+            if message.get("content"):
+                if isinstance(message["content"], str):
+                    converted_content.append({
+                        "type": "text",
+                        "text": message["content"]
+                    })
+                elif isinstance(message["content"], list):
+                    # Already in content block format
+                    converted_content.extend(message["content"])
             
-            # Handle string content
-            if isinstance(message.get("content"), str):
-                converted_msg["content"] = message["content"]
-            # Handle list content (multimodal)
-            elif isinstance(message.get("content"), list):
-                converted_content = []
-                for content_block in message.get("content", []):
-                    if content_block.get("type") == "text":
-                        converted_content.append({
-                            "type": "text",
-                            "text": content_block.get("text", "")
-                        })
-                    elif content_block.get("type") == "image_url":
-                        # Convert OpenAI image_url to Anthropic image
-                        converted_content.append(
-                            self._convert_image_url_to_anthropic(content_block)
-                        )
-                    elif content_block.get("type") == "image":
-                        # Already Anthropic format, pass through
-                        converted_content.append(content_block)
-                    elif content_block.get("type") == "video_url":
-                        # Convert OpenAI video_url to Anthropic video
-                        converted_content.append(
-                            self._convert_video_url_to_anthropic(content_block)
-                        )
-                    elif content_block.get("type") == "video":
-                        # Already Anthropic format, pass through
-                        converted_content.append(content_block)
-                    elif content_block.get("type") == "file_url":
-                        # Convert file_url to document format
-                        converted_content.append(
-                            self._convert_file_url_to_anthropic(content_block)
-                        )
-                    elif content_block.get("type") == "file":
-                        # Convert file to document format
-                        converted_content.append(
-                            self._convert_file_to_anthropic(content_block)
-                        )
-                    elif content_block.get("type") == "document":
-                        # Already Anthropic format, pass through
-                        converted_content.append(content_block)
-                    elif content_block.get("type") == "tool_result":
-                        # Already Anthropic format, pass through
-                        converted_content.append(content_block)
-                    elif content_block.get("type") == "tool_use":
-                        # Already Anthropic format, pass through
-                        converted_content.append(content_block)
-                    else:
-                        # Unknown type, pass through as-is
-                        converted_content.append(content_block)
+            # Convert tool_calls to tool_use blocks
+            for tool_call in message.get("tool_calls", []):
+                tool_use_block = {
+                    "type": "tool_use",
+                    "id": tool_call.get("id", ""),
+                    "name": tool_call.get("function", {}).get("name", ""),
+                }
+                
+                # Parse arguments from string to dict
+                arguments = tool_call.get("function", {}).get("arguments", "{}")
+                if isinstance(arguments, str):
+                    try:
+                        import json
+                        tool_use_block["input"] = json.loads(arguments)
+                    except Exception:
+                        # If parsing fails, use empty dict
+                        tool_use_block["input"] = {}
+                else:
+                    tool_use_block["input"] = arguments
                 
-                converted_msg["content"] = converted_content
+                converted_content.append(tool_use_block)
             
-            converted_messages.append(converted_msg)
+            converted_msg = {
+                "role": "assistant",
+                "content": converted_content
+            }
+            return converted_msg
         
-        return system_message, converted_messages
+        # Handle regular messages
+        converted_msg = {k: v for k, v in message.items() if k not in ["content", "tool_calls"]}
+        
+        # Handle string content
+        if isinstance(message.get("content"), str):
+            converted_msg["content"] = message["content"]
+        # Handle list content (multimodal)
+        elif isinstance(message.get("content"), list):
+            converted_content = []
+            for content_block in message.get("content", []):
+                if content_block.get("type") == "text":
+                    converted_content.append({
+                        "type": "text",
+                        "text": content_block.get("text", "")
+                    })
+                elif content_block.get("type") == "image_url":
+                    # Convert OpenAI image_url to Anthropic image
+                    converted_content.append(
+                        self._convert_image_url_to_anthropic(content_block, deadline=deadline)
+                    )
+                elif content_block.get("type") == "image":
+                    # Already Anthropic format, pass through
+                    converted_content.append(content_block)
+                elif content_block.get("type") == "video_url":
+                    # Convert OpenAI video_url to Anthropic video
+                    converted_content.append(
+                        self._convert_video_url_to_anthropic(content_block, deadline=deadline)
+                    )
+                elif content_block.get("type") == "video":
+                    # Already Anthropic format, pass through
+                    converted_content.append(content_block)
+                elif content_block.get("type") == "file_url":
+                    # Convert file_url to document format
+                    converted_content.append(
+                        self._convert_file_url_to_anthropic(content_block)
+                    )
+                elif content_block.get("type") == "file":
+                    # Convert file to document format
+                    converted_content.append(
+                        self._convert_file_to_anthropic(content_block)
+                    )
+                elif content_block.get("type") == "document":
+                    # Already Anthropic format, pass through
+                    converted_content.append(content_block)
+                elif content_block.get("type") == "tool_result":
+                    # Already Anthropic format, pass through
+                    converted_content.append(content_block)
+                elif content_block.get("type") == "tool_use":
+                    # Already Anthropic format, pass through
+                    converted_content.append(content_block)
+                else:
+                    # Unknown type, pass through as-is
+                    converted_content.append(content_block)
+
+            # 每个内容块各对应一个转换结果，透传其上的 cache_control
+            for index, content_block in enumerate(message["content"]):
+                if content_block.get("cache_control") and "cache_control" not in converted_content[index]:
+                    converted_content[index] = dict(converted_content[index], cache_control=content_block["cache_control"])
+            
+            converted_msg["content"] = converted_content
+        
+        return converted_msg
+
+    @staticmethod
+    def _mark_cache_breakpoint(message: Optional[dict], cache_control: dict) -> Optional[dict]:
+        """Copy of a converted message with cache_control set on its last content block."""
+        if not message:
+            return message
+        content = message.get("content")
+        if isinstance(content, str) and content:
+            blocks = [{"type": "text", "text": content, "cache_control": cache_control}]
+        elif isinstance(content, list) and content:
+            blocks = list(content)
+            blocks[-1] = dict(blocks[-1], cache_control=cache_control)
+        else:
+            return message
+        return dict(message, content=blocks)
+
+    @staticmethod
+    def _count_cache_breakpoints(content) -> int:
+        if not isinstance(content, list):
+            return 0
+        return sum(1 for block in content if isinstance(block, dict) and block.get("cache_control"))
+
+    def _apply_prompt_caching(self, params: Dict[str, Any], messages: List[dict], mode=None) -> List[dict]:
+        """
+        prompt_caching="auto" (or True): add cache_control breakpoints on the last tool,
+        the system prompt and the last two user messages -- this turn writes the history
+        prefix to the cache and the next turn reads it. Explicit hints are kept and count
+        towards Anthropic's limit of MAX_CACHE_BREAKPOINTS per request. Converted messages
+        are copied, never modified in place, since the prefix cache may share them.
+        """
+        if mode not in (True, "auto"):
+            return messages
+        tools = params.get("tools") or []
+        system = params.get("system")
+        slots = self.MAX_CACHE_BREAKPOINTS - (
+            self._count_cache_breakpoints(tools)
+            + self._count_cache_breakpoints(system)
+            + sum(self._count_cache_breakpoints(message.get("content")) for message in messages)
+        )
+        if slots > 0 and tools and not self._count_cache_breakpoints(tools):
+            params["tools"] = tools[:-1] + [dict(tools[-1], cache_control=self.EPHEMERAL)]
+            slots -= 1
+        if slots > 0 and system and not self._count_cache_breakpoints(system):
+            params["system"] = self._mark_cache_breakpoint({"content": system}, self.EPHEMERAL)["content"]
+            slots -= 1
+        user_indexes = [index for index, message in enumerate(messages) if message.get("role") == "user"]
+        marked = list(messages)
+        for index in reversed(user_indexes[-2:]):
+            if slots <= 0:
+                break
+            if self._count_cache_breakpoints(marked[index].get("content")):
+                continue
+            marked[index] = self._mark_cache_breakpoint(marked[index], self.EPHEMERAL)
+            if marked[index] is not messages[index]:
+                slots -= 1
+        return marked
 
-    def _convert_image_url_to_anthropic(self, image_block: dict) -> dict:
+    def _convert_image_url_to_anthropic(self, image_block: dict, deadline: Optional[Deadline] = None) -> dict:
         """
         Convert OpenAI-style image_url block to Anthropic image block.
         Supports:
@@ -340,7 +429,8 @@ class AzureAnthropicProvider(BaseProvider):
         
         # Download image from URL
         try:
-            response = requests.get(url, timeout=30)
+            deadline = deadline or Deadline()
+            response = media_get(deadline, url, timeout=deadline.requests_timeout(default=30, llm_provider="azure"))
             response.raise_for_status()
             
             # Determine media type from Content-Type header
@@ -370,12 +460,13 @@ class AzureAnthropicProvider(BaseProvider):
                 }
             }
         except Exception as e:
+            raise_if_timeout(e, llm_provider="azure")
             raise AzureProviderError(
                 status_code=500,
                 message=f"Failed to download image from URL: {str(e)}"
             )
 
-    def _convert_video_url_to_anthropic(self, video_block: dict) -> dict:
+    def _convert_video_url_to_anthropic(self, video_block: dict, deadline: Optional[Deadline] = None) -> dict:
         """
         Convert OpenAI-style video_url block to Anthropic video block.
         Supports URL-based videos (downloads and encodes to base64).
@@ -391,7 +482,8 @@ class AzureAnthropicProvider(BaseProvider):
         
         # Download video from URL
         try:
-            response = requests.get(url, timeout=60)
+            deadline = deadline or Deadline()
+            response = media_get(deadline, url, timeout=deadline.requests_timeout(default=60, llm_provider="azure"))
             response.raise_for_status()
             
             # Determine media type from Content-Type header
@@ -423,6 +515,7 @@ class AzureAnthropicProvider(BaseProvider):
                 }
             }
         except Exception as e:
+            raise_if_timeout(e, llm_provider="azure")
             raise AzureProviderError(
                 status_code=500,
                 message=f"Failed to download video from URL: {str(e)}"
@@ -575,6 +668,8 @@ class AzureAnthropicProvider(BaseProvider):
                     "description": func.get("description", ""),
                     "input_schema": func.get("parameters", {})  # Map 'parameters' to 'input_schema'
                 }
+                if tool.get("cache_control"):
+                    anthropic_tool["cache_control"] = tool["cache_control"]
                 converted_tools.append(anthropic_tool)
             else:
                 # Pass through non-function tools as-is
@@ -632,16 +727,28 @@ class AzureAnthropicProvider(BaseProvider):
         try:
             usage = getattr(foundry_resp, "usage", None)
             if usage:
-                prompt_tokens = getattr(usage, "input_tokens", None) or usage.get("input_tokens") if isinstance(usage, dict) else None
-                completion_tokens = getattr(usage, "output_tokens", None) or usage.get("output_tokens") if isinstance(usage, dict) else None
+                if isinstance(usage, dict):
+                    prompt_tokens = usage.get("input_tokens")
+                    completion_tokens = usage.get("output_tokens")
+                    cache_creation = usage.get("cache_creation_input_tokens")
+                    cache_read = usage.get("cache_read_input_tokens")
+                else:
+                    prompt_tokens = getattr(usage, "input_tokens", None)
+                    completion_tokens = getattr(usage, "output_tokens", None)
+                    cache_creation = getattr(usage, "cache_creation_input_tokens", None)
+                    cache_read = getattr(usage, "cache_read_input_tokens", None)
                 total_tokens = None
                 if prompt_tokens is not None and completion_tokens is not None:
                     total_tokens = prompt_tokens + completion_tokens
+                # 与 Anthropic 一致，prompt_tokens 不含缓存读写的 token，两者单独返回
                 usage_obj = Usage(
                     prompt_tokens=prompt_tokens,
                     completion_tokens=completion_tokens,
                     total_tokens=total_tokens,
+                    cache_creation_input_tokens=cache_creation or 0,
+                    cache_read_input_tokens=cache_read or 0,
                 )
+                with_cached_prompt_tokens(usage_obj)
         except Exception:
             usage_obj = None
 
@@ -653,16 +760,18 @@ class AzureAnthropicProvider(BaseProvider):
             usage=usage_obj,
         )
 
-    def post_stream_processing_wrapper(self, model: str, messages: List[dict], **kwargs):
+    def post_stream_processing_wrapper(self, model: str, messages: List[dict], deadline: Optional[Deadline] = None, **kwargs):
         """
         Stream AnthropicFoundry events and yield OpenAI-like streaming chunks.
         """        
+        deadline = deadline or Deadline()
         # Convert messages to Anthropic format and extract system message
         try:
-            system_message, messages = self._convert_openai_to_anthropic_messages(messages)
+            system_message, messages = self._convert_openai_to_anthropic_messages(messages, deadline=deadline)
         except AzureProviderError:
             raise
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="azure")
             raise AzureProviderError(
                 status_code=500,
                 message=f"Failed to convert messages format: {str(e)}"
@@ -689,19 +798,30 @@ class AzureAnthropicProvider(BaseProvider):
                     status_code=500,
                     message=f"Failed to convert tools format: {str(e)}"
                 )
+        messages = self._apply_prompt_caching(params, messages, kwargs.get("prompt_caching"))
         
-        stream = self.client.messages.create(
-            model=model,
-            messages=messages,
-            **params,
-        )
+        try:
+            stream = self.client.messages.create(
+                model=model,
+                messages=messages,
+                **params,
+                **deadline.sdk_kwargs(model=model, llm_provider="azure"),
+            )
+        except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="azure")
+            raise
+        # Release the upstream connection if the consumer stops iterating early
+        stream = ClosingStream(iter(stream), stream, deadline=deadline)
 
         msg_id = None
         finish_reason = None
         tool_calls = {}  # Track tool calls by index
         content_blocks = {}  # Track content blocks by index
+        input_tokens = None  # message_delta 的 usage 可能不带 input_tokens，取 message_start 里的值
+        cache_creation_tokens = cache_read_tokens = None
         
         for event in stream:            
+            deadline.check(model=model, llm_provider="azure")
             # Extract message ID from message_start event
             if msg_id is None:
                 if hasattr(event, "message") and hasattr(event.message, "id"):
@@ -716,6 +836,10 @@ class AzureAnthropicProvider(BaseProvider):
                 # Message started, extract ID and initial data
                 if hasattr(event, "message") and hasattr(event.message, "id"):
                     msg_id = event.message.id
+                start_usage = getattr(getattr(event, "message", None), "usage", None)
+                input_tokens = getattr(start_usage, "input_tokens", None)
+                cache_creation_tokens = getattr(start_usage, "cache_creation_input_tokens", None)
+                cache_read_tokens = getattr(start_usage, "cache_read_input_tokens", None)
 
             elif event_type == "content_block_start":
                 # New content block started (text or tool_use)
@@ -870,11 +994,12 @@ class AzureAnthropicProvider(BaseProvider):
                 
                 if hasattr(event, "usage"):
                     chunk_usage = Usage()
-                    chunk_usage.prompt_tokens = event.usage.input_tokens
-                    chunk_usage.completion_tokens = event.usage.output_tokens
-                    chunk_usage.cache_creation_input_tokens = event.usage.cache_creation_input_tokens
-                    chunk_usage.cache_read_input_tokens = event.usage.cache_read_input_tokens
+                    chunk_usage.prompt_tokens = getattr(event.usage, "input_tokens", None) or input_tokens or 0
+                    chunk_usage.completion_tokens = event.usage.output_tokens or 0
+                    chunk_usage.cache_creation_input_tokens = getattr(event.usage, "cache_creation_input_tokens", None) or cache_creation_tokens or 0
+                    chunk_usage.cache_read_input_tokens = getattr(event.usage, "cache_read_input_tokens", None) or cache_read_tokens or 0
                     chunk_usage.total_tokens = chunk_usage.prompt_tokens + chunk_usage.completion_tokens
+                    with_cached_prompt_tokens(chunk_usage)
 
                 model_response = ModelResponse(
                     id=msg_id,
@@ -887,32 +1012,35 @@ class AzureAnthropicProvider(BaseProvider):
                 yield model_response
 
     def completion(self, model: str, messages: List[dict], **kwargs) -> ModelResponse:
+        deadline = Deadline.from_kwargs(kwargs)
         if not model or messages is None:
             raise AzureProviderError(status_code=422, message="Missing model or messages")
 
         # Ensure message format is acceptable, and check multimodal constraints
-        check = self.check_prompt("anthropic", model, messages)
+        check = self.check_prompt("anthropic", model, messages, deadline=deadline)
         if not check.get("pass_check"):
             raise AzureProviderError(status_code=422, message=str(check.get("reason")))
         norm_messages = check.get("messages", messages)
-
-        # Convert OpenAI-style messages to Anthropic-style messages and extract system message
-        # This handles image_url -> image, video_url -> video, system -> system parameter, etc.
-        try:
-            system_message, norm_messages = self._convert_openai_to_anthropic_messages(norm_messages)
-        except AzureProviderError:
-            raise
-        except Exception as e:
-            raise AzureProviderError(
-                status_code=500,
-                message=f"Failed to convert messages format: {str(e)}"
-            )
-
         stream = kwargs.get("stream", False)
 
+        if not stream:
+            # Convert OpenAI-style messages to Anthropic-style messages and extract system message
+            # This handles image_url -> image, video_url -> video, system -> system parameter, etc.
+            # 流式请求在 post_stream_processing_wrapper 中转换，避免重复转换并丢失 system
+            try:
+                system_message, norm_messages = self._convert_openai_to_anthropic_messages(norm_messages, deadline=deadline)
+            except AzureProviderError:
+                raise
+            except Exception as e:
+                raise_if_timeout(e, model=model, llm_provider="azure")
+                raise AzureProviderError(
+                    status_code=500,
+                    message=f"Failed to convert messages format: {str(e)}"
+                )
+
         if stream:
             try:
-                return self.post_stream_processing_wrapper(model, norm_messages, **kwargs)
+                return self.post_stream_processing_wrapper(model, norm_messages, deadline=deadline, **kwargs)
             except AzureProviderError:
                 raise
             except Exception as e:
@@ -939,6 +1067,7 @@ class AzureAnthropicProvider(BaseProvider):
                         status_code=500,
                         message=f"Failed to convert tools format: {str(e)}"
                     )
+            norm_messages = self._apply_prompt_caching(params, norm_messages, kwargs.get("prompt_caching"))
 
             try:
                 # AnthropicFoundry expects messages list with {role, content}
@@ -946,8 +1075,10 @@ class AzureAnthropicProvider(BaseProvider):
                     model=model,
                     messages=norm_messages,
                     **params,
+                    **deadline.sdk_kwargs(model=model, llm_provider="azure"),
                 )
             except Exception as e:
+                raise_if_timeout(e, model=model, llm_provider="azure")
                 status = getattr(e, "status_code", 500)
                 raise AzureProviderError(status_code=status, message=str(e))
 
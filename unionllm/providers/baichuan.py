@@ -1,6 +1,6 @@
 import json
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices, Deadline, raise_if_timeout
 import requests
 import logging, os
 
@@ -23,7 +23,8 @@ class BaiChuanAIProvider(BaseProvider):
             raise BaiChuanOpenAIError(
                 status_code=422, message=f"Missing API key"
             )
-        self.endpoint_url = "https://api.baichuan-ai.com/v1/chat/completions"
+        base_url = model_kwargs.get("api_base") or "https://api.baichuan-ai.com/v1"
+        self.endpoint_url = f"{base_url}/chat/completions"
 
     def pre_processing(self, **kwargs):
         supported_params = [
@@ -36,14 +37,14 @@ class BaiChuanAIProvider(BaseProvider):
                 kwargs.pop(key)
         return kwargs
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        response = requests.post(self.endpoint_url, headers=headers, data=payload)
-        for line in response.iter_lines():
+        response = self.stream_post(self.endpoint_url, deadline, model=model, llm_provider="baichuan", headers=headers, data=payload)
+        for line in self.iter_response_lines(response, deadline, model=model, llm_provider="baichuan"):
             if line:
                 new_line = line.decode("utf-8").replace("data: ", "")
                 if new_line == "[DONE]":
@@ -109,13 +110,14 @@ class BaiChuanAIProvider(BaseProvider):
 
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise BaiChuanOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
 
-            message_check_result = self.check_prompt("baichuan", model, messages)    
+            message_check_result = self.check_prompt("baichuan", model, messages, deadline=deadline)    
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -127,16 +129,17 @@ class BaiChuanAIProvider(BaseProvider):
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model, messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model, messages, deadline=deadline, **new_kwargs)
             else:
                 payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
                 headers = {
                     "Authorization": f"Bearer {self.api_key}",
                     "Content-Type": "application/json",
                 }
-                result = requests.post(self.endpoint_url, headers=headers, data=payload)
+                result = requests.post(self.endpoint_url, headers=headers, data=payload, timeout=deadline.requests_timeout(model=model, llm_provider="baichuan"))
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="baichuan")
             if hasattr(e, "status_code"):
                 raise BaiChuanOpenAIError(status_code=e.status_code, message=str(e))
             else:
@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
 from ..models import ResponseModel
 from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence, List, Union
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, StreamingChoices, Delta, Function, ChatCompletionMessageToolCall, check_object_input_support, check_video_input_support, check_vision_input_support, reformat_object_content, check_file_input_support, check_audio_input_support
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, StreamingChoices, Delta, Function, ChatCompletionMessageToolCall, check_object_input_support, check_video_input_support, check_vision_input_support, reformat_object_content, normalize_messages, check_file_input_support, check_audio_input_support, Deadline, raise_if_timeout, close_quietly, ClosingStream, with_cached_prompt_tokens
 
 import openai
 import json
+import requests
 import inspect
+import time
 from openai._models import BaseModel as OpenAIObject
 
 # if TYPE_CHECKING:
@@ -16,6 +18,8 @@ class BaseProvider(ABC):
     args: Optional[Dict[str, Any]] = None
     key: Optional[str] = None
     group: Optional[str] = None
+    # 上游是否原生支持 n>1；不支持时 UnionLLM 会并发发出 n 个请求并合并结果
+    supports_n = True
 
     def __init__(
         self,
@@ -29,133 +33,19 @@ class BaseProvider(ABC):
     def completion(self, model: str, messages: list) -> ResponseModel:
         pass
 
-    def check_prompt(self, provider, model, messages):
-        # 遍历messages列表，判断消息中间是否存在system消息，是否所有消息content都是string类型, 是否消息中包含图片和文件类型
-        is_invalid_format = False
-        has_middle_system = False
-        has_object_content = False
-        has_vision_input = False
-        has_video_input = False
-        has_audio_input = False
-        has_file_input = False
-        for i, message in enumerate(messages):
-            if message.get("role") == "system":
-                if i != 0:
-                    has_middle_system = True
-            if not isinstance(message.get("content"), str):
-                if isinstance(message.get("content"), list):
-                    message_contents = message.get("content")
-                    for content in message_contents:
-                        if not isinstance(content, dict):
-                            is_invalid_format = True
-                        else:
-                            has_object_content = True
-                            if content.get("type") == "image_url":
-                                has_vision_input = True
-                            elif content.get("type") == "video_url":
-                                has_video_input = True
-                            elif content.get("type") == "audio_url":
-                                has_audio_input = True
-                            elif content.get("type") == "file_url":
-                                has_file_input = True
+    def check_prompt(self, provider, model, messages, deadline=None):
+        context = getattr(deadline, "context", None)
+        if context is None:
+            return self._check_prompt(provider, model, messages, deadline=deadline)
+        started = time.perf_counter()
+        try:
+            return self._check_prompt(provider, model, messages, deadline=deadline)
+        finally:
+            context.add("preprocessing", time.perf_counter() - started)
 
-                            # 新增对tool角色的特殊处理
-                            if message.get("role") == "tool":
-                                # 保留tool_call_id和name字段
-                                if "tool_call_id" in message:
-                                    message["tool_call_id"] = message["tool_call_id"]
-                                if "name" in message:
-                                    message["name"] = message["name"]
-                                                                      
-        if is_invalid_format:
-            return {"pass_check": False, "reformatted": False, "reason": "Invalid message format"}
-
-        reformated = 0
-        if has_object_content:
-            # 判断object content是否支持
-            object_support = check_object_input_support(provider)
-            if object_support == "NONE":
-                # 如果不支持
-                if has_vision_input or has_file_input:
-                    # 如果包含图片或文件，则返回错误信息
-                    return {"pass_check": False, "reformatted": False, "reason": "Object content is not supported"}
-                else:
-                    # 如果不包含，则将object content转为文本
-                    messages = reformat_object_content(messages, False, False, False, False)
-                    reformated = 1
-            else:
-                # 如果支持
-                reformat_image = 0
-                reformat_file = 0
-                reformat_video = 0
-                reformat_audio = 0
-                if object_support == "PARTIAL":
-                    # 如果部分支持，则需要将object content转为文本
-                    reformated = 1
-                if has_vision_input:
-                    # 如果包含图片
-                    vision_input_support = check_vision_input_support(provider, model)
-                    if vision_input_support == "PARTIAL":
-                        # 如果图片是部分支持，则需要将图片转为文本
-                        reformat_image = 1
-                        reformated = 1
-                    elif vision_input_support == "NONE":
-                        # 如果图片不支持，则返回错误信息
-                        return {"pass_check": False, "reformatted": False, "reason": "Vision input is not supported"}
-                
-                if has_video_input:
-                    video_input_support = check_video_input_support(provider, model)
-                    if video_input_support == "INLINE_DATA":
-                        reformat_video = 2
-                        reformated = 1
-                    elif video_input_support == "PARTIAL":
-                        # 如果视频是部分支持，则需要将视频转为文本
-                        reformat_video = 1
-                        reformated = 1
-                    elif video_input_support == "NONE":
-                        # 如果视频不支持，则返回错误信息
-                        return {"pass_check": False, "reformatted": False, "reason": "Video input is not supported"}
-                
-                if has_audio_input:
-                    # 如果包含音频
-                    audio_input_support = check_audio_input_support(provider, model)
-                    if audio_input_support == "PARTIAL":
-                        # 如果音频是部分支持，则需要将音频转为文本
-                        reformat_audio = 1
-                        reformated = 1
-                    elif audio_input_support == "NONE":
-                        # 如果音频不支持，则返回错误信息
-                        return {"pass_check": False, "reformatted": False, "messages": messages, "reason": "Audio input is not supported"}
-                
-                if has_file_input:
-                    # 如果包含文件
-                    file_input_support = check_file_input_support(provider, model)
-                    if file_input_support == "PARTIAL":
-                        # 如果文件是部分支持，则需要将文件转为文本
-                        reformat_file= 1
-                        reformated = 1
-                    elif file_input_support == "NONE":
-                        # 如果文件不支持，则返回错误信息
-                        return {"pass_check": False, "reformatted": False, "messages": messages, "reason": "File input is not supported"}
-                    elif file_input_support == "FULL":
-                        reformat_file= 2
-                        reformated = 1
-                if reformated or reformat_image or reformat_file or reformat_video or reformat_audio:
-                    messages = reformat_object_content(
-                        messages, 
-                        True,  # 新增参数保留tool元数据
-                        reformat_image=reformat_image,
-                        reformat_file=reformat_file,
-                        reformat_video=reformat_video,
-                        reformat_audio=reformat_audio
-                    )
-        multimodal_info = {
-            "has_vision_input": has_vision_input,
-            "has_video_input": has_video_input,
-            "has_file_input": has_file_input,
-            "has_audio_input": has_audio_input
-        }
-        return {"pass_check": True, "reformatted": reformated, "messages": messages, "multimodal_info": multimodal_info}         
+    def _check_prompt(self, provider, model, messages, deadline=None):
+        # 一次遍历完成分类、校验和按需改写，纯文本消息原样透传
+        return normalize_messages(provider, model, messages, deadline=deadline)
 
     def convert_object_to_dict(self, obj):
         """将任何对象递归转换为纯字典/列表结构"""
@@ -225,7 +115,7 @@ class BaseProvider(ABC):
         
         # 把Usage对象也转换为可序列化的结构
         usage_dict = self.convert_object_to_dict(openai_response.usage.model_dump())
-        usage = Usage(**usage_dict)
+        usage = with_cached_prompt_tokens(Usage(**usage_dict))
         
         # 创建最终响应对象
         response = ModelResponse(
@@ -240,58 +130,101 @@ class BaseProvider(ABC):
         
         return response
     
-    def post_stream_processing(self, response, model=None):
-        for chunk in response:
-            data = chunk.json()
-            if isinstance(data, str):
-                data = json.loads(data)
-            if 'choices' in data:
-                choices = data['choices']
-                chunk_choices = []
-                for choice in choices:
-                    # 判断如果choice是StreamingChoices类型的对象，则直接添加到chunk_choices中
-                    if isinstance(choice, StreamingChoices):
-                        chunk_choices.append(choice)
-                    else:
-                        delta = choice.get("delta")
-                        if choice.get("finish_reason") == "stop":
-                            stream_choices = StreamingChoices(index=choice['index'], finish_reason="stop")
-                            chunk_choices.append(stream_choices)
-                        elif delta:
+    def stream_post(self, url, deadline=None, model=None, llm_provider=None, **request_kwargs):
+        """发起流式 POST 请求，连接/读取超时取自调用预算；调用方取消时关闭连接"""
+        deadline = deadline or Deadline()
+        try:
+            response = requests.post(url, stream=True, timeout=deadline.requests_timeout(model=model, llm_provider=llm_provider), **request_kwargs)
+        except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider=llm_provider)
+            raise
+        deadline.add_cancel_callback(lambda: close_quietly(response))
+        return response
+
+    def iter_response_lines(self, response, deadline=None, model=None, llm_provider=None):
+        """
+        逐行读取 requests 流式响应，每行检查调用预算，并将传输层超时统一转换为 Timeout。
+        生成器被关闭或回收（调用方提前停止迭代）时释放上游连接，避免模型继续生成并计费。
+        """
+        try:
+            for line in response.iter_lines():
+                if deadline is not None:
+                    deadline.check(model=model, llm_provider=llm_provider)
+                yield line
+        except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider=llm_provider)
+            raise
+        finally:
+            close_quietly(response)
+
+    def post_stream_processing(self, response, model=None, deadline=None):
+        # SDK 流在迭代之前就已建立连接，用 ClosingStream 保证未消费/提前停止时也能释放
+        return ClosingStream(self._iter_stream_chunks(response, model=model, deadline=deadline), response, deadline=deadline)
+
+    def _iter_stream_chunks(self, response, model=None, deadline=None):
+        try:
+            for chunk in response:
+                if deadline is not None:
+                    deadline.check(model=model)
+                data = chunk.json()
+                if isinstance(data, str):
+                    data = json.loads(data)
+                usage_data = data.get("usage")
+                if 'choices' in data:
+                    choices = data['choices']
+                    chunk_choices = []
+                    for choice in choices:
+                        # Moonshot 在最后一个 choice 里返回 usage，而不是顶层
+                        if not usage_data and isinstance(choice, dict) and choice.get("usage"):
+                            usage_data = choice["usage"]
+                        # 判断如果choice是StreamingChoices类型的对象，则直接添加到chunk_choices中
+                        if isinstance(choice, StreamingChoices):
+                            chunk_choices.append(choice)
+                        else:
                             delta = choice.get("delta")
-                            chunk_delta = Delta()
-                            if "role" in choice['delta']:
-                                chunk_delta.role = choice['delta']["role"]
-                            if "content" in choice['delta']:
-                                chunk_delta.content = choice['delta']["content"]
-                            if "tool_calls" in choice['delta']:
-                                chunk_delta.tool_calls = choice['delta']["tool_calls"]
-                            # 如果choice.message中还包含其他属性，则追加进来
-                            for key in choice['delta']:
-                                if key not in ["content", "role", "tool_calls"]:
-                                    setattr(chunk_delta, key, choice['delta'][key])
+                            if choice.get("finish_reason") == "stop":
+                                stream_choices = StreamingChoices(index=choice['index'], finish_reason="stop")
+                                chunk_choices.append(stream_choices)
+                            elif delta:
+                                delta = choice.get("delta")
+                                chunk_delta = Delta()
+                                if "role" in choice['delta']:
+                                    chunk_delta.role = choice['delta']["role"]
+                                if "content" in choice['delta']:
+                                    chunk_delta.content = choice['delta']["content"]
+                                if "tool_calls" in choice['delta']:
+                                    chunk_delta.tool_calls = choice['delta']["tool_calls"]
+                                # 如果choice.message中还包含其他属性，则追加进来
+                                for key in choice['delta']:
+                                    if key not in ["content", "role", "tool_calls"]:
+                                        setattr(chunk_delta, key, choice['delta'][key])
                             
-                            stream_choices = StreamingChoices(index=choice['index'], delta=chunk_delta, finish_reason=choice.get("finish_reason"))
-                            # 遍历choices字典中的key, 如果在特定的列表中，则添加到stream_choices中
-                            for key in choice.keys():
-                                if key in ["content_filter_results", "content_filter_offsets", "logprobs"]:
-                                    setattr(stream_choices, key, choice[key])
-                            chunk_choices.append(stream_choices)
+                                stream_choices = StreamingChoices(index=choice['index'], delta=chunk_delta, finish_reason=choice.get("finish_reason"))
+                                # 遍历choices字典中的key, 如果在特定的列表中，则添加到stream_choices中
+                                for key in choice.keys():
+                                    if key in ["content_filter_results", "content_filter_offsets", "logprobs"]:
+                                        setattr(stream_choices, key, choice[key])
+                                chunk_choices.append(stream_choices)
                     
-            if "usage" in data:
-                chunk_usage = Usage()
-                if data["usage"]:
-                    # 把usage字典中的数据添加到chunk_usage中
-                    for key, value in data["usage"].items():
-                        setattr(chunk_usage, key, value)
+                has_usage = "usage" in data or usage_data is not None
+                if has_usage:
+                    chunk_usage = Usage()
+                    if usage_data:
+                        # 把usage字典中的数据添加到chunk_usage中
+                        for key, value in usage_data.items():
+                            setattr(chunk_usage, key, value)
+                        with_cached_prompt_tokens(chunk_usage)
             
-            chunk_response = ModelResponse(
-                id=data["id"],
-                choices=chunk_choices,
-                created=data["created"],
-                model=model,
-                usage=chunk_usage if "usage" in data else None,
-                stream=True,
-                system_fingerprint=data.get("system_fingerprint") if "system_fingerprint" in data else None
-            )
-            yield chunk_response
+                chunk_response = ModelResponse(
+                    id=data["id"],
+                    choices=chunk_choices,
+                    created=data["created"],
+                    model=model,
+                    usage=chunk_usage if has_usage else None,
+                    stream=True,
+                    system_fingerprint=data.get("system_fingerprint") if "system_fingerprint" in data else None
+                )
+                yield chunk_response
+        except Exception as e:
+            raise_if_timeout(e, model=model)
+            raise
@@ -1,5 +1,5 @@
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, generate_unique_uid, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, generate_unique_uid, Delta, StreamingChoices, Deadline, raise_if_timeout
 from openai import OpenAI
 import logging, json, time, requests, os
 
@@ -16,6 +16,9 @@ class CozeAIError(Exception):
 
 
 class CozeAIProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):
         # Get COZE_API_KEY from environment variables
         _env_api_key = os.environ.get("COZE_API_KEY")
@@ -32,8 +35,9 @@ class CozeAIProvider(BaseProvider):
                 status_code=422, message=f"Missing Bot ID"
             )
         
-        self.base_url = "https://api.coze.com/v3"
-        self.base_url_v2 = "https://api.coze.com/open_api/v2"
+        api_base = model_kwargs.get("api_base") or "https://api.coze.com"
+        self.base_url = api_base + "/v3"
+        self.base_url_v2 = api_base + "/open_api/v2"
         self.endpoint_url = self.base_url + "/chat"
         self.endpoint_url_v2 = self.base_url_v2 + "/chat"
         if self.conversation_id:
@@ -64,16 +68,13 @@ class CozeAIProvider(BaseProvider):
         history_messages = []
         for message in history:
             if message["role"] == "assistant":
-                # 在message中追加content_type字段和content字段
-                message["type"] = "answer"
-                message["content_type"] = "text"
-                history_messages.append(message)
+                # 在message中追加content_type字段和content字段（复制后追加，不修改调用方的消息）
+                history_messages.append(dict(message, type="answer", content_type="text"))
             elif message["role"] == "user":
-                message["content_type"] = "text"
-                history_messages.append(message)
+                history_messages.append(dict(message, content_type="text"))
         return history_messages, query
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         # 预处理消息内容并提取用户问题
         history, query = self.to_formatted_prompt(messages)
 
@@ -90,10 +91,10 @@ class CozeAIProvider(BaseProvider):
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        response = requests.post(self.endpoint_url, headers=headers, data=payload)
+        response = self.stream_post(self.endpoint_url, deadline, model=model, llm_provider="coze", headers=headers, data=payload)
         event_type = None
         index = 0
-        for line in response.iter_lines():
+        for line in self.iter_response_lines(response, deadline, model=model, llm_provider="coze"):
             if line:
                 if line.startswith(b"event:"):
                     event_type = line.decode("utf-8").replace("event:", "").strip()
@@ -225,13 +226,14 @@ class CozeAIProvider(BaseProvider):
         return response
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise CozeAIError(
                     status_code=422, message="Missing model or messages"
                 )
 
-            message_check_result = self.check_prompt("coze", model, messages)            
+            message_check_result = self.check_prompt("coze", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -239,14 +241,13 @@ class CozeAIProvider(BaseProvider):
                     status_code=422, message=message_check_result['reason']
                 )
                 
-            for message in messages:
-                if 'content_type' not in message:
-                    message['content_type'] = 'text'
+            # 复制后补充content_type，不修改调用方的消息
+            messages = [message if 'content_type' in message else dict(message, content_type='text') for message in messages]
             new_kwargs = self.pre_processing(**kwargs)
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model, messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model, messages, deadline=deadline, **new_kwargs)
             else:
                 history, query = self.to_formatted_prompt(messages)
 
@@ -264,9 +265,10 @@ class CozeAIProvider(BaseProvider):
                     "Authorization": f"Bearer {self.api_key}",
                     "Content-Type": "application/json",
                 }
-                result = requests.post(self.endpoint_url_v2, headers=headers, data=payload)
+                result = requests.post(self.endpoint_url_v2, headers=headers, data=payload, timeout=deadline.requests_timeout(model=model, llm_provider="coze"))
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="coze")
             if hasattr(e, "status_code"):
                 raise CozeAIError(status_code=e.status_code, message=str(e))
             else:
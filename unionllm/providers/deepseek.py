@@ -1,4 +1,5 @@
 from .base_provider import BaseProvider
+from unionllm.utils import Deadline, raise_if_timeout
 from openai import OpenAI
 import logging, json, os
 
@@ -23,7 +24,9 @@ class DeepSeekAIProvider(BaseProvider):
                 status_code=422, message=f"Missing API key"
             )
         
-        if model_kwargs.get("beta"):
+        if model_kwargs.get("api_base"):
+            self.base_url = model_kwargs.get("api_base")
+        elif model_kwargs.get("beta"):
             self.base_url = "https://api.deepseek.com/beta"
         else:
             self.base_url = "https://api.deepseek.com/v1"
@@ -73,23 +76,24 @@ class DeepSeekAIProvider(BaseProvider):
 
         return kwargs
     
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         result = self.client.chat.completions.create(
             model=model, messages=messages, **new_kwargs
         )
-        return self.post_stream_processing(result, model=model)
+        return self.post_stream_processing(result, model=model, deadline=deadline)
 
     def create_model_response_wrapper(self, result, model):
         # 调用 response_model 中的 create_model_response 方法
         return self.create_model_response(result, model=model)
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise DeepSeekError(
                     status_code=422, message=f"Missing model or messages"
                 )
-            message_check_result = self.check_prompt("deepseek", model, messages)            
+            message_check_result = self.check_prompt("deepseek", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -97,15 +101,17 @@ class DeepSeekAIProvider(BaseProvider):
                     status_code=422, message=message_check_result['reason']
                 )
             new_kwargs = self.pre_processing(**kwargs)
+            new_kwargs.update(deadline.sdk_kwargs(model=model, llm_provider="deepseek"))
             stream = kwargs.get("stream", False)
             if stream:
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             else:
                 result = self.client.chat.completions.create(
                     model=model, messages=messages, **new_kwargs
                 )
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="deepseek")
             if hasattr(e, "status_code"):
                 raise DeepSeekError(status_code=e.status_code, message=str(e))
             else:
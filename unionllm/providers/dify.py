@@ -1,6 +1,6 @@
 import json
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, Delta, StreamingChoices, Deadline, raise_if_timeout
 import requests
 import logging, json, time, os
 
@@ -15,6 +15,9 @@ class DifyOpenAIError(Exception):
         super().__init__(self.message)
 
 class DifyAIProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):        
         # Get DIFY_API_KEY from environment variables
         _env_api_key = os.environ.get("DIFY_API_KEY")
@@ -72,7 +75,7 @@ class DifyAIProvider(BaseProvider):
             )
 
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         # 预处理对话内容并返回最近的用户问题        
         messages, query, files = self.to_formatted_prompt(messages)
         mode = "streaming"
@@ -85,10 +88,10 @@ class DifyAIProvider(BaseProvider):
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        response = requests.post(self.endpoint_url, headers=headers, data=payload)
+        response = self.stream_post(self.endpoint_url, deadline, model=model, llm_provider="dify", headers=headers, data=payload)
 
         index = 0
-        for line in response.iter_lines():
+        for line in self.iter_response_lines(response, deadline, model=model, llm_provider="dify"):
             chunk_usage = Usage()
             if line:
                 chunk_choices = []
@@ -219,13 +222,14 @@ class DifyAIProvider(BaseProvider):
 
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise DifyOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
 
-            message_check_result = self.check_prompt("dify", model, messages)            
+            message_check_result = self.check_prompt("dify", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -237,7 +241,7 @@ class DifyAIProvider(BaseProvider):
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model, messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model, messages, deadline=deadline, **new_kwargs)
             else:
                 messages, query, files = self.to_formatted_prompt(messages)
                 mode = "blocking"
@@ -251,9 +255,10 @@ class DifyAIProvider(BaseProvider):
                     "Authorization": f"Bearer {self.api_key}",
                     "Content-Type": "application/json",
                 }
-                result = requests.post(self.endpoint_url, headers=headers, data=payload)
+                result = requests.post(self.endpoint_url, headers=headers, data=payload, timeout=deadline.requests_timeout(model=model, llm_provider="dify"))
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="dify")
             if hasattr(e, "status_code"):
                 raise DifyOpenAIError(status_code=e.status_code, message=str(e))
             else:
@@ -1,5 +1,5 @@
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Context, Delta, StreamingChoices, Deadline, raise_if_timeout
 from openai import OpenAI
 import logging, json, time, requests, os
 
@@ -16,6 +16,9 @@ class FastGPTError(Exception):
 
 
 class FastGPTProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):
         # Get FASTGPT_API_KEY from environment variables
         _env_api_key = os.environ.get("FASTGPT_API_KEY")
@@ -41,16 +44,16 @@ class FastGPTProvider(BaseProvider):
         kwargs.update({"detail": True})
         return kwargs
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        response = requests.post(self.endpoint_url, headers=headers, data=payload)
+        response = self.stream_post(self.endpoint_url, deadline, model=model, llm_provider="fastgpt", headers=headers, data=payload)
         index = 0
         # 解析stream返回信息并生成OpenAI兼容格式
-        for line in response.iter_lines():
+        for line in self.iter_response_lines(response, deadline, model=model, llm_provider="fastgpt"):
             if line:
                 chunk_choices = []
                 chunk_context = []
@@ -148,13 +151,14 @@ class FastGPTProvider(BaseProvider):
         return response
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise FastGPTError(
                     status_code=422, message="Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("fastgpt", model, messages)    
+            message_check_result = self.check_prompt("fastgpt", model, messages, deadline=deadline)    
             
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
@@ -167,16 +171,17 @@ class FastGPTProvider(BaseProvider):
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model, messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model, messages, deadline=deadline, **new_kwargs)
             else:
                 payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
                 headers = {
                     "Authorization": f"Bearer {self.api_key}",
                     "Content-Type": "application/json",
                 }
-                result = requests.post(self.endpoint_url, headers=headers, data=payload)
+                result = requests.post(self.endpoint_url, headers=headers, data=payload, timeout=deadline.requests_timeout(model=model, llm_provider="fastgpt"))
                 return self.create_model_response_wrapper(result)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="fastgpt")
             if hasattr(e, "status_code"):
                 raise FastGPTError(status_code=e.status_code, message=str(e))
             else:
@@ -1,5 +1,8 @@
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices, Deadline, raise_if_timeout, ClosingStream, media_get, with_cached_prompt_tokens
+from unionllm.batch_api import GeminiBatchBackend
+from unionllm import prefix_cache, tokens
+from unionllm.prefix_cache import fingerprint
 from google import genai
 import os, json, time
 from google.genai import types
@@ -8,6 +11,8 @@ from io import BytesIO
 import base64
 import requests
 import re
+import threading
+from collections import OrderedDict
 
 class GeminiError(Exception):
     def __init__(
@@ -19,7 +24,129 @@ class GeminiError(Exception):
         self.message = message
         super().__init__(self.message)
 
+def _http_options(deadline, model=None):
+    """剩余预算对应的 HttpOptions（毫秒），无预算时返回 None，预算已耗尽时抛出 Timeout。"""
+    remaining = deadline.remaining() if deadline else None
+    if remaining is None:
+        return None
+    deadline.check(model=model, llm_provider="gemini")
+    return types.HttpOptions(timeout=max(1, int(remaining * 1000)))
+
+class ContextCacheRegistry:
+    """
+    Local registry of Gemini cached-content resources, keyed by the prefix they hold.
+
+    A prefix is (api key, model, system instruction, tools, leading messages).
+    An entry is reused until it gets within refresh_margin seconds of its
+    expiry, then its TTL is extended on the server; expired entries are
+    recreated. Only one create or refresh per prefix runs at a time; concurrent
+    requests for the same prefix wait for it and reuse its result. Entries
+    evicted from the LRU (beyond maxsize) are deleted on the server so they
+    stop accruing storage charges. A failed create (e.g. the prefix is below
+    the model's minimum cacheable size) is remembered for refresh_margin
+    seconds so it is not retried on every request.
+    """
+
+    def __init__(self, ttl: int = 3600, refresh_margin: int = 300, min_tokens: int = 1024, maxsize: int = 128):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.maxsize = maxsize
+        # key -> (name, expire_at, client)；name 为 None 表示创建失败
+        self._entries = OrderedDict()
+        # key -> threading.Event，正在创建或续期的前缀
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "created": 0, "refreshed": 0, "failures": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, name, expire_at, client, stat):
+        with self._lock:
+            self.stats[stat] += 1
+            self._entries[key] = (name, expire_at, client)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for old_name, _, old_client in evicted:
+            if old_name is None:
+                continue
+            try:
+                old_client.caches.delete(name=old_name)
+            except Exception:
+                # 删除失败时由服务端按 TTL 过期
+                pass
+
+    def resolve(self, client, model, key, build_config, ttl=None, deadline=None):
+        """
+        Return the cached-content name for key, creating or refreshing it as
+        needed, or None when the prefix could not be cached.
+        build_config(ttl) returns the CreateCachedContentConfig for a new resource.
+        """
+        ttl = int(ttl or self.ttl)
+        while True:
+            now = time.time()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    if entry[0] is None and entry[1] > now:
+                        return None
+                    if entry[1] - now > self.refresh_margin:
+                        self.stats["hits"] += 1
+                        return entry[0]
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # 同一前缀已有请求在创建或续期，等它完成后复用结果，避免重复创建计费的缓存
+            remaining = deadline.remaining() if deadline else None
+            if not pending.wait(remaining) and deadline is not None:
+                deadline.check(model=model, llm_provider="gemini")
+        try:
+            return self._renew(client, model, key, entry, build_config, ttl, now, deadline)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.set()
+
+    def _renew(self, client, model, key, entry, build_config, ttl, now, deadline):
+        ttl_str = f"{ttl}s"
+        if entry is not None and entry[0] is not None and entry[1] > now:
+            try:
+                update_config = types.UpdateCachedContentConfig(ttl=ttl_str, http_options=_http_options(deadline, model))
+                client.caches.update(name=entry[0], config=update_config)
+                self._store(key, entry[0], now + ttl, client, "refreshed")
+                return entry[0]
+            except Exception as e:
+                # 服务端已删除等情况，重新创建
+                raise_if_timeout(e, model=model, llm_provider="gemini")
+
+        try:
+            create_config = build_config(ttl_str)
+            create_config.http_options = _http_options(deadline, model)
+            name = client.caches.create(model=model, config=create_config).name
+        except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="gemini")
+            self._store(key, None, now + self.refresh_margin, client, "failures")
+            return None
+        self._store(key, name, now + ttl, client, "created")
+        return name
+
+
+# 进程级注册表：同一 API key 与模型下，不同 UnionLLM 实例共享已创建的缓存
+context_cache_registry = ContextCacheRegistry()
+
 class GeminiAIProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):
         _env_api_key = os.environ.get("GEMINI_API_KEY")
         self.api_key = model_kwargs.get("api_key") if model_kwargs.get("api_key") else _env_api_key
@@ -39,7 +166,8 @@ class GeminiAIProvider(BaseProvider):
             # 兼容思考相关参数
             "thinking_level", "thinking",
             "aspect_ratio", "resolution",
-            "google_search_grounding"
+            "google_search_grounding",
+            "context_cache", "context_cache_ttl"
         ]
         for key in list(kwargs.keys()):
             if key not in supported_params:
@@ -179,6 +307,80 @@ class GeminiAIProvider(BaseProvider):
         except Exception as e:
             raise GeminiError(status_code=500, message=f"Error building config: {str(e)}")
 
+    def _apply_deadline(self, config, deadline, model=None):
+        """把剩余预算写入 http_options（单位毫秒），预算已耗尽时直接抛出 Timeout。"""
+        http_options = _http_options(deadline, model)
+        if http_options is not None:
+            config.http_options = http_options
+        return config
+
+    @staticmethod
+    def _context_cache_boundary(messages):
+        """
+        Number of leading (non-system) messages to cache: up to the last message
+        carrying a cache_control hint, otherwise the messages before the first
+        model reply (documents and instructions attached up front). The last
+        message always stays in the request.
+        """
+        boundary = None
+        for i, msg in enumerate(messages):
+            content = msg.get("content")
+            if msg.get("cache_control") or (isinstance(content, list) and any(isinstance(part, dict) and part.get("cache_control") for part in content)):
+                boundary = i + 1
+        if boundary is None:
+            boundary = next((i for i, msg in enumerate(messages) if msg.get("role") == "assistant"), len(messages))
+        return min(boundary, len(messages) - 1)
+
+    def _apply_context_cache(self, model, config, contents, messages, new_kwargs, stream=False, deadline=None):
+        """
+        Move the system instruction, tools and the leading contents into a Gemini
+        cached-content resource and point config at it. messages are the raw
+        (non-system) messages contents were converted from. Returns the contents
+        still to send; when nothing is cached config and contents are unchanged.
+        """
+        count = self._context_cache_boundary(messages) if contents else 0
+        system_instruction = getattr(config, "system_instruction", None)
+        tools_config = getattr(config, "tools", None)
+        if not count and system_instruction is None and not tools_config:
+            return contents
+
+        counter = tokens.counter_for("gemini", model)
+        estimated = counter.count_text(system_instruction) + counter.count_tools(new_kwargs.get("tools"))
+        if count:
+            estimated += counter.count_messages(messages[:count])
+        if estimated < context_cache_registry.min_tokens:
+            return contents
+
+        key = (
+            self.api_key, model, stream,
+            fingerprint(system_instruction),
+            fingerprint({name: new_kwargs.get(name) for name in ("tools", "tool_choice", "google_search_grounding")}),
+            fingerprint(messages[:count]),
+        )
+        tool_config = getattr(config, "tool_config", None)
+
+        def build_config(ttl):
+            return types.CreateCachedContentConfig(
+                ttl=ttl,
+                display_name="unionllm",
+                contents=list(contents[:count]) or None,
+                system_instruction=system_instruction,
+                tools=tools_config,
+                tool_config=tool_config,
+            )
+
+        name = context_cache_registry.resolve(
+            self.client, model, key, build_config, ttl=new_kwargs.get("context_cache_ttl"), deadline=deadline
+        )
+        if name is None:
+            return contents
+        # 使用 cached_content 时请求中不能再带 system_instruction / tools / tool_config
+        config.cached_content = name
+        config.system_instruction = None
+        config.tools = None
+        config.tool_config = None
+        return contents[count:]
+
     def _extract_markdown_image_url(self, text: str):
         """
         如果 text 完全是 Markdown 图片语法，如: ![alt](https://example.com/x.png)
@@ -200,208 +402,232 @@ class GeminiAIProvider(BaseProvider):
         m = re.match(pattern, s)
         return m.group(1) if m else None
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
-        # 处理所有消息
-        processed_messages = []
+    def _convert_stream_message(self, model, msg, deadline):
+        """
+        把单条 OpenAI 风格消息转成 types.Content，返回 (content, has_image)；system 等其他角色返回 (None, False)。
+        只依赖消息本身，开启 prefix_cache 时按消息前缀缓存。
+        """
+        print(f"Processing message: {msg}")
         stream_has_image = False
-        for msg in messages:
-            print(f"Processing message: {msg}")
-            if msg["role"] == "user":
-                # 支持 OpenAI 风格的多模态输入（content 为数组，含多张 image_url）
-                parts = []
-                content = msg.get("content", "")
-                if isinstance(content, list):
-                    text_parts = []
-                    has_image = False
-                    for item in content:
-                        # 支持直接传 genai.types.Part 对象（非 dict）
-                        if not isinstance(item, dict):
-                            # 处理 Part 对象中的 text / inline_data
-                            try:
-                                if hasattr(item, 'text') and item.text is not None:
-                                    txt = item.text
-                                    converted = self._try_convert_markdown_image_to_part(str(txt))
-                                    if converted:
-                                        parts.append(converted)
-                                        has_image = True
-                                    else:
-                                        text_parts.append(str(txt))
-                                elif hasattr(item, 'inline_data') and item.inline_data is not None:
-                                    # 直接保留已有 inline_data
-                                    parts.append(item)
+        if msg["role"] == "user":
+            # 支持 OpenAI 风格的多模态输入（content 为数组，含多张 image_url）
+            parts = []
+            content = msg.get("content", "")
+            if isinstance(content, list):
+                text_parts = []
+                has_image = False
+                for item in content:
+                    # 支持直接传 genai.types.Part 对象（非 dict）
+                    if not isinstance(item, dict):
+                        # 处理 Part 对象中的 text / inline_data
+                        try:
+                            if hasattr(item, 'text') and item.text is not None:
+                                txt = item.text
+                                converted = self._try_convert_markdown_image_to_part(str(txt), deadline=deadline)
+                                if converted:
+                                    parts.append(converted)
                                     has_image = True
                                 else:
-                                    # 未识别的 Part，尝试转成文本
-                                    parts.append(types.Part(text=str(item)))
-                                continue
-                            except Exception:
-                                continue
-                        item_type = item.get("type")
-                        
-                        if item_type == "text":
-                            txt = item.get("text", "")
-                            converted = self._try_convert_markdown_image_to_part(txt)
-                            if converted:
-                                parts.append(converted)
+                                    text_parts.append(str(txt))
+                            elif hasattr(item, 'inline_data') and item.inline_data is not None:
+                                # 直接保留已有 inline_data
+                                parts.append(item)
                                 has_image = True
                             else:
-                                text_parts.append(txt)
-                        elif item_type == "image_url":
-                            image_url = (item.get("image_url") or {}).get("url")
-                            if image_url:
-                                try:
-                                    resp = requests.get(image_url)
-                                    img_bytes = resp.content
-                                    # 通过 header 或 PIL 推断 mime
-                                    mime_type = resp.headers.get('Content-Type', None)
-                                    if not mime_type:
-                                        try:
-                                            from PIL import Image as _Img
-                                            im = _Img.open(BytesIO(img_bytes))
-                                            fmt = (im.format or 'JPEG').lower()
-                                            mime_type = f"image/{'jpeg' if fmt == 'jpg' else fmt}"
-                                        except Exception:
-                                            mime_type = 'image/jpeg'
-                                    parts.append(types.Part.from_bytes(data=img_bytes, mime_type=mime_type))
-                                    has_image = True
-                                except Exception as e:
-                                    raise GeminiError(status_code=500, message=f"Error processing image URL in stream: {str(e)}")
-                        elif item_type == "audio_url":
-                            audio_url = (item.get("audio_url") or {}).get("url")
-                            if audio_url:
-                                try:
-                                    a_resp = requests.get(audio_url)
-                                    a_bytes = a_resp.content
-                                    a_mime = a_resp.headers.get('Content-Type', None)
-                                    if not a_mime:
-                                        # 根据扩展名简单推断
-                                        lower = audio_url.lower()
-                                        if lower.endswith('.wav'):
-                                            a_mime = 'audio/wav'
-                                        elif lower.endswith('.mp3'):
-                                            a_mime = 'audio/mp3'
-                                        elif lower.endswith('.aiff') or lower.endswith('.aif'):
-                                            a_mime = 'audio/aiff'
-                                        elif lower.endswith('.aac'):
-                                            a_mime = 'audio/aac'
-                                        elif lower.endswith('.ogg') or lower.endswith('.oga'):
-                                            a_mime = 'audio/ogg'
-                                        elif lower.endswith('.flac'):
-                                            a_mime = 'audio/flac'
-                                        else:
-                                            a_mime = 'audio/mpeg'
-                                    parts.append(types.Part.from_bytes(data=a_bytes, mime_type=a_mime))
-                                except Exception as e:
-                                    raise GeminiError(status_code=500, message=f"Error processing audio URL in stream: {str(e)}")
-                        elif item_type == "file":
-                            if "file" in item:
-                                file_data = item["file"]["file_data"]
-                                # 从file_data中获取文件类型
-                                content_type = file_data.split(",")[0].split(";")[0].replace("data:", "")
-                                try:
-                                    # 解析base64部分
-                                    base64_data = file_data.split(",")[1]
-                                    file_content = base64.b64decode(base64_data)
-                                    
-                                    # 使用 types.Part.from_bytes 创建文件部分
-                                    file_part = types.Part.from_bytes(
-                                        data=file_content,
-                                        mime_type=content_type
-                                    )
-                                    parts.append(file_part)
-                                except Exception as e:
-                                    raise GeminiError(status_code=500, message=f"Error processing file data in stream: {str(e)}")
-                        elif item_type == "video_url":
-                            video_url = item.get("video_url", {}).get("url", "")
-                            if video_url and video_url.startswith("https://www.youtube.com/"):
-                                try:
-                                    parts.append(types.Part(file_data=types.FileData(file_uri=video_url)))
-                                except Exception as e:
-                                    raise GeminiError(status_code=500, message=f"Error processing video URL in stream: {str(e)}")
-                    # 文本优先放在前面,便于上下文理解
-                    if text_parts:
-                        parts.insert(0, types.Part(text=" ".join(text_parts)))
-                    # 如果既没有文本也没有有效图片，至少传一个空文本，避免 SDK 报错
-                    if not parts:
-                        parts = [types.Part(text="")]
-                    if has_image:
-                        stream_has_image = True
-                else:
-                    # 纯文本消息，支持 "markdown 图片" 转图片 part
-                    txt = str(content)
-                    converted = self._try_convert_markdown_image_to_part(txt)
-                    if converted:
-                        parts = [converted]
-                        stream_has_image = True
-                    else:
-                        parts = [types.Part(text=txt)]
-
-                processed_messages.append(types.Content(
-                    role="user",
-                    parts=parts
-                ))
-            elif msg["role"] == "assistant":
-                parts = []
-                # 处理助手消息，包括工具调用
-                
-                # 处理文本内容
-                if msg.get("content"):
-                    converted = self._try_convert_markdown_image_to_part(msg["content"])
-                    if converted:
-                        parts.append(converted)
-                        if msg.get("thought_signature") and msg['thought_signature']:
-                            try:
-                                parts[-1].thought_signature = msg['thought_signature']
-                            except Exception:
-                                pass
-
-                    else:
-                        if msg.get("thought_signature") and msg['thought_signature']:
-                            parts.append(types.Part(text=msg["content"], thought_signature=msg["thought_signature"]))
+                                # 未识别的 Part，尝试转成文本
+                                parts.append(types.Part(text=str(item)))
+                            continue
+                        except Exception:
+                            continue
+                    item_type = item.get("type")
+                    
+                    if item_type == "text":
+                        txt = item.get("text", "")
+                        converted = self._try_convert_markdown_image_to_part(txt, deadline=deadline)
+                        if converted:
+                            parts.append(converted)
+                            has_image = True
                         else:
-                            parts.append(types.Part(text=msg["content"]))
-                              
-                # 处理工具调用
-                if "tool_calls" in msg:
-                    for tool_call in msg["tool_calls"]:
-                        if tool_call.get("type") == "function":
-                            function_info = tool_call.get("function", {})
+                            text_parts.append(txt)
+                    elif item_type == "image_url":
+                        image_url = (item.get("image_url") or {}).get("url")
+                        if image_url:
                             try:
-                                args = json.loads(function_info.get("arguments", "{}"))
-                                parts.append(types.Part(
-                                    function_call=types.FunctionCall(
-                                        name=function_info.get("name"),
-                                        args=args
-                                    )
-                                ))
-                                if "thought_signature" in tool_call:
-                                    raw_ts = tool_call["thought_signature"]
-                                    parts[-1].thought_signature = raw_ts
+                                resp = media_get(deadline, image_url, timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
+                                img_bytes = resp.content
+                                # 通过 header 或 PIL 推断 mime
+                                mime_type = resp.headers.get('Content-Type', None)
+                                if not mime_type:
+                                    try:
+                                        from PIL import Image as _Img
+                                        im = _Img.open(BytesIO(img_bytes))
+                                        fmt = (im.format or 'JPEG').lower()
+                                        mime_type = f"image/{'jpeg' if fmt == 'jpg' else fmt}"
+                                    except Exception:
+                                        mime_type = 'image/jpeg'
+                                parts.append(types.Part.from_bytes(data=img_bytes, mime_type=mime_type))
+                                has_image = True
                             except Exception as e:
-                                raise GeminiError(status_code=500, message=f"Error processing tool_calls in stream: {str(e)}")
-
+                                raise_if_timeout(e, model=model, llm_provider="gemini")
+                                raise GeminiError(status_code=500, message=f"Error processing image URL in stream: {str(e)}")
+                    elif item_type == "audio_url":
+                        audio_url = (item.get("audio_url") or {}).get("url")
+                        if audio_url:
+                            try:
+                                a_resp = media_get(deadline, audio_url, timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
+                                a_bytes = a_resp.content
+                                a_mime = a_resp.headers.get('Content-Type', None)
+                                if not a_mime:
+                                    # 根据扩展名简单推断
+                                    lower = audio_url.lower()
+                                    if lower.endswith('.wav'):
+                                        a_mime = 'audio/wav'
+                                    elif lower.endswith('.mp3'):
+                                        a_mime = 'audio/mp3'
+                                    elif lower.endswith('.aiff') or lower.endswith('.aif'):
+                                        a_mime = 'audio/aiff'
+                                    elif lower.endswith('.aac'):
+                                        a_mime = 'audio/aac'
+                                    elif lower.endswith('.ogg') or lower.endswith('.oga'):
+                                        a_mime = 'audio/ogg'
+                                    elif lower.endswith('.flac'):
+                                        a_mime = 'audio/flac'
+                                    else:
+                                        a_mime = 'audio/mpeg'
+                                parts.append(types.Part.from_bytes(data=a_bytes, mime_type=a_mime))
+                            except Exception as e:
+                                raise_if_timeout(e, model=model, llm_provider="gemini")
+                                raise GeminiError(status_code=500, message=f"Error processing audio URL in stream: {str(e)}")
+                    elif item_type == "file":
+                        if "file" in item:
+                            file_data = item["file"]["file_data"]
+                            # 从file_data中获取文件类型
+                            content_type = file_data.split(",")[0].split(";")[0].replace("data:", "")
+                            try:
+                                # 解析base64部分
+                                base64_data = file_data.split(",")[1]
+                                file_content = base64.b64decode(base64_data)
+                                
+                                # 使用 types.Part.from_bytes 创建文件部分
+                                file_part = types.Part.from_bytes(
+                                    data=file_content,
+                                    mime_type=content_type
+                                )
+                                parts.append(file_part)
+                            except Exception as e:
+                                raise GeminiError(status_code=500, message=f"Error processing file data in stream: {str(e)}")
+                    elif item_type == "video_url":
+                        video_url = item.get("video_url", {}).get("url", "")
+                        if video_url and video_url.startswith("https://www.youtube.com/"):
+                            try:
+                                parts.append(types.Part(file_data=types.FileData(file_uri=video_url)))
+                            except Exception as e:
+                                raise GeminiError(status_code=500, message=f"Error processing video URL in stream: {str(e)}")
+                # 文本优先放在前面,便于上下文理解
+                if text_parts:
+                    parts.insert(0, types.Part(text=" ".join(text_parts)))
+                # 如果既没有文本也没有有效图片，至少传一个空文本，避免 SDK 报错
                 if not parts:
                     parts = [types.Part(text="")]
-                processed_messages.append(types.Content(
-                    role="model",
-                    parts=parts
-                ))
-            elif msg["role"] == "tool":
-                # 处理工具响应消息
-                try:
-                    function_response = types.FunctionResponse(
-                        name=msg.get("name", ""),
-                        response={"result": msg.get("content", "")}
-                    )
-                    processed_messages.append(types.Content(
-                        role="function",
-                        parts=[types.Part(function_response=function_response)]
-                    ))
-                except Exception as e:
-                    raise GeminiError(status_code=500, message=f"Error processing tool response in stream: {str(e)}")
-            elif msg["role"] == "system":
+                if has_image:
+                    stream_has_image = True
+            else:
+                # 纯文本消息，支持 "markdown 图片" 转图片 part
+                txt = str(content)
+                converted = self._try_convert_markdown_image_to_part(txt, deadline=deadline)
+                if converted:
+                    parts = [converted]
+                    stream_has_image = True
+                else:
+                    parts = [types.Part(text=txt)]
+
+            return types.Content(
+                role="user",
+                parts=parts
+            ), stream_has_image
+        elif msg["role"] == "assistant":
+            parts = []
+            # 处理助手消息，包括工具调用
+            
+            # 处理文本内容
+            if msg.get("content"):
+                converted = self._try_convert_markdown_image_to_part(msg["content"], deadline=deadline)
+                if converted:
+                    parts.append(converted)
+                    if msg.get("thought_signature") and msg['thought_signature']:
+                        try:
+                            parts[-1].thought_signature = msg['thought_signature']
+                        except Exception:
+                            pass
+
+                else:
+                    if msg.get("thought_signature") and msg['thought_signature']:
+                        parts.append(types.Part(text=msg["content"], thought_signature=msg["thought_signature"]))
+                    else:
+                        parts.append(types.Part(text=msg["content"]))
+                          
+            # 处理工具调用
+            if "tool_calls" in msg:
+                for tool_call in msg["tool_calls"]:
+                    if tool_call.get("type") == "function":
+                        function_info = tool_call.get("function", {})
+                        try:
+                            args = json.loads(function_info.get("arguments", "{}"))
+                            parts.append(types.Part(
+                                function_call=types.FunctionCall(
+                                    name=function_info.get("name"),
+                                    args=args
+                                )
+                            ))
+                            if "thought_signature" in tool_call:
+                                raw_ts = tool_call["thought_signature"]
+                                parts[-1].thought_signature = raw_ts
+                        except Exception as e:
+                            raise GeminiError(status_code=500, message=f"Error processing tool_calls in stream: {str(e)}")
+
+            if not parts:
+                parts = [types.Part(text="")]
+            return types.Content(
+                role="model",
+                parts=parts
+            ), False
+        elif msg["role"] == "tool":
+            # 处理工具响应消息
+            try:
+                function_response = types.FunctionResponse(
+                    name=msg.get("name", ""),
+                    response={"result": msg.get("content", "")}
+                )
+                return types.Content(
+                    role="function",
+                    parts=[types.Part(function_response=function_response)]
+                ), False
+            except Exception as e:
+                raise GeminiError(status_code=500, message=f"Error processing tool response in stream: {str(e)}")
+        # system 消息由调用方作为配置项处理
+        return None, False
+
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
+        deadline = deadline or Deadline()
+        # 逐条转换消息；开启 prefix_cache 时只转换新追加的消息
+        converted = prefix_cache.convert_messages(
+            ("gemini", model), messages, lambda msg: self._convert_stream_message(model, msg, deadline)
+        )
+        processed_messages = []
+        processed_sources = []
+        stream_has_image = False
+        for msg, (content, has_image) in zip(messages, converted):
+            if msg["role"] == "system":
                 # 系统消息作为配置项处理
                 new_kwargs["system_instruction"] = msg["content"]
+            elif content is not None:
+                processed_messages.append(content)
+                processed_sources.append(msg)
+                stream_has_image = stream_has_image or has_image
+        if processed_messages and any(key in new_kwargs for key in ("audio_url", "image_url", "file_url")):
+            # 额外的媒体参数会追加到最后一条消息，先复制一份，避免改动缓存中的 Content
+            last_content = processed_messages[-1]
+            processed_messages[-1] = types.Content(role=last_content.role, parts=list(last_content.parts or []))
 
         # 使用统一构建方法创建 config
         config = self._build_config(new_kwargs, stream=True, multimodal=False, has_image=stream_has_image)
@@ -410,7 +636,7 @@ class GeminiAIProvider(BaseProvider):
         last_message = messages[-1]["content"]
         if "audio_url" in new_kwargs:
             try:
-                a_resp = requests.get(new_kwargs["audio_url"])
+                a_resp = media_get(deadline, new_kwargs["audio_url"], timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
                 a_bytes = a_resp.content
                 a_mime = a_resp.headers.get('Content-Type', None)
                 if not a_mime:
@@ -432,17 +658,19 @@ class GeminiAIProvider(BaseProvider):
                 # 音频理解仅需要文本输出
                 processed_messages[-1].parts.append(types.Part.from_bytes(data=a_bytes, mime_type=a_mime))
             except Exception as e:
+                raise_if_timeout(e, model=model, llm_provider="gemini")
                 raise GeminiError(status_code=500, message=f"Error processing audio URL: {str(e)}")
         if "image_url" in new_kwargs:
             config.response_modalities = ['Image', 'Text']
             try:
-                response = requests.get(new_kwargs["image_url"])
+                response = media_get(deadline, new_kwargs["image_url"], timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
                 img_bytes = response.content
                 mime_type = response.headers.get('Content-Type', 'image/jpeg')
                 processed_messages[-1].parts.append(
                     types.Part.from_bytes(data=img_bytes, mime_type=mime_type)
                 )
             except Exception as e:
+                raise_if_timeout(e, model=model, llm_provider="gemini")
                 raise GeminiError(status_code=500, message=f"Error processing image URL: {str(e)}")
             stream_has_image = True
         
@@ -450,7 +678,7 @@ class GeminiAIProvider(BaseProvider):
             file_url = new_kwargs["file_url"]
             config.response_modalities = ['Text', 'File']
             try:
-                response = requests.get(file_url)
+                response = media_get(deadline, file_url, timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
                 file_content = response.content
                 
                 content_type = response.headers.get('Content-Type', 'application/octet-stream')
@@ -465,6 +693,7 @@ class GeminiAIProvider(BaseProvider):
                 )
                 processed_messages[-1].parts.append(file_part)
             except Exception as e:
+                raise_if_timeout(e, model=model, llm_provider="gemini")
                 raise GeminiError(status_code=500, message=f"Error processing file URL: {str(e)}")
 
         # 如果消息中包含图片（无论来自 content 数组还是 image_url 参数），确保响应模态包含图像
@@ -481,15 +710,23 @@ class GeminiAIProvider(BaseProvider):
                 pass
 
         try:
+            if new_kwargs.get("context_cache"):
+                processed_messages = self._apply_context_cache(
+                    model, config, processed_messages, processed_sources, new_kwargs, stream=True, deadline=deadline
+                )
             # 使用 generate_content_stream 方法
+            self._apply_deadline(config, deadline, model)
             response = self.client.models.generate_content_stream(
                 model=model,
                 contents=processed_messages,
                 config=config
             )
+            # 调用方提前停止迭代时关闭底层流，释放连接
+            response = ClosingStream(iter(response), response, deadline=deadline)
             index = 0
             final_usage_obj = None
             for chunk in response:
+                deadline.check(model=model, llm_provider="gemini")
                 chunk_choices = []
                 # 不在中间chunk直接输出usage, 仅收集到最后
                 usage_obj = None
@@ -619,6 +856,8 @@ class GeminiAIProvider(BaseProvider):
                             final_usage_obj.image_prompt_tokens = image_prompt_tokens
                             final_usage_obj.text_completion_tokens = text_completion_tokens
                             final_usage_obj.image_completion_tokens = image_completion_tokens
+                            final_usage_obj.cached_tokens = getattr(um, 'cached_content_token_count', 0) or 0
+                            with_cached_prompt_tokens(final_usage_obj)
                         except Exception:
                             pass
                     except Exception as e:
@@ -649,6 +888,7 @@ class GeminiAIProvider(BaseProvider):
                 )
                 yield final_chunk
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="gemini")
             raise GeminiError(status_code=500, message=f"Error in stream processing: {str(e)}")
 
     def create_model_response_wrapper(self, response, model):
@@ -757,6 +997,8 @@ class GeminiAIProvider(BaseProvider):
                     usage_obj.image_prompt_tokens = image_prompt_tokens
                     usage_obj.text_completion_tokens = text_completion_tokens
                     usage_obj.image_completion_tokens = image_completion_tokens
+                    usage_obj.cached_tokens = getattr(um, 'cached_content_token_count', 0) or 0
+                    with_cached_prompt_tokens(usage_obj)
                 except Exception:
                     pass
             except Exception as e:
@@ -771,13 +1013,18 @@ class GeminiAIProvider(BaseProvider):
         )
         return model_response
 
+    def batch_backend(self, api_key=None, api_base=None, api_version=None):
+        backend_kwargs = {"api_base": api_base} if api_base else {}
+        return GeminiBatchBackend(self, api_key or self.api_key, **backend_kwargs)
+
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise GeminiError(
                     status_code=422, message=f"Missing model or messages"
                 )
-            message_check_result = self.check_prompt("gemini", model, messages)            
+            message_check_result = self.check_prompt("gemini", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -789,7 +1036,7 @@ class GeminiAIProvider(BaseProvider):
             stream = kwargs.get("stream", False)            
 
             if stream:
-                return self.post_stream_processing_wrapper(model, messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model, messages, deadline=deadline, **new_kwargs)
             else:
                 # 获取最后一条消息内容
                 last_msg_obj = messages[-1]
@@ -811,7 +1058,7 @@ class GeminiAIProvider(BaseProvider):
                             # 处理 Part 对象
                             if hasattr(content, 'text') and content.text is not None:
                                 txt = content.text
-                                converted = self._try_convert_markdown_image_to_part(str(txt))
+                                converted = self._try_convert_markdown_image_to_part(str(txt), deadline=deadline)
                                 if converted:
                                     image_parts.append(converted)
                                     try:
@@ -831,7 +1078,7 @@ class GeminiAIProvider(BaseProvider):
                             continue
                         if content.get("type") == "text":
                             txt = content.get("text", "")
-                            converted = self._try_convert_markdown_image_to_part(txt)
+                            converted = self._try_convert_markdown_image_to_part(txt, deadline=deadline)
                             if converted:
                                 # 透传内容项 thought_signature
                                 if content.get("thought_signature"):
@@ -846,7 +1093,7 @@ class GeminiAIProvider(BaseProvider):
                             try:
                                 audio_url = content.get("audio_url", {}).get("url", "")
                                 if audio_url:
-                                    a_resp = requests.get(audio_url)
+                                    a_resp = media_get(deadline, audio_url, timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
                                     a_bytes = a_resp.content
                                     a_mime = a_resp.headers.get('Content-Type', None)
                                     if not a_mime:
@@ -867,12 +1114,13 @@ class GeminiAIProvider(BaseProvider):
                                             a_mime = 'audio/mpeg'
                                     image_parts.append(types.Part.from_bytes(data=a_bytes, mime_type=a_mime))
                             except Exception as e:
+                                raise_if_timeout(e, model=model, llm_provider="gemini")
                                 raise GeminiError(status_code=500, message=f"Error downloading audio: {str(e)}")
                         elif content.get("type") == "image_url":
                             try:
                                 image_url = content.get("image_url", {}).get("url", "")
                                 if image_url:
-                                    response = requests.get(image_url)
+                                    response = media_get(deadline, image_url, timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
                                     img_bytes = response.content
                                     mime_type = response.headers.get('Content-Type', None)
                                     if not mime_type:
@@ -885,6 +1133,7 @@ class GeminiAIProvider(BaseProvider):
                                             mime_type = 'image/jpeg'
                                     image_parts.append(types.Part.from_bytes(data=img_bytes, mime_type=mime_type))
                             except Exception as e:
+                                raise_if_timeout(e, model=model, llm_provider="gemini")
                                 raise GeminiError(status_code=500, message=f"Error downloading image: {str(e)}")
                         elif content.get("type") == "file":
                             if "file" in content:
@@ -925,6 +1174,9 @@ class GeminiAIProvider(BaseProvider):
                             )
                             
                             # 使用 generate_content 方法处理视频内容
+                            if new_kwargs.get("context_cache"):
+                                self._apply_context_cache(model, config, [], [], new_kwargs, deadline=deadline)
+                            self._apply_deadline(config, deadline, model)
                             result = self.client.models.generate_content(
                                 model=model,
                                 contents=contents,
@@ -933,6 +1185,7 @@ class GeminiAIProvider(BaseProvider):
                             
                             return self.create_model_response_wrapper(result, model=model)
                         except Exception as e:
+                            raise_if_timeout(e, model=model, llm_provider="gemini")
                             raise GeminiError(status_code=500, message=f"Error processing video URL: {str(e)}")
                     else:
                         # 添加文本部分
@@ -959,7 +1212,7 @@ class GeminiAIProvider(BaseProvider):
                     try:
                         audio_url = new_kwargs["audio_url"]
                         contents.append(last_message)
-                        a_resp = requests.get(audio_url)
+                        a_resp = media_get(deadline, audio_url, timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
                         a_bytes = a_resp.content
                         a_mime = a_resp.headers.get('Content-Type', None)
                         if not a_mime:
@@ -982,6 +1235,7 @@ class GeminiAIProvider(BaseProvider):
                         # 音频 + 文本
                         config.response_modalities = ['Text']
                     except Exception as e:
+                        raise_if_timeout(e, model=model, llm_provider="gemini")
                         raise GeminiError(status_code=500, message=f"Error downloading audio: {str(e)}")
                 elif "image_url" in new_kwargs:
                     # 处理image_url参数
@@ -989,7 +1243,7 @@ class GeminiAIProvider(BaseProvider):
                         image_url = new_kwargs["image_url"]
                         # 添加文本部分
                         contents.append(last_message)
-                        response = requests.get(image_url)
+                        response = media_get(deadline, image_url, timeout=deadline.requests_timeout(model=model, llm_provider="gemini"))
                         img_bytes = response.content
                         mime_type = response.headers.get('Content-Type', None)
                         if not mime_type:
@@ -1003,6 +1257,7 @@ class GeminiAIProvider(BaseProvider):
                         contents.append(types.Part.from_bytes(data=img_bytes, mime_type=mime_type))
                         config.response_modalities = ['Text', 'Image']
                     except Exception as e:
+                        raise_if_timeout(e, model=model, llm_provider="gemini")
                         raise GeminiError(status_code=500, message=f"Error downloading image: {str(e)}")
                 elif "video_url" in new_kwargs:
                     # 处理YouTube视频URL
@@ -1019,6 +1274,9 @@ class GeminiAIProvider(BaseProvider):
                         )
                         
                         # 使用 generate_content 方法处理视频内容
+                        if new_kwargs.get("context_cache"):
+                            self._apply_context_cache(model, config, [], [], new_kwargs, deadline=deadline)
+                        self._apply_deadline(config, deadline, model)
                         result = self.client.models.generate_content(
                             model=model,
                             contents=contents,
@@ -1027,11 +1285,12 @@ class GeminiAIProvider(BaseProvider):
                         
                         return self.create_model_response_wrapper(result, model=model)
                     except Exception as e:
+                        raise_if_timeout(e, model=model, llm_provider="gemini")
                         raise GeminiError(status_code=500, message=f"Error processing video URL: {str(e)}")
                 else:
                     # 普通文本消息，支持 "markdown 图片" 转图片 part
                     if isinstance(last_message, str):
-                        converted = self._try_convert_markdown_image_to_part(last_message)
+                        converted = self._try_convert_markdown_image_to_part(last_message, deadline=deadline)
                         if converted:
                             if last_msg_obj.get("thought_signature"):
                                 try:
@@ -1053,7 +1312,11 @@ class GeminiAIProvider(BaseProvider):
                     else:
                         contents = last_message
                     
+                # 非流式只发送最后一条消息，可缓存的前缀是 system_instruction 与 tools
+                if new_kwargs.get("context_cache"):
+                    self._apply_context_cache(model, config, [], [], new_kwargs, deadline=deadline)
                 # 直接使用 generate_content 方法
+                self._apply_deadline(config, deadline, model)
                 result = self.client.models.generate_content(
                     model=model,
                     contents=contents,
@@ -1062,16 +1325,18 @@ class GeminiAIProvider(BaseProvider):
                 return self.create_model_response_wrapper(result, model=model)
                 
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="gemini")
             if hasattr(e, "status_code"):
                 raise GeminiError(status_code=e.status_code, message=str(e))
             else:
                 raise GeminiError(status_code=500, message=str(e))
 
-    def _try_convert_markdown_image_to_part(self, text: str):
+    def _try_convert_markdown_image_to_part(self, text: str, deadline=None):
+        deadline = deadline or Deadline()
         md_url = self._extract_markdown_image_url(text)
         if md_url:
             try:
-                resp = requests.get(md_url)
+                resp = media_get(deadline, md_url, timeout=deadline.requests_timeout(llm_provider="gemini"))
                 img_bytes = resp.content
                 mime_type = resp.headers.get('Content-Type', None)
                 if not mime_type:
@@ -1084,5 +1349,6 @@ class GeminiAIProvider(BaseProvider):
                         mime_type = 'image/jpeg'
                 return types.Part.from_bytes(data=img_bytes, mime_type=mime_type)
             except Exception as e:
+                raise_if_timeout(e, llm_provider="gemini")
                 raise GeminiError(status_code=500, message=f"Error processing markdown image: {str(e)}")
         return None
@@ -1,4 +1,5 @@
 from .base_provider import BaseProvider
+from unionllm.utils import Deadline, raise_if_timeout
 from openai import OpenAI
 import logging, json, os
 
@@ -39,24 +40,25 @@ class LingyiAIProvider(BaseProvider):
 
         return kwargs
     
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         result = self.client.chat.completions.create(
             model=model, messages=messages, **new_kwargs
         )
-        return self.post_stream_processing(result)
+        return self.post_stream_processing(result, deadline=deadline)
 
     def create_model_response_wrapper(self, result, model):
         # 调用 response_model 中的 create_model_response 方法
         return self.create_model_response(result, model=model)
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise LingyiOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("lingyi", model, messages)            
+            message_check_result = self.check_prompt("lingyi", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -65,16 +67,18 @@ class LingyiAIProvider(BaseProvider):
                 )
                 
             new_kwargs = self.pre_processing(**kwargs)
+            new_kwargs.update(deadline.sdk_kwargs(model=model, llm_provider="lingyi"))
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             else:
                 result = self.client.chat.completions.create(
                     model=model, messages=messages, **new_kwargs
                 )
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="lingyi")
             if hasattr(e, "status_code"):
                 raise LingyiOpenAIError(status_code=e.status_code, message=str(e))
             else:
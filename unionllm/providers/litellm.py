@@ -1,6 +1,8 @@
-import json, time
+import json, time, os
 import dashscope
 from .base_provider import BaseProvider
+from unionllm.utils import Deadline, raise_if_timeout
+from unionllm.batch_api import OpenAIBatchBackend, DashScopeBatchBackend
 import litellm
 from litellm import completion
 
@@ -32,16 +34,43 @@ class LiteLLMProvider(BaseProvider):
                 pass
         return kwargs
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         result = completion(
             model=model, messages=messages, **new_kwargs
         )
-        return self.post_stream_processing(result, model=model)
+        return self.post_stream_processing(result, model=model, deadline=deadline)
 
     def create_model_response_wrapper(self, result, model):
         return self.create_model_response(result, model=model)
 
+    def batch_backend(self, provider, api_key=None, api_base=None, api_version=None):
+        # 供应商原生离线批处理：OpenAI 及其兼容接口、Azure OpenAI、DashScope
+        if provider == "azure":
+            api_key = api_key or os.environ.get("AZURE_API_KEY")
+            api_base = api_base or os.environ.get("AZURE_API_BASE")
+            if not api_key or not api_base:
+                raise LiteLLMError(status_code=422, message="Missing api_key or api_base for Azure batch")
+            api_base = api_base.rstrip("/")
+            if not api_base.endswith("/openai"):
+                api_base += "/openai"
+            api_version = api_version or os.environ.get("AZURE_API_VERSION") or "2024-10-21"
+            return OpenAIBatchBackend(self, api_key, api_base=api_base, api_version=api_version, endpoint="/chat/completions")
+        if provider == "qwen":
+            api_key = api_key or os.environ.get("DASHSCOPE_API_KEY")
+            backend_kwargs = {"api_base": api_base} if api_base else {}
+            if not api_key:
+                raise LiteLLMError(status_code=422, message="Missing API key")
+            return DashScopeBatchBackend(self, api_key, **backend_kwargs)
+        if provider in (None, "openai"):
+            api_key = api_key or os.environ.get("OPENAI_API_KEY")
+            api_base = api_base or os.environ.get("OPENAI_API_BASE") or "https://api.openai.com/v1"
+            if not api_key:
+                raise LiteLLMError(status_code=422, message="Missing API key")
+            return OpenAIBatchBackend(self, api_key, api_base=api_base)
+        raise LiteLLMError(status_code=422, message=f"Provider '{provider}' has no native batch API support")
+
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if 'provider' in kwargs:
                 provider = kwargs['provider']
@@ -54,7 +83,7 @@ class LiteLLMProvider(BaseProvider):
                     status_code=422, message=f"Missing model or messages"
                 )
             # 检查消息格式
-            message_check_result = self.check_prompt(provider, model, messages)       
+            message_check_result = self.check_prompt(provider, model, messages, deadline=deadline)       
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -62,19 +91,21 @@ class LiteLLMProvider(BaseProvider):
                     status_code=422, message=message_check_result['reason']
                 )
             
-            new_kwargs = self.pre_processing(**kwargs)                        
+            new_kwargs = self.pre_processing(**kwargs)
+            new_kwargs.update(deadline.sdk_kwargs(model=model, llm_provider=provider))
             stream = kwargs.get("stream", False)
 
             if stream:
                 if provider not in ['azure_ai']:
                     new_kwargs['stream_options'] = {"include_usage": True}
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             else:
                 result = completion(
                     model=model, messages=messages, **new_kwargs
                 )
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="litellm")
             if hasattr(e, "status_code"):
                 raise LiteLLMError(status_code=e.status_code, message=str(e))
             else:
@@ -1,5 +1,5 @@
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices, Deadline, raise_if_timeout
 import requests
 import json
 import logging, os
@@ -37,14 +37,14 @@ class MinimaxAIProvider(BaseProvider):
                 kwargs.pop(key)
         return kwargs
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        response = requests.post(self.endpoint_url, headers=headers, data=payload)
-        for line in response.iter_lines():
+        response = self.stream_post(self.endpoint_url, deadline, model=model, llm_provider="minimax", headers=headers, data=payload)
+        for line in self.iter_response_lines(response, deadline, model=model, llm_provider="minimax"):
             if line:
                 new_line = line.decode("utf-8").replace("data: ", "")
                 data = json.loads(new_line)
@@ -148,13 +148,14 @@ class MinimaxAIProvider(BaseProvider):
         return response
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise MinimaxOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("minimax", model, messages)            
+            message_check_result = self.check_prompt("minimax", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -166,7 +167,7 @@ class MinimaxAIProvider(BaseProvider):
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             
             else:
                 payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
@@ -174,9 +175,10 @@ class MinimaxAIProvider(BaseProvider):
                     "Authorization": f"Bearer {self.api_key}",
                     "Content-Type": "application/json",
                 }
-                result = requests.post(self.endpoint_url, headers=headers, data=payload)
+                result = requests.post(self.endpoint_url, headers=headers, data=payload, timeout=deadline.requests_timeout(model=model, llm_provider="minimax"))
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="minimax")
             if hasattr(e, "status_code"):
                 raise MinimaxOpenAIError(status_code=e.status_code, message=str(e))
             else:
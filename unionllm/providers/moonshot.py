@@ -1,4 +1,6 @@
 from .base_provider import BaseProvider
+from unionllm.utils import Deadline, raise_if_timeout, media_get
+from unionllm import prefix_cache
 from openai import OpenAI
 import base64
 import logging, json, os
@@ -79,8 +81,9 @@ class MoonshotAIProvider(BaseProvider):
         encoded = base64.b64encode(raw).decode("utf-8")
         return f"data:{media_type};base64,{encoded}"
 
-    def _fetch_url_as_data_uri(self, url: str, *, fallback_mime: str, timeout_s: int) -> str:
-        resp = requests.get(url, timeout=timeout_s)
+    def _fetch_url_as_data_uri(self, url: str, *, fallback_mime: str, timeout_s: int, deadline=None) -> str:
+        deadline = deadline or Deadline()
+        resp = media_get(deadline, url, timeout=deadline.requests_timeout(default=timeout_s, llm_provider="moonshot"))
         resp.raise_for_status()
         content_type = (resp.headers.get("Content-Type") or "").split(";", 1)[0].strip()
         if not content_type or content_type in ("application/octet-stream", "binary/octet-stream"):
@@ -95,7 +98,7 @@ class MoonshotAIProvider(BaseProvider):
         mime = self._guess_mime_type(path, fallback_mime)
         return self._encode_bytes_as_data_uri(mime, raw)
 
-    def _ensure_base64_multimodal(self, model: str, messages: list) -> list:
+    def _ensure_base64_multimodal(self, model: str, messages: list, deadline=None) -> list:
         """
         Moonshot's multimodal inputs require base64 data URIs. For kimi-k2.5, we
         accept http(s) URLs (and local file paths) and convert them to base64 data URIs
@@ -104,70 +107,78 @@ class MoonshotAIProvider(BaseProvider):
         model_name = str(model or "").lower()
         allow_url_fetch = model_name.startswith("kimi-k2.5")
 
-        normalized_messages = []
-        for message in messages or []:
-            content = message.get("content")
-            if not isinstance(content, list):
-                normalized_messages.append(message)
+        # 开启 prefix_cache 时历史消息里的 URL 只下载一次，之后复用已转换的 data URI
+        return prefix_cache.convert_messages(
+            ("moonshot", allow_url_fetch),
+            messages or [],
+            lambda message: self._ensure_base64_message(model, message, allow_url_fetch, deadline=deadline),
+        )
+
+    def _ensure_base64_message(self, model: str, message: dict, allow_url_fetch: bool, deadline=None) -> dict:
+        content = message.get("content")
+        if not isinstance(content, list):
+            return message
+
+        new_content = []
+        changed = False
+
+        for part in content:
+            if not isinstance(part, dict):
+                new_content.append(part)
                 continue
 
-            new_message = dict(message)
-            new_content = []
-
-            for part in content:
-                if not isinstance(part, dict):
-                    new_content.append(part)
-                    continue
-
-                part_type = part.get("type")
-                if part_type not in ("image_url", "video_url"):
-                    new_content.append(part)
-                    continue
-
-                payload_key = "image_url" if part_type == "image_url" else "video_url"
-                payload = part.get(payload_key) or {}
-                url = payload.get("url") if isinstance(payload, dict) else None
-                if not isinstance(url, str) or not url:
-                    raise MoonshotOpenAIError(
-                        status_code=422,
-                        message=f"Invalid {part_type} input: missing '{payload_key}.url'",
-                    )
+            part_type = part.get("type")
+            if part_type not in ("image_url", "video_url"):
+                new_content.append(part)
+                continue
 
-                if url.startswith("data:"):
-                    self._parse_data_uri_base64(part_type, url)
-                    new_content.append(part)
-                    continue
-
-                if not allow_url_fetch:
-                    raise MoonshotOpenAIError(
-                        status_code=422,
-                        message=(
-                            f"Moonshot {part_type} requires base64 data URI for model={model}; "
-                            f"received non-data URL: {url}"
-                        ),
-                    )
+            payload_key = "image_url" if part_type == "image_url" else "video_url"
+            payload = part.get(payload_key) or {}
+            url = payload.get("url") if isinstance(payload, dict) else None
+            if not isinstance(url, str) or not url:
+                raise MoonshotOpenAIError(
+                    status_code=422,
+                    message=f"Invalid {part_type} input: missing '{payload_key}.url'",
+                )
 
-                if url.startswith(("http://", "https://")):
-                    if part_type == "image_url":
-                        new_url = self._fetch_url_as_data_uri(url, fallback_mime="image/jpeg", timeout_s=30)
-                    else:
-                        new_url = self._fetch_url_as_data_uri(url, fallback_mime="video/mp4", timeout_s=60)
+            if url.startswith("data:"):
+                self._parse_data_uri_base64(part_type, url)
+                new_content.append(part)
+                continue
+
+            if not allow_url_fetch:
+                raise MoonshotOpenAIError(
+                    status_code=422,
+                    message=(
+                        f"Moonshot {part_type} requires base64 data URI for model={model}; "
+                        f"received non-data URL: {url}"
+                    ),
+                )
+
+            if url.startswith(("http://", "https://")):
+                if part_type == "image_url":
+                    new_url = self._fetch_url_as_data_uri(url, fallback_mime="image/jpeg", timeout_s=30, deadline=deadline)
                 else:
-                    if part_type == "image_url":
-                        new_url = self._read_file_as_data_uri(url, fallback_mime="image/jpeg")
-                    else:
-                        new_url = self._read_file_as_data_uri(url, fallback_mime="video/mp4")
+                    new_url = self._fetch_url_as_data_uri(url, fallback_mime="video/mp4", timeout_s=60, deadline=deadline)
+            else:
+                if part_type == "image_url":
+                    new_url = self._read_file_as_data_uri(url, fallback_mime="image/jpeg")
+                else:
+                    new_url = self._read_file_as_data_uri(url, fallback_mime="video/mp4")
 
-                new_part = dict(part)
-                new_payload = dict(payload) if isinstance(payload, dict) else {}
-                new_payload["url"] = new_url
-                new_part[payload_key] = new_payload
-                new_content.append(new_part)
+            new_part = dict(part)
+            new_payload = dict(payload) if isinstance(payload, dict) else {}
+            new_payload["url"] = new_url
+            new_part[payload_key] = new_payload
+            new_content.append(new_part)
+            changed = True
 
+        # 没有需要转换的 URL 时复用原消息，不做复制
+        if changed:
+            new_message = dict(message)
             new_message["content"] = new_content
-            normalized_messages.append(new_message)
-
-        return normalized_messages
+            return new_message
+        return message
 
     def pre_processing(self, model: str, **kwargs):
         # process the compatibility issue of parameters, all unsupported parameters are discarded
@@ -243,24 +254,25 @@ class MoonshotAIProvider(BaseProvider):
 
         return kwargs
     
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         result = self.client.chat.completions.create(
             model=model, messages=messages, **new_kwargs
         )
-        return self.post_stream_processing(result)
+        return self.post_stream_processing(result, deadline=deadline)
 
     def create_model_response_wrapper(self, result, model):
         # 调用 response_model 中的 create_model_response 方法
         return self.create_model_response(result, model=model)
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise MoonshotOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("moonshot", model, messages)            
+            message_check_result = self.check_prompt("moonshot", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -268,19 +280,21 @@ class MoonshotAIProvider(BaseProvider):
                     status_code=422, message=message_check_result['reason']
                 )
 
-            messages = self._ensure_base64_multimodal(model, messages)
+            messages = self._ensure_base64_multimodal(model, messages, deadline=deadline)
                 
             new_kwargs = self.pre_processing(model=model, **kwargs)
+            new_kwargs.update(deadline.sdk_kwargs(model=model, llm_provider="moonshot"))
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             else:
                 result = self.client.chat.completions.create(
                     model=model, messages=messages, **new_kwargs
                 )
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="moonshot")
             if hasattr(e, "status_code"):
                 raise MoonshotOpenAIError(status_code=e.status_code, message=str(e))
             else:
@@ -2,8 +2,10 @@ from openai import OpenAI
 from .base_provider import BaseProvider
 from http import HTTPStatus
 from dashscope import Generation, MultiModalConversation
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices
-import json, time, os
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices, Deadline, raise_if_timeout, with_cached_prompt_tokens
+from unionllm.batch_api import DashScopeBatchBackend
+import json, time, os, math
+import dashscope
 
 class QwenOpenAIError(Exception):
     def __init__(
@@ -15,6 +17,18 @@ class QwenOpenAIError(Exception):
         self.message = message
         super().__init__(self.message)
 
+def dashscope_usage(usage) -> Usage:
+    """Usage from a DashScope response; cache details (prompt_tokens_details) are kept as reported."""
+    result = Usage(
+        prompt_tokens=usage.input_tokens,
+        completion_tokens=usage.output_tokens,
+        total_tokens=usage.total_tokens,
+    )
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    if details:
+        result.prompt_tokens_details = dict(details)
+    return with_cached_prompt_tokens(result)
+
 class QwenAIProvider(BaseProvider):
     def __init__(self, **model_kwargs):
         # Get DASHSCOPE_API_KEY from environment variables
@@ -25,8 +39,8 @@ class QwenAIProvider(BaseProvider):
                 status_code=422, message=f"Missing API key"
             )        
         # Configure DashScope base URL per latest sample usage
-        # Allow override via env DASHSCOPE_BASE_URL if provided, otherwise use the default API endpoint
-        dashscope.base_http_api_url = os.environ.get(
+        # Allow override via api_base or env DASHSCOPE_BASE_URL if provided, otherwise use the default API endpoint
+        dashscope.base_http_api_url = model_kwargs.get("api_base") or os.environ.get(
             "DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/api/v1"
         )
         # Keep global api_key for backward compatibility, though we will also pass api_key explicitly on each call
@@ -43,7 +57,15 @@ class QwenAIProvider(BaseProvider):
                 kwargs.pop(key)
         return kwargs
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def dashscope_timeout_kwargs(self, deadline, model=None):
+        # DashScope SDK 的 request_timeout 只接受整数秒，向上取整并至少为1秒
+        remaining = deadline.remaining() if deadline else None
+        if remaining is None:
+            return {}
+        deadline.check(model=model, llm_provider="qwen")
+        return {"request_timeout": max(1, math.ceil(remaining))}
+
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         if_vision_model = new_kwargs.get("if_vision_model", False)
         has_vision_input = new_kwargs.get("has_vision_input", False)
         use_multimodal = new_kwargs.get("use_multimodal", False)
@@ -55,6 +77,7 @@ class QwenAIProvider(BaseProvider):
             # 清理与SDK不兼容的参数，并显式打开 stream
             clean_kwargs = dict(new_kwargs)
             clean_kwargs["stream"] = True
+            clean_kwargs.update(self.dashscope_timeout_kwargs(deadline, model=model))
             if use_multimodal:
                 responses = MultiModalConversation.call(
                     api_key=self.api_key,
@@ -83,12 +106,15 @@ class QwenAIProvider(BaseProvider):
                     message=f"DashScope stream error (code={code}, request_id={req_id}): {msg}"
                 )
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="qwen")
             # 提前捕获 DashScope SDK 抛出的异常，包含异常类型，便于诊断（鉴权/参数/网络等）
             raise QwenOpenAIError(
                 status_code=500,
                 message=f"DashScope streaming call failed: {type(e).__name__}: {str(e)}"
             )
         for response in responses:
+            if deadline:
+                deadline.check(model=model, llm_provider="qwen")
             if not hasattr(response, "status_code"):
                 # 兼容性保护：如果SDK返回了意外的字符串/字节流，避免AttributeError并给出清晰诊断
                 preview = None
@@ -139,6 +165,21 @@ class QwenAIProvider(BaseProvider):
                             else:
                                 stream_choices.finish_reason = None
                         chunk_choices.append(stream_choices)
+                if response.usage:
+                    chunk_usage = dashscope_usage(response.usage)
+                yield ModelResponse(
+                    id=response.request_id,
+                    choices=chunk_choices,
+                    created=int(time.time()),
+                    model=model,
+                    usage=chunk_usage,
+                    stream=True,
+                )
+            else:
+                raise QwenOpenAIError(
+                    status_code=response.status_code,
+                    message=f"DashScope stream error (code={getattr(response, 'code', None)}): {getattr(response, 'message', None)}",
+                )
 
     def create_model_response_wrapper(self, response, model):
         if response.status_code == HTTPStatus.OK:
@@ -158,11 +199,7 @@ class QwenAIProvider(BaseProvider):
                     )
                 )
 
-            usage = Usage(
-                prompt_tokens=response.usage.input_tokens,
-                completion_tokens=response.usage.output_tokens,
-                total_tokens=response.usage.total_tokens,
-            )
+            usage = dashscope_usage(response.usage)
 
             return ModelResponse(
                 id=response.request_id,
@@ -185,11 +222,7 @@ class QwenAIProvider(BaseProvider):
             choices.append(
                 Choices(message=message, index=index, finish_reason=choice.finish_reason)
             )
-        usage = Usage(
-            prompt_tokens=result.usage.input_tokens,
-            completion_tokens=result.usage.output_tokens,
-            total_tokens=result.usage.total_tokens,
-        )
+        usage = dashscope_usage(result.usage)
         response = ModelResponse(
             id=result.request_id,
             choices=choices,
@@ -258,13 +291,19 @@ class QwenAIProvider(BaseProvider):
                 })
         return fixed
 
+    def batch_backend(self, api_key=None, api_base=None, api_version=None):
+        # 离线批处理走 DashScope 的 OpenAI 兼容 Batch 接口
+        backend_kwargs = {"api_base": api_base} if api_base else {}
+        return DashScopeBatchBackend(self, api_key or self.api_key, **backend_kwargs)
+
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise QwenOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
-            message_check_result = self.check_prompt("qwen", model, messages)  
+            message_check_result = self.check_prompt("qwen", model, messages, deadline=deadline)  
              
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
@@ -290,11 +329,12 @@ class QwenAIProvider(BaseProvider):
             stream = new_kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             else:
                 try:
                     call_kwargs = dict(new_kwargs)
                     call_kwargs.pop("stream", None)
+                    call_kwargs.update(self.dashscope_timeout_kwargs(deadline, model=model))
                     if use_multimodal:
                         response = MultiModalConversation.call(
                             api_key=self.api_key,
@@ -311,6 +351,7 @@ class QwenAIProvider(BaseProvider):
                             **call_kwargs,
                         )
                 except Exception as e:
+                    raise_if_timeout(e, model=model, llm_provider="qwen")
                     raise QwenOpenAIError(
                         status_code=500,
                         message=f"DashScope call failed: {type(e).__name__}: {str(e)}"
@@ -331,6 +372,7 @@ class QwenAIProvider(BaseProvider):
                         message=f"DashScope error (code={err_code}, request_id={req_id}): {msg}"
                     )
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="qwen")
             if hasattr(e, "status_code"):
                 raise QwenOpenAIError(status_code=e.status_code, message=str(e))
             else:
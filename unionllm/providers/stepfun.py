@@ -1,4 +1,5 @@
 from .base_provider import BaseProvider
+from unionllm.utils import Deadline, raise_if_timeout
 from openai import OpenAI
 import logging, json, os
 
@@ -38,24 +39,25 @@ class StepfunAIProvider(BaseProvider):
 
         return kwargs
     
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         result = self.client.chat.completions.create(
             model=model, messages=messages, **new_kwargs
         )
-        return self.post_stream_processing(result)
+        return self.post_stream_processing(result, deadline=deadline)
 
     def create_model_response_wrapper(self, result, model):
         # 调用 response_model 中的 create_model_response 方法
         return self.create_model_response(result, model=model)
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise StepfunOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("stepfun", model, messages)            
+            message_check_result = self.check_prompt("stepfun", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -64,16 +66,18 @@ class StepfunAIProvider(BaseProvider):
                 )
                 
             new_kwargs = self.pre_processing(**kwargs)
+            new_kwargs.update(deadline.sdk_kwargs(model=model, llm_provider="stepfun"))
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             else:
                 result = self.client.chat.completions.create(
                     model=model, messages=messages, **new_kwargs
                 )
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="stepfun")
             if hasattr(e, "status_code"):
                 raise StepfunOpenAIError(status_code=e.status_code, message=str(e))
             else:
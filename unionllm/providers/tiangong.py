@@ -3,7 +3,7 @@ import requests
 import json
 import hashlib
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices, Deadline, raise_if_timeout
 
 class TianGongOpenAIError(Exception):
     def __init__(
@@ -16,6 +16,9 @@ class TianGongOpenAIError(Exception):
         super().__init__(self.message)
 
 class TianGongAIProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):
         # Get TIANGONG_API_KEY from environment variables
         _env_app_key = os.environ.get("TIANGONG_APP_KEY")
@@ -26,7 +29,8 @@ class TianGongAIProvider(BaseProvider):
             raise TianGongOpenAIError(
                 status_code=422, message=f"Missing APP key or APP secret"
             )
-        self.endpoint_url = "https://sky-api.singularity-ai.com/saas/api/v4/generate"
+        api_base = model_kwargs.get("api_base") or "https://sky-api.singularity-ai.com"
+        self.endpoint_url = api_base + "/saas/api/v4/generate"
 
     def pre_processing(self, **kwargs):
         supported_params = [
@@ -40,13 +44,10 @@ class TianGongAIProvider(BaseProvider):
         return kwargs
 
     def to_formatted_prompt(self, messages):
-        # replace the role of assistant to bot
-        for message in messages:
-            if message.get("role") == "assistant":
-                message["role"] = "bot"
-        return messages
+        # replace the role of assistant to bot（不修改调用方的消息）
+        return [dict(message, role="bot") if message.get("role") == "assistant" else message for message in messages]
     
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         timestamp = str(int(time.time()))
         sign_content = self.app_key + self.app_secret + timestamp
         sign_result = hashlib.md5(sign_content.encode("utf-8")).hexdigest()
@@ -58,9 +59,9 @@ class TianGongAIProvider(BaseProvider):
             "Content-Type": "application/json",
             "stream": "true",
         }
-        result = requests.post(self.endpoint_url, headers=headers, json=payload, stream=True)
+        result = self.stream_post(self.endpoint_url, deadline, model=model, llm_provider="tiangong", headers=headers, json=payload)
         index = 0
-        for line in result.iter_lines():
+        for line in self.iter_response_lines(result, deadline, model=model, llm_provider="tiangong"):
             if line:
                 new_line = json.loads(line.decode('utf-8'))
                 chunk_choices = []
@@ -119,12 +120,13 @@ class TianGongAIProvider(BaseProvider):
 
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         if model is None or messages is None:
             raise TianGongOpenAIError(
                 status_code=422, message=f"Missing model or messages"
             )
                
-        message_check_result = self.check_prompt("tiangong", model, messages)            
+        message_check_result = self.check_prompt("tiangong", model, messages, deadline=deadline)            
         if message_check_result['pass_check']:
             messages = message_check_result['messages']
         else:
@@ -138,7 +140,7 @@ class TianGongAIProvider(BaseProvider):
         messages = self.to_formatted_prompt(messages)
 
         if stream:
-            return self.post_stream_processing_wrapper(model, messages, **new_kwargs)
+            return self.post_stream_processing_wrapper(model, messages, deadline=deadline, **new_kwargs)
         else:
             timestamp = str(int(time.time()))
             sign_content = self.app_key + self.app_secret + timestamp
@@ -151,7 +153,11 @@ class TianGongAIProvider(BaseProvider):
                 "Content-Type": "application/json",
                 "stream": "false",
             }
-            result = requests.post(self.endpoint_url, headers=headers, json=payload)
+            try:
+                result = requests.post(self.endpoint_url, headers=headers, json=payload, timeout=deadline.requests_timeout(model=model, llm_provider="tiangong"))
+            except Exception as e:
+                raise_if_timeout(e, model=model, llm_provider="tiangong")
+                raise
             result_json = result.json()
             if result_json['code'] != 200:
                 raise TianGongOpenAIError(
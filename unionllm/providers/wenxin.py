@@ -4,7 +4,7 @@ import json, os
 import logging
 import hashlib
 from .base_provider import BaseProvider
-from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Delta, StreamingChoices, Deadline, raise_if_timeout
 
 class WenXinOpenAIError(Exception):
     def __init__(
@@ -17,6 +17,9 @@ class WenXinOpenAIError(Exception):
         super().__init__(self.message)
 
 class WenXinAIProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):
         # Get ERNIE_CLIENT_ID and ERNIE_CLIENT_ID from environment variables
         _env_client_id = os.environ.get("ERNIE_CLIENT_ID")
@@ -29,17 +32,21 @@ class WenXinAIProvider(BaseProvider):
             raise WenXinOpenAIError(
                 status_code=422, message=f"Missing necessary credentials"
             )
+        # api_base 为千帆 v2 接口地址，aip_base 为 OAuth 与旧版 wenxinworkshop 接口所在域名
+        self.api_base = model_kwargs.get("api_base") or "https://qianfan.baidubce.com/v2"
+        self.aip_base = model_kwargs.get("aip_base") or "https://aip.baidubce.com"
         if not self.api_key:
             self.access_token = self.get_access_token()
 
-    def get_access_token(self):
-        url = "https://aip.baidubce.com/oauth/2.0/token"
+    def get_access_token(self, deadline=None):
+        deadline = deadline or Deadline()
+        url = f"{self.aip_base}/oauth/2.0/token"
         params = {
             "grant_type": "client_credentials",
             "client_id": self.client_id,
             "client_secret": self.client_secret,
         }
-        response = requests.post(url, params=params)
+        response = requests.post(url, params=params, timeout=deadline.requests_timeout(llm_provider="wenxin"))
         return str(response.json().get("access_token"))
 
     def pre_processing(self, **kwargs):
@@ -59,13 +66,14 @@ class WenXinAIProvider(BaseProvider):
             system = None
         return messages, system
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
         headers = {"Content-Type": "application/json"}
         if self.api_key:
             headers["Authorization"] = f"Bearer {self.api_key}"
         index = 0
-        for line in requests.post(self.endpoint_url, headers=headers, data=payload, stream=True).iter_lines():
+        response = self.stream_post(self.endpoint_url, deadline, model=model, llm_provider="wenxin", headers=headers, data=payload)
+        for line in self.iter_response_lines(response, deadline, model=model, llm_provider="wenxin"):
             if line:
                 try:
                     # Remove the "data: " prefix before decoding the JSON
@@ -166,13 +174,14 @@ class WenXinAIProvider(BaseProvider):
         return response
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise WenXinOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("wenxin", model, messages)            
+            message_check_result = self.check_prompt("wenxin", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -197,20 +206,21 @@ class WenXinAIProvider(BaseProvider):
                 self.model_path = model
 
             if self.api_key:
-                self.endpoint_url = f"https://qianfan.baidubce.com/v2/chat/completions"
+                self.endpoint_url = f"{self.api_base}/chat/completions"
             else:
-                self.endpoint_url = f"https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{self.model_path}?access_token={self.access_token}"
+                self.endpoint_url = f"{self.aip_base}/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{self.model_path}?access_token={self.access_token}"
 
             if stream:
-                return self.post_stream_processing_wrapper(model, messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model, messages, deadline=deadline, **new_kwargs)
             else:
                 payload = json.dumps({"model": model, "messages": messages, **new_kwargs})
                 headers = {"Content-Type": "application/json"}
                 if self.api_key:
                     headers["Authorization"] = f"Bearer {self.api_key}"
-                result = requests.post(self.endpoint_url, headers=headers, data=payload)
+                result = requests.post(self.endpoint_url, headers=headers, data=payload, timeout=deadline.requests_timeout(model=model, llm_provider="wenxin"))
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="wenxin")
             if hasattr(e, "status_code"):
                 raise WenXinOpenAIError(status_code=e.status_code, message=str(e))
             else:
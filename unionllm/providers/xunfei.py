@@ -13,7 +13,7 @@ from datetime import datetime
 from time import mktime
 from urllib.parse import urlencode
 from wsgiref.handlers import format_date_time
-from unionllm.utils import ModelResponse, Message, Choices, Usage
+from unionllm.utils import ModelResponse, Message, Choices, Usage, Deadline, raise_if_timeout, timeout_error, close_quietly
 
 class XunfeiSocksError(Exception):
     def __init__(self, status_code, message):
@@ -63,7 +63,7 @@ class Ws_Param(object):
         return url
 
 class XunfeiWebSocketClient:
-    def __init__(self, app_id, api_key, api_secret, model, **kwargs):
+    def __init__(self, app_id, api_key, api_secret, model, api_base=None, **kwargs):
         self.app_id = app_id
         self.api_key = api_key
         self.api_secret = api_secret
@@ -73,19 +73,21 @@ class XunfeiWebSocketClient:
         self.complete_event = threading.Event()
         self.usage = None
         self.error = None
+        self.finished = False
+        self.api_base = api_base or "wss://spark-api.xf-yun.com"
         self.spark_url = self.get_spark_url(model)
         self.domain = self.model
 
     # 获取模型对应的spark_url
     def get_spark_url(self, model):
         if model == "generalv3.5":
-            return "wss://spark-api.xf-yun.com/v3.5/chat"
+            return self.api_base + "/v3.5/chat"
         elif model == "generalv3":
-            return "wss://spark-api.xf-yun.com/v3.1/chat"
+            return self.api_base + "/v3.1/chat"
         elif model == "generalv2":
-            return "wss://spark-api.xf-yun.com/v2.1/chat"
+            return self.api_base + "/v2.1/chat"
         elif model == "general":
-            return "wss://spark-api.xf-yun.com/v1.1/chat"
+            return self.api_base + "/v1.1/chat"
         else:
             raise ValueError(f"Unsupported model: {model}")
 
@@ -105,6 +107,7 @@ class XunfeiWebSocketClient:
                             self.prompt_tokens = text_usage.get("prompt_tokens", 0)
                             self.completion_tokens = text_usage.get("completion_tokens", 0)
                     
+                    self.finished = True
                     self.complete_event.set()
             else:
                 self.complete_event.set()
@@ -115,6 +118,10 @@ class XunfeiWebSocketClient:
             self.complete_event.set()
 
     def on_error(self, ws, error):
+        if self.finished:
+            # 收到最后一帧后服务端关闭连接，新版 websocket-client 也会回调 on_error，不算失败
+            logging.info(f"WebSocket closed after completion: {error}")
+            return
         logging.error(f"WebSocket error: {error}")
         self.error = error
         self.complete_event.set()
@@ -123,6 +130,11 @@ class XunfeiWebSocketClient:
         logging.info("WebSocket connection closed")
         self.complete_event.set()
 
+    def close(self):
+        if self.ws is not None:
+            close_quietly(self.ws)
+        self.complete_event.set()
+
     def on_open(self, ws, temperature, max_tokens):
         data = {
             "header": {
@@ -143,7 +155,9 @@ class XunfeiWebSocketClient:
         }
         ws.send(json.dumps(data))
 
-    def connect(self, messages, **kwargs):
+    def connect(self, messages, deadline=None, **kwargs):
+        deadline = deadline or Deadline()
+        deadline.check(model=self.model, llm_provider="xunfei")
         self.messages = messages
         ws_param = Ws_Param(self.app_id, self.api_key, self.api_secret, self.spark_url)
         ws_url = ws_param.create_url()
@@ -154,12 +168,26 @@ class XunfeiWebSocketClient:
         self.ws.on_open = lambda ws: self.on_open(ws, kwargs.get('temperature', 0.5), kwargs.get('max_tokens', 2048))
         wst = threading.Thread(target=self.ws.run_forever, kwargs={"sslopt": {"cert_reqs": ssl.CERT_NONE}})
         wst.start()
-        self.complete_event.wait()  # 等待消息接收完成或出错
+        # 调用方取消时关闭 websocket，on_close 会唤醒下面的等待
+        deadline.add_cancel_callback(self.close)
+        try:
+            # 等待消息接收完成或出错；设置了预算时超时后主动关闭连接
+            if not self.complete_event.wait(timeout=deadline.remaining()):
+                raise timeout_error("Deadline exceeded", model=self.model, llm_provider="xunfei", url=self.spark_url)
+            deadline.check(model=self.model, llm_provider="xunfei")
+        except BaseException:
+            # 超时、取消或等待被中断时释放连接，避免上游继续生成
+            self.close()
+            wst.join(timeout=1)
+            raise
         wst.join()  # 确保WebSocket线程已结束
         return self.answer, {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}, self.error
 
 
 class XunfeiAIProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):
         # Get XUNFEI_APP_ID, XUNFEI_API_KEY, XUNFEI_API_SECRET from environment variables
         _env_app_id = os.environ.get("XUNFEI_APP_ID")
@@ -173,6 +201,7 @@ class XunfeiAIProvider(BaseProvider):
             raise XunfeiSocksError(
                 status_code=422, message=f"Missing app_id, api_key or api_secret"
             )
+        self.api_base = model_kwargs.get("api_base")
 
     def pre_processing(self, **kwargs):
         if "app_id" in kwargs:
@@ -227,13 +256,14 @@ class XunfeiAIProvider(BaseProvider):
         return response
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise XunfeiSocksError(
                     status_code=422, message="Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("xunfei", model, messages)            
+            message_check_result = self.check_prompt("xunfei", model, messages, deadline=deadline)            
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -243,13 +273,14 @@ class XunfeiAIProvider(BaseProvider):
                 
             new_kwargs = self.pre_processing(**kwargs)
 
-            client = XunfeiWebSocketClient(self.app_id, self.api_key, self.api_secret, model, **new_kwargs)
-            answer, usage, error = client.connect(messages)
+            client = XunfeiWebSocketClient(self.app_id, self.api_key, self.api_secret, model, api_base=self.api_base, **new_kwargs)
+            answer, usage, error = client.connect(messages, deadline=deadline)
             if error:
                 raise XunfeiSocksError(status_code=500, message=error)
             return self.create_model_response_wrapper(answer, usage, model=model)
         
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="xunfei")
             if hasattr(e, "status_code"):
                 raise XunfeiSocksError(status_code=e.status_code, message=str(e))
             else:
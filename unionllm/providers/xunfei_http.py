@@ -1,4 +1,5 @@
 from .base_provider import BaseProvider
+from unionllm.utils import Deadline, raise_if_timeout
 from openai import OpenAI
 import os
 
@@ -15,6 +16,9 @@ class XunfeiHTTPError(Exception):
 
 
 class XunfeiHTTPProvider(BaseProvider):
+    # 上游接口不支持 n，n>1 时由 UnionLLM 并发请求后合并
+    supports_n = False
+
     def __init__(self, **model_kwargs):
         # Get XUNFEI_API_KEY from environment variables
         _env_api_key = os.environ.get("XUNFEI_HTTP_API_KEY")
@@ -43,24 +47,25 @@ class XunfeiHTTPProvider(BaseProvider):
 
         return kwargs
     
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         result = self.client.chat.completions.create(
             model=model, messages=messages, **new_kwargs
         )
-        return self.post_stream_processing(result, model=model)
+        return self.post_stream_processing(result, model=model, deadline=deadline)
 
     def create_model_response_wrapper(self, result, model):
         # 调用 response_model 中的 create_model_response 方法
         return self.create_model_response(result, model=model)
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise XunfeiHTTPError(
                     status_code=422, message=f"Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("xunfei", model, messages)         
+            message_check_result = self.check_prompt("xunfei", model, messages, deadline=deadline)         
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -69,16 +74,18 @@ class XunfeiHTTPProvider(BaseProvider):
                 )
                 
             new_kwargs = self.pre_processing(**kwargs)
+            new_kwargs.update(deadline.sdk_kwargs(model=model, llm_provider="xunfei"))
             stream = kwargs.get("stream", False)
 
             if stream:
-                return self.post_stream_processing_wrapper(model=model, messages=messages, **new_kwargs)
+                return self.post_stream_processing_wrapper(model=model, messages=messages, deadline=deadline, **new_kwargs)
             else:
                 result = self.client.chat.completions.create(
                     model=model, messages=messages, **new_kwargs
                 )
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="xunfei")
             if hasattr(e, "status_code"):
                 raise XunfeiHTTPError(status_code=e.status_code, message=str(e))
             else:
@@ -1,4 +1,5 @@
 from .base_provider import BaseProvider
+from unionllm.utils import Deadline, raise_if_timeout
 from openai import OpenAI
 import os
 
@@ -60,23 +61,24 @@ class ZhipuAIProvider(BaseProvider):
                 kwargs.pop(key)
         return kwargs
 
-    def post_stream_processing_wrapper(self, model, messages, **new_kwargs):
+    def post_stream_processing_wrapper(self, model, messages, deadline=None, **new_kwargs):
         result = self.client.chat.completions.create(
             model=model, messages=messages, **new_kwargs
         )
-        return self.post_stream_processing(result, model=model)
+        return self.post_stream_processing(result, model=model, deadline=deadline)
 
     def create_model_response_wrapper(self, result, model):
         return self.create_model_response(result, model=model)
 
     def completion(self, model: str, messages: list, **kwargs):
+        deadline = Deadline.from_kwargs(kwargs)
         try:
             if model is None or messages is None:
                 raise ZhiPuOpenAIError(
                     status_code=422, message=f"Missing model or messages"
                 )
                 
-            message_check_result = self.check_prompt("zhipuai", model, messages)     
+            message_check_result = self.check_prompt("zhipuai", model, messages, deadline=deadline)     
             if message_check_result['pass_check']:
                 messages = message_check_result['messages']
             else:
@@ -85,11 +87,12 @@ class ZhipuAIProvider(BaseProvider):
                 )
                 
             new_kwargs = self.pre_processing(**kwargs)
+            new_kwargs.update(deadline.sdk_kwargs(model=model, llm_provider="zhipuai"))
             stream = new_kwargs.get("stream", False)
 
             if stream:
                 return self.post_stream_processing_wrapper(
-                    model=model, messages=messages, **new_kwargs
+                    model=model, messages=messages, deadline=deadline, **new_kwargs
                 )
             else:
                 result = self.client.chat.completions.create(
@@ -97,6 +100,7 @@ class ZhipuAIProvider(BaseProvider):
                 )
                 return self.create_model_response_wrapper(result, model=model)
         except Exception as e:
+            raise_if_timeout(e, model=model, llm_provider="zhipuai")
             if hasattr(e, "status_code"):
                 raise ZhiPuOpenAIError(status_code=e.status_code, message=str(e))
             else:
@@ -0,0 +1,259 @@
+"""
+Prefix-cache-affinity routing across API keys and deployments.
+
+Provider-side prompt caches (DeepSeek, Moonshot, Anthropic, Gemini) are
+scoped per account or key, so spreading one conversation over several keys
+for throughput loses its cache hits. PrefixAffinityRouter hashes the stable
+prefix of a request (model, system prompt and first user turn) onto a
+consistent-hash ring of deployments, so requests sharing a prefix keep going
+to the same deployment:
+
+    router = PrefixAffinityRouter(
+        {"key-a": UnionLLM(provider="deepseek", api_key=KEY_A),
+         "key-b": UnionLLM(provider="deepseek", api_key=KEY_B)},
+        limits={"key-a": ProviderLimit(max_concurrency=16), "key-b": ProviderLimit(max_concurrency=16)},
+    )
+    response = router.completion("deepseek-chat", messages)
+
+- The prefix hash does not depend on the process, so several gateway replicas
+  send the same conversation to the same deployment. affinity_key=... (e.g. a
+  conversation id) replaces the prefix hash.
+- A request leaves its home deployment only when that deployment is saturated
+  (its ProviderLimit / AdaptiveLimit has no capacity). It then takes the next
+  deployment on the ring that has capacity, so a hot prefix spills over to
+  one consistent neighbour instead of scattering. When every deployment is
+  saturated completion() raises AdmissionRejected (429) rather than
+  over-subscribing a limit; pass a scheduler to queue such requests instead.
+- Adding or removing a deployment only moves the prefixes on its own arcs.
+- With scheduler=RequestScheduler(...) the deployment names are passed as
+  provider_key, so saturation is read from the scheduler's per-deployment
+  limits and requests queue there instead of in the router.
+
+metrics() reports requests and in-flight count per deployment and how many
+requests were rebalanced away from their home deployment.
+"""
+import bisect
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .exceptions import AdmissionRejected
+from .scheduler import ProviderLimit
+from .utils import ClosingStream, close_quietly
+
+DEFAULT_PREFIX_MESSAGES = 1
+DEFAULT_VNODES = 64
+
+
+def _hash(value: str) -> int:
+    # 不使用内置 hash()：它按进程随机化，多副本之间路由会不一致
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def prefix_key(model: str, messages: List[dict], prefix_messages: int = DEFAULT_PREFIX_MESSAGES) -> str:
+    """
+    Text key of the cacheable prefix of a request: the model, the leading system
+    messages and the first prefix_messages other messages. The default (first user
+    turn) stays the same for every turn of a conversation.
+    """
+    prefix = []
+    others = 0
+    for message in messages:
+        if message.get("role") not in ("system", "developer"):
+            if others >= prefix_messages:
+                break
+            others += 1
+        prefix.append(message)
+    return json.dumps([model, prefix], ensure_ascii=False, sort_keys=True, default=str)
+
+
+class _LimitRelease:
+    """close() hands a deployment slot back; used as a ClosingStream resource."""
+
+    def __init__(self, router, name, limit, started):
+        self.router = router
+        self.name = name
+        self.limit = limit
+        self.started = started
+        # 返回结果时的耗时；流式请求在关闭时才释放，但延迟按首次返回计算
+        self.latency = None
+        self.error = None
+        self.released = False
+
+    def close(self):
+        self.router._release(self)
+
+
+class PrefixAffinityRouter:
+    def __init__(self, deployments: Dict[str, Any], limits: Optional[Dict[str, ProviderLimit]] = None,
+                 weights: Optional[Dict[str, float]] = None, scheduler=None,
+                 prefix_messages: int = DEFAULT_PREFIX_MESSAGES, vnodes: int = DEFAULT_VNODES):
+        self.deployments = {}
+        self.limits = dict(limits or {})
+        self.scheduler = scheduler
+        self.prefix_messages = prefix_messages
+        self.vnodes = vnodes
+        self._lock = threading.Lock()
+        self._ring = []
+        self._points = []
+        self._requests = {}
+        self._stats = {"routed": 0, "rebalanced": 0}
+        for name, client in deployments.items():
+            self.add(name, client, weight=(weights or {}).get(name, 1.0))
+
+    # ---- 哈希环 ----
+
+    def _rebuild(self, ring):
+        self._ring = sorted(ring)
+        self._points = [point for point, _ in self._ring]
+
+    def add(self, name: str, client, weight: float = 1.0, limit: Optional[ProviderLimit] = None):
+        """Add (or replace) a deployment; weight scales its share of the ring."""
+        points = [(_hash(f"{name}#{i}"), name) for i in range(max(1, int(self.vnodes * weight)))]
+        with self._lock:
+            self.deployments[name] = client
+            if limit is not None:
+                self.limits[name] = limit
+            self._rebuild([entry for entry in self._ring if entry[1] != name] + points)
+
+    def remove(self, name: str):
+        with self._lock:
+            self.deployments.pop(name, None)
+            self.limits.pop(name, None)
+            self._rebuild([entry for entry in self._ring if entry[1] != name])
+
+    def candidates(self, key: str) -> List[str]:
+        """Deployment names in ring order, starting with the home deployment of key."""
+        with self._lock:
+            return self._candidates(key)
+
+    def _candidates(self, key):
+        ring, points, count = self._ring, self._points, len(self.deployments)
+        if not ring:
+            raise ValueError("PrefixAffinityRouter has no deployments")
+        start = bisect.bisect(points, _hash(key))
+        order = []
+        for i in range(len(ring)):
+            name = ring[(start + i) % len(ring)][1]
+            if name not in order:
+                order.append(name)
+                if len(order) == count:
+                    break
+        return order
+
+    # ---- 路由 ----
+
+    def _limit(self, name):
+        if self.scheduler is not None:
+            return self.scheduler.get_limit(name)
+        return self.limits.get(name)
+
+    def _pick(self, order):
+        """First deployment in order with capacity, or (None, None, now) when all are saturated."""
+        now = time.monotonic()
+        for name in order:
+            limit = self._limit(name)
+            if limit is None or limit.can_acquire(now):
+                return name, limit, now
+        return None, None, now
+
+    def _choose(self, model, messages, affinity_key, acquire=False):
+        """(order, name, limit, client); the client is read under the lock so remove() cannot race it."""
+        key = affinity_key if affinity_key is not None else prefix_key(model, messages, self.prefix_messages)
+        if self.scheduler is not None:
+            # 槽位由调度器占用并在那里排队，这里只读取各部署的余量；都饱和时留在主部署排队
+            with self.scheduler._lock, self._lock:
+                order = self._candidates(key)
+                name = self._pick(order)[0] or order[0]
+                return order, name, None, self.deployments[name]
+        with self._lock:
+            order = self._candidates(key)
+            name, limit, now = self._pick(order)
+            if name is None:
+                if acquire:
+                    raise AdmissionRejected(f"Every deployment is saturated: {', '.join(order)}")
+                name = order[0]
+            elif acquire and limit is not None:
+                limit.acquire(now)
+            return order, name, limit, self.deployments[name]
+
+    def route(self, model: str, messages: List[dict], affinity_key: Optional[str] = None) -> str:
+        """Name of the deployment a request would be sent to right now (home when all are saturated)."""
+        return self._choose(model, messages, affinity_key)[1]
+
+    def _acquire(self, model, messages, affinity_key):
+        order, name, limit, client = self._choose(model, messages, affinity_key, acquire=True)
+        with self._lock:
+            self._stats["routed"] += 1
+            if name != order[0]:
+                self._stats["rebalanced"] += 1
+            self._requests[name] = self._requests.get(name, 0) + 1
+        return name, client, _LimitRelease(self, name, limit, time.monotonic())
+
+    def _release(self, release):
+        with self._lock:
+            if release.released:
+                return
+            release.released = True
+            if release.limit is not None:
+                latency = release.latency if release.latency is not None else time.monotonic() - release.started
+                release.limit.release(error=release.error, latency=latency)
+
+    def _finish(self, release, result, stream):
+        release.latency = time.monotonic() - release.started
+        if not stream:
+            self._release(release)
+            return result
+        return ClosingStream(self._watch_stream(result, release), release)
+
+    @staticmethod
+    def _watch_stream(stream, release):
+        try:
+            for chunk in stream:
+                yield chunk
+        except Exception as e:
+            release.error = e
+            raise
+        finally:
+            close_quietly(stream)
+
+    def completion(self, model: str, messages: list, affinity_key: Optional[str] = None, **kwargs) -> Any:
+        """Run client.completion on the deployment chosen for the request; streams hold the slot until closed."""
+        name, client, release = self._acquire(model, messages, affinity_key)
+        if self.scheduler is not None:
+            return self.scheduler.completion(client, model, messages, provider_key=name, **kwargs)
+        try:
+            result = client.completion(model, messages, **kwargs)
+            return self._finish(release, result, kwargs.get("stream"))
+        except BaseException as e:
+            release.error = e
+            self._release(release)
+            raise
+
+    async def acompletion(self, model: str, messages: list, affinity_key: Optional[str] = None, **kwargs) -> Any:
+        name, client, release = self._acquire(model, messages, affinity_key)
+        if self.scheduler is not None:
+            return await self.scheduler.acompletion(client, model, messages, provider_key=name, **kwargs)
+        try:
+            result = await client.acompletion(model, messages, **kwargs)
+            return self._finish(release, result, kwargs.get("stream"))
+        except BaseException as e:
+            release.error = e
+            self._release(release)
+            raise
+
+    # ---- 指标 ----
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            names = list(self.deployments)
+            requests = dict(self._requests)
+            stats = dict(self._stats)
+        in_flight = {}
+        for name in names:
+            limit = self._limit(name)
+            if limit is not None:
+                in_flight[name] = limit.in_flight
+        return {"requests": requests, "in_flight": in_flight, **stats}
@@ -0,0 +1,560 @@
+"""
+Priority and fair-share request scheduler.
+
+Sits in front of UnionLLM.completion / acompletion for gateways where several
+kinds of traffic share the same provider pools:
+
+    scheduler = RequestScheduler(
+        provider_limits={"moonshot": ProviderLimit(max_concurrency=8, rate=5)},
+        tenant_weights={"chat-app": 4, "evals": 1},
+        max_queue_depth=500,
+    )
+    response = scheduler.completion(client, model, messages, priority="interactive", tenant="chat-app", queue_timeout=2)
+
+- Priority classes are served strictly in order ("interactive", "default", "batch").
+- Inside a class, tenants share the capacity by weight (start-time fair queuing).
+- A request waits only for its own provider's limits, so a saturated provider
+  does not hold back requests for other providers.
+- queue_timeout (and the request's own timeout/deadline) bounds the time spent
+  queued; expiry raises Timeout.
+- Admission control: when the queue is full a new request either evicts the
+  newest request of a lower class or is rejected with AdmissionRejected.
+- Dispatch is event driven: admissions and releases dispatch directly, and a
+  single timer fires at the next token-bucket refill or queue expiry. Waiting
+  requests only block on their own event.
+
+metrics() returns queue depth per class and tenant, in-flight count per
+provider, and admission/wait statistics.
+
+AdaptiveLimit replaces a fixed max_concurrency with AIMD: the limit grows by
+about one per window of successful requests and is cut multiplicatively on
+429/503 (read from the status_code every provider error carries), timeouts,
+or a latency spike against the recent baseline:
+
+    scheduler = RequestScheduler(limit_factory=AdaptiveLimit.factory(initial_limit=4, max_limit=64))
+"""
+import asyncio
+import itertools
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .exceptions import AdmissionRejected
+from .utils import ClosingStream, Deadline, call_context, close_quietly, timeout_error
+
+PRIORITIES = ("interactive", "default", "batch")
+
+
+class ProviderLimit:
+    """Concurrency and request-rate limit of one provider or deployment."""
+
+    def __init__(self, max_concurrency: Optional[int] = None, rate: Optional[float] = None, burst: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.rate = rate  # 每秒请求数，令牌桶
+        self.burst = burst if burst is not None else max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def can_acquire(self, now: float) -> bool:
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            return False
+        if self.rate:
+            self._refill(now)
+            return self.tokens >= 1
+        return True
+
+    def acquire(self, now: float):
+        self.in_flight += 1
+        if self.rate:
+            self.tokens -= 1
+
+    def release(self, error: Optional[BaseException] = None, latency: Optional[float] = None):
+        """Called once per finished request, with its error (if any) and time to response."""
+        self.in_flight -= 1
+
+    def ready_at(self, now: float) -> Optional[float]:
+        """When can_acquire may next succeed without a release; None if only a release frees capacity."""
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            return None
+        if self.rate and self.tokens < 1:
+            return now + (1 - self.tokens) / self.rate
+        return now
+
+
+def error_status_code(error):
+    """status_code of a provider error, looking through wrapped causes."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status_code = getattr(error, "status_code", None)
+        if isinstance(status_code, int):
+            return status_code
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class AdaptiveLimit(ProviderLimit):
+    """
+    AIMD concurrency limit for one provider or deployment.
+
+    - success: limit += increase / limit (about +increase per full window)
+    - 429/503 (overload_status_codes), 408/504 timeouts or a latency spike:
+      limit *= backoff, at most once per cooldown seconds
+    - other errors (bad request, auth, ...) leave the limit unchanged
+
+    A latency spike is a response slower than spike_factor times the moving
+    average of recent successful latencies (or slower than latency_target).
+    """
+
+    overload_status_codes = (429, 503)
+    timeout_status_codes = (408, 504)
+
+    def __init__(self, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 256,
+                 increase: float = 1.0, backoff: float = 0.5, cooldown: float = 1.0,
+                 latency_target: Optional[float] = None, spike_factor: float = 2.0, min_samples: int = 10,
+                 rate: Optional[float] = None, burst: Optional[float] = None):
+        super().__init__(max_concurrency=int(initial_limit), rate=rate, burst=burst)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.latency_target = latency_target
+        self.spike_factor = spike_factor
+        self.min_samples = min_samples
+        self.latency_avg = None
+        self.samples = 0
+        self.last_decrease = None
+        self.increases = 0
+        self.decreases = 0
+
+    @classmethod
+    def factory(cls, **kwargs):
+        """limit_factory for RequestScheduler: one AdaptiveLimit per provider key."""
+        return lambda key: cls(**kwargs)
+
+    def _set_limit(self, value):
+        self.limit = min(self.max_limit, max(self.min_limit, value))
+        self.max_concurrency = max(1, int(self.limit))
+
+    def is_latency_spike(self, latency):
+        if latency is None:
+            return False
+        if self.latency_target is not None and latency > self.latency_target:
+            return True
+        return self.samples >= self.min_samples and latency > self.latency_avg * self.spike_factor
+
+    def _record_latency(self, latency):
+        if latency is None:
+            return
+        self.samples += 1
+        self.latency_avg = latency if self.latency_avg is None else self.latency_avg * 0.9 + latency * 0.1
+
+    def decrease(self, now=None):
+        now = time.monotonic() if now is None else now
+        # 一批并发请求同时收到 429 时只收缩一次
+        if self.last_decrease is not None and now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        self._set_limit(self.limit * self.backoff)
+
+    def release(self, error: Optional[BaseException] = None, latency: Optional[float] = None):
+        super().release(error=error, latency=latency)
+        if error is not None:
+            status_code = error_status_code(error)
+            if status_code in self.overload_status_codes or status_code in self.timeout_status_codes:
+                self.decrease()
+            return
+        if self.is_latency_spike(latency):
+            # 仍计入均值，持续变慢时基线会逐渐跟上
+            self._record_latency(latency)
+            self.decrease()
+            return
+        self._record_latency(latency)
+        self.increases += 1
+        self._set_limit(self.limit + self.increase / max(self.limit, 1.0))
+
+
+class _Ticket:
+    """A request waiting in, or admitted from, the scheduler queue."""
+
+    def __init__(self, seq, priority, tenant, provider, start, finish, expires_at):
+        self.seq = seq
+        self.priority = priority
+        self.tenant = tenant
+        self.provider = provider
+        self.start = start
+        self.finish = finish
+        self.expires_at = expires_at
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.waited = 0.0
+        self.released = False
+        self.error = None
+        self.wake = None
+
+    def remaining(self, now=None):
+        if self.expires_at is None:
+            return None
+        return self.expires_at - (now if now is not None else time.monotonic())
+
+
+def _fair_order(ticket):
+    return ticket.finish, ticket.seq
+
+
+class _Release:
+    """close() hands the ticket's slot back; used as a ClosingStream resource."""
+
+    def __init__(self, scheduler, ticket, latency):
+        self.scheduler = scheduler
+        self.ticket = ticket
+        self.latency = latency
+        self.error = None
+
+    def close(self):
+        self.scheduler._release(self.ticket, error=self.error, latency=self.latency)
+
+
+class RequestScheduler:
+    def __init__(self, priorities=PRIORITIES, tenant_weights: Optional[Dict[str, float]] = None,
+                 provider_limits: Optional[Dict[str, ProviderLimit]] = None, limit_factory=None,
+                 max_queue_depth: Optional[int] = None, max_tenant_queue_depth: Optional[int] = None,
+                 default_queue_timeout: Optional[float] = None, poll_interval: float = 0.05):
+        self.priorities = tuple(priorities)
+        self.tenant_weights = dict(tenant_weights or {})
+        self.limits = dict(provider_limits or {})
+        # 未配置的 provider 通过 limit_factory(key) 创建限制，为 None 时不限制
+        self.limit_factory = limit_factory
+        self.max_queue_depth = max_queue_depth
+        self.max_tenant_queue_depth = max_tenant_queue_depth
+        self.default_queue_timeout = default_queue_timeout
+        # 已不再轮询（由调度定时器唤醒），保留参数以兼容旧的调用方式
+        self.poll_interval = poll_interval
+
+        self._lock = threading.RLock()
+        self._seq = itertools.count()
+        self._queues = {p: [] for p in self.priorities}
+        self._virtual_time = {p: 0.0 for p in self.priorities}
+        # (priority, tenant) -> 该租户最近一个请求的虚拟完成时间；租户空闲且已被虚拟时间追上时删除
+        self._tenant_finish = {}
+        self._tenant_depth = {}
+        self._class_depth = {}
+        self._stats = {"admitted": 0, "rejected": 0, "evicted": 0, "expired": 0, "completed": 0, "failed": 0}
+        self._granted = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timer = None
+        self._timer_at = None
+
+    # ---- 队列 ----
+
+    def get_limit(self, provider):
+        limit = self.limits.get(provider)
+        if limit is None and self.limit_factory is not None:
+            limit = self.limits[provider] = self.limit_factory(provider)
+        return limit
+
+    def _submit(self, priority, tenant, provider, expires_at, wake):
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        with self._lock:
+            if self.max_tenant_queue_depth is not None and self._tenant_depth.get(tenant, 0) >= self.max_tenant_queue_depth:
+                self._stats["rejected"] += 1
+                raise AdmissionRejected(f"Queue for tenant '{tenant}' is full")
+            if self.max_queue_depth is not None and self.queue_depth() >= self.max_queue_depth:
+                if not self._evict_below(priority):
+                    self._stats["rejected"] += 1
+                    raise AdmissionRejected("Scheduler queue is full")
+
+            weight = self.tenant_weights.get(tenant, 1.0)
+            start = max(self._virtual_time[priority], self._tenant_finish.get((priority, tenant), 0.0))
+            finish = start + 1.0 / weight
+            self._tenant_finish[(priority, tenant)] = finish
+            ticket = _Ticket(next(self._seq), priority, tenant, provider, start, finish, expires_at)
+            ticket.wake = wake
+            queue = self._queues[priority]
+            queue.append(ticket)
+            # 队列按 (finish, seq) 保持有序；新请求通常排在末尾，timsort 接近 O(n)
+            queue.sort(key=_fair_order)
+            self._tenant_depth[tenant] = self._tenant_depth.get(tenant, 0) + 1
+            self._class_depth[(priority, tenant)] = self._class_depth.get((priority, tenant), 0) + 1
+            self._stats["admitted"] += 1
+        self._dispatch()
+        return ticket
+
+    def _remove(self, ticket):
+        """Take a ticket out of the queue without granting it (evicted or cancelled)."""
+        self._queues[ticket.priority].remove(ticket)
+        self._unqueue(ticket)
+        self._give_back(ticket)
+        self._prune_tenants()
+
+    def _unqueue(self, ticket):
+        """Depth bookkeeping for a ticket that has left its queue."""
+        self._tenant_depth[ticket.tenant] -= 1
+        if not self._tenant_depth[ticket.tenant]:
+            del self._tenant_depth[ticket.tenant]
+        key = (ticket.priority, ticket.tenant)
+        self._class_depth[key] -= 1
+        if not self._class_depth[key]:
+            del self._class_depth[key]
+
+    def _give_back(self, ticket):
+        """Roll back the fair share a ticket was charged at admission when it leaves ungranted."""
+        share = ticket.finish - ticket.start
+        queue = self._queues[ticket.priority]
+        moved = False
+        # 同租户之后入队的请求是按这个请求的完成时间排的，一起前移
+        for other in queue:
+            if other.tenant == ticket.tenant and other.seq > ticket.seq:
+                other.start -= share
+                other.finish -= share
+                moved = True
+        if moved:
+            queue.sort(key=_fair_order)
+        key = (ticket.priority, ticket.tenant)
+        if key in self._tenant_finish:
+            self._tenant_finish[key] -= share
+
+    def _prune_tenants(self):
+        for priority, queue in self._queues.items():
+            if not queue:
+                # 队列排空时虚拟时间推进到最大完成时间（SFQ 的忙期结束），空闲租户的记录都可以删除
+                finishes = [finish for (p, _), finish in self._tenant_finish.items() if p == priority]
+                if finishes:
+                    self._virtual_time[priority] = max(self._virtual_time[priority], max(finishes))
+        for key, finish in list(self._tenant_finish.items()):
+            if key not in self._class_depth and finish <= self._virtual_time[key[0]]:
+                del self._tenant_finish[key]
+
+    def _evict_below(self, priority):
+        # 从最低优先级开始，挤掉最晚入队的请求
+        rank = self.priorities.index(priority)
+        for lower in reversed(self.priorities[rank + 1:]):
+            queue = self._queues[lower]
+            if queue:
+                victim = max(queue, key=lambda t: t.seq)
+                self._remove(victim)
+                victim.error = AdmissionRejected(f"Evicted from the queue by a '{priority}' request")
+                self._stats["evicted"] += 1
+                victim.wake()
+                return True
+        return False
+
+    def _dispatch(self):
+        """Admit queued requests while their providers have capacity, then re-arm the timer."""
+        with self._lock:
+            now = time.monotonic()
+            wake_at = None
+            # 同一次调度中已确认没有余量的 provider，后面的请求直接跳过
+            blocked = {}
+            for priority in self.priorities:
+                queue = self._queues[priority]
+                if not queue:
+                    continue
+                kept = []
+                expired = []
+                # 队列按公平顺序排列，一次遍历即可依次为每个 provider 选出最优的可执行请求
+                for ticket in queue:
+                    remaining = ticket.remaining(now)
+                    if remaining is not None and remaining <= 0:
+                        self._unqueue(ticket)
+                        expired.append(ticket)
+                        self._stats["expired"] += 1
+                        ticket.error = timeout_error("Queue deadline exceeded while waiting for a scheduler slot", llm_provider=ticket.provider)
+                        ticket.wake()
+                        continue
+                    if ticket.provider not in blocked:
+                        limit = self.get_limit(ticket.provider)
+                        if limit is None or limit.can_acquire(now):
+                            self._unqueue(ticket)
+                            self._grant(ticket, now)
+                            continue
+                        blocked[ticket.provider] = limit.ready_at(now)
+                    kept.append(ticket)
+                    for at in (ticket.expires_at, blocked[ticket.provider]):
+                        if at is not None and (wake_at is None or at < wake_at):
+                            wake_at = at
+                queue[:] = kept
+                for ticket in expired:
+                    self._give_back(ticket)
+            self._prune_tenants()
+            self._arm_timer(wake_at, now)
+
+    def _arm_timer(self, wake_at, now):
+        # 只保留一个最早到期的定时器；仅受并发数限制的请求由 release 唤醒，不需要定时器
+        if wake_at is None or (self._timer is not None and self._timer_at <= wake_at):
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        timer = threading.Timer(max(0.0, wake_at - now), self._on_timer)
+        timer.args = (timer,)
+        timer.daemon = True
+        self._timer, self._timer_at = timer, wake_at
+        timer.start()
+
+    def _on_timer(self, timer):
+        with self._lock:
+            if self._timer is timer:
+                self._timer = self._timer_at = None
+        self._dispatch()
+
+    def _grant(self, ticket, now):
+        limit = self.get_limit(ticket.provider)
+        if limit is not None:
+            limit.acquire(now)
+        self._virtual_time[ticket.priority] = max(self._virtual_time[ticket.priority], ticket.start)
+        waited = ticket.waited = now - ticket.enqueued
+        self._granted += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        ticket.granted = True
+        ticket.wake()
+
+    def _cancel(self, ticket):
+        with self._lock:
+            if ticket.granted:
+                self._release(ticket)
+            elif ticket.error is None and ticket in self._queues[ticket.priority]:
+                self._remove(ticket)
+
+    def _release(self, ticket, error=None, latency=None):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._stats["failed" if error is not None else "completed"] += 1
+            limit = self.get_limit(ticket.provider)
+            if limit is not None:
+                limit.release(error=error, latency=latency)
+        self._dispatch()
+
+    # ---- 执行 ----
+
+    def _provider_key(self, client, provider_key):
+        return provider_key or getattr(client, "provider", None) or "default"
+
+    def _expires_at(self, deadline, queue_timeout):
+        if queue_timeout is None:
+            queue_timeout = self.default_queue_timeout
+        candidates = []
+        if queue_timeout is not None:
+            candidates.append(queue_timeout)
+        remaining = deadline.remaining()
+        if remaining is not None:
+            candidates.append(remaining)
+        return time.monotonic() + min(candidates) if candidates else None
+
+    def _wait(self, ticket, event):
+        try:
+            # 令牌桶补充和排队超时由调度定时器处理，这里只等待唤醒
+            while not ticket.granted and ticket.error is None:
+                event.wait()
+                event.clear()
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        if ticket.error is not None and not ticket.granted:
+            raise ticket.error
+
+    def _finish(self, ticket, result, started, stream):
+        latency = time.monotonic() - started
+        if not stream:
+            self._release(ticket, latency=latency)
+            return result
+        release = _Release(self, ticket, latency)
+        return ClosingStream(self._watch_stream(result, release), release)
+
+    @staticmethod
+    def _watch_stream(stream, release):
+        try:
+            for chunk in stream:
+                yield chunk
+        except Exception as e:
+            release.error = e
+            raise
+        finally:
+            close_quietly(stream)
+
+    def completion(self, client, model: str, messages: list, priority: str = "default", tenant: str = "default",
+                   queue_timeout: Optional[float] = None, provider_key: Optional[str] = None, **kwargs) -> Any:
+        """Wait for a slot, then run client.completion; streams hold the slot until closed."""
+        # 排队时间计入请求自身的 timeout/deadline
+        deadline = Deadline.from_kwargs(kwargs)
+        kwargs["deadline"] = deadline
+        # 租户同时作为用量统计的标签（见 cost.UsageAggregator）
+        kwargs["tags"] = dict({"tenant": tenant}, **(kwargs.get("tags") or {}))
+        event = threading.Event()
+        ticket = self._submit(priority, tenant, self._provider_key(client, provider_key),
+                              self._expires_at(deadline, queue_timeout), event.set)
+        self._wait(ticket, event)
+        call_context(deadline).add("queue", ticket.waited)
+        started = time.monotonic()
+        try:
+            result = client.completion(model, messages, **kwargs)
+        except BaseException as e:
+            self._release(ticket, error=e, latency=time.monotonic() - started)
+            raise
+        return self._finish(ticket, result, started, kwargs.get("stream"))
+
+    async def acompletion(self, client, model: str, messages: list, priority: str = "default", tenant: str = "default",
+                          queue_timeout: Optional[float] = None, provider_key: Optional[str] = None, **kwargs) -> Any:
+        deadline = Deadline.from_kwargs(kwargs)
+        kwargs["deadline"] = deadline
+        # 租户同时作为用量统计的标签（见 cost.UsageAggregator）
+        kwargs["tags"] = dict({"tenant": tenant}, **(kwargs.get("tags") or {}))
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        ticket = self._submit(priority, tenant, self._provider_key(client, provider_key),
+                              self._expires_at(deadline, queue_timeout), lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while not ticket.granted and ticket.error is None:
+                await event.wait()
+                event.clear()
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        if ticket.error is not None and not ticket.granted:
+            raise ticket.error
+        call_context(deadline).add("queue", ticket.waited)
+        started = time.monotonic()
+        try:
+            result = await client.acompletion(model, messages, **kwargs)
+        except BaseException as e:
+            self._release(ticket, error=e, latency=time.monotonic() - started)
+            raise
+        return self._finish(ticket, result, started, kwargs.get("stream"))
+
+    # ---- 指标 ----
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        with self._lock:
+            if priority is not None:
+                return len(self._queues[priority])
+            return sum(len(q) for q in self._queues.values())
+
+    def set_tenant_weight(self, tenant: str, weight: float):
+        with self._lock:
+            self.tenant_weights[tenant] = weight
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": {p: len(q) for p, q in self._queues.items()},
+                "tenant_queue_depth": dict(self._tenant_depth),
+                "in_flight": {key: limit.in_flight for key, limit in self.limits.items() if limit is not None},
+                "max_concurrency": {key: limit.max_concurrency for key, limit in self.limits.items() if limit is not None},
+                "adaptive_limit": {key: limit.limit for key, limit in self.limits.items() if isinstance(limit, AdaptiveLimit)},
+                **self._stats,
+                "queue_wait_avg": self._wait_total / self._granted if self._granted else 0.0,
+                "queue_wait_max": self._wait_max,
+            }
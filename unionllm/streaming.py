@@ -0,0 +1,737 @@
+"""
+Helpers that sit on top of UnionLLM's chunk streams.
+
+Stream fan-out: let several consumers read one upstream chunk stream.
+
+    user_view, log_view, moderation_view = tee_stream(
+        client.completion(model=..., messages=..., stream=True), n=3, max_buffer=32
+    )
+
+Each branch yields the same ModelResponse chunks in the same order. Chunks
+are kept in a bounded buffer shared by all branches and pulled from the
+upstream stream only when some branch needs one that is not buffered yet.
+When the buffer is full, the branch that wants to read ahead waits for the
+slowest branch (backpressure). With slow_consumer_policy="drop", the slowest
+branch is dropped instead once the wait exceeds slow_consumer_timeout. A
+dropped branch raises SlowConsumerDropped on its next read.
+
+The "block" policy needs the branches to run in separate threads/tasks. A
+single thread alternating between branches should use "drop" instead,
+otherwise it can wait forever on itself.
+
+Chunks are shared objects, not copies, so consumers must not mutate them.
+
+Streamed tool calls: ToolCallStreamParser turns Delta.tool_calls fragments
+into events (tool name known, argument key completed, call complete) while
+the arguments are still streaming, so tools can be dispatched early.
+
+Stream fan-in: multiplex_streams merges N single-choice streams (the n>1
+fan-out for providers without native `n`) into one stream whose chunks carry
+the choice index of the branch they came from. Usage is taken off the
+branch chunks and sent summed in one final chunk with no choices.
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from .exceptions import SlowConsumerDropped
+from .utils import ModelResponse, Usage, close_quietly, sum_usage, _chunk_field, _update_usage_values
+
+BLOCK = "block"
+DROP = "drop"
+
+_EXHAUSTED = object()
+
+
+class _TeeBuffer:
+    """Buffer and per-branch read positions shared by the sync and async tees."""
+
+    def __init__(self, n, max_buffer, slow_consumer_policy, slow_consumer_timeout):
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        if max_buffer < 1:
+            raise ValueError("max_buffer must be at least 1")
+        if slow_consumer_policy not in (BLOCK, DROP):
+            raise ValueError(f"Unsupported slow_consumer_policy: {slow_consumer_policy}")
+        self.max_buffer = max_buffer
+        self.policy = slow_consumer_policy
+        self.slow_consumer_timeout = slow_consumer_timeout
+        self.items = deque()
+        self.base = 0  # 缓冲区第一个元素的绝对序号
+        self.positions = {i: 0 for i in range(n)}  # 仍在读取的分支 -> 下一个要读的序号
+        self.dropped = set()
+        self.finished = False
+        self.error = None
+        self.pulling = False
+
+    @property
+    def head(self):
+        return self.base + len(self.items)
+
+    def full(self):
+        return len(self.items) >= self.max_buffer
+
+    def trim(self):
+        low = min(self.positions.values(), default=self.head)
+        while self.base < low and self.items:
+            self.items.popleft()
+            self.base += 1
+
+    def take(self, branch):
+        """Return the next buffered chunk for `branch`, or _EXHAUSTED if it has to wait or pull."""
+        if branch in self.dropped:
+            raise SlowConsumerDropped(f"Stream consumer {branch} was dropped for falling behind")
+        pos = self.positions[branch]
+        if pos < self.head:
+            item = self.items[pos - self.base]
+            self.positions[branch] = pos + 1
+            if pos == self.base:
+                self.trim()
+            return item
+        if self.error is not None:
+            raise self.error
+        if self.finished:
+            raise StopIteration
+        return _EXHAUSTED
+
+    def drop_slowest(self, requester):
+        others = {b: p for b, p in self.positions.items() if b != requester}
+        if not others:
+            return
+        low = min(others.values())
+        for b, p in others.items():
+            if p == low:
+                self.dropped.add(b)
+                del self.positions[b]
+        self.trim()
+
+    def remove(self, branch):
+        self.positions.pop(branch, None)
+        self.trim()
+        return not self.positions
+
+    def wait_timeout(self, started):
+        # 返回本次等待的超时；None 表示无限等待，0 表示应立即丢弃最慢的分支
+        if self.policy != DROP:
+            return None
+        if not self.slow_consumer_timeout:
+            return 0
+        return max(0.0, self.slow_consumer_timeout - (time.monotonic() - started))
+
+
+class StreamTee:
+    """Thread-safe fan-out of a sync chunk iterator to `n` branches."""
+
+    def __init__(self, stream, n=2, max_buffer=64, slow_consumer_policy=BLOCK, slow_consumer_timeout=None):
+        self._source = stream
+        self._iterator = iter(stream)
+        self._state = _TeeBuffer(n, max_buffer, slow_consumer_policy, slow_consumer_timeout)
+        self._cond = threading.Condition(threading.RLock())
+        self.branches = [_TeeBranch(self, i) for i in range(n)]
+
+    def _next(self, branch):
+        state = self._state
+        while True:
+            with self._cond:
+                waiting_since = None
+                while True:
+                    item = state.take(branch)
+                    if item is not _EXHAUSTED:
+                        self._cond.notify_all()
+                        return item
+                    if state.pulling:
+                        self._cond.wait()
+                        continue
+                    if state.full():
+                        waiting_since = waiting_since or time.monotonic()
+                        timeout = state.wait_timeout(waiting_since)
+                        if timeout == 0:
+                            state.drop_slowest(branch)
+                            self._cond.notify_all()
+                        else:
+                            self._cond.wait(timeout)
+                        continue
+                    state.pulling = True
+                    break
+            # 在锁外拉取上游，其他分支可以同时读取已缓冲的数据
+            try:
+                item = next(self._iterator, _EXHAUSTED)
+            except BaseException as e:
+                with self._cond:
+                    state.pulling = False
+                    state.error = e
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                state.pulling = False
+                if item is _EXHAUSTED:
+                    state.finished = True
+                else:
+                    state.items.append(item)
+                self._cond.notify_all()
+
+    def _close_branch(self, branch):
+        with self._cond:
+            last = self._state.remove(branch)
+            self._cond.notify_all()
+        if last:
+            # 所有分支都已关闭，释放上游连接
+            close_quietly(self._source)
+
+    def close(self):
+        for branch in self.branches:
+            branch.close()
+
+
+class _TeeBranch:
+    def __init__(self, tee, index):
+        self._tee = tee
+        self.index = index
+        self.closed = False
+
+    @property
+    def dropped(self):
+        return self.index in self._tee._state.dropped
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        try:
+            return self._tee._next(self.index)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._tee._close_branch(self.index)
+
+    def __del__(self):
+        self.close()
+
+
+class AsyncStreamTee:
+    """
+    asyncio fan-out of a chunk stream to `n` branches. The source may be an
+    async iterator or one of UnionLLM's sync chunk generators. Sync sources
+    are advanced in the default executor so the event loop is not blocked.
+    """
+
+    def __init__(self, stream, n=2, max_buffer=64, slow_consumer_policy=BLOCK, slow_consumer_timeout=None):
+        self._source = stream
+        self._async_source = hasattr(stream, "__aiter__")
+        self._iterator = stream.__aiter__() if self._async_source else iter(stream)
+        self._state = _TeeBuffer(n, max_buffer, slow_consumer_policy, slow_consumer_timeout)
+        self._cond = None  # 延迟到事件循环中创建
+        self._pull_task = None
+        self.branches = [_AsyncTeeBranch(self, i) for i in range(n)]
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _pull(self):
+        if self._async_source:
+            try:
+                return await self._iterator.__anext__()
+            except StopAsyncIteration:
+                return _EXHAUSTED
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, next, self._iterator, _EXHAUSTED)
+
+    async def _fill(self):
+        """Pull one chunk into the buffer. Runs as its own task, shared by every waiting branch."""
+        state = self._state
+        cond = self._condition()
+        try:
+            item = await self._pull()
+        except BaseException as e:
+            async with cond:
+                state.pulling = False
+                if not isinstance(e, asyncio.CancelledError):
+                    state.error = e
+                cond.notify_all()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        async with cond:
+            state.pulling = False
+            if item is _EXHAUSTED:
+                state.finished = True
+            else:
+                state.items.append(item)
+            cond.notify_all()
+
+    async def _next(self, branch):
+        state = self._state
+        cond = self._condition()
+        async with cond:
+            waiting_since = None
+            while True:
+                try:
+                    item = state.take(branch)
+                except StopIteration:
+                    raise StopAsyncIteration
+                if item is not _EXHAUSTED:
+                    cond.notify_all()
+                    return item
+                if state.pulling:
+                    await cond.wait()
+                    continue
+                if state.full():
+                    waiting_since = waiting_since or time.monotonic()
+                    timeout = state.wait_timeout(waiting_since)
+                    if timeout == 0:
+                        state.drop_slowest(branch)
+                        cond.notify_all()
+                    elif timeout is None:
+                        await cond.wait()
+                    else:
+                        try:
+                            await asyncio.wait_for(cond.wait(), timeout)
+                        except asyncio.TimeoutError:
+                            pass
+                    continue
+                # 拉取放在独立任务中，发起拉取的分支被取消时，执行器线程里的 next() 结果仍会进入缓冲区，
+                # 其他分支只等待这次拉取完成，不会并发调用 next()
+                state.pulling = True
+                self._pull_task = asyncio.ensure_future(self._fill())
+
+    async def _close_branch(self, branch):
+        async with self._condition():
+            last = self._state.remove(branch)
+            self._condition().notify_all()
+        if last:
+            if self._pull_task is not None and not self._pull_task.done():
+                self._pull_task.cancel()
+                try:
+                    await self._pull_task
+                except BaseException:
+                    pass
+            aclose = getattr(self._source, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+            else:
+                close_quietly(self._source)
+
+    async def aclose(self):
+        for branch in self.branches:
+            await branch.aclose()
+
+
+class _AsyncTeeBranch:
+    def __init__(self, tee, index):
+        self._tee = tee
+        self.index = index
+        self.closed = False
+
+    @property
+    def dropped(self):
+        return self.index in self._tee._state.dropped
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            return await self._tee._next(self.index)
+        except StopAsyncIteration:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            await self._tee._close_branch(self.index)
+
+
+def tee_stream(stream, n=2, max_buffer=64, slow_consumer_policy=BLOCK, slow_consumer_timeout=None):
+    """Split a sync chunk stream into `n` iterators; see the module docstring."""
+    return StreamTee(stream, n, max_buffer, slow_consumer_policy, slow_consumer_timeout).branches
+
+
+def atee_stream(stream, n=2, max_buffer=64, slow_consumer_policy=BLOCK, slow_consumer_timeout=None):
+    """Split a chunk stream into `n` async iterators; see the module docstring."""
+    return AsyncStreamTee(stream, n, max_buffer, slow_consumer_policy, slow_consumer_timeout).branches
+
+
+TOOL_NAME = "tool_name"
+ARGUMENT = "argument"
+TOOL_CALL_COMPLETE = "tool_call_complete"
+
+_WHITESPACE = " \t\r\n"
+
+
+@dataclass
+class ToolCallEvent:
+    type: str
+    index: int
+    id: Optional[str] = None
+    name: Optional[str] = None
+    key: Optional[str] = None
+    value: Any = None
+    arguments: Optional[dict] = field(default=None, repr=False)
+    # 参数不是合法 JSON 时，TOOL_CALL_COMPLETE 事件带上原始字符串和错误
+    raw_arguments: Optional[str] = field(default=None, repr=False)
+    error: Optional[str] = None
+
+
+class PartialJSONObjectParser:
+    """
+    Incremental parser for a JSON object arriving in fragments.
+
+    Every character is scanned once. When a top-level value ends, only that
+    value's own text is handed to json.loads, so the growing prefix is never
+    re-parsed. feed() returns the (key, value) pairs completed by the fragment.
+    """
+
+    def __init__(self):
+        self.state = "start"
+        self.done = False
+        self.error = None
+        self._parts = []  # 完整参数字符串，结束时一次性 join
+        self._token = []  # 当前 key / value 的字符
+        self._key = None
+        self._in_string = False
+        self._escape = False
+        self._depth = 0
+        self._scalar = False
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def feed(self, fragment):
+        completed = []
+        if not fragment:
+            return completed
+        self._parts.append(fragment)
+        if self.done or self.error:
+            return completed
+        for ch in fragment:
+            try:
+                self._step(ch, completed)
+            except ValueError as e:
+                self.error = str(e)
+                break
+            if self.done:
+                break
+        return completed
+
+    def _step(self, ch, completed):
+        state = self.state
+        if state == "start":
+            if ch == "{":
+                self.state = "key_or_end"
+            elif ch not in _WHITESPACE:
+                raise ValueError("tool call arguments are not a JSON object")
+        elif state == "key_or_end":
+            if ch == '"':
+                self._token = []
+                self.state = "key"
+            elif ch == "}":
+                self.done = True
+            elif ch not in _WHITESPACE and ch != ",":
+                raise ValueError(f"unexpected {ch!r} while expecting a key")
+        elif state == "key":
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._key = json.loads('"' + "".join(self._token) + '"')
+                self.state = "colon"
+                return
+            self._token.append(ch)
+        elif state == "colon":
+            if ch == ":":
+                self.state = "value_start"
+            elif ch not in _WHITESPACE:
+                raise ValueError(f"unexpected {ch!r} while expecting ':'")
+        elif state == "value_start":
+            if ch in _WHITESPACE:
+                return
+            self._token = [ch]
+            self._in_string = ch == '"'
+            self._depth = 1 if ch in "{[" else 0
+            self._scalar = not self._in_string and not self._depth
+            self.state = "value"
+        elif state == "value":
+            if self._scalar:
+                if ch in _WHITESPACE or ch in ",}":
+                    self._complete_value(completed)
+                    self._after_value(ch)
+                    return
+                self._token.append(ch)
+                return
+            self._token.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 0:
+                        self._complete_value(completed)
+                return
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_value(completed)
+        elif state == "after_value":
+            self._after_value(ch)
+
+    def _complete_value(self, completed):
+        try:
+            value = json.loads("".join(self._token))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid value for key {self._key!r}: {e}")
+        completed.append((self._key, value))
+        self._token = []
+        self.state = "after_value"
+
+    def _after_value(self, ch):
+        if ch == ",":
+            self.state = "key_or_end"
+        elif ch == "}":
+            self.done = True
+        elif ch not in _WHITESPACE:
+            raise ValueError(f"unexpected {ch!r} after value")
+
+
+class _ToolCallState:
+    def __init__(self, index):
+        self.index = index
+        self.id = None
+        self.name = None
+        self.name_emitted = False
+        self.completed = False
+        self.parser = PartialJSONObjectParser()
+
+
+class ToolCallStreamParser:
+    """
+    Emit ToolCallEvents from streamed Delta.tool_calls as the arguments arrive.
+
+        parser = ToolCallStreamParser()
+        for chunk in parser.wrap(stream, on_event=dispatch):
+            send(chunk)
+
+    Events, per tool call:
+    - TOOL_NAME once the function name is known
+    - ARGUMENT for every top-level argument key whose value is complete
+    - TOOL_CALL_COMPLETE with the parsed `arguments`, when the JSON object
+      closes or, at the latest, at finish_reason / end of stream
+
+    Tool calls are told apart by their index, like StreamAccumulator; calls
+    without an index (gemini) are told apart by id.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._last_index = None
+
+    def _state(self, tool_call):
+        index = _chunk_field(tool_call, "index")
+        call_id = _chunk_field(tool_call, "id")
+        if index is None:
+            if self._last_index is not None and (not call_id or call_id == self._calls[self._last_index].id):
+                index = self._last_index
+            else:
+                index = max(self._calls, default=-1) + 1
+        state = self._calls.get(index)
+        if state is None:
+            state = self._calls[index] = _ToolCallState(index)
+        self._last_index = index
+        if call_id:
+            state.id = call_id
+        return state
+
+    def feed(self, chunk):
+        """Consume one chunk and return the events it produced."""
+        events = []
+        finished = False
+        for choice in _chunk_field(chunk, "choices") or []:
+            if _chunk_field(choice, "finish_reason"):
+                finished = True
+            delta = _chunk_field(choice, "delta")
+            if not delta:
+                continue
+            for tool_call in _chunk_field(delta, "tool_calls") or []:
+                state = self._state(tool_call)
+                function = _chunk_field(tool_call, "function")
+                name = _chunk_field(function, "name")
+                if name and not state.name:
+                    state.name = name
+                if state.name and not state.name_emitted:
+                    state.name_emitted = True
+                    events.append(ToolCallEvent(TOOL_NAME, state.index, state.id, state.name))
+                if state.completed:
+                    continue
+                for key, value in state.parser.feed(_chunk_field(function, "arguments") or ""):
+                    events.append(ToolCallEvent(ARGUMENT, state.index, state.id, state.name, key=key, value=value))
+                if state.parser.done:
+                    events.append(self._complete(state))
+        if finished:
+            events.extend(self.finish())
+        return events
+
+    def _complete(self, state):
+        state.completed = True
+        raw = state.parser.text
+        event = ToolCallEvent(TOOL_CALL_COMPLETE, state.index, state.id, state.name)
+        try:
+            event.arguments = json.loads(raw) if raw.strip() else {}
+        except json.JSONDecodeError as e:
+            event.raw_arguments = raw
+            event.error = str(e)
+        return event
+
+    def finish(self):
+        """Complete every tool call still open, e.g. at the end of the stream."""
+        return [self._complete(state) for index, state in sorted(self._calls.items()) if not state.completed]
+
+    def wrap(self, stream, on_event):
+        """Yield the chunks of `stream`, calling on_event(event) as tool call events occur."""
+        try:
+            for chunk in stream:
+                for event in self.feed(chunk):
+                    on_event(event)
+                yield chunk
+            for event in self.finish():
+                on_event(event)
+        finally:
+            close_quietly(stream)
+
+
+class MultiplexedStream:
+    """
+    Runs each stream factory in its own thread and yields their chunks as they
+    arrive, relabelled with the branch number as choice index.
+
+    The first branch error stops the other branches and is raised to the
+    consumer. Closing the stream stops every branch and, through `deadline`,
+    releases connections that are blocked in a read.
+    """
+
+    def __init__(self, factories, deadline=None, max_buffer=64):
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._stop = threading.Event()
+        self._deadline = deadline
+        self._usage = [{} for _ in factories]
+        self._remaining = len(factories)
+        self._first = None
+        self.closed = False
+        for index, factory in enumerate(factories):
+            threading.Thread(target=self._pump, args=(index, factory), daemon=True).start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _relabel(self, index, chunk):
+        for choice in _chunk_field(chunk, "choices") or []:
+            choice.index = index
+        usage = _chunk_field(chunk, "usage")
+        if usage:
+            _update_usage_values(self._usage[index], usage)
+            chunk.usage = Usage()
+        if self._first is None:
+            self._first = chunk
+
+    def _pump(self, index, factory):
+        stream = None
+        try:
+            stream = factory()
+            for chunk in stream:
+                if self._stop.is_set():
+                    break
+                self._relabel(index, chunk)
+                if not self._put((chunk, None)):
+                    break
+        except Exception as e:
+            self._put((None, e))
+        finally:
+            close_quietly(stream)
+            self._put((_EXHAUSTED, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.closed:
+            if self._remaining == 0:
+                self.close()
+                return self._usage_chunk()
+            chunk, error = self._queue.get()
+            if error is not None:
+                self.close()
+                raise error
+            if chunk is _EXHAUSTED:
+                self._remaining -= 1
+                continue
+            return chunk
+        raise StopIteration
+
+    def _usage_chunk(self):
+        usage = sum_usage(self._usage)
+        if not usage.model_dump():
+            raise StopIteration
+        first = self._first
+        return ModelResponse(
+            id=_chunk_field(first, "id"),
+            choices=[],
+            created=_chunk_field(first, "created"),
+            model=_chunk_field(first, "model"),
+            stream=True,
+            usage=usage,
+        )
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop.set()
+        if self._remaining and self._deadline is not None:
+            # 仍在读取的分支可能阻塞在网络读上，通过 deadline 关闭其连接
+            self._deadline.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def multiplex_streams(factories, deadline=None, max_buffer=64):
+    """Merge the streams returned by `factories` into one stream, see MultiplexedStream."""
+    return MultiplexedStream(list(factories), deadline=deadline, max_buffer=max_buffer)
+
@@ -0,0 +1,345 @@
+"""
+Local token estimation and pre-flight context-window fitting.
+
+    from unionllm import tokens
+
+    tokens.count_messages(messages, "deepseek", "deepseek-chat")      # estimated prompt tokens
+    tokens.context_window("moonshot", "moonshot-v1-8k")              # 8192
+    messages = tokens.fit_messages(messages, "moonshot", "moonshot-v1-8k", max_tokens=1024)
+
+    client.completion(model, messages, max_tokens=1024, context_fit="trim")      # or "validate"
+
+Counting uses a real tokenizer where one ships locally (tiktoken cl100k via
+litellm's bundled file for OpenAI-compatible models, the Qwen vocabulary
+bundled with dashscope) and a fast heuristic otherwise: one token per non-ASCII
+character plus one per four ASCII characters. That overestimates most Chinese
+tokenizers, which is the safe side for fitting. Media parts count as a fixed
+MEDIA_TOKENS each. Per-message counts are memoized, so re-sending a long
+history only tokenizes the new turns.
+
+Context windows come from CONTEXT_WINDOWS (provider -> model prefix -> total
+tokens, longest prefix wins), then a "-32k"-style suffix in the model name,
+then litellm's model map. Unknown models are sent unchecked.
+
+fit_messages drops whole turns oldest-first: a turn is a user message with
+the assistant replies and tool calls/results that follow it, so tool-call
+pairs are never split. System messages and the last turn are always kept;
+when they alone do not fit, ContextWindowExceededError is raised before any
+request is sent.
+"""
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .exceptions import ContextWindowExceededError
+from .prefix_cache import fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 每条消息的角色/分隔符开销，以及回复起始的固定开销（参照 OpenAI 的计数方式）
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+# 媒体内容无法在本地精确计数，按类型取一个偏保守的固定值
+MEDIA_TOKENS = {
+    "image_url": 765,
+    "image": 765,
+    "audio_url": 512,
+    "video_url": 2048,
+    "file_url": 1024,
+    "file": 1024,
+    "document": 1024,
+}
+
+K = 1024
+
+# 各 provider 的上下文窗口（输入 + 输出的总 token 数），按模型名最长前缀匹配
+CONTEXT_WINDOWS: Dict[str, Dict[str, int]] = {
+    "zhipuai": {
+        "glm-4": 128 * K, "glm-4-long": 1000 * K, "glm-4-airx": 8 * K, "glm-4-flashx": 128 * K,
+        "glm-4v": 8 * K, "glm-4v-plus": 8 * K, "glm-4.5": 128 * K, "glm-4.6": 200 * K,
+        "glm-z1": 32 * K, "glm-3-turbo": 128 * K,
+    },
+    "moonshot": {
+        "moonshot-v1": 128 * K, "kimi-latest": 128 * K, "kimi-k2": 128 * K, "kimi-k2-0905": 256 * K,
+        "kimi-k2-turbo": 256 * K, "kimi-k2-thinking": 256 * K, "kimi-k2.5": 256 * K,
+    },
+    "minimax": {
+        "abab5.5": 16 * K, "abab6.5": 8 * K, "abab6.5s": 245760, "abab6.5g": 8 * K, "abab6.5t": 8 * K,
+        "minimax-text-01": 1000192, "minimax-m1": 1000 * K, "minimax-m2": 200 * K,
+    },
+    "qwen": {
+        "qwen-turbo": 1000 * K, "qwen-plus": 128 * K, "qwen-max": 32 * K, "qwen-long": 10000 * K,
+        "qwen-vl": 32 * K, "qwen3": 128 * K, "qwen2.5": 128 * K, "qwq": 128 * K,
+    },
+    "tiangong": {"skychat": 4 * K},
+    "baichuan": {"baichuan2": 32 * K, "baichuan3": 32 * K, "baichuan4": 32 * K},
+    "wenxin": {"ernie-4.0": 8 * K, "ernie-3.5": 8 * K, "ernie-speed": 8 * K, "ernie-lite": 8 * K, "ernie-4.5": 128 * K},
+    "xunfei": {"lite": 4 * K, "generalv3": 8 * K, "generalv3.5": 8 * K, "4.0ultra": 32 * K, "pro-128k": 128 * K, "max-32k": 32 * K},
+    "xunfei_http": {"lite": 4 * K, "generalv3": 8 * K, "generalv3.5": 8 * K, "4.0ultra": 32 * K, "pro-128k": 128 * K, "max-32k": 32 * K},
+    "lingyi": {"yi-large": 32 * K, "yi-lightning": 16 * K, "yi-medium": 16 * K, "yi-vision": 16 * K, "yi-spark": 16 * K},
+    "stepfun": {"step-2": 16 * K, "step-1o": 32 * K, "step-3": 64 * K},
+    "doubao": {"doubao-pro": 32 * K, "doubao-lite": 32 * K, "doubao-1.5": 32 * K, "doubao-seed": 256 * K},
+    "deepseek": {"deepseek-chat": 128 * K, "deepseek-reasoner": 128 * K, "deepseek-coder": 128 * K},
+    "gemini": {"gemini-1.5-pro": 2000 * K, "gemini-1.5-flash": 1000 * K, "gemini-2": 1000 * K, "gemini-3": 1000 * K},
+    "azure": {"claude": 200 * K, "gpt-4o": 128 * K, "gpt-4.1": 1000 * K, "gpt-5": 400 * K, "o1": 200 * K, "o3": 200 * K, "o4": 200 * K},
+    "openai": {"gpt-3.5-turbo": 16 * K, "gpt-4": 8 * K, "gpt-4-turbo": 128 * K, "gpt-4o": 128 * K, "gpt-4.1": 1000 * K,
+               "gpt-5": 400 * K, "o1": 200 * K, "o3": 200 * K, "o4": 200 * K},
+    "anthropic": {"claude": 200 * K},
+    "xai": {"grok-2": 128 * K, "grok-3": 128 * K, "grok-4": 256 * K},
+}
+
+# 模型名里带窗口大小的（moonshot-v1-8k、ernie-3.5-128k、step-1-32k、doubao-pro-256k ...）
+_WINDOW_SUFFIX = re.compile(r"[-_](\d+)k(?:$|[-_])", re.IGNORECASE)
+
+
+class HeuristicEstimator:
+    """Fast character-based estimate: non-ASCII characters count one token each, ASCII text one per four characters."""
+
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        ascii_length = len(text.encode("ascii", "ignore"))
+        return len(text) - ascii_length + (ascii_length + 3) // 4
+
+
+class TokenizerEstimator:
+    """Exact counts from a local tokenizer exposing encode(text)."""
+
+    def __init__(self, name: str, tokenizer):
+        self.name = name
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        try:
+            return len(self.tokenizer.encode(text, disallowed_special=()))
+        except TypeError:
+            return len(self.tokenizer.encode(text))
+
+
+HEURISTIC = HeuristicEstimator()
+
+
+@lru_cache(maxsize=None)
+def _cl100k():
+    try:
+        # litellm 自带 cl100k 词表文件，离线可用
+        from litellm.litellm_core_utils.default_encoding import encoding
+        return TokenizerEstimator("cl100k_base", encoding)
+    except Exception:
+        pass
+    try:
+        import tiktoken
+        return TokenizerEstimator("cl100k_base", tiktoken.get_encoding("cl100k_base"))
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=None)
+def _qwen():
+    try:
+        from dashscope import get_tokenizer
+        return TokenizerEstimator("qwen", get_tokenizer("qwen-turbo"))
+    except Exception:
+        return None
+
+
+# 与 OpenAI 词表相近、可用 cl100k 计数的 provider
+_CL100K_PROVIDERS = ("openai", "azure", "xai", "deepseek", "lingyi", "stepfun")
+
+
+def estimator_for(provider: Optional[str], model: Optional[str] = None):
+    """The most accurate estimator available locally for provider/model."""
+    provider, model = _split_model(provider, model)
+    if provider == "qwen" or (model or "").lower().startswith(("qwen", "qwq")):
+        return _qwen() or HEURISTIC
+    # 未指定 provider 时走 litellm，默认是 OpenAI 模型
+    if (provider is None or provider in _CL100K_PROVIDERS) and not (model or "").lower().startswith("claude"):
+        return _cl100k() or HEURISTIC
+    return HEURISTIC
+
+
+def _split_model(provider, model):
+    # litellm 风格的 "openai/gpt-4o"
+    if model and "/" in model and not provider:
+        provider, model = model.split("/", 1)
+    return (provider.lower() if provider else None), model
+
+
+def context_window(provider: Optional[str], model: str) -> Optional[int]:
+    """Total context tokens (prompt + completion) of provider/model, or None when unknown."""
+    provider, model = _split_model(provider, model)
+    name = (model or "").lower()
+    best = None
+    for prefix, window in CONTEXT_WINDOWS.get(provider or "openai", {}).items():
+        if name.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+            best = (prefix, window)
+    # 名字里显式写了窗口大小时以名字为准
+    match = _WINDOW_SUFFIX.search(name)
+    if match:
+        return int(match.group(1)) * K
+    if best:
+        return best[1]
+    return _litellm_window(provider, model)
+
+
+def _litellm_window(provider, model):
+    try:
+        import litellm
+    except ImportError:
+        return None
+    model_cost = getattr(litellm, "model_cost", None) or {}
+    entry = model_cost.get(f"{provider}/{model}") or model_cost.get(model)
+    if not entry:
+        return None
+    window = entry.get("max_input_tokens") or entry.get("max_tokens")
+    return int(window) if window else None
+
+
+def register_context_window(provider: str, model_prefix: str, tokens: int):
+    CONTEXT_WINDOWS.setdefault(provider.lower(), {})[model_prefix.lower()] = int(tokens)
+
+
+class TokenCounter:
+    """Counts message tokens with one estimator; per-message counts are memoized in a bounded LRU."""
+
+    def __init__(self, estimator, maxsize: int = 4096):
+        self.estimator = estimator
+        self.maxsize = maxsize
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count_text(self, text) -> int:
+        if not text:
+            return 0
+        return self.estimator.count(text if isinstance(text, str) else str(text))
+
+    def _count_content(self, content) -> int:
+        if isinstance(content, str):
+            return self.count_text(content)
+        if not isinstance(content, list):
+            return self.count_text(content) if content is not None else 0
+        total = 0
+        for part in content:
+            if not isinstance(part, dict):
+                total += self.count_text(getattr(part, "text", None) or "")
+                continue
+            part_type = part.get("type")
+            if part_type == "text":
+                total += self.count_text(part.get("text"))
+            elif part_type in MEDIA_TOKENS:
+                total += MEDIA_TOKENS[part_type]
+            else:
+                total += self.count_text(json.dumps(part, ensure_ascii=False, default=str))
+        return total
+
+    def count_message(self, message: dict) -> int:
+        key = fingerprint(message)
+        with self._lock:
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                return cached
+        total = TOKENS_PER_MESSAGE + self._count_content(message.get("content"))
+        if message.get("name"):
+            total += self.count_text(message["name"])
+        for tool_call in message.get("tool_calls") or []:
+            function = (tool_call.get("function") or {}) if isinstance(tool_call, dict) else {}
+            total += self.count_text(function.get("name")) + self.count_text(function.get("arguments"))
+        with self._lock:
+            self._memo[key] = total
+            while len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+        return total
+
+    def count_messages(self, messages: List[dict]) -> int:
+        return sum(self.count_message(message) for message in messages) + TOKENS_PER_REPLY
+
+    def count_tools(self, tools) -> int:
+        if not tools:
+            return 0
+        return self.count_text(json.dumps(tools, ensure_ascii=False, sort_keys=True, default=str))
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def counter_for(provider: Optional[str], model: Optional[str] = None) -> TokenCounter:
+    estimator = estimator_for(provider, model)
+    counter = _counters.get(estimator.name)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.setdefault(estimator.name, TokenCounter(estimator))
+    return counter
+
+
+def count_messages(messages: List[dict], provider: Optional[str] = None, model: Optional[str] = None, tools=None) -> int:
+    """Estimated prompt tokens of messages (plus tool definitions) for provider/model."""
+    counter = counter_for(provider, model)
+    return counter.count_messages(messages) + counter.count_tools(tools)
+
+
+def context_window_error(message, model=None, llm_provider=None):
+    return ContextWindowExceededError(
+        message=message,
+        model=model,
+        llm_provider=llm_provider,
+        response=httpx.Response(400, request=httpx.Request("POST", "https://unionllm.invalid")),
+    )
+
+
+def _turns(messages):
+    """Index groups of non-system messages; each turn starts at a user message."""
+    turns = []
+    for index, message in enumerate(messages):
+        if message.get("role") == "system":
+            continue
+        if message.get("role") == "user" or not turns:
+            turns.append([index])
+        else:
+            turns[-1].append(index)
+    return turns
+
+
+def fit_messages(messages: List[dict], provider: Optional[str], model: str, max_tokens: Optional[int] = None,
+                 tools=None, mode: str = "trim", window: Optional[int] = None) -> List[dict]:
+    """
+    Make messages fit the context window of provider/model, reserving max_tokens for the reply.
+
+    mode="validate" only raises ContextWindowExceededError when the prompt is too long;
+    mode="trim" drops the oldest turns first. Returns messages itself when nothing is dropped.
+    """
+    if mode not in ("trim", "validate"):
+        raise ValueError(f"context_fit must be 'trim' or 'validate', got {mode!r}")
+    window = window or context_window(provider, model)
+    if not window or not messages:
+        return messages
+    counter = counter_for(provider, model)
+    budget = window - (max_tokens or 0) - counter.count_tools(tools) - TOKENS_PER_REPLY
+    counts = [counter.count_message(message) for message in messages]
+    total = sum(counts)
+    if total <= budget:
+        return messages
+
+    too_long = (f"Prompt of ~{total + TOKENS_PER_REPLY} tokens plus max_tokens={max_tokens or 0} exceeds "
+                f"the {window}-token context window of {model}")
+    if mode == "validate":
+        raise context_window_error(too_long, model=model, llm_provider=provider)
+
+    dropped = set()
+    turns = _turns(messages)
+    for turn in turns[:-1]:
+        if total <= budget:
+            break
+        dropped.update(turn)
+        total -= sum(counts[i] for i in turn)
+    if total > budget:
+        raise context_window_error(too_long + " even after dropping the older turns", model=model, llm_provider=provider)
+    logger.debug("context_fit dropped %d of %d messages for %s", len(dropped), len(messages), model)
+    return [message for index, message in enumerate(messages) if index not in dropped]
@@ -3,8 +3,11 @@ from abc import ABC, abstractmethod
 from openai import OpenAIError as OriginalError
 from typing import List, Union, Optional
 
-import uuid, time, openai, random, requests
+import base64
+import uuid, time, openai, random, requests, httpx
 from openai._models import BaseModel as OpenAIObject
+from .exceptions import Timeout, RequestCancelled
+from . import prefix_cache
 
 class Message(OpenAIObject):
     def __init__(
@@ -119,6 +122,39 @@ class Usage(OpenAIObject):
         # Allow dictionary-style assignment of attributes
         setattr(self, key, value)
 
+
+def _usage_field(obj, key):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+def cached_prompt_tokens(usage) -> int:
+    """
+    Prompt tokens served from the provider's prefix cache, read from whichever
+    field the provider reports them in (Usage object or dict).
+    """
+    details = _usage_field(usage, "prompt_tokens_details")
+    for value in (
+        _usage_field(usage, "cache_read_input_tokens"),  # Anthropic
+        _usage_field(details, "cached_tokens"),  # OpenAI 兼容接口（Moonshot / DashScope / 智谱）
+        _usage_field(usage, "prompt_cache_hit_tokens"),  # DeepSeek
+        _usage_field(usage, "cached_tokens"),  # Moonshot 旧版上下文缓存 / Gemini
+        _usage_field(usage, "cached_prompt_tokens"),
+    ):
+        if value:
+            return int(value)
+    return 0
+
+
+def with_cached_prompt_tokens(usage):
+    """Fill usage.cached_prompt_tokens from the provider's raw cache fields, which are kept as-is."""
+    if usage is not None:
+        usage.cached_prompt_tokens = cached_prompt_tokens(usage)
+    return usage
+
 class Context(OpenAIObject):
     def __init__(self, id=None, content=None, score=None, **params):
         super(Context, self).__init__(**params)
@@ -315,9 +351,354 @@ def generate_unique_uid():
     
     # Combine them to get a unique ID
     unique_uid = f"{microseconds:x}{rand_num:04x}"
-    
+
     return unique_uid
 
+class Deadline:
+    """
+    Per-call time budget shared by every transport a completion touches:
+    media prefetch, the upstream HTTP/SDK/websocket call and stream consumption.
+
+    - timeout: relative budget in seconds, or a (connect, total) tuple
+    - deadline: absolute unix timestamp; the earlier of the two wins
+    - connect_timeout: optional cap for establishing connections
+
+    A Deadline without timeout/deadline is unbounded and leaves every
+    transport at its own default.
+
+    It also carries cancellation: transports register a callback that
+    releases their upstream connection, and cancel() runs them from any
+    thread so a blocked read is interrupted.
+    """
+
+    def __init__(self, timeout=None, deadline=None, connect_timeout=None):
+        if isinstance(timeout, (tuple, list)):
+            connect_timeout, timeout = timeout
+        now = time.monotonic()
+        expires_at = None
+        if timeout is not None:
+            expires_at = now + float(timeout)
+        if deadline is not None:
+            absolute = now + (float(deadline) - time.time())
+            expires_at = absolute if expires_at is None else min(expires_at, absolute)
+        self.expires_at = expires_at
+        self.connect_timeout = float(connect_timeout) if connect_timeout is not None else None
+        self.cancelled = False
+        self._cancel_callbacks = []
+        self.context = None
+
+    @classmethod
+    def from_kwargs(cls, kwargs: dict) -> "Deadline":
+        # 从调用参数中取出 timeout / deadline（会从 kwargs 中移除，避免透传给上游）
+        timeout = kwargs.pop("timeout", None)
+        deadline = kwargs.pop("deadline", None)
+        if isinstance(deadline, Deadline):
+            return deadline
+        if isinstance(timeout, Deadline):
+            return timeout
+        if isinstance(timeout, httpx.Timeout):
+            timeout = (timeout.connect, timeout.read)
+        return cls(timeout=timeout, deadline=deadline)
+
+    def child(self) -> "Deadline":
+        """Same budget, cancelled together with this deadline, but with its own CallContext."""
+        child = Deadline()
+        child.expires_at = self.expires_at
+        child.connect_timeout = self.connect_timeout
+        self.add_cancel_callback(child.cancel)
+        return child
+
+    @property
+    def bounded(self) -> bool:
+        return self.expires_at is not None
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def add_cancel_callback(self, callback):
+        # 已经取消时立即执行，保证取消之后才建立的连接也会被释放
+        self._cancel_callbacks.append(callback)
+        if self.cancelled:
+            callback()
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        for callback in list(self._cancel_callbacks):
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def check(self, model=None, llm_provider=None):
+        if self.cancelled:
+            raise RequestCancelled(f"Request cancelled by caller (model={model}, provider={llm_provider})")
+        if self.expired():
+            raise timeout_error("Deadline exceeded", model=model, llm_provider=llm_provider)
+
+    def requests_timeout(self, default=None, model=None, llm_provider=None):
+        """(connect, read) tuple for `requests`, clipped to the remaining budget."""
+        self.check(model=model, llm_provider=llm_provider)
+        remaining = self.remaining()
+        if remaining is None:
+            if self.connect_timeout is not None:
+                return (self.connect_timeout, default)
+            return default
+        read = remaining if default is None else min(default, remaining)
+        connect = read if self.connect_timeout is None else min(self.connect_timeout, read)
+        return (connect, read)
+
+    def sdk_timeout(self, model=None, llm_provider=None):
+        """Timeout value for httpx based SDKs (openai, anthropic, litellm)."""
+        self.check(model=model, llm_provider=llm_provider)
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        if self.connect_timeout is not None:
+            return httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining))
+        return remaining
+
+    def sdk_kwargs(self, key="timeout", model=None, llm_provider=None) -> dict:
+        # 无界时不传 timeout，保持 SDK 默认行为（openai 中 timeout=None 表示永不超时）
+        value = self.sdk_timeout(model=model, llm_provider=llm_provider)
+        return {key: value} if value is not None else {}
+
+
+class CallContext:
+    """
+    Timing breakdown of one completion call, carried on its Deadline so that
+    every layer the call passes through (scheduler, check_prompt, media
+    prefetch, stream consumption) can record into it. Values are seconds.
+
+    - queue: waiting for a scheduler slot or an executor thread
+    - preprocessing: check_prompt, including media_fetch done there
+    - media_fetch: downloading images/audio/video/files referenced by messages
+    - upstream: provider call after preprocessing, up to the response / open stream
+    - ttfb: from start until the response or the open stream was returned
+    - ttft, inter_token_avg, inter_token_max: streams only
+    - total, tokens_per_second
+
+    intervals keeps (name, start, end) perf_counter pairs of each phase, for
+    exporters that rebuild them as child spans (see to_ns).
+    """
+
+    def __init__(self, provider=None, model=None, stream=False):
+        self.provider = provider
+        self.model = model
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.timings = {}
+        self.intervals = []
+        self.usage = {}
+        self.metadata = {}
+        self.chunk_count = 0
+        self._queued_at = None
+        self._began = None
+        self._responded_at = None
+        self._last_token_at = None
+        self._gaps = 0
+        self._gap_total = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add(self, name, seconds, end=None):
+        """Add a phase of `seconds` that ended at `end` (default: now)."""
+        end = time.perf_counter() if end is None else end
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.intervals.append((name, end - seconds, end))
+
+    def to_ns(self, perf_time):
+        """Convert a perf_counter reading of this call into unix nanoseconds."""
+        return self.started_ns + int((perf_time - self.started) * 1e9)
+
+    def queued(self):
+        self._queued_at = time.perf_counter()
+
+    def begin(self, provider, model, stream):
+        """Provider dispatch starts; closes any open queue interval."""
+        now = time.perf_counter()
+        if self._queued_at is not None:
+            self.add("queue", now - self._queued_at, end=now)
+            self._queued_at = None
+        self.provider = provider
+        self.model = model
+        self.stream = stream
+        self._began = now
+
+    def responded(self):
+        now = time.perf_counter()
+        self._responded_at = now
+        self.timings["ttfb"] = now - self.started
+        if self._began is not None:
+            self.add("upstream", max(0.0, now - self._began - self.timings.get("preprocessing", 0.0)), end=now)
+
+    def chunk(self, chunk):
+        """Record one stream chunk; returns True for the first chunk that carries output."""
+        self.chunk_count += 1
+        _update_usage_values(self.usage, _chunk_field(chunk, "usage"))
+        if not _chunk_has_output(chunk):
+            return False
+        now = time.perf_counter()
+        first = self._last_token_at is None
+        if first:
+            self.timings["ttft"] = now - self.started
+        else:
+            gap = now - self._last_token_at
+            self._gaps += 1
+            self._gap_total += gap
+            self.timings["inter_token_max"] = max(self.timings.get("inter_token_max", 0.0), gap)
+        self._last_token_at = now
+        return first
+
+    def finish(self, usage=None):
+        _update_usage_values(self.usage, usage)
+        now = time.perf_counter()
+        self.timings["total"] = now - self.started
+        if self.stream and self._responded_at is not None:
+            self.intervals.append(("stream", self._responded_at, now))
+        if self._gaps:
+            self.timings["inter_token_avg"] = self._gap_total / self._gaps
+        completion_tokens = self.usage.get("completion_tokens")
+        if completion_tokens:
+            # 流式从首 token 起算，非流式按上游耗时
+            start = self.timings.get("ttft") if self.stream else self.timings["total"] - self.timings.get("upstream", 0.0)
+            duration = self.timings["total"] - (start or 0.0)
+            if duration > 0:
+                self.timings["tokens_per_second"] = completion_tokens / duration
+        return self
+
+    def to_dict(self):
+        data = {"provider": self.provider, "model": self.model, "stream": self.stream}
+        data.update(self.timings)
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            if self.usage.get(key) is not None:
+                data[key] = self.usage[key]
+        if self.stream:
+            data["chunks"] = self.chunk_count
+        return data
+
+def _chunk_has_output(chunk):
+    for choice in _chunk_field(chunk, "choices") or []:
+        delta = _chunk_field(choice, "delta")
+        if delta and (_chunk_field(delta, "content") or _chunk_field(delta, "reasoning_content") or _chunk_field(delta, "tool_calls")):
+            return True
+    return False
+
+def call_context(deadline):
+    """The CallContext attached to `deadline`, created on first use."""
+    context = getattr(deadline, "context", None)
+    if context is None:
+        context = deadline.context = CallContext()
+    return context
+
+def media_get(deadline, url, **kwargs):
+    """requests.get for media prefetch, timed into the call's media_fetch."""
+    context = getattr(deadline, "context", None)
+    if context is None:
+        return requests.get(url, **kwargs)
+    started = time.perf_counter()
+    try:
+        return requests.get(url, **kwargs)
+    finally:
+        context.add("media_fetch", time.perf_counter() - started)
+
+def timeout_error(message, model=None, llm_provider=None, url=None):
+    return Timeout(
+        message=message,
+        model=model,
+        llm_provider=llm_provider,
+        request=httpx.Request("POST", url or "https://unionllm.invalid"),
+    )
+
+def is_timeout_exception(e) -> bool:
+    return isinstance(e, (
+        Timeout,
+        requests.exceptions.Timeout,
+        openai.APITimeoutError,
+        httpx.TimeoutException,
+        TimeoutError,
+    ))
+
+def raise_if_timeout(e, model=None, llm_provider=None):
+    """
+    Re-raise `e` as unionllm.exceptions.Timeout if it, or any exception it was
+    raised from/while handling, is a transport timeout. Providers wrap errors in
+    their own exception types, so the original timeout lives in the chain.
+    """
+    seen = set()
+    current = e
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(current, Timeout):
+            raise current
+        if is_timeout_exception(current):
+            raise timeout_error(str(current) or "Request timed out", model=model, llm_provider=llm_provider) from current
+        current = current.__cause__ or current.__context__
+
+def close_quietly(resource):
+    """Close a response / SDK stream / websocket, ignoring errors from an already broken connection."""
+    close = getattr(resource, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
+class ClosingStream:
+    """
+    Iterator returned for streams whose upstream connection is opened before
+    iteration starts (OpenAI/LiteLLM SDK streams). The connection is released
+    when the stream is exhausted, fails, is closed explicitly, or is garbage
+    collected without being consumed.
+    """
+
+    def __init__(self, iterator, *resources, deadline=None):
+        self._iterator = iterator
+        self._resources = [r for r in resources if r is not None]
+        self.closed = False
+        if deadline is not None:
+            # 取消回调只关闭底层连接，生成器可能正在另一个线程中执行
+            for resource in self._resources:
+                deadline.add_cancel_callback(lambda r=resource: close_quietly(r))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        close_quietly(self._iterator)
+        for resource in self._resources:
+            close_quietly(resource)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
 def check_object_input_support(provider):
     not_supported_providers = ["wenxin", "baichuan", "minimax", "xunfei", "tiangong", "lingyi", "fastgpt", "doubao"]
     if provider in not_supported_providers:
@@ -363,212 +744,260 @@ def check_audio_input_support(provider, model):
     else:
         return "PARTIAL"
 
-def reformat_object_content(messages, reformat=False, reformat_image=False, reformat_file=False, reformat_video=False, reformat_audio=False):
+# 需要内联为 base64 时各媒体类型的默认 MIME；响应头给不出类型时按扩展名推断
+_AUDIO_MIME = ("audio/mpeg", ".mp3", {".wav": "audio/wav", ".ogg": "audio/ogg", ".flac": "audio/flac", ".m4a": "audio/m4a"})
+_VIDEO_MIME = ("video/mp4", ".mp4", {
+    ".mpeg": "video/mpeg", ".mov": "video/mov", ".avi": "video/avi", ".flv": "video/x-flv", ".mpg": "video/mpg",
+    ".webm": "video/webm", ".wmv": "video/wmv", ".3gpp": "video/3gpp", ".3gp": "video/3gpp",
+})
+_FILE_MIME = ("application/octet-stream", None, {})
+
+def _inline_data_url(url, deadline, mime):
+    """data: URL for `url`, fetched and base64 encoded unless it already is one."""
+    if "base64," in url:
+        return url
+    default_mime, default_ext, ext_mapping = mime
+    response = media_get(deadline, url, timeout=deadline.requests_timeout())
+    content_type = response.headers.get("Content-Type", default_mime)
+    if default_ext and content_type == default_mime and not url.endswith(default_ext):
+        for ext, ext_mime in ext_mapping.items():
+            if url.lower().endswith(ext):
+                content_type = ext_mime
+                break
+    encoded = base64.b64encode(response.content).decode("utf-8")
+    return f"data:{content_type};base64,{encoded}"
+
+def _inline_file_part(url, deadline, mime):
+    """{"type": "file"} part (litellm/Gemini inline_data), or None to fall back to a link."""
+    try:
+        return {"type": "file", "file": {"file_data": _inline_data_url(url, deadline, mime)}}
+    except Exception:
+        # 预算耗尽时直接抛出 Timeout，否则回退为原始URL
+        deadline.check()
+        return None
+
+def _media_url(content, key):
+    payload = content.get(key)
+    return payload.get("url") if payload else None
+
+def reformat_message(message, reformat_image=0, reformat_file=0, reformat_video=0, reformat_audio=0, deadline=None, fallbacks=None):
+    """
+    按各媒体类型的处理方式改写一条消息（copy-on-write）。
+
+    content 不是 list，或改写后与原来相同时返回原消息对象本身；需要改写时返回新 dict，
+    原消息及其 content 中的各项都不会被修改。content 中有非 dict 项或媒体缺少 url 时返回 False。
+    reformat_* 为 0 时原样保留该类型，为 1 时转为文本链接追加到文本中，为 2 时内联为 base64（音频、视频、pdf 文件）。
+    fallbacks 为 list 时，下载失败、回退为链接的媒体 url 会追加到其中。
+    """
+    contents = message.get("content")
+    if not isinstance(contents, list):
+        return message
+    new_contents = []
+    to_append_text = ""
+    changed = False
+    for content in contents:
+        if not isinstance(content, dict):
+            return False
+        content_type = content.get("type")
+        if content_type == "text":
+            if isinstance(content.get("text"), str):
+                new_contents.append(content)
+                continue
+        elif content_type == "audio_url":
+            if not reformat_audio:
+                new_contents.append(content)
+                continue
+            url = _media_url(content, "audio_url")
+            if not url:
+                return False
+            part = _inline_file_part(url, deadline, _AUDIO_MIME) if reformat_audio == 2 else None
+            if part is not None:
+                new_contents.append(part)
+            else:
+                if reformat_audio == 2 and fallbacks is not None:
+                    fallbacks.append(url)
+                to_append_text += f"![audio]({url})"
+        elif content_type in ("image_url", "image"):
+            if not reformat_image:
+                new_contents.append(content)
+                continue
+            url = _media_url(content, "image_url")
+            if not url:
+                return False
+            to_append_text += f"![image]({url})"
+        elif content_type == "video_url":
+            if not reformat_video:
+                new_contents.append(content)
+                continue
+            url = _media_url(content, "video_url")
+            if not url:
+                return False
+            part = _inline_file_part(url, deadline, _VIDEO_MIME) if reformat_video == 2 else None
+            if part is not None:
+                new_contents.append(part)
+            else:
+                if reformat_video == 2 and fallbacks is not None:
+                    fallbacks.append(url)
+                to_append_text += f"![video]({url})"
+        elif content_type == "file_url":
+            if not reformat_file:
+                new_contents.append(content)
+                continue
+            url = _media_url(content, "file_url")
+            if not url:
+                return False
+            # 只内联 pdf 文件，其余文件转为链接
+            inline = reformat_file == 2 and url.endswith(".pdf")
+            part = _inline_file_part(url, deadline, _FILE_MIME) if inline else None
+            if part is not None:
+                new_contents.append(part)
+            else:
+                if inline and fallbacks is not None:
+                    fallbacks.append(url)
+                to_append_text += f"[file]({url})"
+        # 走到这里的项被改写或丢弃（无法识别的类型、text 不是字符串）
+        changed = True
+
+    if to_append_text:
+        # 媒体链接追加到第一段文本后；没有文本段时新建一段
+        for i, content in enumerate(new_contents):
+            if content.get("type") == "text":
+                new_contents[i] = dict(content, text=content["text"] + to_append_text)
+                break
+        else:
+            new_contents.insert(0, {"type": "text", "text": to_append_text})
+    if not changed:
+        return message
+    new_message = dict(message)
+    new_message["content"] = new_contents
+    return new_message
+
+def reformat_object_content(messages, reformat=False, reformat_image=False, reformat_file=False, reformat_video=False, reformat_audio=False, deadline=None):
+    """对每条消息调用 reformat_message；未改写的消息原样复用。任一消息不合法时返回 False。"""
+    if deadline is None:
+        deadline = Deadline()
     formatted_messages = []
     for message in messages:
-        # 保留原始消息除了content以外的所有字段（包括tool_call_id和name）
-        new_formatted_message = {k: v for k, v in message.items() if k != 'content'}
-        if isinstance(message.get("content"), list):
-            new_formatted_message["content"] = []
-            message_contents = message.get("content")   
-            to_append_text = ""
-            for content in message_contents:
-                if not isinstance(content, dict):
-                    return False
-                content_type = content.get("type")
-                if content_type == "text":
-                    if isinstance(content.get("text"), str):
-                        new_formatted_message["content"].append(content)
-                elif content_type == "audio_url":
-                    if not reformat_audio:
-                        new_formatted_message["content"].append(content)
-                        continue
-                    elif content.get("audio_url") and content.get("audio_url").get("url"):
-                        if reformat_audio == 1:
-                            to_append_text += f"![audio]({content.get('audio_url').get('url')})"
-                        elif reformat_audio == 2:
-                            # 转换音频为inline_data格式 (适用于 Gemini/litellm)
-                            audio_url = content.get("audio_url").get("url")
-                            try:
-                                import base64
-                                import requests
-                                
-                                # 检查是否已经是base64格式
-                                if "base64," in audio_url:
-                                    # 已经是base64格式，直接使用
-                                    audio_data = audio_url
-                                else:
-                                    # 获取音频数据
-                                    response = requests.get(audio_url)
-                                    audio_content = response.content
-                                    
-                                    # 确定音频MIME类型
-                                    # 支持的音频格式: mp3, wav, ogg, flac, m4a
-                                    content_type_header = response.headers.get('Content-Type', 'audio/mpeg')
-                                    
-                                    # 如果无法从header获取，尝试从URL扩展名推断
-                                    if content_type_header == 'audio/mpeg' and not audio_url.endswith('.mp3'):
-                                        ext_mapping = {
-                                            '.wav': 'audio/wav',
-                                            '.ogg': 'audio/ogg',
-                                            '.flac': 'audio/flac',
-                                            '.m4a': 'audio/m4a'
-                                        }
-                                        for ext, mime in ext_mapping.items():
-                                            if audio_url.lower().endswith(ext):
-                                                content_type_header = mime
-                                                break
-                                    
-                                    # 转换为base64
-                                    encoded_audio = base64.b64encode(audio_content).decode('utf-8')
-                                    audio_data = f"data:{content_type_header};base64,{encoded_audio}"
-                                
-                                # 创建inline_data格式 (litellm标准格式)
-                                new_content = {
-                                    "type": "file",
-                                    "file": {
-                                        "file_data": audio_data
-                                    }
-                                }
-                                new_formatted_message["content"].append(new_content)
-                            except Exception as e:
-                                # 如果获取失败，则使用原始URL格式
-                                to_append_text += f"![audio]({audio_url})"
-                    else:
-                        return False
-                elif content_type in ["image_url","image"]:
-                    if not reformat_image:
-                        new_formatted_message["content"].append(content)
-                        continue
-                    elif content.get("image_url") and content.get("image_url").get("url"):
-                        to_append_text += f"![image]({content.get('image_url').get('url')})"
-                    else:
-                        return False
-                elif content_type == "video_url":
-                    if not reformat_video:
-                        new_formatted_message["content"].append(content)
-                        continue
-                    elif content.get("video_url") and content.get("video_url").get("url"):
-                        if reformat_video == 1:
-                            to_append_text += f"![video]({content.get('video_url').get('url')})"
-                        elif reformat_video == 2:
-                            # 转换视频为inline_data格式 (适用于 Gemini/litellm)
-                            video_url = content.get("video_url").get("url")
-                            try:
-                                import base64
-                                import requests
-                                
-                                # 检查是否已经是base64格式
-                                if "base64," in video_url:
-                                    # 已经是base64格式，直接使用
-                                    video_data = video_url
-                                else:
-                                    # 获取视频数据
-                                    response = requests.get(video_url)
-                                    video_content = response.content
-                                    
-                                    # 确定视频MIME类型
-                                    # 支持的视频格式: mp4, mpeg, mov, avi, x-flv, mpg, webm, wmv, 3gpp
-                                    content_type_header = response.headers.get('Content-Type', 'video/mp4')
-                                    
-                                    # 如果无法从header获取，尝试从URL扩展名推断
-                                    if content_type_header == 'video/mp4' and not video_url.endswith('.mp4'):
-                                        ext_mapping = {
-                                            '.mpeg': 'video/mpeg',
-                                            '.mov': 'video/mov',
-                                            '.avi': 'video/avi',
-                                            '.flv': 'video/x-flv',
-                                            '.mpg': 'video/mpg',
-                                            '.webm': 'video/webm',
-                                            '.wmv': 'video/wmv',
-                                            '.3gpp': 'video/3gpp',
-                                            '.3gp': 'video/3gpp'
-                                        }
-                                        for ext, mime in ext_mapping.items():
-                                            if video_url.lower().endswith(ext):
-                                                content_type_header = mime
-                                                break
-                                    
-                                    # 转换为base64
-                                    encoded_video = base64.b64encode(video_content).decode('utf-8')
-                                    video_data = f"data:{content_type_header};base64,{encoded_video}"
-                                
-                                # 创建inline_data格式 (litellm标准格式)
-                                new_content = {
-                                    "type": "file",
-                                    "file": {
-                                        "file_data": video_data
-                                    }
-                                }
-                                new_formatted_message["content"].append(new_content)
-                            except Exception as e:
-                                # 如果获取失败，则使用原始URL格式
-                                to_append_text += f"![video]({video_url})"
-                    else:
-                        return False
-                elif content_type == "file_url":
-                    if not reformat_file:
-                        new_formatted_message["content"].append(content)
-                        continue
-                    elif content.get("file_url") and content.get("file_url").get("url"):
-                        if reformat_file == 1:
-                            to_append_text += f"[file]({content.get('file_url').get('url')})"
-                        elif reformat_file == 2:
-                            # 只转换pdf文件
-                            if content.get("file_url").get("url").endswith(".pdf"):
-                                # 将文件转换为base64
-                                file_url = content.get("file_url").get("url")
-                                # 从URL获取文件数据
-                                try:
-                                    import base64
-                                    import requests
-                                    from urllib.parse import urlparse
-                                    
-                                    # 检查是否已经是base64格式
-                                    if "base64," in file_url:
-                                        # 已经是base64格式，直接使用
-                                        file_data = file_url
-                                    else:
-                                        # 获取content中的
-
-                                        # 获取文件数据
-                                        response = requests.get(file_url)
-                                        file_content = response.content
-                                        
-                                        # 确定文件类型
-                                        content_type = response.headers.get('Content-Type', 'application/octet-stream')
-                                        
-                                        # 转换为base64
-                                        encoded_file = base64.b64encode(file_content).decode('utf-8')
-                                        file_data = f"data:{content_type};base64,{encoded_file}"
-                                    
-                                    # 创建所需格式
-                                    new_content = {
-                                        "type": "file",
-                                        "file": {
-                                            "file_data": file_data
-                                        }
-                                    }
-                                    new_formatted_message["content"].append(new_content)
-                                except Exception as e:
-                                    # 如果获取失败，则使用原始URL
-                                    to_append_text += f"[file]({file_url})"
-                            else:
-                                file_url = content.get("file_url").get("url")
-                                to_append_text += f"[file]({file_url})"
-                    else:
-                        return False
-            formatted_messages.append(new_formatted_message)   
-
-            if to_append_text:
-                # 将to_append_text添加到formatted_messages中的text类型文本中
-                for content in formatted_messages[-1]["content"]:
-                    if content.get("type") == "text":
-                        content["text"] += to_append_text
-        else:
-            formatted_messages.append(message)
+        formatted = reformat_message(message, reformat_image, reformat_file, reformat_video, reformat_audio, deadline)
+        if formatted is False:
+            return False
+        formatted_messages.append(formatted)
     return formatted_messages
 
+def normalize_messages(provider, model, messages, deadline=None):
+    """
+    检查并规范化消息，供 BaseProvider.check_prompt 使用。
+
+    只遍历一次消息列表做分类和校验，纯文本消息不复制、不改动；需要改写时只改写含 object content
+    的消息（copy-on-write），调用方传入的消息列表和其中的 dict 都不会被修改。
+    返回 {"pass_check", "reformatted", "messages", "multimodal_info"}，不通过时带 "reason"。
+    """
+    object_indexes = []
+    seen_types = set()
+    is_invalid_format = False
+    for i, message in enumerate(messages):
+        contents = message.get("content")
+        if isinstance(contents, str) or not isinstance(contents, list):
+            continue
+        object_indexes.append(i)
+        for content in contents:
+            if isinstance(content, dict):
+                seen_types.add(content.get("type"))
+            else:
+                is_invalid_format = True
+
+    if is_invalid_format:
+        return {"pass_check": False, "reformatted": False, "reason": "Invalid message format"}
+
+    has_vision_input = "image_url" in seen_types
+    has_video_input = "video_url" in seen_types
+    has_audio_input = "audio_url" in seen_types
+    has_file_input = "file_url" in seen_types
+    multimodal_info = {
+        "has_vision_input": has_vision_input,
+        "has_video_input": has_video_input,
+        "has_file_input": has_file_input,
+        "has_audio_input": has_audio_input
+    }
+    # 只有空 list 时不算 object content
+    if not seen_types:
+        return {"pass_check": True, "reformatted": 0, "messages": messages, "multimodal_info": multimodal_info}
+
+    reformatted = 0
+    flags = {"reformat_image": 0, "reformat_file": 0, "reformat_video": 0, "reformat_audio": 0}
+    object_support = check_object_input_support(provider)
+    if object_support == "NONE":
+        if has_vision_input or has_file_input:
+            return {"pass_check": False, "reformatted": False, "reason": "Object content is not supported"}
+        # 不支持 object content 时只整理结构，媒体按原样保留
+        reformatted = 1
+    else:
+        if object_support == "PARTIAL":
+            reformatted = 1
+        if has_vision_input:
+            vision_input_support = check_vision_input_support(provider, model)
+            if vision_input_support == "PARTIAL":
+                flags["reformat_image"] = reformatted = 1
+            elif vision_input_support == "NONE":
+                return {"pass_check": False, "reformatted": False, "reason": "Vision input is not supported"}
+        if has_video_input:
+            video_input_support = check_video_input_support(provider, model)
+            if video_input_support in ("INLINE_DATA", "PARTIAL"):
+                flags["reformat_video"] = 2 if video_input_support == "INLINE_DATA" else 1
+                reformatted = 1
+            elif video_input_support == "NONE":
+                return {"pass_check": False, "reformatted": False, "reason": "Video input is not supported"}
+        if has_audio_input:
+            audio_input_support = check_audio_input_support(provider, model)
+            if audio_input_support == "PARTIAL":
+                flags["reformat_audio"] = reformatted = 1
+            elif audio_input_support == "NONE":
+                return {"pass_check": False, "reformatted": False, "messages": messages, "reason": "Audio input is not supported"}
+        if has_file_input:
+            file_input_support = check_file_input_support(provider, model)
+            if file_input_support in ("PARTIAL", "FULL"):
+                flags["reformat_file"] = 2 if file_input_support == "FULL" else 1
+                reformatted = 1
+            elif file_input_support == "NONE":
+                return {"pass_check": False, "reformatted": False, "messages": messages, "reason": "File input is not supported"}
+
+    if reformatted:
+        if deadline is None:
+            deadline = Deadline()
+        cache = prefix_cache.active()
+        # 改写为链接比计算消息指纹还便宜，只有需要下载并内联媒体时才走前缀缓存
+        if cache is not None and 2 in flags.values():
+            # 按消息前缀复用改写结果，只改写新追加的消息
+            def _reformat(message):
+                if not isinstance(message.get("content"), list):
+                    return message
+                fallbacks = []
+                formatted = reformat_message(message, deadline=deadline, fallbacks=fallbacks, **flags)
+                if fallbacks or formatted is False:
+                    # 下载失败回退为链接的结果不缓存，下次请求重新下载
+                    raise prefix_cache.Uncacheable(formatted)
+                return formatted
+
+            namespace = ("check_prompt", provider, model, tuple(sorted(flags.items())))
+            formatted = cache.convert(namespace, messages, _reformat)
+            if any(item is False for item in formatted):
+                return {"pass_check": False, "reformatted": False, "reason": "Invalid message format"}
+            if any(new is not old for new, old in zip(formatted, messages)):
+                messages = formatted
+            return {"pass_check": True, "reformatted": reformatted, "messages": messages, "multimodal_info": multimodal_info}
+        new_messages = None
+        for i in object_indexes:
+            formatted = reformat_message(messages[i], deadline=deadline, **flags)
+            if formatted is False:
+                return {"pass_check": False, "reformatted": False, "reason": "Invalid message format"}
+            if formatted is not messages[i]:
+                if new_messages is None:
+                    new_messages = list(messages)
+                new_messages[i] = formatted
+        if new_messages is not None:
+            messages = new_messages
+    return {"pass_check": True, "reformatted": reformatted, "messages": messages, "multimodal_info": multimodal_info}
+
 class Function(OpenAIObject):
     def __init__(
         self,
@@ -628,3 +1057,244 @@ class ChatCompletionMessageToolCall(OpenAIObject):
 
     def __setitem__(self, key, value):
         setattr(self, key, value)
+
+def _chunk_field(obj, key, default=None):
+    # 流式 chunk 中的 delta / tool_call 可能是 dict 也可能是对象
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+class _ChoiceAccumulator:
+    def __init__(self, index):
+        self.index = index
+        self.role = None
+        self.content_parts = []
+        self.reasoning_parts = []
+        self.tool_calls = {}  # tool call index -> {"id", "type", "name", "arguments": [..], "extra": {}}
+        self.last_tool_index = None
+        self.finish_reason = None
+        self.extra = {}
+
+    def add_tool_call(self, tool_call):
+        index = _chunk_field(tool_call, "index")
+        call_id = _chunk_field(tool_call, "id")
+        if index is None:
+            # 没有 index 的 provider（如 gemini）每个 chunk 给出完整调用，按 id 区分
+            if self.last_tool_index is not None and (not call_id or call_id == self.tool_calls[self.last_tool_index]["id"]):
+                index = self.last_tool_index
+            else:
+                index = max(self.tool_calls, default=-1) + 1
+        entry = self.tool_calls.get(index)
+        if entry is None:
+            entry = self.tool_calls[index] = {"id": None, "type": "function", "name": None, "arguments": [], "extra": {}}
+        self.last_tool_index = index
+        if call_id:
+            entry["id"] = call_id
+        if _chunk_field(tool_call, "type"):
+            entry["type"] = _chunk_field(tool_call, "type")
+        function = _chunk_field(tool_call, "function")
+        name = _chunk_field(function, "name")
+        if name:
+            entry["name"] = name
+        arguments = _chunk_field(function, "arguments")
+        if arguments:
+            entry["arguments"].append(arguments)
+        thought_signature = _chunk_field(tool_call, "thought_signature")
+        if thought_signature:
+            entry["extra"]["thought_signature"] = thought_signature
+
+    def build_tool_calls(self):
+        tool_calls = []
+        for index in sorted(self.tool_calls):
+            entry = self.tool_calls[index]
+            tool_calls.append(
+                ChatCompletionMessageToolCall(
+                    id=entry["id"],
+                    type=entry["type"],
+                    function=Function(name=entry["name"], arguments="".join(entry["arguments"])),
+                    **entry["extra"]
+                )
+            )
+        return tool_calls
+
+
+class StreamAccumulator:
+    """
+    Rebuild the final ModelResponse from streamed chunks as they pass through.
+
+        acc = StreamAccumulator()
+        for chunk in acc.wrap(client.completion(..., stream=True)):
+            send(chunk)
+        response = acc.build()
+
+    content / reasoning_content are collected as lists of parts and joined
+    once in build(), so the cost is linear in the total output length.
+    tool_calls deltas are merged by their index, arguments concatenated.
+    Usage fields are merged across chunks, later non-empty values win.
+
+    Most providers number their stream chunks in StreamingChoices.index
+    (dify, coze, fastgpt, tiangong, wenxin, doubao, gemini) rather than the
+    choice. With n=1 (default) every delta is folded into a single choice;
+    pass n>1 only for streams whose index really is the choice index.
+    """
+
+    def __init__(self, n=1):
+        self.n = n
+        self.id = None
+        self.created = None
+        self.model = None
+        self.system_fingerprint = None
+        self.conversation_id = None
+        self.usage = {}
+        self.chunk_count = 0
+        self._choices = {}
+
+    def _choice(self, index):
+        if not self.n or self.n <= 1:
+            index = 0
+        else:
+            try:
+                index = int(index)
+            except (TypeError, ValueError):
+                index = 0
+        choice = self._choices.get(index)
+        if choice is None:
+            choice = self._choices[index] = _ChoiceAccumulator(index)
+        return choice
+
+    def add(self, chunk):
+        """Fold one chunk into the accumulated response and return the chunk unchanged."""
+        self.chunk_count += 1
+        if self.id is None:
+            self.id = _chunk_field(chunk, "id")
+            self.created = _chunk_field(chunk, "created")
+        if self.model is None:
+            self.model = _chunk_field(chunk, "model")
+        if _chunk_field(chunk, "system_fingerprint"):
+            self.system_fingerprint = _chunk_field(chunk, "system_fingerprint")
+        if _chunk_field(chunk, "conversation_id"):
+            self.conversation_id = _chunk_field(chunk, "conversation_id")
+
+        for choice in _chunk_field(chunk, "choices") or []:
+            acc = self._choice(_chunk_field(choice, "index", 0))
+            finish_reason = _chunk_field(choice, "finish_reason")
+            if finish_reason:
+                acc.finish_reason = finish_reason
+            delta = _chunk_field(choice, "delta")
+            if not delta:
+                continue
+            role = _chunk_field(delta, "role")
+            if role and acc.role is None:
+                acc.role = role
+            content = _chunk_field(delta, "content")
+            if content:
+                acc.content_parts.append(content)
+            reasoning = _chunk_field(delta, "reasoning_content")
+            if reasoning:
+                acc.reasoning_parts.append(reasoning)
+            tool_calls = _chunk_field(delta, "tool_calls")
+            if tool_calls:
+                for tool_call in tool_calls:
+                    acc.add_tool_call(tool_call)
+            thought_signature = _chunk_field(delta, "thought_signature")
+            if thought_signature:
+                acc.extra["thought_signature"] = thought_signature
+
+        _update_usage_values(self.usage, _chunk_field(chunk, "usage"))
+        return chunk
+
+    def wrap(self, stream):
+        """Yield every chunk of `stream` while accumulating it; closing the wrapper closes the stream."""
+        try:
+            for chunk in stream:
+                yield self.add(chunk)
+        finally:
+            close_quietly(stream)
+
+    def build(self) -> ModelResponse:
+        """Assemble the response seen so far, shaped like the non-stream result."""
+        choices = []
+        for index in sorted(self._choices) or [0]:
+            acc = self._choices.get(index) or _ChoiceAccumulator(index)
+            message = Message(
+                content="".join(acc.content_parts) if acc.content_parts else None,
+                role=acc.role or "assistant",
+            )
+            if acc.reasoning_parts:
+                message.reasoning_content = "".join(acc.reasoning_parts)
+            if acc.tool_calls:
+                message.tool_calls = acc.build_tool_calls()
+            for key, value in acc.extra.items():
+                setattr(message, key, value)
+            finish_reason = acc.finish_reason or ("tool_calls" if acc.tool_calls else "stop")
+            choices.append(Choices(message=message, index=index, finish_reason=finish_reason))
+
+        usage = dict(self.usage)
+        if usage.get("total_tokens") is None and usage.get("prompt_tokens") is not None and usage.get("completion_tokens") is not None:
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        return ModelResponse(
+            id=self.id,
+            choices=choices,
+            created=self.created,
+            model=self.model,
+            system_fingerprint=self.system_fingerprint,
+            usage=Usage(**usage),
+            conversation_id=self.conversation_id,
+        )
+
+
+def _update_usage_values(values, usage):
+    """Merge one chunk's usage into `values`; later non-empty values win."""
+    if not usage:
+        return values
+    items = usage if isinstance(usage, dict) else usage.model_dump()
+    for key, value in items.items():
+        if value is not None and (value or key not in values):
+            values[key] = value
+    return values
+
+def _sum_usage_values(total, values):
+    for key, value in values.items():
+        if isinstance(value, bool) or value is None:
+            total.setdefault(key, value)
+        elif isinstance(value, (int, float)):
+            total[key] = (total.get(key) or 0) + value
+        elif isinstance(value, dict):
+            total[key] = _sum_usage_values(dict(total.get(key) or {}), value)
+        else:
+            total.setdefault(key, value)
+    return total
+
+def sum_usage(usages) -> Usage:
+    """Add up token counts (including nested *_details dicts) of several usages."""
+    total = {}
+    for usage in usages:
+        if usage:
+            _sum_usage_values(total, usage if isinstance(usage, dict) else usage.model_dump())
+    if total.get("total_tokens") is None and total.get("prompt_tokens") is not None and total.get("completion_tokens") is not None:
+        total["total_tokens"] = total["prompt_tokens"] + total["completion_tokens"]
+    return Usage(**total)
+
+def merge_model_responses(responses) -> ModelResponse:
+    """
+    Combine single-choice responses of the same request into one response
+    with their choices renumbered 0..N-1 and usage summed.
+    """
+    choices = []
+    for response in responses:
+        for choice in response.choices:
+            choice.index = len(choices)
+            choices.append(choice)
+    first = responses[0]
+    return ModelResponse(
+        id=first.id,
+        choices=choices,
+        created=first.created,
+        model=first.model,
+        system_fingerprint=getattr(first, "system_fingerprint", None),
+        usage=sum_usage(response.usage for response in responses),
+        conversation_id=getattr(first, "conversation_id", None),
+    )